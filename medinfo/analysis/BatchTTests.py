@@ -10,10 +10,11 @@ from optparse import OptionParser
 from cStringIO import StringIO;
 
 import numpy as np;
+import pandas as pd;
 from scipy.stats import ttest_rel, ttest_ind;
+from scipy.stats import t as tDistribution;
 
 from medinfo.db.Model import columnFromModelList;
-from medinfo.db.Model import RowItemFieldComparator;
 from medinfo.common.Const import COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
 from medinfo.db.ResultsFormatter import TextResultsFormatter, TabDictReader;
@@ -32,6 +33,88 @@ SUMMARY_FUNCTIONS = [len, np.mean, np.std, np.median, percentile25, percentile75
 # Use to determine which tests to run
 COMPARISON_TESTS = [ttest_ind, ttest_rel];
 
+# Vectorized equivalents of the above, to evaluate many group pairs at once.
+#   Each takes (values, valid) arrays with a row of paired values per group pair
+#   (only those marked valid in each row count), and returns an array with a result per row.
+def validCount(values, valid):
+    return valid.sum(axis=1);
+
+def validMean(values, valid):
+    return np.where(valid, values, 0.0).sum(axis=1) / validCount(values, valid);
+
+def validStd(values, valid):
+    deviations = values - validMean(values, valid)[:,np.newaxis];
+    return np.sqrt(np.where(valid, deviations*deviations, 0.0).sum(axis=1) / validCount(values, valid));
+
+def validVar(values, valid, ddof=0):
+    deviations = values - validMean(values, valid)[:,np.newaxis];
+    return np.where(valid, deviations*deviations, 0.0).sum(axis=1) / (validCount(values, valid) - ddof);
+
+def validPercentile(values, valid, q):
+    """Linear interpolation between sorted values, as np.percentile"""
+    counts = validCount(values, valid);
+    sortedValues = np.sort(np.where(valid, values, np.inf), axis=1);   # Invalid values to the end of each row
+    indices = (q / 100.0) * (counts - 1);
+    indicesBelow = np.floor(indices).astype(int);
+    indicesAbove = np.minimum(indicesBelow + 1, counts - 1);
+    weightsAbove = indices - indicesBelow;
+    rows = np.arange(len(values));
+    result = sortedValues[rows, np.maximum(indicesBelow,0)] * (1.0 - weightsAbove) + sortedValues[rows, np.maximum(indicesAbove,0)] * weightsAbove;
+    result[(counts < 1) | (valid & np.isnan(values)).any(axis=1)] = np.nan;
+    return result;
+
+def validMedian(values, valid):
+    """Mean of the middle value(s), as np.median"""
+    counts = validCount(values, valid);
+    sortedValues = np.sort(np.where(valid, values, np.inf), axis=1);
+    rows = np.arange(len(values));
+    result = (sortedValues[rows, np.maximum((counts - 1) // 2, 0)] + sortedValues[rows, np.maximum(counts // 2, 0)]) / 2.0;
+    result[(counts < 1) | (valid & np.isnan(values)).any(axis=1)] = np.nan;
+    return result;
+
+VECTORIZED_SUMMARY_FUNCTIONS = \
+    {   len: validCount,
+        np.mean: validMean,
+        np.std: validStd,
+        np.median: validMedian,
+        percentile25: lambda values, valid: validPercentile(values, valid, 25),
+        percentile75: lambda values, valid: validPercentile(values, valid, 75),
+    };
+
+def validTTestInd(values0, values1, valid):
+    """P-values of independent t-tests (equal variance), as scipy.stats.ttest_ind"""
+    counts = validCount(values0, valid);
+    df = 2.0*counts - 2.0;
+    pooledVar = ((counts - 1) * validVar(values0, valid, 1) + (counts - 1) * validVar(values1, valid, 1)) / df;
+    denom = np.sqrt(pooledVar * (1.0 / counts + 1.0 / counts));
+    t = (validMean(values0, valid) - validMean(values1, valid)) / denom;
+    return tDistribution.sf(np.abs(t), df) * 2;
+
+def validTTestRel(values0, values1, valid):
+    """P-values of paired t-tests, as scipy.stats.ttest_rel"""
+    counts = validCount(values0, valid);
+    differences = values0 - values1;
+    t = validMean(differences, valid) / np.sqrt(validVar(differences, valid, 1) / counts);
+    return tDistribution.sf(np.abs(t), counts - 1.0) * 2;
+
+VECTORIZED_COMPARISON_TESTS = {ttest_ind: validTTestInd, ttest_rel: validTTestRel};
+
+def parseValues(texts):
+    """Parse an array of value strings into (values, valid) float and bool arrays, as float() would,
+    with any that cannot be parsed (e.g., "None" strings) marked invalid.
+    """
+    texts = np.asarray(texts, dtype=object);
+    valid = ~np.isnan(pd.to_numeric(texts, errors="coerce"));   # Quick check for which are numbers (but conversion not always correctly rounded)
+    values = np.full(len(texts), np.nan);
+    values[valid] = texts[valid].astype(float);   # Exact conversion by float()
+    for i in np.flatnonzero(~valid):    # Check for any other values float() will accept, like "nan" or overflows
+        try:
+            values[i] = float(texts[i]);
+            valid[i] = True;
+        except (ValueError, TypeError):
+            pass;
+    return (values, valid);
+
 class BatchTTests(BaseAnalysis):
     def __init__(self):
         BaseAnalysis.__init__(self);
@@ -41,49 +124,20 @@ class BatchTTests(BaseAnalysis):
         self.baseLabels = None;
 
     def __call__(self, inputFile, labelCols, valueCols, matchCols, baseLabels=None):
-        prog = ProgressDots();
-
+        """Generator of result dictionaries comparing the value columns between each pair of label groups.
+        Data is read once into columns, then for each value column, pivoted into a matrix with a row
+        of values per label group (sorted by any matchCols, so positionally paired between groups),
+        so the summary statistics and tests for many group pairs can be evaluated at once.
+        Pairwise comparisons are symmetric, so when comparing all groups to each other,
+        only evaluate each unordered pair once, and yield its results for both orders.
+        """
         self.labelCols = labelCols;
         self.valueCols = valueCols;
         self.matchCols = matchCols;
         self.baseLabels = baseLabels;
 
-        labelModelByLabelKey = dict();
-        dataByLabelKey = dict();
-
-        reader = TabDictReader(inputFile);
-        for rowModel in reader:
-            labelKey = list();
-            labelModel = dict();
-            for labelCol in self.labelCols:
-                labelModel[labelCol] = rowModel[labelCol];
-                labelKey.append(rowModel[labelCol]);
-            labelKey = tuple(labelKey); # Change to immutable object that can be hashed
-
-            # Copy just items of interest
-            valueModel = {};
-            if self.matchCols:
-                for matchCol in self.matchCols:
-                    valueModel[matchCol] = rowModel[matchCol];
-            for valueCol in self.valueCols:
-                try:
-                    valueModel[valueCol] = float(rowModel[valueCol]);
-                except ValueError:  # Maybe None string, could not parse into a number
-                    valueModel[valueCol] = None;
-
-            if labelKey not in dataByLabelKey:
-                labelModelByLabelKey[labelKey] = labelModel;
-                dataByLabelKey[labelKey] = list();
-            dataByLabelKey[labelKey].append(valueModel);
-
-            prog.update();
-
-        # prog.printStatus();
-
-        # Another pass to ensure data is consistently sorted in each group to allow later paired t-tests
-        if self.matchCols:
-            for labelKey, data in dataByLabelKey.iteritems():
-                data.sort( RowItemFieldComparator(self.matchCols) );
+        (labelKeys, valuesByCol, validByCol) = self.loadGroupValues(inputFile);
+        iGroupByLabelKey = dict( (labelKey, iGroup) for (iGroup, labelKey) in enumerate(labelKeys) );
 
         # See if looking for only one set of base labeled data to compare the rest against
         baseLabelKey = None;
@@ -92,47 +146,120 @@ class BatchTTests(BaseAnalysis):
 
         # Result pass to compare all group pair-wise combinations
         prog = ProgressDots();
-        for labelKey0, data0 in dataByLabelKey.iteritems():
-            prefix0 = "Group0.";
-            labelModel0 = labelModelByLabelKey[labelKey0];
-
+        pairResultsByGroup = dict();   # Results from each group vs. all later groups, to reuse when compare in reverse order
+        for (iGroup0, labelKey0) in enumerate(labelKeys):
             if baseLabelKey is not None and labelKey0 != baseLabelKey:
                 continue;   # Skip entries where the base label does not match specified key
 
-            for labelKey1, data1 in dataByLabelKey.iteritems():
-                prefix1 = "Group1.";
-                labelModel1 = labelModelByLabelKey[labelKey1];
-
-                result = dict();
-                for labelCol in self.labelCols:
-                    result[prefix0+labelCol] = labelModel0[labelCol];
-                    result[prefix1+labelCol] = labelModel1[labelCol];
-
-                for valueCol in self.valueCols:
-                    # Pull out value column for each data group.  Previous, sort by match col to allow paired t-testing
-                    # Skip any value pairs if non-numeric / None value
-                    values0 = list();
-                    values1 = list();
-                    for dataItem0, dataItem1 in zip(data0, data1):
-                        if dataItem0[valueCol] is not None and dataItem1[valueCol] is not None:
-                            values0.append(dataItem0[valueCol]);
-                            values1.append(dataItem1[valueCol]);
-
-                    for summaryFunction in SUMMARY_FUNCTIONS:
-                        result[prefix0 +valueCol+"."+ summaryFunction.__name__] = summaryFunction(values0);
-                        result[prefix1 +valueCol+"."+ summaryFunction.__name__] = summaryFunction(values1);
-
-                    for compTest in COMPARISON_TESTS:
-                        (t, p) = compTest(values0,values1);
-                        if np.isnan(p):
-                            p = None;   # Use more generic expression for NaN / null value
-                        result[compTest.__name__+"."+valueCol] = p;
-
-                yield result;
+            iGroups1 = np.arange(len(labelKeys));
+            if baseLabelKey is None:
+                iGroups1 = iGroups1[iGroup0:];  # Earlier groups already evaluated against this one
+            pairResultsByGroup[iGroup0] = self.pairResults(iGroup0, iGroups1, valuesByCol, validByCol);
+
+            for (iGroup1, labelKey1) in enumerate(labelKeys):
+                if iGroup1 >= iGroups1[0]:
+                    yield self.formatResult(labelKey0, labelKey1, pairResultsByGroup[iGroup0], iGroup1 - iGroups1[0]);
+                else:
+                    yield self.formatResult(labelKey0, labelKey1, pairResultsByGroup[iGroup1], iGroup0 - iGroup1, reverse=True);
 
                 prog.update();
         # prog.printStatus();
 
+    def loadGroupValues(self, inputFile):
+        """Read the data file in one pass and return (labelKeys, valuesByCol, validByCol)
+        with a list of the label group keys (tuples of labelCol values), and for each value column,
+        a matrix with a row per label group of the values in that group (sorted by any matchCols,
+        then in file order, so positionally paired between groups), and a matrix of whether each
+        is a valid (parsed) value, versus missing or past the end of the group's rows.
+        """
+        reader = TabDictReader(inputFile);
+        fieldnames = reader.fieldnames;
+        dataFrame = pd.DataFrame(list(reader.reader), columns=fieldnames, dtype=object);
+
+        # Label groups, keep a dictionary (of first rows) to iterate through groups in the same order a dictionary of data by label would
+        rowsByLabelKey = dict();
+        if len(dataFrame) > 0:
+            for (labelKey, rows) in sorted(dataFrame.groupby(self.labelCols, sort=False).indices.iteritems(), key=lambda item: item[1][0]):
+                if not isinstance(labelKey, tuple):
+                    labelKey = (labelKey,);
+                rowsByLabelKey[labelKey] = rows;
+        labelKeys = rowsByLabelKey.keys();
+
+        # Sort the rows in each group by the match columns, so data is paired between groups
+        if self.matchCols:
+            rowRanks = np.empty(len(dataFrame), dtype=int);
+            rowRanks[np.lexsort([dataFrame[matchCol].values.astype(str) for matchCol in reversed(self.matchCols)])] = np.arange(len(dataFrame));
+            for (labelKey, rows) in rowsByLabelKey.iteritems():
+                rowsByLabelKey[labelKey] = rows[np.argsort(rowRanks[rows], kind="mergesort")];
+
+        # Pivot into a matrix of values by group
+        groupSizes = np.array([len(rowsByLabelKey[labelKey]) for labelKey in labelKeys], dtype=int);
+        maxGroupSize = groupSizes.max() if len(groupSizes) > 0 else 0;
+        groupRows = np.concatenate([rowsByLabelKey[labelKey] for labelKey in labelKeys]) if len(labelKeys) > 0 else np.zeros(0, dtype=int);
+        iGroups = np.repeat(np.arange(len(labelKeys)), groupSizes);
+        positions = np.arange(len(groupRows)) - np.repeat(np.cumsum(groupSizes) - groupSizes, groupSizes);
+
+        valuesByCol = dict();
+        validByCol = dict();
+        for valueCol in self.valueCols:
+            (values, valid) = parseValues(dataFrame[valueCol].values);
+            valuesByCol[valueCol] = np.zeros((len(labelKeys), maxGroupSize));
+            validByCol[valueCol] = np.zeros((len(labelKeys), maxGroupSize), dtype=bool);
+            valuesByCol[valueCol][iGroups, positions] = values[groupRows];
+            validByCol[valueCol][iGroups, positions] = valid[groupRows];
+
+        return (labelKeys, valuesByCol, validByCol);
+
+    def pairResults(self, iGroup0, iGroups1, valuesByCol, validByCol):
+        """Evaluate the summary statistics and comparison tests between one group and each of the others at once.
+        Return (summaryValues0, summaryValues1, pValues) dictionaries keyed by (valueCol, summaryFunction)
+        or (valueCol, compTest), each with a list of the results against each of the other groups.
+        """
+        summaryValues0 = dict();
+        summaryValues1 = dict();
+        pValues = dict();
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for valueCol in self.valueCols:
+                # Skip any value pairs if non-numeric / None value
+                valid = validByCol[valueCol][iGroup0] & validByCol[valueCol][iGroups1];
+                values0 = np.repeat(valuesByCol[valueCol][iGroup0:iGroup0+1], len(iGroups1), axis=0);
+                values1 = valuesByCol[valueCol][iGroups1];
+
+                for summaryFunction in SUMMARY_FUNCTIONS:
+                    vectorFunction = VECTORIZED_SUMMARY_FUNCTIONS[summaryFunction];
+                    summaryValues0[(valueCol, summaryFunction)] = vectorFunction(values0, valid).tolist();
+                    summaryValues1[(valueCol, summaryFunction)] = vectorFunction(values1, valid).tolist();
+
+                for compTest in COMPARISON_TESTS:
+                    p = VECTORIZED_COMPARISON_TESTS[compTest](values0, values1, valid);
+                    pValues[(valueCol, compTest)] = np.where(np.isnan(p), None, p).tolist(); # Use more generic expression for NaN / null value
+        return (summaryValues0, summaryValues1, pValues);
+
+    def formatResult(self, labelKey0, labelKey1, pairResults, iPair, reverse=False):
+        """Result dictionary for the pair of label groups, from the iPair-th of the pairResults.
+        If reverse, then the pairResults were evaluated with the groups in the opposite order.
+        """
+        prefix0 = "Group0.";
+        prefix1 = "Group1.";
+        (summaryValues0, summaryValues1, pValues) = pairResults;
+        if reverse:
+            (summaryValues0, summaryValues1) = (summaryValues1, summaryValues0);   # P-values of (two-sided) tests are symmetric
+
+        result = dict();
+        for (labelCol, label0, label1) in zip(self.labelCols, labelKey0, labelKey1):
+            result[prefix0+labelCol] = label0;
+            result[prefix1+labelCol] = label1;
+
+        for valueCol in self.valueCols:
+            for summaryFunction in SUMMARY_FUNCTIONS:
+                result[prefix0 +valueCol+"."+ summaryFunction.__name__] = summaryValues0[(valueCol, summaryFunction)][iPair];
+                result[prefix1 +valueCol+"."+ summaryFunction.__name__] = summaryValues1[(valueCol, summaryFunction)][iPair];
+
+            for compTest in COMPARISON_TESTS:
+                result[compTest.__name__+"."+valueCol] = pValues[(valueCol, compTest)][iPair];
+
+        return result;
+
     def resultHeaders(self, labelCols, valueCols, matchCol):
         headers = list();
         prefixes = ["Group0.","Group1."];
@@ -25,6 +25,7 @@ from Util import log;
 from BaseAnalysis import BaseAnalysis;
 
 CONFIDENCE_INTERVAL = 0.95;
+BOOTSTRAP_CHUNK_ELEMENTS = 2**24;  # Max number of resample indexes to draw (and count) at a time for bootstrap AUC distributions
 
 class ROCPlot(BaseAnalysis):
     """Convenience class to consolidate construction of Receiver Operating Characteristic
@@ -91,24 +92,14 @@ class ROCPlot(BaseAnalysis):
         
         if options is not None and options.nSamples is not None:
             nSamples = int(options.nSamples);
-            bootstrapCStats = list();
             rng = np.random.RandomState(nSamples);  # For consistency of results, seed random number generator with fixed number
-            for i in range(nSamples):
-                # bootstrap by sampling with replacement on the prediction indices
-                indices = rng.random_integers(0, len(scores) - 1, len(scores));
-                if len(np.unique(outcomes[indices])) < 2:
-                    # We need at least one positive and one negative sample for ROC AUC
-                    # to be defined: reject the sample
-                    continue
-
-                cStat = roc_auc_score(outcomes[indices], scores[indices]);
-                bootstrapCStats.append(cStat);
+            bootstrapCStats = self.bootstrapAUCs(outcomes, scores, nSamples, rng);
 
             # Record results to summary data
             #summaryData["bootstrapCStats"] = bootstrapCStats;
             ciFractionLow = (1.0-CONFIDENCE_INTERVAL)/2;
             ciFractionHigh = CONFIDENCE_INTERVAL+ciFractionLow;
-            bootstrapCStats.sort();
+            bootstrapCStats = np.sort(bootstrapCStats).tolist();
             nBootstraps = len(bootstrapCStats);  # May not be equal to nSamples if some samples were rejected
             summaryData["%s.ROC-AUC-%s-CI" % (scoreId,CONFIDENCE_INTERVAL)] = (bootstrapCStats[int(ciFractionLow*nBootstraps)], bootstrapCStats[int(ciFractionHigh*nBootstraps)]);
         return (rocData , summaryData);
@@ -139,26 +130,75 @@ class ROCPlot(BaseAnalysis):
         pChi2 = scipy.stats.chi_contingency(ct, correction=False)[1];   # 0.0648
         pYatesChi2 = scipy.stats.chi_contingency(ct, correction=True)[1];   # 0.0877
         pFisher = scipy.stats.fisher_exact(ct)[1];  # 0.0725
+
+        Rather than comparing every pair, counts by rank (the Mann-Whitney U statistic):
+        sort the negative example scores once, then binary search where each positive example's score falls
+        to count the negative examples with lower and equal scores.  O(n log n) instead of O(n^2).
         """
-        pairsCorrect = 0.0;
-        pairsChecked = 0;
-        
-        for (outcome0,score0) in zip(outcomes,scores):
-            if outcome0 == 0:    # Negative example
-                for (outcome1,score1) in zip(outcomes,scores):
-                    if outcome1 != 0:   # Positive example
-                        pairsChecked += 1;
-                        if score1 > score0:
-                            pairsCorrect += 1;
-                        elif score1 == score0:
-                            pairsCorrect += 0.5;
-        
+        positives = (np.asarray(outcomes) != 0);
+        scores = np.asarray(scores, dtype=float);
+        negativeScores = np.sort(scores[~positives]);
+        positiveScores = scores[positives];
+        positiveScores = positiveScores[~np.isnan(positiveScores)];    # Undefined (NaN) scores never rank higher or tie, as in direct comparisons
+
+        nLower = np.searchsorted(negativeScores, positiveScores, side="left");
+        nLowerOrEqual = np.searchsorted(negativeScores, positiveScores, side="right");
+        pairsCorrect = float(nLower.sum()) + 0.5*float((nLowerOrEqual - nLower).sum());
+        pairsChecked = int(positives.sum()) * int(len(negativeScores));
+
         return (pairsCorrect, pairsChecked);
     aucComponents = staticmethod(aucComponents);
 
+    def bootstrapAUCs(outcomes, scores, nSamples, randomState, chunkElements=BOOTSTRAP_CHUNK_ELEMENTS):
+        """Return array of the ROC AUC for each of nSamples bootstrap resamples (with replacement) of the outcomes and scores.
+        Resamples without at least one positive and one negative example are rejected,
+        so the result may have fewer than nSamples values.
+
+        Draws the resample indexes for many samples at once as one (samples x items) matrix from the randomState
+        (same draws as random_integers(0, nItems-1, nItems) for one sample at a time),
+        limited to chunkElements indexes at a time to bound memory.
+        Rather than sorting each resample, the data is sorted by score once, and each resample is
+        just a count of how many times each item was drawn.  The pairs correct are then counted
+        on the per score (tie group) totals of positive and negative draws across the matrix.
+        """
+        outcomes = np.asarray(outcomes);
+        scores = np.asarray(scores, dtype=float);
+        nItems = len(scores);
+        if nItems < 1 or nSamples < 1:
+            return np.zeros(0);
+
+        order = np.argsort(scores, kind="mergesort");
+        sortedScores = scores[order];
+        positives = (outcomes[order] != 0);
+        validPositives = positives & ~np.isnan(sortedScores);  # Undefined (NaN) scores never rank higher or tie
+        negatives = ~positives;
+        # Start of each group of tied scores (NaN's each end up in a group of their own at the end)
+        groupStarts = np.flatnonzero(np.concatenate(([True], sortedScores[1:] != sortedScores[:-1])));
+        sortedPositionByIndex = np.empty(nItems, dtype=np.int64);
+        sortedPositionByIndex[order] = np.arange(nItems);
+
+        aucsList = list();
+        samplesPerChunk = max(1, chunkElements // nItems);
+        for iStart in xrange(0, nSamples, samplesPerChunk):
+            nChunkSamples = min(samplesPerChunk, nSamples - iStart);
+            indexMatrix = randomState.randint(0, nItems, (nChunkSamples, nItems));
+            # Count of draws of each (score sorted) item in each sample, by offsetting each sample row into its own bins
+            positions = sortedPositionByIndex[indexMatrix] + (np.arange(nChunkSamples, dtype=np.int64) * nItems)[:,np.newaxis];
+            drawCounts = np.bincount(positions.ravel(), minlength=nChunkSamples*nItems).reshape(nChunkSamples, nItems).astype(float);
+
+            positiveCounts = np.add.reduceat(drawCounts * validPositives, groupStarts, axis=1);
+            negativeCounts = np.add.reduceat(drawCounts * negatives, groupStarts, axis=1);
+            negativesBelow = np.cumsum(negativeCounts, axis=1) - negativeCounts;
+            pairsCorrect = (positiveCounts * (negativesBelow + 0.5*negativeCounts)).sum(axis=1);
+            pairsChecked = (drawCounts * positives).sum(axis=1) * negativeCounts.sum(axis=1);
+
+            accepted = (pairsChecked > 0);  # Need at least one positive and one negative for ROC AUC to be defined
+            aucsList.append(pairsCorrect[accepted] / pairsChecked[accepted]);
+        return np.concatenate(aucsList);
+    bootstrapAUCs = staticmethod(bootstrapAUCs);
+
     def aucScore(outcomes, scores):
-        """Calculate ROC AUC score.  Use internal functions to remove library dependencies as necessary, 
-        but much slower implementation.
+        """Calculate ROC AUC score.  Use internal functions to remove library dependencies as necessary.
         Otherwise performs same function as sklearn.metrics.roc_auc_score;
         """
         auc = None;
@@ -5,11 +5,14 @@ import sys, os
 from cStringIO import StringIO
 import unittest
 
+import numpy as np;
+
 from Const import RUNNER_VERBOSITY;
 from Util import log;
 
 from medinfo.db.Model import RowItemModel;
 from medinfo.analysis.BatchTTests import BatchTTests;
+from medinfo.analysis.BatchTTests import SUMMARY_FUNCTIONS, COMPARISON_TESTS, VECTORIZED_SUMMARY_FUNCTIONS, VECTORIZED_COMPARISON_TESTS;
 
 from Util import BaseTestAnalysis;
 
@@ -161,7 +164,28 @@ patient_id\tnumQueryItems\tnumVerifyItems\tnumRecommendedItems\trecall\tprecisio
             ];
         self.assertEqualStatResultsTextOutput(expectedResults, textOutput, colNames);
 
-    
+    def test_vectorizedStats(self):
+        # Vectorized statistics across rows of paired values should match those calculated on the valid values of each row
+        rng = np.random.RandomState(1);
+        values0 = rng.rand(6,9);
+        values1 = rng.rand(6,9);
+        valid = rng.rand(6,9) < 0.7;
+        valid[0,:] = True;
+        valid[1,:2] = True;
+        valid[1,2:] = False;
+        values1[2] = values0[2] + 0.25;  # Constant difference
+
+        for summaryFunction in SUMMARY_FUNCTIONS:
+            vectorValues = VECTORIZED_SUMMARY_FUNCTIONS[summaryFunction](values1, valid);
+            for iRow in xrange(len(values1)):
+                self.assertAlmostEqual(summaryFunction(list(values1[iRow][valid[iRow]])), vectorValues[iRow], 10);
+
+        for compTest in COMPARISON_TESTS:
+            vectorP = VECTORIZED_COMPARISON_TESTS[compTest](values0, values1, valid);
+            for iRow in xrange(len(values1)):
+                (t, p) = compTest(values0[iRow][valid[iRow]], values1[iRow][valid[iRow]]);
+                self.assertAlmostEqual(p, vectorP[iRow], 10);
+
 def suite():
     suite = unittest.TestSuite();
     #suite.addTest(TestItemRecommender('test_findOrInsertItem'));
@@ -5,6 +5,8 @@ import sys, os
 from cStringIO import StringIO
 import unittest
 
+import numpy as np;
+
 from Const import RUNNER_VERBOSITY;
 from Util import log;
 
@@ -139,6 +141,53 @@ outcome\tscore\tscore2
         self.verifyJSONData( expectedStatsByNameByScoreId, jsonData );
         #self.assertEqualStatResultsTextOutput(expectedResults, textOutput, colNames);
 
+    def test_aucComponents(self):
+        # Rank based counting should match direct comparison of every positive and negative pair, including ties
+        rng = np.random.RandomState(1);
+        outcomes = rng.randint(0, 2, 300);
+        scores = rng.randint(0, 20, 300).astype(float);   # Many ties
+        scores[:5] = np.nan;
+
+        expectedCorrect = 0.0;
+        expectedChecked = 0;
+        for (outcome0, score0) in zip(outcomes, scores):
+            if outcome0 == 0:
+                for (outcome1, score1) in zip(outcomes, scores):
+                    if outcome1 != 0:
+                        expectedChecked += 1;
+                        if score1 > score0:
+                            expectedCorrect += 1;
+                        elif score1 == score0:
+                            expectedCorrect += 0.5;
+        self.assertEqual((expectedCorrect, expectedChecked), ROCPlot.aucComponents(outcomes, scores));
+        self.assertEqual((expectedCorrect, expectedChecked), ROCPlot.aucComponents(list(outcomes == 1), list(scores)));
+
+        # Degenerate cases
+        self.assertEqual((0.0, 0), ROCPlot.aucComponents([1,1,1], [0.1,0.2,0.3]));
+        self.assertEqual((0.0, 0), ROCPlot.aucComponents([], []));
+
+    def test_bootstrapAUCs(self):
+        # Matrix of resamples should yield same distribution as resampling and scoring one at a time
+        from sklearn.metrics import roc_auc_score;
+        rng = np.random.RandomState(2);
+        outcomes = (rng.rand(20) < 0.1).astype(int);
+        scores = np.round(rng.rand(20) + 0.3*outcomes, 1);
+
+        nSamples = 200;
+        expectedAUCs = list();
+        loopRNG = np.random.RandomState(nSamples);
+        for i in xrange(nSamples):
+            indices = loopRNG.randint(0, len(scores), len(scores));
+            if len(np.unique(outcomes[indices])) < 2:
+                continue;
+            expectedAUCs.append(roc_auc_score(outcomes[indices], scores[indices]));
+        self.assertTrue(len(expectedAUCs) < nSamples);  # Some rejected samples
+
+        sampleAUCs = ROCPlot.bootstrapAUCs(outcomes, scores, nSamples, np.random.RandomState(nSamples), chunkElements=1000);   # Small chunks to force multiple matrix draws
+        self.assertEqual(len(expectedAUCs), len(sampleAUCs));
+        for (expectedAUC, sampleAUC) in zip(expectedAUCs, sampleAUCs):
+            self.assertAlmostEqual(expectedAUC, sampleAUC, 10);
+
     def verifyJSONData( self, expectedStatsByNameByScoreId, jsonData ):
         """Pull out JSON data components and verify equals where expected"""
 
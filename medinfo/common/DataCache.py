@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Bounded in-memory cache of query results (or other data) for long-lived processes,
+such as the DataManager / ItemRecommender dataCache and the web server's webDataCache.
+"""
+import sys;
+import time;
+import threading;
+from collections import OrderedDict;
+
+DEFAULT_MAX_SIZE = 512*1024*1024;   # Estimated bytes of cached values before evicting least recently used entries
+
+def estimateSize(value):
+    """Rough estimate of the memory used by a value (bytes), including the contents of (nested) lists, tuples and dictionaries.
+    Objects with an nbytes attribute (e.g., numpy arrays) report their own size.
+    """
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes);
+    size = sys.getsizeof(value);
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum([estimateSize(item) for item in value]);
+    elif isinstance(value, dict):
+        size += sum([estimateSize(key) + estimateSize(item) for (key, item) in value.iteritems()]);
+    return size;
+
+class DataCache:
+    """Dictionary-like cache (supports in, [], get, del, len, clear), so usable wherever a plain dict was used as a data cache.
+
+    Bounded by maxEntries and / or maxSize (estimated bytes of the cached values),
+    evicting the least recently used entries when adding one would exceed either.
+    Values larger than maxSize on their own are just not stored.
+    Entries expire ttl seconds (if not None) after being set, unless set with their own ttl.
+
+    Keeps hit / miss / eviction statistics (see stats).
+    Call invalidate when the underlying data changes (e.g., DataManager.invalidateDataCache).
+    """
+    def __init__(self, maxEntries=None, maxSize=DEFAULT_MAX_SIZE, ttl=None, sizeFunc=estimateSize):
+        self.maxEntries = maxEntries;
+        self.maxSize = maxSize;
+        self.ttl = ttl;
+        self.sizeFunc = sizeFunc;
+        self.timer = time.time; # Source of current time, for testing
+
+        self.entries = OrderedDict();   # (value, size, expireTime) by key, from least to most recently used
+        self.size = 0;
+        self.lock = threading.RLock();  # Shared between web server threads
+
+        self.hits = 0;
+        self.misses = 0;
+        self.evictions = 0;
+        self.expirations = 0;
+        self.invalidations = 0;
+
+    def get(self, key, default=None):
+        """Return the value for the key (marking it most recently used), or the default if not present or expired"""
+        with self.lock:
+            entry = self.liveEntry(key);
+            if entry is None:
+                self.misses += 1;
+                return default;
+            self.hits += 1;
+            return entry[0];
+
+    def set(self, key, value, ttl=None):
+        """Store the value for the key, to expire after ttl seconds (default the cache's ttl)"""
+        if ttl is None:
+            ttl = self.ttl;
+        size = self.sizeFunc(value);
+        with self.lock:
+            self.removeEntry(key);
+            if self.maxSize is not None and size > self.maxSize:
+                return;
+            while len(self.entries) > 0 and \
+                    ( (self.maxEntries is not None and len(self.entries) >= self.maxEntries) or \
+                      (self.maxSize is not None and self.size + size > self.maxSize) ):
+                self.removeEntry(next(iter(self.entries)));
+                self.evictions += 1;
+            expireTime = None;
+            if ttl is not None:
+                expireTime = self.timer() + ttl;
+            self.entries[key] = (value, size, expireTime);
+            self.size += size;
+
+    def invalidate(self, keyFilter=None):
+        """Remove all entries, or only those whose keys match the keyFilter function"""
+        with self.lock:
+            if keyFilter is None:
+                keys = self.entries.keys();
+            else:
+                keys = [key for key in self.entries if keyFilter(key)];
+            for key in keys:
+                self.removeEntry(key);
+            self.invalidations += len(keys);
+
+    def stats(self):
+        """Return dictionary of cache statistics"""
+        with self.lock:
+            lookups = self.hits + self.misses;
+            return \
+                {   "entries": len(self.entries),
+                    "size": self.size,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hitRate": float(self.hits) / lookups if lookups > 0 else None,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "invalidations": self.invalidations,
+                };
+
+    def liveEntry(self, key):
+        """Return the entry for the key, moving it to the most recently used end,
+        or None if not present or expired (removing it).  Call with lock held.
+        """
+        entry = self.entries.pop(key, None);
+        if entry is not None and entry[2] is not None and entry[2] <= self.timer():
+            self.size -= entry[1];
+            self.expirations += 1;
+            return None;
+        if entry is not None:
+            self.entries[key] = entry;
+        return entry;
+
+    def removeEntry(self, key):
+        """Remove the entry for the key, if present.  Call with lock held."""
+        entry = self.entries.pop(key, None);
+        if entry is not None:
+            self.size -= entry[1];
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.liveEntry(key) is not None;
+
+    def __getitem__(self, key):
+        missing = object();
+        value = self.get(key, missing);
+        if value is missing:
+            raise KeyError(key);
+        return value;
+
+    def __setitem__(self, key, value):
+        self.set(key, value);
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self.entries:
+                raise KeyError(key);
+            self.removeEntry(key);
+
+    def __len__(self):
+        return len(self.entries);
+
+    def clear(self):
+        self.invalidate();
@@ -2,8 +2,10 @@
 import sys;
 from math import log;
 from math import sqrt, exp, log as ln;
+import numpy as np;
 from scipy.stats import chi2_contingency;
 from scipy.stats import fisher_exact;
+from scipy.stats import chi2 as chi2Distribution;
 
 """Count values less than this in the contingency stats table will be considered degenerate and needing normalization.
 Will correct such values by the given adjustment value.
@@ -306,6 +308,265 @@ class ContingencyStats:
         """Short-hand for access calc function"""
         return self.calc(key);
 
+"""Synonyms for each statistic ID, keyed by the canonical ID that ContingencyStatsArray calculates"""
+STAT_IDS_BY_CANONICAL_ID = \
+    {   "N": ("total","N"),
+        "nA": ("nA",),
+        "nB": ("nB",),
+        "nAB": ("nAB","support"),
+        "P(A)": ("P(A)",),
+        "P(!A)": ("P(!A)",),
+        "P(B)": ("P(B)","prevalence","preTestProbability","baselineFreq"),
+        "SE(prevalence)": ("SE(prevalence)",),
+        "prevalence95CILow": ("prevalence95CILow",),
+        "prevalence95CIHigh": ("prevalence95CIHigh",),
+        "P(!B)": ("P(!B)",),
+        "P(AB)": ("P(AB)",),
+        "P(B|A)": ("P(B|A)","positivePredictiveValue","PPV","precision","postTestProbability","confidence","conditionalFreq","truePositiveAccuracy"),
+        "SE(PPV)": ("SE(PPV)",),
+        "PPV95CILow": ("PPV95CILow",),
+        "PPV95CIHigh": ("PPV95CIHigh",),
+        "P(!B|A)": ("P(!B|A)",),
+        "P(B|!A)": ("P(B|!A)",),
+        "P(!B|!A)": ("P(!B|!A)","negativePredictiveValue","NPV","inversePrecision","trueNegativeAccuracy"),
+        "P(A|B)": ("P(A|B)","truePositiveRate","TPR","sensitivity","sens","recall"),
+        "P(!A|B)": ("P(!A|B)","falseNegativeRate","FNR","missRate"),
+        "P(A|!B)": ("P(A|!B)","falsePositiveRate","FPR","fallout"),
+        "P(!A|!B)": ("P(!A|!B)","trueNegativeRate","TNR","specificity","spec","inverseRecall"),
+        "F1": ("F1","F1-score"),
+        "LR+": ("positiveLikelihoodRatio","+LR","LR+","LR"),
+        "LR-": ("negativeLikelihoodRatio","-LR","LR-"),
+        "OR": ("oddsRatio","OR"),
+        "SE(ln(OR))": ("SE(ln(OR))",),
+        "OR95CILow": ("oddsRatio95CILow","OR95CILow"),
+        "OR95CIHigh": ("oddsRatio95CIHigh","OR95CIHigh"),
+        "RR": ("relativeRisk","RR"),
+        "SE(ln(RR))": ("SE(ln(RR))",),
+        "RR95CILow": ("relativeRisk95CILow","RR95CILow"),
+        "RR95CIHigh": ("relativeRisk95CIHigh","RR95CIHigh"),
+        "freqRatio": ("interest","freqRatio","TF*IDF","tfidf","lift","P(B|A)/P(B)"),
+        "YatesChi2": ("YatesChi2",),
+        "P-YatesChi2": ("P-YatesChi2",),
+        "P-YatesChi2-NegLog": ("P-YatesChi2-NegLog",),
+        "P-Chi2": ("P-Chi2",),
+        "P-Chi2-NegLog": ("P-Chi2-NegLog",),
+        "P-Fisher": ("P-Fisher",),
+        "P-Fisher-Complement": ("P-Fisher-Complement",),
+        "P-Fisher-NegLog": ("P-Fisher-NegLog",),
+    };
+CANONICAL_STAT_ID_BY_STAT_ID = dict( (statId, canonicalId) for (canonicalId, statIds) in STAT_IDS_BY_CANONICAL_ID.iteritems() for statId in statIds );
+
+class ContingencyStatsArray:
+    """Array based equivalent of ContingencyStats.
+    Given vectors of nAB, nA, nB, N values (e.g., one per candidate item),
+    calculates any of the same statistics for all of them at once with vectorized numpy operations,
+    rather than constructing a ContingencyStats object per candidate.
+
+    Cases that would raise a ZeroDivisionError in ContingencyStats yield inf or nan values here instead.
+    """
+    def __init__(self, nAB, nA, nB, N):
+        """Setup vectors of 2x2 tables based on occurence totals.  Scalar arguments are broadcast to the other vector lengths."""
+        (nAB, nA, nB, N) = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in (nAB, nA, nB, N)]);
+        self.nAB = nAB;
+        self.nA = nA;
+        self.nB = nB;
+        self.N = N;
+
+        # ct[i][j] is the vector of that table cell's values across all tables
+        self.ct = [ [None,None], [None,None] ];
+        self.ct[0][0] = np.array(nAB);
+        self.ct[0][1] = nA-nAB;
+        self.ct[1][0] = nB-nAB;
+        self.ct[1][1] = N-nA-nB+nAB;
+
+        self.valueByStatId = dict();  # Cache of calculated stat vectors, as many stats derive from others
+
+    def __len__(self):
+        return len(self.nAB);
+
+    def normalize(self,truncateNegativeValues=False):
+        """Check for irregular table values like negative or zero values and adjust them to avoid calculation failures,
+        as in ContingencyStats.normalize, but only for the tables that need it.
+        """
+        ct = self.ct;   # Convenience short-hand
+        cells = [(i,j) for i in (0,1) for j in (0,1)];
+        if truncateNegativeValues:
+            for (i,j) in cells:
+                ct[i][j] = np.maximum(ct[i][j], 0.0);
+
+        # If any zero values in a table, change or add a small delta value to ALL of that table's fields
+        hasDegenerateValues = np.zeros(len(self), dtype=bool);
+        for (i,j) in cells:
+            hasDegenerateValues |= (np.abs(ct[i][j]) <= DEGENERATE_VALUE_THRESHOLD);
+        for (i,j) in cells:
+            isDegenerate = (np.abs(ct[i][j]) <= DEGENERATE_VALUE_THRESHOLD);
+            ct[i][j] = np.where(hasDegenerateValues & isDegenerate, DEGENERATE_VALUE_ADJUSTMENT, np.where(hasDegenerateValues, ct[i][j]+DEGENERATE_VALUE_ADJUSTMENT, ct[i][j]));
+        self.valueByStatId.clear();
+
+    def calc(self, statId):
+        """Return array of a calculated statistic (by an identifying name) for every table"""
+        if statId not in CANONICAL_STAT_ID_BY_STAT_ID:
+            raise UnrecognizedStatException("Unrecognized statistic ID: [%s]" % statId );
+        statId = CANONICAL_STAT_ID_BY_STAT_ID[statId];
+        if statId not in self.valueByStatId:
+            errState = np.seterr(divide="ignore", invalid="ignore");
+            try:
+                self.valueByStatId[statId] = self.calcCanonical(statId);
+            finally:
+                np.seterr(**errState);
+        return self.valueByStatId[statId];
+
+    def calcCanonical(self, statId):
+        """Calculate a statistic by its canonical ID, deferring to (cached) calc for any component statistics"""
+        ct = self.ct;   # Short-hand convenience
+        if statId == "N":
+            return self.N;
+        elif statId == "nA":
+            return self.nA;
+        elif statId == "nB":
+            return self.nB;
+        elif statId == "nAB":
+            return ct[0][0];
+        elif statId == "P(A)":
+            return self["nA"] / self["total"];
+        elif statId == "P(!A)":
+            return 1-self["P(A)"];
+        elif statId == "P(B)":
+            return self["nB"] / self["total"];
+        elif statId == "SE(prevalence)":
+            return np.sqrt( (self["prevalence"]*(1-self["prevalence"]))/self["total"] );
+        elif statId == "prevalence95CILow":
+            return self["prevalence"] - 1.96*self["SE(prevalence)"];
+        elif statId == "prevalence95CIHigh":
+            return self["prevalence"] + 1.96*self["SE(prevalence)"];
+        elif statId == "P(!B)":
+            return 1-self["P(B)"];
+        elif statId == "P(AB)":
+            return self["nAB"] / self["total"];
+        elif statId == "P(B|A)":
+            # Where table values suppressed to 0 (by loss of numerical precision), fall back on original values
+            denominator = ct[0][0]+ct[0][1];
+            return np.where(denominator == 0.0, self.nAB / self.nA, ct[0][0] / denominator);
+        elif statId == "SE(PPV)":
+            return np.sqrt( (self["PPV"]*(1-self["PPV"]))/(ct[0][0]+ct[0][1]) );
+        elif statId == "PPV95CILow":
+            return self["PPV"] - 1.96*self["SE(PPV)"];
+        elif statId == "PPV95CIHigh":
+            return self["PPV"] + 1.96*self["SE(PPV)"];
+        elif statId == "P(!B|A)":
+            return 1-self["P(B|A)"];
+        elif statId == "P(B|!A)":
+            return ct[1][0] / (ct[1][0]+ct[1][1]);
+        elif statId == "P(!B|!A)":
+            return 1-self["P(B|!A)"];
+        elif statId == "P(A|B)":
+            return ct[0][0] / (ct[0][0]+ct[1][0]);
+        elif statId == "P(!A|B)":
+            return 1-self["P(A|B)"];
+        elif statId == "P(A|!B)":
+            return ct[0][1] / (ct[0][1]+ct[1][1]);
+        elif statId == "P(!A|!B)":
+            return 1-self["P(A|!B)"];
+        elif statId == "F1":
+            precision = self["precision"];
+            recall = self["recall"];
+            return np.where(precision+recall == 0.0, 0.0, 2*precision*recall / (precision+recall));
+        elif statId == "LR+":
+            return self["P(A|B)"] / self["P(A|!B)"];
+        elif statId == "LR-":
+            return self["P(!A|B)"] / self["P(!A|!B)"];
+        elif statId == "OR":
+            return (ct[0][0]/ct[0][1]) / (ct[1][0]/ct[1][1]);
+        elif statId == "SE(ln(OR))":
+            return np.sqrt(1/ct[0][0] + 1/ct[0][1] + 1/ct[1][0] + 1/ct[1][1]);
+        elif statId == "OR95CILow":
+            return np.exp( np.log(self["OR"]) - 1.96*self["SE(ln(OR))"] );
+        elif statId == "OR95CIHigh":
+            return np.exp( np.log(self["OR"]) + 1.96*self["SE(ln(OR))"] );
+        elif statId == "RR":
+            return self["P(B|A)"] / self["P(B|!A)"];
+        elif statId == "SE(ln(RR))":
+            return np.sqrt(1/ct[0][0] + 1/ct[1][0] + 1/(ct[0][0]+ct[0][1]) + 1/(ct[1][0]+ct[1][1]) );
+        elif statId == "RR95CILow":
+            return np.exp( np.log(self["RR"]) - 1.96*self["SE(ln(RR))"] );
+        elif statId == "RR95CIHigh":
+            return np.exp( np.log(self["RR"]) + 1.96*self["SE(ln(RR))"] );
+        elif statId == "freqRatio":
+            return self["P(B|A)"] / self["P(B)"];
+        elif statId in ("YatesChi2","P-YatesChi2","P-YatesChi2-NegLog"):
+            (chi2, chi2P, isValid) = self.chi2Test(True);
+            if statId == "YatesChi2":
+                return np.where(isValid, chi2, 0.0);    # Invalid (e.g., negative) table values, don't know how to interpret
+            elif statId == "P-YatesChi2":
+                return np.where(isValid, chi2P, 1.0);
+            else:
+                return np.where(isValid, self.signedNegLog(chi2P, self["OR"]), 0.0);
+        elif statId in ("P-Chi2","P-Chi2-NegLog"):
+            (chi2, chi2P, isValid) = self.chi2Test(False);
+            if statId == "P-Chi2":
+                return np.where(isValid, chi2P, 1.0);
+            else:
+                return np.where(isValid, self.signedNegLog(chi2P, self["OR"]), 0.0);
+        elif statId in ("P-Fisher","P-Fisher-Complement","P-Fisher-NegLog"):
+            (oddsRatio, fisherP, isValid) = self.fisherTest();
+            if statId == "P-Fisher":
+                return np.where(isValid, fisherP, 1.0);
+            elif statId == "P-Fisher-Complement":
+                return np.where(isValid, np.where(oddsRatio > 1.0, 1-fisherP, fisherP-1), 0.0);
+            else:
+                return np.where(isValid, self.signedNegLog(fisherP, oddsRatio), 0.0);
+
+    def chi2Test(self, correction):
+        """Vectorized equivalent of chi2_contingency for 2x2 tables.
+        Return arrays of (chi2, P-value, isValid), where invalid are tables chi2_contingency would reject
+        (negative values or zero expected frequencies).
+        """
+        ct = self.ct;
+        rowTotals = [ct[0][0]+ct[0][1], ct[1][0]+ct[1][1]];
+        colTotals = [ct[0][0]+ct[1][0], ct[0][1]+ct[1][1]];
+        total = ct[0][0]+ct[0][1]+ct[1][0]+ct[1][1];
+        isValid = np.ones(len(self), dtype=bool);
+        chi2 = np.zeros(len(self));
+        for i in (0,1):
+            for j in (0,1):
+                expected = rowTotals[i]*colTotals[j] / total;
+                observed = ct[i][j];
+                if correction:
+                    observed = observed + 0.5*np.sign(expected - observed);   # Yates' correction for continuity
+                isValid &= (ct[i][j] >= 0) & (expected != 0);
+                chi2 += (observed - expected)**2 / expected;
+        return (chi2, chi2Distribution.sf(chi2, 1), isValid);
+
+    def fisherTest(self):
+        """Fisher exact test for each table.  No closed form to vectorize, so evaluate fisher_exact
+        only once for each distinct table and gather the results.
+        Return arrays of (oddsRatio, P-value, isValid), where invalid are tables fisher_exact would reject (negative values).
+        """
+        ct = self.ct;
+        tables = np.column_stack([ct[0][0], ct[0][1], ct[1][0], ct[1][1]]);
+        isValid = np.all(tables.astype(np.int64) >= 0, axis=1); # Same integer conversion as fisher_exact applies
+        oddsRatio = np.ones(len(self));
+        fisherP = np.ones(len(self));
+        if np.any(isValid):
+            (distinctTables, inverse) = np.unique(tables[isValid], axis=0, return_inverse=True);
+            distinctResults = np.array([fisher_exact(table.reshape(2,2)) for table in distinctTables]);
+            oddsRatio[isValid] = distinctResults[inverse,0];
+            fisherP[isValid] = distinctResults[inverse,1];
+        return (oddsRatio, fisherP, isValid);
+
+    def signedNegLog(self, pValues, oddsRatio):
+        """Negated log10 of P-values if odds ratio positive, such that sorting in descending order
+        will bring the most significant positive associations to the top and most significant negative associations to the bottom
+        """
+        logP = np.full(len(self), -sys.float_info.max);
+        isPositive = (pValues > 0.0);
+        logP[isPositive] = np.log10(pValues[isPositive]);
+        return np.where(oddsRatio > 1.0, -logP, logP);
+
+    def __getitem__(self, key):
+        """Short-hand for access calc function"""
+        return self.calc(key);
+
 class UnrecognizedStatException(Exception):
     def __init__( self, initStr ):
         Exception.__init__(self, initStr);
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Test case for respective module in parent package"""
+
+import sys, os
+import unittest
+
+import numpy as np;
+
+import Const, Util
+
+from medinfo.common.DataCache import DataCache, estimateSize;
+from medinfo.common.test.Util import MedInfoTestCase
+
+class TestDataCache(MedInfoTestCase):
+    def setUp(self):
+        MedInfoTestCase.setUp(self);
+        self.currentTime = 1000.0;
+
+    def timer(self):
+        """Stand-in clock for the cache to test expiration times"""
+        return self.currentTime;
+
+    def test_dictInterface(self):
+        cache = DataCache();
+        cache["a"] = [[1,2],[3,4]];
+        self.assertTrue("a" in cache);
+        self.assertFalse("b" in cache);
+        self.assertEqual([[1,2],[3,4]], cache["a"]);
+        self.assertEqual(None, cache.get("b"));
+        self.assertRaises(KeyError, cache.__getitem__, "b");
+        self.assertEqual(1, len(cache));
+
+        del cache["a"];
+        self.assertEqual(0, len(cache));
+        self.assertEqual(0, cache.size);
+
+        stats = cache.stats();
+        self.assertEqual(1, stats["hits"]);
+        self.assertEqual(2, stats["misses"]);
+        self.assertAlmostEqual(1.0/3, stats["hitRate"]);
+
+    def test_lruEviction(self):
+        cache = DataCache(maxEntries=3);
+        for key in ["a","b","c"]:
+            cache[key] = key;
+        cache.get("a");    # Now most recently used, so b will be evicted first
+        cache["d"] = "d";
+        self.assertEqual(["c","a","d"], list(cache.entries.keys()));
+        cache["e"] = "e";
+        self.assertEqual(["a","d","e"], list(cache.entries.keys()));
+        self.assertEqual(2, cache.stats()["evictions"]);
+
+    def test_sizeEviction(self):
+        cache = DataCache(maxSize=100, sizeFunc=len);
+        cache["a"] = "x"*40;
+        cache["b"] = "x"*40;
+        self.assertEqual(80, cache.size);
+
+        cache["c"] = "x"*30;   # Would exceed max size, so least recently used a evicted
+        self.assertEqual(["b","c"], list(cache.entries.keys()));
+        self.assertEqual(70, cache.size);
+
+        cache["b"] = "x"*10;   # Replacing an entry frees up its prior size
+        self.assertEqual(40, cache.size);
+
+        cache["d"] = "x"*101;  # Too big to store at all
+        self.assertFalse("d" in cache);
+        self.assertEqual(["c","b"], list(cache.entries.keys()));
+
+    def test_ttl(self):
+        cache = DataCache(ttl=60);
+        cache.timer = self.timer;
+        cache["a"] = 1;
+        cache.set("b", 2, ttl=300);
+
+        self.currentTime += 59;
+        self.assertEqual(1, cache.get("a"));
+        self.currentTime += 1;
+        self.assertEqual(None, cache.get("a"));
+        self.assertFalse("a" in cache);
+        self.assertEqual(2, cache["b"]);
+        self.currentTime += 240;
+        self.assertFalse("b" in cache);
+
+        self.assertEqual(0, cache.size);
+        self.assertEqual(2, cache.stats()["expirations"]);
+
+    def test_invalidate(self):
+        cache = DataCache();
+        for key in ["select a","select b","update c"]:
+            cache[key] = key;
+        cache.invalidate(lambda key: key.startswith("select"));
+        self.assertEqual(["update c"], list(cache.entries.keys()));
+        cache.clear();
+        self.assertEqual(0, len(cache));
+        self.assertEqual(0, cache.size);
+        self.assertEqual(3, cache.stats()["invalidations"]);
+
+    def test_estimateSize(self):
+        # Contents of containers count towards size
+        self.assertTrue(estimateSize([["abc"]*100]) > estimateSize([["abc"]]));
+        self.assertTrue(estimateSize({"a": range(100)}) > estimateSize({"a": []}));
+        # Objects with nbytes report their own
+        self.assertEqual(800, estimateSize(np.zeros(100)));
+
+def suite():
+    """Returns the suite of tests to run for this test class / module.
+    Use unittest.makeSuite methods which simply extracts all of the
+    methods for the given class whose name starts with "test"
+    """
+    suite = unittest.TestSuite();
+    suite.addTest(unittest.makeSuite(TestDataCache));
+    return suite;
+
+if __name__=="__main__":
+    Util.log.setLevel(Const.LOGGER_LEVEL)
+
+    unittest.TextTestRunner(verbosity=Const.RUNNER_VERBOSITY).run(suite())
@@ -7,9 +7,11 @@ import logging
 import unittest
 from math import sqrt, exp, log as ln;
 
+import numpy as np;
+
 import Const, Util
 
-from medinfo.common.StatsUtil import AggregateStats, ContingencyStats, UnrecognizedStatException;
+from medinfo.common.StatsUtil import AggregateStats, ContingencyStats, ContingencyStatsArray, UnrecognizedStatException;
 from medinfo.common.test.Util import MedInfoTestCase
 
 class TestAggregateStats(MedInfoTestCase):
@@ -263,6 +265,39 @@ class TestContingencyStats(MedInfoTestCase):
             testValue = contStats.calc(statId);
             self.assertAlmostEquals( expectedValue, testValue, 3 );
 
+    def test_contingencyStatsArray(self):
+        # Vectorized stats should match those from individual ContingencyStats, including the normalization adjustments
+        nABs = [self.TEST_NAB, 10, 0, 3.5, 7];
+        nAs = [self.TEST_NA, 15, 12, 8, 7];
+        nBs = [self.TEST_NB, 25, 30, 20, 9];
+        Ns = [self.TEST_TOTAL, 20, 100, 50, 7];
+
+        for truncateNegativeValues in (False, True):
+            contStatsArray = ContingencyStatsArray( nABs, nAs, nBs, Ns );
+            contStatsArray.normalize(truncateNegativeValues);
+            for statId in self.EXPECTED.iterkeys():
+                Util.log.debug(statId);
+                testValues = contStatsArray.calc(statId);
+                self.assertEqual(len(nABs), len(testValues));
+                for (nAB, nA, nB, N, testValue) in zip(nABs, nAs, nBs, Ns, testValues):
+                    contStats = ContingencyStats( nAB, nA, nB, N );
+                    contStats.normalize(truncateNegativeValues);
+                    try:
+                        expectedValue = contStats.calc(statId);
+                    except (ZeroDivisionError, ValueError):
+                        expectedValue = np.nan;  # Array version yields inf or nan instead of math errors
+                    if np.isfinite(expectedValue):
+                        self.assertAlmostEquals( expectedValue, testValue, 6 );
+                    else:
+                        self.assertFalse(np.isfinite(testValue));
+
+        # Scalar values broadcast against vectors
+        contStatsArray = ContingencyStatsArray( [20, 10], 30, 40, 100 );
+        self.assertAlmostEquals( 20/30.0, contStatsArray["PPV"][0], 6 );
+        self.assertAlmostEquals( 10/30.0, contStatsArray["PPV"][1], 6 );
+
+        self.assertRaises(UnrecognizedStatException, contStatsArray.calc, "notAStat");
+
 class TestUnitTestTools(MedInfoTestCase):
     def test_assertEqualsGeneral(self):
         # Should allow option of verifying equal values by number of significant digits, not just decimal places
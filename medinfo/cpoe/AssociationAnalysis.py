@@ -3,7 +3,14 @@ import sys, os
 import json
 import time;
 import math;
+import copy;
+import itertools;
+import tempfile;
+import traceback;
+import multiprocessing;
+import Queue;
 from datetime import datetime;
+import numpy as np;
 from optparse import OptionParser
 from medinfo.common.Util import stdOpen, ProgressDots;
 from medinfo.db import DBUtil;
@@ -12,11 +19,41 @@ from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList
 from Env import DATE_FORMAT;
 
 from DataManager import DataManager;
+import AssociationBufferFile;
+from AssociationCountBuffer import AssociationCountBuffer, asAssociationCountBuffer, packItemIdPairs, COLUMN_NAMES, COUNT_COLUMN_INDEXES;
 
 from Const import DELTA_NAME_BY_SECONDS, SECONDS_PER_DAY;
 
 from Util import log;
 
+"""Reference time point for converting item dates to simple numerical (seconds) representation"""
+EPOCH = datetime(1970,1,1);
+
+def epochSeconds(itemDate):
+    """Convert a datetime into seconds (real number) since the EPOCH, to facilitate array arithmetic"""
+    timeDelta = itemDate - EPOCH;
+    return timeDelta.days*SECONDS_PER_DAY + timeDelta.seconds + timeDelta.microseconds / 1000000.0;
+
+"""Columns of the patient item query results (see patientItemsQuery), in order"""
+PATIENT_ITEM_COLUMNS = ["patient_item_id","patient_id","encounter_id","clinical_item_id","item_date","analyze_date"];
+
+"""Seconds to wait on parallel worker results before checking on the workers (and keeping the DB connection alive)"""
+WORKER_POLL_SECONDS = 30;
+
+"""Temporary tables (and their column definitions) to stage data in for bulkCommit"""
+ITEM_STAGE_TABLE = "association_item_staging";
+PAIR_STAGE_TABLE = "association_pair_staging";
+INCREMENT_STAGE_TABLE = "association_increment_staging";
+ANALYZED_STAGE_TABLE = "analyzed_item_staging";
+STAGE_TABLE_COLUMNS = \
+    [   (ITEM_STAGE_TABLE, "clinical_item_id BIGINT"),
+        (PAIR_STAGE_TABLE, "clinical_item_id BIGINT, subsequent_item_id BIGINT"),
+        (INCREMENT_STAGE_TABLE, "clinical_item_id BIGINT, subsequent_item_id BIGINT, %s" % str.join(", ", ["%s DOUBLE PRECISION" % colName for colName in COLUMN_NAMES]) ),
+        (ANALYZED_STAGE_TABLE, "patient_item_id BIGINT"),
+    ];
+
+"""Limit on the number of baseline item pairs to generate and stage at once in bulkPrepareItemAssociations"""
+BASELINE_BLOCK_PAIRS = 2**20;
 
 class AnalysisOptions:
     """Simple struct to pass filter parameters on which records to do analysis on"""
@@ -26,6 +63,8 @@ class AnalysisOptions:
         self.endDate = None;
         self.bufferFile = None;
         self.deltaSecondsOptions = None;    # Seconds values / suffixes to look for count fields to update
+        self.patientShardIndex = None;  # If patientShardCount set, only analyze patients whose abs(patient_id) modulo patientShardCount is this index
+        self.patientShardCount = None;
 
 class AssociationAnalysis:
     """Pre-Computation module to sort through data on patient clinical items
@@ -59,11 +98,26 @@ class AssociationAnalysis:
     Run a single AssociationAnalysis with -b option on the buffer file name prefix
     (and -u to limit number of patient item updates per query), to sequentially load and merge all buffer files
     into one aggregate buffer file to commit to database in one pass.
+    Buffer files are written in the binary, key sorted AssociationBufferFile format,
+    so a series of them is k-way merged on disk and committed from memory-mapped chunks,
+    rather than all loaded into memory at once (legacy .json.gz buffer files can still be read).
+
+    Association increments are accrued in an AssociationCountBuffer,
+    with item pairs packed into int64 keys and the counters in numpy arrays.
+
+    Set nWorkers to run the analysis in parallel within a single run.  Patients are sharded
+    across worker processes (by patient ID modulo nWorkers), each streaming its shard
+    from its own DB cursor.  The worker buffers are passed back to the parent process,
+    reduced with a tree merge, and persisted by the parent alone, so only one connection
+    ever writes association increments.
     """
     connFactory = None; # Allow specification of alternative DB connection source
     patientsPerCommit = None; # Commit any bufferred analysis results to the database after analyzing this many patients.  If None, will wait until the end before committing, so less DB hits, but will lose  progress if script cancelled midway
     associationsPerCommit = None;   # Commit buffered analysis results if accrue this many association results to avoid risk of running over runtime memory limitations
     itemsPerUpdate = None;  # When updating analyze_dates for patient_items, do so for this many blocks at a time to avoid avoid loading MySQL query time
+    bulkCommit = False; # If True, commit update buffers by streaming them into temporary staging tables (COPY for PostgreSQL) and applying them with single set-based queries, rather than one query per item pair
+    nWorkers = None;    # Number of parallel worker processes to shard patients across.  If None (or 1), analyze all patients in this process
+    streamQuery = False;    # If True, stream the main patient item query through a server-side cursor on a dedicated connection (see queryPatientItemArraysPerPatient), rather than a default client-side cursor
 
     def __init__(self):
         """Default constructor"""
@@ -72,11 +126,16 @@ class AssociationAnalysis:
         self.patientsPerCommit = None;
         self.associationsPerCommit = None;
         self.itemsPerUpdate = None;
+        self.bulkCommit = False;
+        self.nWorkers = None;
+        self.streamQuery = False;
 
     def makeUpdateBuffer(self, existingBuffer=None):
         """Factory method to prepare a blank "updateBuffer" to store association increment data.
-        Is really just a dictionary for simple JSON conversion, but instantiate here to control
+        Is really just a dictionary, but instantiate here to control
         expected attributes / keys;
+        The "incrementDataByItemIdPair" entry is an AssociationCountBuffer
+        holding the count increments for each item pair.
         If exitingBuffer is not None, assume that is a previous one that we wish to
         clear / blank out.
         """
@@ -86,10 +145,10 @@ class AssociationAnalysis:
         updateBuffer.clear();
         updateBuffer["nAssociations"] = 0;
         updateBuffer["analyzedPatientItemIds"] = set();
-        updateBuffer["incrementDataByItemIdPair"] = dict();
+        updateBuffer["incrementDataByItemIdPair"] = AssociationCountBuffer();
         return updateBuffer;
 
-    def analyzePatientItems(self, analysisOptions):
+    def analyzePatientItems(self, analysisOptions, nWorkers=None):
         """Primary run function to analyze patient clinical item data and
         record updated stats to the respective database tables.
 
@@ -98,7 +157,16 @@ class AssociationAnalysis:
 
         Will also record analyze_date timestamp on any records analyzed,
         so that analysis will not be repeated if called again on the same records.
+
+        If nWorkers (default self.nWorkers) is more than 1, shard the patients
+        across that many worker processes.  See analyzePatientItemsParallel.
         """
+        if nWorkers is None:
+            nWorkers = self.nWorkers;
+        if nWorkers is not None and nWorkers > 1:
+            self.analyzePatientItemsParallel(analysisOptions, nWorkers);
+            return;
+
         progress = ProgressDots();
         conn = self.connFactory.connection();
 
@@ -110,9 +178,9 @@ class AssociationAnalysis:
             #   to the database in batch to minimize inefficient DB hits
             updateBuffer = self.makeUpdateBuffer();
             log.info("Main patient item query...")
-            for iPatient, patientItemList in enumerate(self.queryPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn)):
-                log.debug("Calculate associations for Patient %d's %d patient items. %d associations in buffer." % (iPatient, len(patientItemList), updateBuffer["nAssociations"]) );
-                self.updateItemAssociationsBuffer(patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
+            for iPatient, patientItemArrays in enumerate(self.patientItemArraysPerPatient(analysisOptions, progress=progress, conn=conn)):
+                log.debug("Calculate associations for Patient %d's %d patient items. %d associations in buffer." % (iPatient, len(patientItemArrays["patient_item_id"]), updateBuffer["nAssociations"]) );
+                self.updateItemAssociationsBufferFromArrays(patientItemArrays, updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
                 if self.readyForIntervalCommit(iPatient, updateBuffer, analysisOptions):
                     log.info("Commit after %s patients" % (iPatient+1) );
                     self.persistUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, analysisOptions, iPatient, conn=conn);  # Periodically commit update buffer
@@ -125,6 +193,105 @@ class AssociationAnalysis:
             conn.close();
         # progress.PrintStatus();
 
+    def analyzePatientItemsParallel(self, analysisOptions, nWorkers):
+        """Parallel version of analyzePatientItems.  Patients are sharded across nWorkers
+        processes, each running analyzePatientItemsShard to accrue its own update buffer
+        from its own DB connection and cursor.
+
+        This (parent) process collects the worker buffers, reduces them with
+        a tree merge, and persists the results.  associationsPerCommit is honored
+        across all workers: each worker hands back its buffer once it accrues
+        its share (associationsPerCommit / nWorkers) of associations, and the parent
+        persists the merged buffers whenever their total exceeds associationsPerCommit.
+        If patientsPerCommit is set, each buffer handed back is persisted upon receipt.
+        """
+        # Bounded result queue, so workers stall rather than piling up buffers in memory when the parent is busy committing
+        resultQueue = multiprocessing.Queue(nWorkers);
+        workers = list();
+        doneShards = set();
+        conn = None;
+        try:
+            for iShard in xrange(nWorkers):
+                shardOptions = copy.copy(analysisOptions);
+                shardOptions.patientShardIndex = iShard;
+                shardOptions.patientShardCount = nWorkers;
+                worker = multiprocessing.Process(target=self.analyzePatientItemsShard, args=(shardOptions, nWorkers, iShard, resultQueue));
+                worker.start();
+                workers.append(worker);
+
+            conn = self.connFactory.connection();   # Open after forking worker processes, which each open their own
+            linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
+
+            pendingBuffers = list();
+            nPendingAssociations = 0;
+            iCommit = 0;
+            while len(doneShards) < nWorkers:
+                try:
+                    (iShard, resultType, result) = resultQueue.get(timeout=WORKER_POLL_SECONDS);
+                except Queue.Empty:
+                    for (iShard, worker) in enumerate(workers):
+                        if iShard not in doneShards and not worker.is_alive():
+                            raise Exception("Association analysis worker %d exited (code %s) without completing" % (iShard, worker.exitcode) );
+                    # Still send a quick arbitrary query to DB, otherwise connection may get recycled because DB thinks timeout with no interaction
+                    DBUtil.execute("select 1+1", conn=conn);
+                    continue;
+
+                if resultType == "error":
+                    raise Exception("Association analysis worker %d failed:\n%s" % (iShard, result) );
+                elif resultType == "done":
+                    doneShards.add(iShard);
+                else:   # "buffer"
+                    log.debug("Received %d associations from worker %d" % (result["nAssociations"], iShard) );
+                    pendingBuffers.append(result);
+                    nPendingAssociations += result["nAssociations"];
+                    if self.patientsPerCommit is not None or (self.associationsPerCommit is not None and nPendingAssociations > self.associationsPerCommit):
+                        log.info("Commit %d worker buffers" % len(pendingBuffers) );
+                        updateBuffer = self.treeMergeBuffers(pendingBuffers);
+                        pendingBuffers = list();
+                        nPendingAssociations = 0;
+                        self.persistUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, analysisOptions, iCommit, conn=conn);  # Periodically commit update buffer
+                        iCommit += 1;
+
+            log.info("Final commit / persist");
+            updateBuffer = self.treeMergeBuffers(pendingBuffers);
+            self.persistUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, analysisOptions, -1, conn=conn);
+        finally:
+            for worker in workers:
+                if worker.is_alive() and len(doneShards) < nWorkers:
+                    worker.terminate(); # Abandoning the run.  Don't leave workers stalled on the result queue
+                worker.join();
+            if conn is not None:
+                conn.close();
+
+    def analyzePatientItemsShard(self, analysisOptions, nWorkers, iShard, resultQueue):
+        """Worker process body for analyzePatientItemsParallel.
+        Accrue associations for the patients in the analysisOptions shard,
+        putting (iShard, "buffer", updateBuffer) messages on the resultQueue
+        at each interval commit point and at the end,
+        then (iShard, "done", None) (or (iShard, "error", traceback) on failure).
+        """
+        try:
+            if self.associationsPerCommit is not None:
+                # Each worker's share of the buffer size limit.  Instance is this process's own (forked) copy
+                self.associationsPerCommit = max(self.associationsPerCommit // nWorkers, 1);
+
+            progress = ProgressDots();
+            conn = self.connFactory.connection();
+            try:
+                linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
+                updateBuffer = self.makeUpdateBuffer();
+                for iPatient, patientItemArrays in enumerate(self.patientItemArraysPerPatient(analysisOptions, progress=progress, conn=conn)):
+                    self.updateItemAssociationsBufferFromArrays(patientItemArrays, updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
+                    if self.readyForIntervalCommit(iPatient, updateBuffer, analysisOptions):
+                        resultQueue.put( (iShard, "buffer", updateBuffer) );
+                        updateBuffer = self.makeUpdateBuffer(); # New buffer rather than clearing, as queue pickles the last one in the background
+                resultQueue.put( (iShard, "buffer", updateBuffer) );
+            finally:
+                conn.close();
+            resultQueue.put( (iShard, "done", None) );
+        except Exception:
+            resultQueue.put( (iShard, "error", traceback.format_exc()) );
+
     def queryPatientItemsPerPatient(self, analysisOptions, progress=None, conn=None):
         """Query the database for an ordered list of patient clinical items,
         in the order in which they occurred.
@@ -142,27 +309,7 @@ class AssociationAnalysis:
         if not extConn:
             conn = self.connFactory.connection();
 
-        # Reset for actual data selects
-        query= SQLQuery();
-        query.addSelect("pi.patient_item_id");
-        query.addSelect("pi.patient_id");
-        query.addSelect("pi.encounter_id");
-        query.addSelect("pi.clinical_item_id");
-        query.addSelect("pi.item_date");
-        query.addSelect("pi.analyze_date");
-        query.addFrom("patient_item as pi");
-        query.addFrom("clinical_item as ci");
-        query.addWhere("pi.clinical_item_id = ci.clinical_item_id");
-        query.addWhere("ci.analysis_status <> 0");  # Skip steps designated to be ignored
-        if analysisOptions.patientIds is not None:
-            query.addWhereIn("patient_id", analysisOptions.patientIds );
-        if analysisOptions.startDate is not None:
-            query.addWhereOp("pi.item_date",">=", analysisOptions.startDate);
-        if analysisOptions.endDate is not None:
-            query.addWhereOp("pi.item_date","<", analysisOptions.endDate);
-        query.addOrderBy("pi.patient_id");
-        query.addOrderBy("pi.item_date");
-        query.addOrderBy("pi.clinical_item_id");
+        query = self.patientItemsQuery(analysisOptions);
 
         # Query to get an estimate of how long the process will be
         if progress is not None:
@@ -178,7 +325,7 @@ class AssociationAnalysis:
         currentPatientId = None;
         currentPatientData = list();
 
-        headers = ["patient_item_id","patient_id","encounter_id","clinical_item_id","item_date","analyze_date"];
+        headers = PATIENT_ITEM_COLUMNS;
 
         row = cursor.fetchone();
         while row is not None:
@@ -208,6 +355,76 @@ class AssociationAnalysis:
         if not extConn:
             conn.close();
 
+    def queryPatientItemArraysPerPatient(self, analysisOptions):
+        """Streaming alternative to queryPatientItemsPerPatient.
+        Runs the same query, but through a server-side (or unbuffered) cursor on a dedicated connection,
+        fetching DBUtil.ROWS_PER_FETCH rows at a time, so the full result set is never held in client memory,
+        and results are never built into RowItemModels.
+        Skips the separate count(*) query of the whole result set for progress estimates.
+        Yields a dictionary of parallel arrays for each patient (see patientItemArrays).
+        """
+        query = self.patientItemsQuery(analysisOptions);
+
+        # Dedicated connection, as MySQL cannot run other queries on a connection with unread streaming results
+        conn = self.connFactory.connection();
+        try:
+            cursor = DBUtil.streamingCursor(conn, "patient_item_stream");
+            try:
+                cursor.execute( str(query), tuple(query.params) );
+
+                currentPatientId = None;
+                currentPatientRows = list();
+                for row in DBUtil.iterateRows(cursor):
+                    patientId = row[1];
+                    if patientId != currentPatientId and len(currentPatientRows) > 0:
+                        yield self.patientItemArraysFromRows(currentPatientRows);
+                        currentPatientRows = list();
+                    currentPatientId = patientId;
+                    currentPatientRows.append(row);
+                if len(currentPatientRows) > 0:
+                    yield self.patientItemArraysFromRows(currentPatientRows);
+            finally:
+                cursor.close();
+        finally:
+            conn.close();
+
+    def patientItemArraysPerPatient(self, analysisOptions, progress=None, conn=None):
+        """Iterator over the patientItemArrays for each patient's items,
+        from the streaming queryPatientItemArraysPerPatient if self.streamQuery is set,
+        otherwise converted from the queryPatientItemsPerPatient lists.
+        """
+        if self.streamQuery:
+            return self.queryPatientItemArraysPerPatient(analysisOptions);
+        return ( self.patientItemArrays(patientItemList) for patientItemList in self.queryPatientItemsPerPatient(analysisOptions, progress=progress, conn=conn) );
+
+    def patientItemsQuery(self, analysisOptions):
+        """Build the SQLQuery for the patient items to analyze (columns as in PATIENT_ITEM_COLUMNS),
+        ordered by patient and then item date.
+        """
+        query= SQLQuery();
+        query.addSelect("pi.patient_item_id");
+        query.addSelect("pi.patient_id");
+        query.addSelect("pi.encounter_id");
+        query.addSelect("pi.clinical_item_id");
+        query.addSelect("pi.item_date");
+        query.addSelect("pi.analyze_date");
+        query.addFrom("patient_item as pi");
+        query.addFrom("clinical_item as ci");
+        query.addWhere("pi.clinical_item_id = ci.clinical_item_id");
+        query.addWhere("ci.analysis_status <> 0");  # Skip steps designated to be ignored
+        if analysisOptions.patientIds is not None:
+            query.addWhereIn("patient_id", analysisOptions.patientIds );
+        if analysisOptions.startDate is not None:
+            query.addWhereOp("pi.item_date",">=", analysisOptions.startDate);
+        if analysisOptions.endDate is not None:
+            query.addWhereOp("pi.item_date","<", analysisOptions.endDate);
+        if analysisOptions.patientShardCount is not None:
+            query.addWhereOp("mod(abs(pi.patient_id), %d)" % analysisOptions.patientShardCount, "=", analysisOptions.patientShardIndex);
+        query.addOrderBy("pi.patient_id");
+        query.addOrderBy("pi.item_date");
+        query.addOrderBy("pi.clinical_item_id");
+        return query;
+
     def updateItemAssociationsBuffer(self, patientItemList, updateBuffer, analysisOptions, linkedItemIdsByBaseId=None,  progress=None):
         """Given a list of data on patient clinical items,
         ordered by item event date, increment information in the
@@ -218,56 +435,69 @@ class AssociationAnalysis:
         After done, also provide updateBuffer info for subsequent setting the analyze_date
         for all (completed) patient_items from this patient to the current time so that
         subsequent queries will know they have already been accounted for.
+
+        Rather than a nested loop over every item pair, hands the patient's items
+        as arrays to the batched AssociationCountBuffer.addPatientItems engine,
+        which enumerates and counts the pairs with array operations.
+        """
+        self.updateItemAssociationsBufferFromArrays(self.patientItemArrays(patientItemList), updateBuffer, analysisOptions, linkedItemIdsByBaseId, progress=progress);
+
+    def updateItemAssociationsBufferFromArrays(self, patientItemArrays, updateBuffer, analysisOptions, linkedItemIdsByBaseId=None, progress=None):
+        """Same as updateItemAssociationsBuffer, but given the patient's items
+        already converted into patientItemArrays.
         """
+        deltaSecondsOptions = None;
+        if analysisOptions is not None:
+            deltaSecondsOptions = analysisOptions.deltaSecondsOptions;
+
+        countBuffer = asAssociationCountBuffer(updateBuffer.get("incrementDataByItemIdPair"));
+        updateBuffer["incrementDataByItemIdPair"] = countBuffer;
+
         # Keep track of which items to mark as newly analyzed
-        newlyAnalyzedPatientItemIdSet = set();
-
-        # Keep track of which subsequent items have been analyzed, so we don't count further duplicates (just the first ones found)
-        subsequentItemIds = set();
-        # Keep track of all item pairs encountered to avoid counting patient level duplicates
-        encounterIdPairsByItemIdPair = dict();
-
-        patientId = None;
-        for iItem1, patientItem1 in enumerate(patientItemList):
-            if patientId is None:
-                patientId = patientItem1["patient_id"];
-
-            subsequentItemIds.clear();
-
-            for iItem2, patientItem2 in enumerate(patientItemList):
-                itemIdPair = (patientItem1["clinical_item_id"], patientItem2["clinical_item_id"]);
-                encounterIdPair = (patientItem1["encounter_id"], patientItem2["encounter_id"]);
-
-                # Verify is not a previously composite linked item pair, in which case no meaningful asssociation stats to calculate
-                #   and that the item dates are in non-negative direction
-                isPairToAnalyze = self.acceptableClinicalItemPair(patientItem1, patientItem2, linkedItemIdsByBaseId );
-                if isPairToAnalyze:
-                    if (patientItem1["analyze_date"] is None or patientItem2["analyze_date"] is None):
-                        # Record the stat update if this pair has not already been analyzed/recorded before
-                        isNewSubsequentItem = patientItem2["clinical_item_id"] not in subsequentItemIds;   # Track repeats
-                        isNewPair = itemIdPair not in encounterIdPairsByItemIdPair; # Pair ever seen for this patient
-                        isNewPairWithinEncounter = (encounterIdPair[0]==encounterIdPair[-1]) and (isNewPair or encounterIdPair not in encounterIdPairsByItemIdPair[itemIdPair]);    # Pair ever seen for a common encounter combination
-
-                        self.updateClinicalItemAssociationBuffer( patientItem1, patientItem2, isNewSubsequentItem, isNewPair, isNewPairWithinEncounter, updateBuffer, analysisOptions );
-
-                        if patientItem1["analyze_date"] is None:
-                            newlyAnalyzedPatientItemIdSet.add(patientItem1["patient_item_id"]);
-                        if patientItem2["analyze_date"] is None:
-                            newlyAnalyzedPatientItemIdSet.add(patientItem2["patient_item_id"]);
-                    subsequentItemIds.add(patientItem2["clinical_item_id"]);
-
-                    if itemIdPair not in encounterIdPairsByItemIdPair:
-                        encounterIdPairsByItemIdPair[itemIdPair] = set();
-                    encounterIdPairsByItemIdPair[itemIdPair].add(encounterIdPair);
-
-            # Update progress meter if available
-            if progress is not None:
-                progress.Update();
+        newlyAnalyzed = countBuffer.addPatientItems \
+            (   patientItemArrays["clinical_item_id"],
+                patientItemArrays["encounter_id"],
+                patientItemArrays["item_seconds"],
+                patientItemArrays["analyzed"],
+                linkedItemIdsByBaseId,
+                deltaSecondsOptions,
+            );
+        updateBuffer["nAssociations"] = len(countBuffer);
+
+        # Update progress meter if available
+        if progress is not None:
+            progress.Update(len(patientItemArrays["patient_item_id"]));
 
         # Record this analysis date to any unmarked records
         if "analyzedPatientItemIds" not in updateBuffer:
             updateBuffer["analyzedPatientItemIds"] = set();
-        updateBuffer["analyzedPatientItemIds"].update(newlyAnalyzedPatientItemIdSet);
+        updateBuffer["analyzedPatientItemIds"].update(patientItemArrays["patient_item_id"][newlyAnalyzed].tolist());
+
+    def patientItemArrays(self, patientItemList):
+        """Convert a list of patient item RowItemModels (as from queryPatientItemsPerPatient)
+        into a dictionary of parallel arrays, to feed into AssociationCountBuffer.addPatientItems:
+            * patient_item_id
+            * clinical_item_id
+            * encounter_id (object array, as encounter IDs may be null)
+            * item_seconds - item_date as seconds since the epoch
+            * analyzed - Whether the item already has an analyze_date recorded
+        """
+        columns = [ [patientItem[col] for patientItem in patientItemList] for col in PATIENT_ITEM_COLUMNS ];
+        return self.patientItemArraysFromColumns(*columns);
+
+    def patientItemArraysFromRows(self, rows):
+        """Same as patientItemArrays, but from raw query result row tuples (columns as in PATIENT_ITEM_COLUMNS)"""
+        return self.patientItemArraysFromColumns(*zip(*rows));
+
+    def patientItemArraysFromColumns(self, patientItemIds, patientIds, encounterIds, clinicalItemIds, itemDates, analyzeDates):
+        nItems = len(patientItemIds);
+        patientItemArrays = dict();
+        patientItemArrays["patient_item_id"] = np.fromiter( patientItemIds, dtype=np.int64, count=nItems );
+        patientItemArrays["clinical_item_id"] = np.fromiter( clinicalItemIds, dtype=np.int64, count=nItems );
+        patientItemArrays["encounter_id"] = np.array( encounterIds, dtype=object );
+        patientItemArrays["item_seconds"] = np.fromiter( (epochSeconds(itemDate) for itemDate in itemDates), dtype=np.float64, count=nItems );
+        patientItemArrays["analyzed"] = np.fromiter( (analyzeDate is not None for analyzeDate in analyzeDates), dtype=bool, count=nItems );
+        return patientItemArrays;
 
     def updateClinicalItemAssociationBuffer(self, patientItem1, patientItem2, isNewSubsequentItem, isNewPair, isNewPairWithinEncounter, updateBuffer, analysisOptions=None, itemIdPair=None):
         """Identify and record in the updateBuffer which statistics on associations
@@ -304,37 +534,12 @@ class AssociationAnalysis:
         if isNewPairWithinEncounter:
             countPrefixes.append("encounter_");
 
-        if "incrementDataByItemIdPair" not in updateBuffer:
-            updateBuffer["incrementDataByItemIdPair"] = dict();
-            updateBuffer["nAssociations"] = 0;
-        if str(itemIdPair) not in updateBuffer["incrementDataByItemIdPair"]:
-            updateBuffer["incrementDataByItemIdPair"][str(itemIdPair)] = dict();
-            updateBuffer["nAssociations"] += 1;
-        incrementData = updateBuffer["incrementDataByItemIdPair"][str(itemIdPair)];
-
-        # Decide on columns to increment pair association with time dependency
-        for countPrefix in countPrefixes:
-            countField = countPrefix+"count_any";
-            if countField not in incrementData:
-                incrementData[countField] = 0;
-            incrementData[countField] += 1;
-
-            for secondsOption in deltaSecondsOptions:
-                if secondsDelta <= secondsOption:
-                    countField = countPrefix+"count_%d" % secondsOption;
-                    if countField not in incrementData:
-                        incrementData[countField] = 0;
-                    incrementData[countField] += 1;
-
-            sumField = countPrefix+"time_diff_sum";
-            if sumField not in incrementData:
-                incrementData[sumField] = 0;
-            incrementData[sumField] += secondsDelta;
-
-            sumField = countPrefix+"time_diff_sum_squares";
-            if sumField not in incrementData:
-                incrementData[sumField] = 0;
-            incrementData[sumField] += secondsDelta**2;
+        countBuffer = asAssociationCountBuffer(updateBuffer.get("incrementDataByItemIdPair"));
+        updateBuffer["incrementDataByItemIdPair"] = countBuffer;
+
+        # Increment count_any, count_<seconds> columns within the time windows, and time_diff sums
+        countBuffer.addPairIncrement(itemIdPair, secondsDelta, countPrefixes, deltaSecondsOptions);
+        updateBuffer["nAssociations"] = len(countBuffer);
 
     def readyForIntervalCommit(self, iPatient, updateBuffer, analysisOptions):
         isReady = False;
@@ -349,34 +554,40 @@ class AssociationAnalysis:
         else:
             bufferOne["analyzedPatientItemIds"].update(bufferTwo["analyzedPatientItemIds"]);
 
-        if "nAssociations" not in bufferOne:
-            bufferOne["nAssociations"] = 0
-        else:
-             bufferOne["nAssociations"] = bufferOne["nAssociations"] + bufferTwo["nAssociations"]
-
-        if "incrementDataByItemIdPair" not in bufferOne:
-            bufferOne["incrementDataByItemIdPair"] = dict()
-        if "incrementDataByItemIdPair" not in bufferTwo:
-            bufferTwo["incrementDataByItemIdPair"] = dict()
-
-        # then fill up any remaining id pairs from buffer two. if you have some in buffer two that are also in buffer one, then add those specific ones together
-        for key, value in bufferTwo["incrementDataByItemIdPair"].iteritems():
-            if key not in bufferOne["incrementDataByItemIdPair"]:
-                bufferOne["incrementDataByItemIdPair"][key] = bufferTwo["incrementDataByItemIdPair"][key]
-            else:
-                for key2, value2 in bufferTwo["incrementDataByItemIdPair"][key].iteritems():
-                    if key2 not in bufferOne["incrementDataByItemIdPair"][key]:
-                        bufferOne["incrementDataByItemIdPair"][key][key2]=bufferTwo["incrementDataByItemIdPair"][key][key2]
-                    else:
-                        bufferOne["incrementDataByItemIdPair"][key][key2]+=bufferTwo["incrementDataByItemIdPair"][key][key2]
+        # Add up count increments from buffer two into buffer one, with item pairs in either
+        countBufferOne = asAssociationCountBuffer(bufferOne.get("incrementDataByItemIdPair"));
+        countBufferTwo = asAssociationCountBuffer(bufferTwo.get("incrementDataByItemIdPair"));
+        countBufferOne.merge(countBufferTwo);
+        bufferOne["incrementDataByItemIdPair"] = countBufferOne;
+        bufferOne["nAssociations"] = len(countBufferOne);
 
         return bufferOne
 
+    def treeMergeBuffers(self, updateBuffers):
+        """Reduce a list of update buffers (e.g., from parallel workers) into one,
+        merging pairs of buffers in rounds, rather than folding every buffer into a single
+        ever growing accumulator.  Within each pair, merge the smaller buffer into the larger.
+        """
+        updateBuffers = list(updateBuffers);
+        if len(updateBuffers) < 1:
+            return self.makeUpdateBuffer();
+        while len(updateBuffers) > 1:
+            mergedBuffers = list();
+            for iBuffer in xrange(0, len(updateBuffers)-1, 2):
+                (bufferOne, bufferTwo) = (updateBuffers[iBuffer], updateBuffers[iBuffer+1]);
+                if bufferOne["nAssociations"] < bufferTwo["nAssociations"]:
+                    (bufferOne, bufferTwo) = (bufferTwo, bufferOne);
+                mergedBuffers.append(self.mergeBuffers(bufferOne, bufferTwo));
+            if len(updateBuffers) % 2 == 1:
+                mergedBuffers.append(updateBuffers[-1]);    # Odd one out carries over to the next round
+            updateBuffers = mergedBuffers;
+        return updateBuffers[0];
+
     def bufferDecay (self, bufferDecay, decayValue):
         if "incrementDataByItemIdPair" in bufferDecay:
-            for key, value in bufferDecay["incrementDataByItemIdPair"].iteritems():
-                for key2, value2 in bufferDecay["incrementDataByItemIdPair"][key].iteritems():
-                    bufferDecay["incrementDataByItemIdPair"][key][key2] *= decayValue
+            countBuffer = asAssociationCountBuffer(bufferDecay["incrementDataByItemIdPair"]);
+            countBuffer.decay(decayValue);
+            bufferDecay["incrementDataByItemIdPair"] = countBuffer;
         return bufferDecay
 
 
@@ -385,14 +596,24 @@ class AssociationAnalysis:
             linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
             self.commitUpdateBuffer(updateBuffer, linkedItemIdsByBaseId, conn=conn)
         else:
-            bufferFilename = "%s.%s.json.gz" % (analysisOptions.bufferFile, iPatient);    # Modify filename with which patient done so far, in case saving several sequential results
+            bufferFilename = "%s.%s%s" % (analysisOptions.bufferFile, iPatient, AssociationBufferFile.FILE_SUFFIX);    # Modify filename with which patient done so far, in case saving several sequential results
             self.saveBufferToFile(bufferFilename, updateBuffer);
 
     def saveBufferToFile (self, filename, updateBuffer):
-        ofs = stdOpen (filename, "w");
-        updateBuffer["analyzedPatientItemIds"] = list(updateBuffer["analyzedPatientItemIds"]);
-        json.dump(updateBuffer, ofs);
-        ofs.close();
+        """Save the updateBuffer contents to the named file, in the binary AssociationBufferFile format,
+        unless the filename ends with .json or .json.gz, in which case dump a (legacy) JSON object.
+        """
+        if not filename.endswith(".json") and not filename.endswith(".json.gz"):
+            countBuffer = asAssociationCountBuffer(updateBuffer.get("incrementDataByItemIdPair"));
+            AssociationBufferFile.saveBufferFile(filename, countBuffer, updateBuffer.get("analyzedPatientItemIds"));
+        else:
+            ofs = stdOpen (filename, "w");
+            updateBuffer["analyzedPatientItemIds"] = list(updateBuffer["analyzedPatientItemIds"]);
+            if "incrementDataByItemIdPair" in updateBuffer:
+                # JSON file format still expects the dictionary of named counters per str(itemIdPair)
+                updateBuffer["incrementDataByItemIdPair"] = asAssociationCountBuffer(updateBuffer["incrementDataByItemIdPair"]).toIncrementDataByItemIdPair();
+            json.dump(updateBuffer, ofs);
+            ofs.close();
 
         # Wipe out buffer to reflect incremental changes done, so any new ones should be recorded fresh
         updateBuffer = self.makeUpdateBuffer(updateBuffer);
@@ -402,34 +623,71 @@ class AssociationAnalysis:
         try:
             #print >> sys.stderr, filename
             log.info("Loading: %s" % filename);
-            ifs = stdOpen(filename, "r")
-            updateBuffer = json.load(ifs)
-            updateBuffer["analyzedPatientItemIds"] = set(updateBuffer["analyzedPatientItemIds"])
-            ifs.close()
+            if AssociationBufferFile.isBufferFile(filename):
+                reader = AssociationBufferFile.AssociationBufferFileReader(filename);
+                updateBuffer = self.makeUpdateBuffer();
+                updateBuffer["analyzedPatientItemIds"] = set(reader.analyzedPatientItemIds.tolist());
+                updateBuffer["incrementDataByItemIdPair"] = reader.toCountBuffer();
+                reader.close();
+            else:
+                ifs = stdOpen(filename, "r")
+                updateBuffer = json.load(ifs)
+                updateBuffer["analyzedPatientItemIds"] = set(updateBuffer["analyzedPatientItemIds"])
+                updateBuffer["incrementDataByItemIdPair"] = asAssociationCountBuffer(updateBuffer.get("incrementDataByItemIdPair"));
+                ifs.close()
+            updateBuffer["nAssociations"] = len(updateBuffer["incrementDataByItemIdPair"]);
         except IOError, exc:
             # Apparently could not find the named filename. See if instead it's a prefix
             #    for a series of enumerated files and then merge them into one mass buffer
-            dirname = os.path.dirname(filename);
-            if dirname == "": dirname = ".";    # Implicitly the current working directory
-            basename = os.path.basename(filename);
-            for nextFilename in os.listdir(dirname):
-                if nextFilename.startswith(basename):
-                    nextFilepath = os.path.join(dirname, nextFilename);
-                    nextUpdateBuffer = self.loadUpdateBufferFromFile(nextFilepath);
-                    if updateBuffer is None:    # First update buffer, use it as base
-                        updateBuffer = nextUpdateBuffer;
-                    else:    # Have existing update buffer. Just update it's contents with the next one
-                        updateBuffer = self.mergeBuffers(updateBuffer, nextUpdateBuffer);
-                        del nextUpdateBuffer;	# Make sure memory gets reclaimed
+            for nextFilepath in self.bufferFilenamesWithPrefix(filename):
+                nextUpdateBuffer = self.loadUpdateBufferFromFile(nextFilepath);
+                if updateBuffer is None:    # First update buffer, use it as base
+                    updateBuffer = nextUpdateBuffer;
+                else:    # Have existing update buffer. Just update it's contents with the next one
+                    updateBuffer = self.mergeBuffers(updateBuffer, nextUpdateBuffer);
+                    del nextUpdateBuffer;	# Make sure memory gets reclaimed
 
         return updateBuffer;
 
+    def bufferFilenamesWithPrefix(self, filenamePrefix):
+        """List of file paths whose names start with the given prefix (e.g., a series of enumerated buffer files)"""
+        dirname = os.path.dirname(filenamePrefix);
+        if dirname == "": dirname = ".";    # Implicitly the current working directory
+        basename = os.path.basename(filenamePrefix);
+        return [os.path.join(dirname, nextFilename) for nextFilename in sorted(os.listdir(dirname)) if nextFilename.startswith(basename)];
+
     def commitUpdateBufferFromFile(self, filename):
-        conn = self.connFactory.connection();
-        updateBuffer = self.loadUpdateBufferFromFile(filename);
-        linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
-        self.commitUpdateBuffer(updateBuffer,linkedItemIdsByBaseId, conn=conn);
+        """Commit a previously saved buffer file (or series of files with the filename as a prefix) to the database.
+        If all are binary AssociationBufferFiles, stream k-way merge them into one (temporary) file,
+        and commit directly from its memory-mapped contents, chunk by chunk,
+        rather than loading and merging the whole buffers in memory.
+        """
+        filenames = [filename];
+        if not os.path.exists(filename):
+            filenames = self.bufferFilenamesWithPrefix(filename);
 
+        conn = self.connFactory.connection();
+        try:
+            linkedItemIdsByBaseId = self.dataManager.loadLinkedItemIdsByBaseId(conn=conn);
+            if len(filenames) > 0 and all(AssociationBufferFile.isBufferFile(nextFilename) for nextFilename in filenames):
+                mergedFilename = filenames[0];
+                if len(filenames) > 1:
+                    (fd, mergedFilename) = tempfile.mkstemp(suffix=AssociationBufferFile.FILE_SUFFIX);
+                    os.close(fd);
+                    log.info("Merging %d buffer files" % len(filenames) );
+                    AssociationBufferFile.mergeBufferFiles(filenames, mergedFilename);
+                try:
+                    reader = AssociationBufferFile.AssociationBufferFileReader(mergedFilename);
+                    self.commitIncrements(reader.itemIds(), reader.iterCountBuffers(), reader.analyzedPatientItemIds.tolist(), linkedItemIdsByBaseId, conn);
+                    reader.close();
+                finally:
+                    if mergedFilename not in filenames:
+                        os.remove(mergedFilename);
+            else:
+                updateBuffer = self.loadUpdateBufferFromFile(filename);
+                self.commitUpdateBuffer(updateBuffer,linkedItemIdsByBaseId, conn=conn);
+        finally:
+            conn.close();
 
     def commitUpdateBuffer(self, updateBuffer, linkedItemIdsByBaseId, conn=None):
         """Take data accumulated in updateBuffer from prior update methods and
@@ -440,97 +698,270 @@ class AssociationAnalysis:
         if not extConn:
             conn = self.connFactory.connection();
         try:
+            itemIds = list();
+            countBuffers = list();
             if "incrementDataByItemIdPair" in updateBuffer:
-                # Ensure baseline records exist to facilitate subsequent incremental update queries
-                itemIdPairs = updateBuffer["incrementDataByItemIdPair"].keys();
-                self.prepareItemAssociations(itemIdPairs, linkedItemIdsByBaseId, conn);
-
-                # Construct incremental update queries based on each item pair's incremental counts/sums
-                nItemPairs = len(itemIdPairs);
-                log.debug("Primary increment updates for %d item pairs" % nItemPairs );
-                incrementProg = ProgressDots(name="Increments");
-                incrementProg.total = nItemPairs;
-                cursor = conn.cursor();
-                try:
-                    for (itemIdPair, incrementData) in updateBuffer["incrementDataByItemIdPair"].iteritems():
-                        query = ["UPDATE clinical_item_association SET"];
-                        for col, increment in incrementData.iteritems():
-                            query.append("%(col)s=%(col)s+%(increment)s" % {"col":col,"increment":increment});
-                            query.append(",");
-                        query.pop();    # Drop extra comma at end of list
-                        query.append("WHERE clinical_item_id=%(p)s AND subsequent_item_id=%(p)s" % {"p":DBUtil.SQL_PLACEHOLDER} );
-                        query = str.join(" ", query);
-                        itemIdPair = eval(itemIdPair)
-                        cursor.execute(query, itemIdPair);
-                        incrementProg.update();
-                    # incrementProg.printStatus();
-                finally:
-                    cursor.close();
-
-            if "analyzedPatientItemIds" in updateBuffer:
-                # Record analysis date for the given patient items
-                patientItemIdSet = updateBuffer["analyzedPatientItemIds"];
-                nItems = len(patientItemIdSet);
-                log.debug("Record %d analyzed items" % nItems );
-                if nItems > 0:
-                    paramList = [datetime.now()];
-                    updateSize = 0;
-                    for itemId in patientItemIdSet:
-                        paramList.append(itemId);
-                        updateSize += 1;
-
-                        if self.itemsPerUpdate is not None and updateSize > self.itemsPerUpdate:
-                            # Update what we have so far to avoid excessive single mass query that may overwhelm database timeout
-                            DBUtil.execute \
-                            (   """update patient_item
-                                set analyze_date = %(p)s
-                                where patient_item_id in (%(pList)s)
-                                and analyze_date is null
-                                """ % {"p": DBUtil.SQL_PLACEHOLDER, "pList":generatePlaceholders(updateSize)},
-                                tuple(paramList),
-                                conn=conn
-                            );
-                            # Reset item list parameters
-                            paramList = [datetime.now()];
-                            updateSize = 0;
-                    # Final Update
-                    DBUtil.execute \
-                    (   """update patient_item
-                        set analyze_date = %(p)s
-                        where patient_item_id in (%(pList)s)
-                        and analyze_date is null
-                        """ % {"p": DBUtil.SQL_PLACEHOLDER, "pList":generatePlaceholders(updateSize)},
-                        tuple(paramList),
-                        conn=conn
-                    );
-
-            # Flag that any cached association metrics will be out of date
-            self.dataManager.clearCacheData("analyzedPatientCount");
-            self.dataManager.clearCacheData("clinicalItemCountsUpdated");
-
-            # Database commit
-            conn.commit();
+                countBuffer = asAssociationCountBuffer(updateBuffer["incrementDataByItemIdPair"]);
+                itemIds = countBuffer.itemIds();
+                countBuffers.append(countBuffer);
+            patientItemIds = updateBuffer.get("analyzedPatientItemIds", list());
+
+            self.commitIncrements(itemIds, countBuffers, patientItemIds, linkedItemIdsByBaseId, conn);
 
             # Wipe out buffer to reflect incremental changes done, so any new ones should be recorded fresh
-            updateBuffer.clear();
-            updateBuffer["nAssociations"] = 0;
+            self.makeUpdateBuffer(updateBuffer);
         finally:
             if not extConn:
                 conn.close();
 
+    def commitIncrements(self, itemIds, countBuffers, patientItemIds, linkedItemIdsByBaseId, conn):
+        """Commit association count increments and analyzed patient item records to the database.
+        Ensures baseline association records for all combinations of the itemIds,
+        then applies the count increments from each of the countBuffers
+        (e.g., chunks of one large buffer file), then records the analysis date
+        for the patientItemIds.
+
+        If the database counts have a lazy decay scale factor (see DecayingWindows.lazyDecay),
+        the count increments are divided by it before they are added to the stored values.
+        """
+        countScale = self.dataManager.getAssociationCountScale(conn=conn, useCache=False);
+        if self.bulkCommit:
+            self.createStageTables(conn);
+
+        if len(itemIds) > 0:
+            if self.bulkCommit:
+                self.bulkPrepareItemAssociations(itemIds, linkedItemIdsByBaseId, conn);
+            else:
+                self.prepareItemAssociationsForItemIds(itemIds, linkedItemIdsByBaseId, conn);
+
+        for countBuffer in countBuffers:
+            if countScale != 1.0:
+                countBuffer.scaleColumns(COUNT_COLUMN_INDEXES, 1.0/countScale);
+            if self.bulkCommit:
+                self.bulkIncrementItemAssociations(countBuffer, conn);
+            else:
+                self.incrementItemAssociations(countBuffer, conn);
+
+        # Record analysis date for the given patient items
+        nItems = len(patientItemIds);
+        log.debug("Record %d analyzed items" % nItems );
+        if nItems > 0 and self.bulkCommit:
+            self.bulkMarkAnalyzedItems(patientItemIds, conn);
+        elif nItems > 0:
+            self.markAnalyzedItems(patientItemIds, conn);
+
+        if self.bulkCommit:
+            self.dropStageTables(conn);
+
+        # Flag that any cached association metrics will be out of date
+        self.dataManager.clearCacheData("analyzedPatientCount");
+        self.dataManager.clearCacheData("clinicalItemCountsUpdated");
+
+        # Database commit
+        conn.commit();
+
+    def incrementItemAssociations(self, countBuffer, conn):
+        """Increment the clinical_item_association counts by those in the countBuffer, one update query per item pair.
+        Assumes the baseline records already exist.
+        """
+        # Construct incremental update query based on the count columns with any increments.
+        #   Same query for every item pair, adding zero to columns not incremented for a particular pair.
+        colIndexes = countBuffer.activeColumnIndexes();
+        if len(colIndexes) < 1:
+            return;
+        query = ["UPDATE clinical_item_association SET"];
+        for iCol in colIndexes:
+            query.append("%(col)s=%(col)s+%(p)s" % {"col":COLUMN_NAMES[iCol],"p":DBUtil.SQL_PLACEHOLDER});
+            query.append(",");
+        query.pop();    # Drop extra comma at end of list
+        query.append("WHERE clinical_item_id=%(p)s AND subsequent_item_id=%(p)s" % {"p":DBUtil.SQL_PLACEHOLDER} );
+        query = str.join(" ", query);
+
+        itemIdPairs = countBuffer.itemIdPairs();
+        nItemPairs = len(itemIdPairs);
+        log.debug("Primary increment updates for %d item pairs" % nItemPairs );
+        incrementProg = ProgressDots(name="Increments");
+        incrementProg.total = nItemPairs;
+        cursor = conn.cursor();
+        try:
+            for (itemIdPair, countRow) in zip(itemIdPairs, countBuffer.countArray()[:,colIndexes].tolist()):
+                cursor.execute(query, tuple(countRow)+itemIdPair);
+                incrementProg.update();
+            # incrementProg.printStatus();
+        finally:
+            cursor.close();
+
+    def markAnalyzedItems(self, patientItemIds, conn):
+        """Record analysis date for the given patient items,
+        in blocks of up to itemsPerUpdate items per query.
+        """
+        paramList = [datetime.now()];
+        updateSize = 0;
+        for itemId in patientItemIds:
+            paramList.append(itemId);
+            updateSize += 1;
+
+            if self.itemsPerUpdate is not None and updateSize > self.itemsPerUpdate:
+                # Update what we have so far to avoid excessive single mass query that may overwhelm database timeout
+                DBUtil.execute \
+                (   """update patient_item
+                    set analyze_date = %(p)s
+                    where patient_item_id in (%(pList)s)
+                    and analyze_date is null
+                    """ % {"p": DBUtil.SQL_PLACEHOLDER, "pList":generatePlaceholders(updateSize)},
+                    tuple(paramList),
+                    conn=conn
+                );
+                # Reset item list parameters
+                paramList = [datetime.now()];
+                updateSize = 0;
+        if updateSize > 0:
+            # Final Update
+            DBUtil.execute \
+            (   """update patient_item
+                set analyze_date = %(p)s
+                where patient_item_id in (%(pList)s)
+                and analyze_date is null
+                """ % {"p": DBUtil.SQL_PLACEHOLDER, "pList":generatePlaceholders(updateSize)},
+                tuple(paramList),
+                conn=conn
+            );
+
+    def createStageTables(self, conn):
+        """Create the (empty) temporary tables for the bulk commit methods to stage data in,
+        dropping any left on the (pooled) connection by a prior failed commit.
+        Done before any updates, so the commit stays in one transaction
+        even with connectors that implicitly commit before DDL statements (e.g., sqlite3).
+        """
+        for (tableName, colDefs) in STAGE_TABLE_COLUMNS:
+            DBUtil.execute("drop table if exists %s" % tableName, conn=conn, autoCommit=False);
+            DBUtil.execute("create temporary table %s (%s)" % (tableName, colDefs), conn=conn, autoCommit=False);
+
+    def dropStageTables(self, conn):
+        """Drop the temporary tables made by createStageTables, so they don't linger on a pooled connection"""
+        for (tableName, colDefs) in STAGE_TABLE_COLUMNS:
+            DBUtil.execute("drop table if exists %s" % tableName, conn=conn, autoCommit=False);
+
+    def bulkPrepareItemAssociations(self, itemIds, linkedItemIdsByBaseId, conn):
+        """Bulk commit alternative to prepareItemAssociations.
+        Generate the baseline item pairs in blocks of source items (see baselineItemIdPairBlocks).
+        For each block, stream the pairs not already in clinical_item_association into a temporary staging table,
+        and insert them with a single set-based upsert query.
+        """
+        keyColNames = ["clinical_item_id","subsequent_item_id"];
+        itemIds = np.unique(np.asarray(itemIds, dtype=np.int64));
+        log.debug("Ensure %d baseline records ready" % (len(itemIds)*len(itemIds)) );
+        DBUtil.bulkInsertRows(ITEM_STAGE_TABLE, ["clinical_item_id"], ( (itemId,) for itemId in itemIds.tolist() ), conn);
+        upsertQueries = DBUtil.buildUpsertQueries("clinical_item_association", keyColNames, [], "select %s from %s" % (str.join(",", keyColNames), PAIR_STAGE_TABLE) );
+
+        for (sourceItemIds, baselineItemIds1, baselineItemIds2) in self.baselineItemIdPairBlocks(itemIds, linkedItemIdsByBaseId):
+            # Query which ones already exist in the database, for this block of source items
+            existingTable = DBUtil.execute \
+            (   """select assoc.clinical_item_id, assoc.subsequent_item_id
+                from clinical_item_association as assoc, %(stage)s as source, %(stage)s as target
+                where assoc.clinical_item_id = source.clinical_item_id
+                and assoc.subsequent_item_id = target.clinical_item_id
+                and source.clinical_item_id >= %(p)s and source.clinical_item_id <= %(p)s
+                """ % {"stage": ITEM_STAGE_TABLE, "p": DBUtil.SQL_PLACEHOLDER},
+                (int(sourceItemIds[0]), int(sourceItemIds[-1])),
+                conn=conn, autoCommit=False
+            );
+            if len(existingTable) > 0:
+                existingKeys = packItemIdPairs([row[0] for row in existingTable], [row[1] for row in existingTable]);
+                isNew = ~np.in1d(packItemIdPairs(baselineItemIds1, baselineItemIds2), existingKeys);
+                baselineItemIds1 = baselineItemIds1[isNew];
+                baselineItemIds2 = baselineItemIds2[isNew];
+            if len(baselineItemIds1) < 1:
+                continue;
+
+            DBUtil.execute("delete from %s" % PAIR_STAGE_TABLE, conn=conn, autoCommit=False);
+            DBUtil.bulkInsertRows(PAIR_STAGE_TABLE, keyColNames, itertools.izip(baselineItemIds1.tolist(), baselineItemIds2.tolist()), conn);
+            for query in upsertQueries:
+                DBUtil.execute(query, conn=conn, autoCommit=False);
+
+    def bulkIncrementItemAssociations(self, countBuffer, conn):
+        """Bulk commit alternative to incrementItemAssociations.
+        Stream the count increments into a temporary staging table, and apply them
+        to clinical_item_association with a single set-based upsert query.
+        """
+        keyColNames = ["clinical_item_id","subsequent_item_id"];
+        colIndexes = countBuffer.activeColumnIndexes();
+        incrementColNames = [COLUMN_NAMES[iCol] for iCol in colIndexes];
+        if len(incrementColNames) < 1:
+            return;
+
+        log.debug("Primary increment updates for %d item pairs" % len(countBuffer) );
+        DBUtil.execute("delete from %s" % INCREMENT_STAGE_TABLE, conn=conn, autoCommit=False);
+        (itemIds1, itemIds2) = countBuffer.itemIdPairArrays();
+        countRows = countBuffer.countArray()[:,colIndexes].tolist();
+        incrementRows = ( (itemId1, itemId2)+tuple(countRow) for (itemId1, itemId2, countRow) in itertools.izip(itemIds1.tolist(), itemIds2.tolist(), countRows) );
+        DBUtil.bulkInsertRows(INCREMENT_STAGE_TABLE, keyColNames+incrementColNames, incrementRows, conn);
+        for query in DBUtil.buildUpsertQueries("clinical_item_association", keyColNames, incrementColNames, "select %s from %s" % (str.join(",", keyColNames+incrementColNames), INCREMENT_STAGE_TABLE) ):
+            DBUtil.execute(query, conn=conn, autoCommit=False);
+
+    def baselineItemIdPairBlocks(self, itemIds, linkedItemIdsByBaseId, blockPairs=None):
+        """Array version of the item pairs that prepareItemAssociations ensures baseline records for:
+        Every acceptable (not linked) combination of the given (unique, sorted) clinical item ID array.
+        Generates them in blocks of source items, up to blockPairs (default BASELINE_BLOCK_PAIRS) pairs at a time
+        (but at least one source item), rather than all combinations at once.
+        Yields (sourceItemIds, baselineItemIds1, baselineItemIds2) arrays for each block.
+        """
+        if blockPairs is None:
+            blockPairs = BASELINE_BLOCK_PAIRS;
+
+        # Linked item pairs to exclude in either direction
+        itemIdSet = set(itemIds.tolist());
+        linkedItemIds1 = list();
+        linkedItemIds2 = list();
+        for (baseItemId, linkedItemIds) in linkedItemIdsByBaseId.iteritems():
+            if baseItemId in itemIdSet:
+                for linkedItemId in linkedItemIds:
+                    if linkedItemId in itemIdSet:
+                        linkedItemIds1.extend([baseItemId, linkedItemId]);
+                        linkedItemIds2.extend([linkedItemId, baseItemId]);
+        linkedKeys = packItemIdPairs(linkedItemIds1, linkedItemIds2);
+
+        itemsPerBlock = max(1, blockPairs // max(1, len(itemIds)) );
+        for iStart in xrange(0, len(itemIds), itemsPerBlock):
+            sourceItemIds = itemIds[iStart:iStart+itemsPerBlock];
+            baselineItemIds1 = np.repeat(sourceItemIds, len(itemIds));
+            baselineItemIds2 = np.tile(itemIds, len(sourceItemIds));
+            if len(linkedKeys) > 0:
+                isLinked = np.in1d(packItemIdPairs(baselineItemIds1, baselineItemIds2), linkedKeys);
+                baselineItemIds1 = baselineItemIds1[~isLinked];
+                baselineItemIds2 = baselineItemIds2[~isLinked];
+            yield (sourceItemIds, baselineItemIds1, baselineItemIds2);
+
+    def bulkMarkAnalyzedItems(self, patientItemIds, conn):
+        """Bulk commit alternative to markAnalyzedItems.
+        Stream the IDs into a temporary staging table, and update them all with a single query.
+        """
+        DBUtil.execute("delete from %s" % ANALYZED_STAGE_TABLE, conn=conn, autoCommit=False);
+        DBUtil.bulkInsertRows(ANALYZED_STAGE_TABLE, ["patient_item_id"], ( (itemId,) for itemId in patientItemIds ), conn);
+        DBUtil.execute \
+        (   """update patient_item
+            set analyze_date = %(p)s
+            where patient_item_id in (select patient_item_id from %(stage)s)
+            and analyze_date is null
+            """ % {"p": DBUtil.SQL_PLACEHOLDER, "stage": ANALYZED_STAGE_TABLE},
+            (datetime.now(),),
+            conn=conn, autoCommit=False
+        );
+
     def prepareItemAssociations(self, itemIdPairs, linkedItemIdsByBaseId, conn):
         """Make sure all pair-wise item association records are ready / initialized
         so that subsequent queries don't have to pause to check for their existence.
         Should help greatly to reduce number of queries and execution time.
         """
         clinicalItemIdSet = set();
-        #Do the below to convert the list of strings into a list of pairs, which is needed for the rest of this function
-        for index, pair in enumerate(itemIdPairs):
-            itemIdPairs[index]=eval(pair)
-
         for (itemId1, itemId2) in itemIdPairs:
             clinicalItemIdSet.add(itemId1);
             clinicalItemIdSet.add(itemId2);
+        self.prepareItemAssociationsForItemIds(clinicalItemIdSet, linkedItemIdsByBaseId, conn);
+
+    def prepareItemAssociationsForItemIds(self, clinicalItemIds, linkedItemIdsByBaseId, conn):
+        """Make sure item association records are ready for all pair-wise combinations of the clinical item IDs"""
+        clinicalItemIdSet = set( int(itemId) for itemId in clinicalItemIds );
         nItems = len(clinicalItemIdSet);
 
         # Now go through all needed item pairs and create default records as needed
@@ -592,6 +1023,9 @@ class AssociationAnalysis:
         parser.add_option("-p", "--patientsPerCommit", dest="patientsPerCommit", help="If provided, will commit incremental analysis results to the database after every p patients.  If not set, will just wait until full analysis to commit all (will keep more in memory, and will lose progress if script aborted during mid-execution).  Beware that large values are more efficient, but requires more runtime memory which can exceed memory limits.")
         parser.add_option("-a", "--associationsPerCommit", dest="associationsPerCommit", help="If provided, will commit incremental analysis results to the database when accrue this many association items.  Can help to avoid allowing accrual of too much buffered items whose runtime memory will exceed the 32bit 2GB program limit. 1M seems to just fit within 7.5GB memory (assuming 64-bit Python). Running batches of 3000 patients with ~3000 possible clinical items yields ~5M associations requiring ~25GB memory for learning then ~45GB memory to reload and commit a buffer file.")
         parser.add_option("-u", "--itemsPerUpdate", dest="itemsPerUpdate", help="If provided, when updating patient_item analyze_dates, will only update this many items at a time to avoid overloading MySQL query. (e.g., 10,000)")
+        parser.add_option("-k", "--bulkCommit", dest="bulkCommit", action="store_true", help="If set, commit results to the database by streaming them into temporary staging tables and applying them with single set-based queries (e.g., PostgreSQL COPY and upsert queries), rather than one query per item pair.")
+        parser.add_option("-q", "--streamQuery", dest="streamQuery", action="store_true", help="If set, stream the patient item query results through a server-side cursor on a dedicated connection, a batch of rows at a time, and skip the up front count(*) query for progress estimates.")
+        parser.add_option("-w", "--nWorkers", dest="nWorkers", help="If provided, shard the patients across this many parallel worker processes, whose results are merged in memory before committing.")
         parser.add_option("-b", "--bufferFile", dest="bufferFile", help="If provided, send buffer to output file rather than commiting to database. If patientIds arguments and idFile parameter are blank, then instead read in bufferFile from this filename (prefix) and commit to database.")
         (options, args) = parser.parse_args(argv[1:])
 
@@ -613,6 +1047,10 @@ class AssociationAnalysis:
 
         if options.itemsPerUpdate is not None:
             self.itemsPerUpdate = int(options.itemsPerUpdate);
+        if options.bulkCommit:
+            self.bulkCommit = True;
+        if options.streamQuery:
+            self.streamQuery = True;
 
         if analysisOptions.bufferFile is not None and not analysisOptions.patientIds:
             # Have a previously generated result buffer file and not trying to train on any patientID subset.
@@ -640,6 +1078,8 @@ class AssociationAnalysis:
                 self.patientsPerCommit = int(options.patientsPerCommit);
             if options.associationsPerCommit is not None:
                 self.associationsPerCommit = int(options.associationsPerCommit);
+            if options.nWorkers is not None:
+                self.nWorkers = int(options.nWorkers);
 
             self.analyzePatientItems(analysisOptions);
 
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""Binary, streamable file format for AssociationAnalysis update buffers,
+in place of dumping the whole buffer as one gzipped JSON object.
+
+File layout:
+    HEADER_BYTES - MAGIC string followed by a space padded JSON header
+        (format version, count column names, number of item pair records and analyzed patient item IDs)
+    nPairs records of (key, counts[N_COLUMNS]), in ascending packed item pair key order
+    nAnalyzed analyzed patient_item_ids, in ascending order
+
+Records are written in chunks, so a buffer never has to be serialized as a whole,
+and files are read back as memory-mapped arrays, so they can be merged (k-way, as all are
+sorted by key) or committed chunk by chunk with bounded memory.
+"""
+
+import os;
+import json;
+
+import numpy as np;
+
+from AssociationCountBuffer import AssociationCountBuffer, unpackItemIdPairs, COLUMN_NAMES, N_COLUMNS;
+
+from Util import log;
+
+MAGIC = "ACBUFFER";
+FORMAT_VERSION = 1;
+HEADER_BYTES = 4096;
+FILE_SUFFIX = ".acb";
+
+RECORD_DTYPE = np.dtype([("key","<i8"), ("counts","<f8",(N_COLUMNS,))]);
+ID_DTYPE = np.dtype("<i8");
+
+ROWS_PER_CHUNK = 2**16;    # Records to write or read at a time
+
+def isBufferFile(filename):
+    """Whether the named file is in this binary format (as opposed to a legacy JSON buffer file)"""
+    ifs = open(filename, "rb");
+    try:
+        return ifs.read(len(MAGIC)) == MAGIC;
+    finally:
+        ifs.close();
+
+def saveBufferFile(filename, countBuffer, analyzedPatientItemIds=None, rowsPerChunk=ROWS_PER_CHUNK):
+    """Write the contents of an AssociationCountBuffer and the analyzed patient item IDs to a binary buffer file"""
+    (keys, counts) = countBuffer.sortedArrays();
+    writer = AssociationBufferFileWriter(filename);
+    try:
+        for iStart in xrange(0, len(keys), rowsPerChunk):
+            writer.writeRecords(keys[iStart:iStart+rowsPerChunk], counts[iStart:iStart+rowsPerChunk]);
+    finally:
+        writer.close(analyzedPatientItemIds);
+
+def mergeBufferFiles(filenames, outputFilename, rowsPerChunk=ROWS_PER_CHUNK):
+    """Streaming k-way merge of several buffer files into one output file,
+    adding up the count increments for any item pairs in common.
+    Only holds up to rowsPerChunk records from each input file in memory at a time
+    (plus the analyzed patient item IDs, which are small by comparison).
+    """
+    readers = [AssociationBufferFileReader(filename) for filename in filenames];
+    writer = AssociationBufferFileWriter(outputFilename);
+    analyzedPatientItemIds = None;
+    try:
+        chunkIterators = [reader.iterChunks(rowsPerChunk) for reader in readers];
+        pendingChunks = [None]*len(readers);    # (keys, counts) loaded from each reader, but not yet written
+        while True:
+            # Top up any readers whose pending records are used up
+            for (iReader, chunkIterator) in enumerate(chunkIterators):
+                if chunkIterator is not None and pendingChunks[iReader] is None:
+                    pendingChunks[iReader] = next(chunkIterator, None);
+                    if pendingChunks[iReader] is None:
+                        chunkIterators[iReader] = None;   # Exhausted
+            activeReaders = [iReader for (iReader, chunk) in enumerate(pendingChunks) if chunk is not None];
+            if len(activeReaders) < 1:
+                break;
+
+            # Safe to write out all records up to the smallest last key of any reader with more records yet to load,
+            #   as any later records from that reader will have greater keys
+            frontierKeys = [pendingChunks[iReader][0][-1] for iReader in activeReaders if chunkIterators[iReader] is not None];
+            frontierKey = min(frontierKeys) if len(frontierKeys) > 0 else None;
+
+            keysList = list();
+            countsList = list();
+            for iReader in activeReaders:
+                (keys, counts) = pendingChunks[iReader];
+                nReady = len(keys) if frontierKey is None else np.searchsorted(keys, frontierKey, side="right");
+                keysList.append(keys[:nReady]);
+                countsList.append(counts[:nReady]);
+                pendingChunks[iReader] = (keys[nReady:], counts[nReady:]) if nReady < len(keys) else None;
+            (keys, counts) = sumByKey(np.concatenate(keysList), np.concatenate(countsList));
+            writer.writeRecords(keys, counts);
+
+        analyzedPatientItemIds = np.unique(np.concatenate([reader.analyzedPatientItemIds for reader in readers]));
+    finally:
+        writer.close(analyzedPatientItemIds);
+        for reader in readers:
+            reader.close();
+
+def sumByKey(keys, counts):
+    """Given arrays of keys (possibly repeated) and their count rows,
+    return the sorted distinct keys and the count rows added up for each.
+    """
+    if len(keys) < 1:
+        return (keys, counts);
+    order = np.argsort(keys, kind="mergesort");
+    keys = keys[order];
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])));
+    return (keys[starts], np.add.reduceat(counts[order], starts, axis=0));
+
+class AssociationBufferFileWriter:
+    """Write a binary buffer file, a chunk of records at a time.
+    The header is only written on close, once the final number of records is known.
+    """
+    def __init__(self, filename):
+        self.filename = filename;
+        self.file = open(filename, "wb");
+        self.file.write(" "*HEADER_BYTES);  # Placeholder until header is written on close
+        self.nPairs = 0;
+        self.lastKey = None;
+
+    def writeRecords(self, keys, counts):
+        """Append records for the given packed item pair keys and count rows.
+        Keys must be strictly ascending, including relative to any previously written records.
+        """
+        keys = np.asarray(keys, dtype=np.int64);
+        if len(keys) < 1:
+            return;
+        if np.any(keys[1:] <= keys[:-1]) or (self.lastKey is not None and keys[0] <= self.lastKey):
+            raise ValueError("Buffer file records must be written in strictly ascending key order: %s" % self.filename);
+        records = np.zeros(len(keys), dtype=RECORD_DTYPE);
+        records["key"] = keys;
+        records["counts"] = counts;
+        records.tofile(self.file);
+        self.nPairs += len(keys);
+        self.lastKey = keys[-1];
+
+    def close(self, analyzedPatientItemIds=None):
+        """Write out the analyzed patient item IDs and the header, then close the file"""
+        if analyzedPatientItemIds is None:
+            analyzedPatientItemIds = list();
+        analyzedPatientItemIds = np.unique(np.asarray(list(analyzedPatientItemIds), dtype=ID_DTYPE));
+        analyzedPatientItemIds.tofile(self.file);
+
+        header = \
+            {   "version": FORMAT_VERSION,
+                "columns": COLUMN_NAMES,
+                "nPairs": self.nPairs,
+                "nAnalyzed": len(analyzedPatientItemIds),
+            };
+        headerStr = MAGIC + json.dumps(header);
+        if len(headerStr) > HEADER_BYTES:
+            raise ValueError("Buffer file header too long: %s" % headerStr);
+        self.file.seek(0);
+        self.file.write(headerStr.ljust(HEADER_BYTES));
+        self.file.close();
+
+class AssociationBufferFileReader:
+    """Read access to a binary buffer file, with the records and analyzed patient item IDs
+    available as memory-mapped arrays, so the file contents never need to be fully loaded.
+    """
+    def __init__(self, filename):
+        self.filename = filename;
+        ifs = open(filename, "rb");
+        try:
+            headerStr = ifs.read(HEADER_BYTES);
+        finally:
+            ifs.close();
+        if not headerStr.startswith(MAGIC):
+            raise ValueError("Not an association buffer file: %s" % filename);
+        self.header = json.loads(headerStr[len(MAGIC):].strip());
+        if self.header["version"] != FORMAT_VERSION:
+            raise ValueError("Unsupported buffer file format version %s: %s" % (self.header["version"], filename) );
+        if self.header["columns"] != COLUMN_NAMES:
+            raise ValueError("Buffer file count columns do not match those expected: %s" % filename);
+
+        nPairs = self.header["nPairs"];
+        nAnalyzed = self.header["nAnalyzed"];
+        self.records = np.zeros(0, dtype=RECORD_DTYPE);
+        if nPairs > 0:
+            self.records = np.memmap(filename, dtype=RECORD_DTYPE, mode="r", offset=HEADER_BYTES, shape=(nPairs,));
+        self.analyzedPatientItemIds = np.zeros(0, dtype=ID_DTYPE);
+        if nAnalyzed > 0:
+            self.analyzedPatientItemIds = np.memmap(filename, dtype=ID_DTYPE, mode="r", offset=HEADER_BYTES+nPairs*RECORD_DTYPE.itemsize, shape=(nAnalyzed,));
+
+    def __len__(self):
+        return len(self.records);
+
+    def iterChunks(self, rowsPerChunk=ROWS_PER_CHUNK):
+        """Iterate over the records in key order, as (keys, counts) array chunks"""
+        for iStart in xrange(0, len(self.records), rowsPerChunk):
+            records = np.array(self.records[iStart:iStart+rowsPerChunk]); # Copy to regular (non-mapped) memory
+            yield (records["key"], records["counts"]);
+
+    def iterCountBuffers(self, rowsPerChunk=ROWS_PER_CHUNK):
+        """Iterate over the records as a series of (chunk sized) AssociationCountBuffers"""
+        for (keys, counts) in self.iterChunks(rowsPerChunk):
+            yield AssociationCountBuffer.fromArrays(keys, counts);
+
+    def itemIds(self, rowsPerChunk=ROWS_PER_CHUNK):
+        """Return sorted array of the distinct clinical item IDs in any of the item pairs"""
+        itemIds = np.zeros(0, dtype=np.int64);
+        for iStart in xrange(0, len(self.records), rowsPerChunk):
+            (itemIds1, itemIds2) = unpackItemIdPairs(self.records["key"][iStart:iStart+rowsPerChunk]);
+            itemIds = np.union1d(itemIds, np.union1d(itemIds1, itemIds2));
+        return itemIds;
+
+    def toCountBuffer(self):
+        """Load the full file contents into an in-memory AssociationCountBuffer"""
+        countBuffer = AssociationCountBuffer(len(self.records));
+        for (keys, counts) in self.iterChunks():
+            countBuffer.addIncrements(keys, counts);
+        return countBuffer;
+
+    def close(self):
+        """Release the memory maps"""
+        self.records = None;
+        self.analyzedPatientItemIds = None;
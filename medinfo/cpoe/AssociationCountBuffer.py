@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+"""Compact in-memory store for clinical item association increments,
+accrued by AssociationAnalysis before committing them to the clinical_item_association table.
+
+Original buffer was a dictionary keyed by str(itemIdPair), each value another dictionary of
+up to ~50 named counters, costing on the order of kilobytes per item pair.
+Here item pairs are packed into single int64 keys, each mapped to a row slot,
+and all of the counters are held in one 2D numpy array (pair slot x count column),
+with the count columns laid out as (count prefix x time delta window) in the same
+naming as the clinical_item_association table.
+"""
+
+import numpy as np;
+
+from Const import DELTA_NAME_BY_SECONDS, COUNT_PREFIX_OPTIONS;
+
+"""Time threshold (seconds) count windows, in ascending order"""
+DELTA_SECONDS_OPTIONS = sorted(DELTA_NAME_BY_SECONDS.keys());
+DELTA_SECONDS_ARRAY = np.array(DELTA_SECONDS_OPTIONS, dtype=np.int64);
+
+"""Count column suffixes recorded for each of the count prefixes"""
+COLUMN_SUFFIXES = ["count_%d" % secondsOption for secondsOption in DELTA_SECONDS_OPTIONS];
+COLUMN_SUFFIXES.extend(["count_any","time_diff_sum","time_diff_sum_squares"]);
+
+"""Full list of clinical_item_association count columns, in buffer column order"""
+COLUMN_NAMES = [countPrefix+suffix for countPrefix in COUNT_PREFIX_OPTIONS for suffix in COLUMN_SUFFIXES];
+COLUMN_INDEX_BY_NAME = dict( (colName, iCol) for (iCol, colName) in enumerate(COLUMN_NAMES) );
+
+N_DELTAS = len(DELTA_SECONDS_OPTIONS);
+N_SUFFIXES = len(COLUMN_SUFFIXES);
+N_COLUMNS = len(COLUMN_NAMES);
+
+"""Limit on the number of candidate item pairs to enumerate at once when counting a patient's item pairs.
+Bounds the working memory for patients with thousands of items.
+"""
+MAX_BLOCK_PAIRS = 2**22;
+
+"""Indexes of the count_* columns for each count prefix (i.e., excluding the time_diff_sum* columns)"""
+COUNT_COLUMN_INDEXES = np.array([iCol for (iCol, colName) in enumerate(COLUMN_NAMES) if "time_diff" not in colName], dtype=np.int64);
+
+"""Bit shift and mask to pack a pair of (32 bit) clinical_item_ids into a single int64 key"""
+ITEM_ID_BITS = 32;
+ITEM_ID_MASK = (1 << ITEM_ID_BITS) - 1;
+
+def packItemIdPair(itemId1, itemId2):
+    """Pack a single clinical item ID pair into an int64 key value.
+    Item IDs may be negative (e.g., test data), so treat each as a signed 32 bit value.
+    """
+    return (int(itemId1) << ITEM_ID_BITS) | (int(itemId2) & ITEM_ID_MASK);
+
+def packItemIdPairs(itemIds1, itemIds2):
+    """Vectorized version of packItemIdPair for arrays of item IDs"""
+    itemIds1 = np.asarray(itemIds1, dtype=np.int64);
+    itemIds2 = np.asarray(itemIds2, dtype=np.int64);
+    return (itemIds1 << ITEM_ID_BITS) | (itemIds2 & ITEM_ID_MASK);
+
+def unpackItemIdPairs(keys):
+    """Inverse of packItemIdPairs.  Return a pair of int64 arrays (itemIds1, itemIds2)"""
+    keys = np.asarray(keys, dtype=np.int64);
+    itemIds1 = keys >> ITEM_ID_BITS;
+    itemIds2 = (keys & ITEM_ID_MASK).astype(np.uint32).view(np.int32).astype(np.int64);
+    return (itemIds1, itemIds2);
+
+def parseItemIdPairStr(itemIdPairStr):
+    """Parse a legacy string itemIdPair key, as produced by str((itemId1, itemId2)),
+    back into a tuple of ints without resorting to eval.
+    """
+    chunks = itemIdPairStr.strip().strip("()").split(",");
+    return tuple( int(chunk.strip().rstrip("Ll")) for chunk in chunks );
+
+def deltaSecondsMask(deltaSecondsOptions=None):
+    """Boolean mask over DELTA_SECONDS_OPTIONS for which count_<seconds> columns to record.
+    If deltaSecondsOptions is None, then record all of them.
+    """
+    if deltaSecondsOptions is None:
+        return np.ones(N_DELTAS, dtype=bool);
+    return np.in1d(DELTA_SECONDS_ARRAY, list(deltaSecondsOptions));
+
+def asAssociationCountBuffer(incrementData):
+    """Accept either an existing AssociationCountBuffer or a legacy
+    incrementDataByItemIdPair dictionary (e.g., as loaded from an older JSON buffer file),
+    and return the equivalent AssociationCountBuffer.
+    """
+    if incrementData is None:
+        return AssociationCountBuffer();
+    if isinstance(incrementData, AssociationCountBuffer):
+        return incrementData;
+    return AssociationCountBuffer.fromIncrementDataByItemIdPair(incrementData);
+
+class AssociationCountBuffer:
+    """Columnar buffer of association count increments, one row slot per clinical item pair.
+    Slots are appended in order of first observation, with a dictionary
+    to look up the slot for each packed item pair key.
+    """
+    INITIAL_CAPACITY = 1024;
+
+    def __init__(self, capacity=None):
+        """Default constructor.  Optionally specify expected number of item pairs to preallocate"""
+        if capacity is None:
+            capacity = self.INITIAL_CAPACITY;
+        capacity = max(capacity, 1);
+        self.slotByKey = dict();
+        self.keys = np.zeros(capacity, dtype=np.int64);    # Packed item pair key of each slot
+        self.counts = np.zeros((capacity, N_COLUMNS));     # Count increments by slot and count column
+        self.nPairs = 0;
+
+        # Cache deltaSecondsOptions masks, as they are usually the same for every item pair
+        self.deltaMaskByOptions = dict();
+
+    def __len__(self):
+        return self.nPairs;
+
+    def __getstate__(self):
+        """Pickle only the filled slots (e.g., when passing buffers between worker processes).
+        The key lookup dictionary is rebuilt on unpickling rather than serialized.
+        """
+        return {"keys": self.keys[:self.nPairs], "counts": self.counts[:self.nPairs]};
+
+    def __setstate__(self, state):
+        keys = state["keys"];
+        self.__init__(len(keys));
+        self.keys[:len(keys)] = keys;
+        self.counts[:len(keys)] = state["counts"];
+        self.slotByKey = dict( (key, slot) for (slot, key) in enumerate(keys.tolist()) );
+        self.nPairs = len(keys);
+
+    def ensureCapacity(self, nPairs):
+        """Grow the backing arrays if needed to hold at least nPairs slots"""
+        capacity = len(self.keys);
+        if nPairs > capacity:
+            while capacity < nPairs:
+                capacity *= 2;
+            keys = np.zeros(capacity, dtype=np.int64);
+            keys[:self.nPairs] = self.keys[:self.nPairs];
+            counts = np.zeros((capacity, N_COLUMNS));
+            counts[:self.nPairs] = self.counts[:self.nPairs];
+            self.keys = keys;
+            self.counts = counts;
+
+    def slotForKey(self, key):
+        """Find the row slot for the packed item pair key, adding a new one if not yet seen"""
+        slot = self.slotByKey.get(key);
+        if slot is None:
+            slot = self.nPairs;
+            self.ensureCapacity(slot+1);
+            self.keys[slot] = key;
+            self.slotByKey[key] = slot;
+            self.nPairs += 1;
+        return slot;
+
+    def slotsForKeys(self, keys):
+        """Vectorized slotForKey.  Given an array of unique packed item pair keys,
+        return an array of their row slots, adding slots for any new keys.
+        """
+        slotByKey = self.slotByKey;
+        keyList = np.asarray(keys, dtype=np.int64).tolist();
+        slots = np.fromiter( (slotByKey.get(key,-1) for key in keyList), dtype=np.int64, count=len(keyList) );
+
+        newIndexes = np.flatnonzero(slots < 0);
+        if len(newIndexes) > 0:
+            newSlots = np.arange(self.nPairs, self.nPairs+len(newIndexes), dtype=np.int64);
+            self.ensureCapacity(self.nPairs+len(newIndexes));
+            newKeys = np.asarray(keys, dtype=np.int64)[newIndexes];
+            self.keys[newSlots] = newKeys;
+            slotByKey.update( zip(newKeys.tolist(), newSlots.tolist()) );
+            slots[newIndexes] = newSlots;
+            self.nPairs += len(newIndexes);
+        return slots;
+
+    def deltaMask(self, deltaSecondsOptions=None):
+        """Cached version of deltaSecondsMask"""
+        optionsKey = None;
+        if deltaSecondsOptions is not None:
+            optionsKey = tuple(deltaSecondsOptions);
+        if optionsKey not in self.deltaMaskByOptions:
+            self.deltaMaskByOptions[optionsKey] = deltaSecondsMask(deltaSecondsOptions);
+        return self.deltaMaskByOptions[optionsKey];
+
+    def incrementRow(self, secondsDelta, deltaSecondsOptions=None):
+        """Count column increments (for a single count prefix) for one item pair
+        observed secondsDelta apart, counting only the given time window options.
+        """
+        deltaMask = self.deltaMask(deltaSecondsOptions);
+
+        row = np.empty(N_SUFFIXES);
+        row[:N_DELTAS] = np.logical_and(np.less_equal(secondsDelta, DELTA_SECONDS_ARRAY), deltaMask);
+        row[N_DELTAS] = 1;  # count_any
+        row[N_DELTAS+1] = secondsDelta;
+        row[N_DELTAS+2] = float(secondsDelta)**2;
+        return row;
+
+    def addPairIncrement(self, itemIdPair, secondsDelta, countPrefixes, deltaSecondsOptions=None):
+        """Record one observation of the item pair, secondsDelta apart,
+        for each of the named countPrefixes (subset of COUNT_PREFIX_OPTIONS).
+        """
+        slot = self.slotForKey(packItemIdPair(*itemIdPair));
+        row = self.incrementRow(secondsDelta, deltaSecondsOptions);
+        for countPrefix in countPrefixes:
+            iStart = COUNT_PREFIX_OPTIONS.index(countPrefix) * N_SUFFIXES;
+            self.counts[slot,iStart:iStart+N_SUFFIXES] += row;
+
+    def addIncrements(self, keys, increments):
+        """Scatter-add a block of count increments.
+        keys - Array of packed item pair keys, may contain repeats
+        increments - 2D array of increments with one row per key and N_COLUMNS columns
+        """
+        keys = np.asarray(keys, dtype=np.int64);
+        if len(keys) < 1:
+            return;
+        (uniqueKeys, inverse) = np.unique(keys, return_inverse=True);
+        slots = self.slotsForKeys(uniqueKeys);
+        if len(uniqueKeys) < len(keys):
+            # Aggregate repeated keys first, so the final scatter has unique slots
+            aggregate = np.zeros((len(uniqueKeys), N_COLUMNS));
+            np.add.at(aggregate, inverse, increments);
+            increments = aggregate;
+        self.counts[slots] += increments;
+
+    def addPatientItems(self, itemIds, encounterIds, itemSeconds, analyzedFlags, linkedItemIdsByBaseId=None, deltaSecondsOptions=None, maxBlockPairs=MAX_BLOCK_PAIRS):
+        """Batched equivalent of AssociationAnalysis per item pair loop for a single patient's items.
+        Given parallel arrays describing the patient's items, in the order the items were queried:
+            itemIds - clinical_item_id of each item
+            encounterIds - encounter_id of each item (any hashable values, including None)
+            itemSeconds - item_date of each item as (epoch) seconds
+            analyzedFlags - True for items whose analyze_date is already recorded
+        Count forward (non-negative time difference) item pairs, excluding linked item pairs,
+        and where not both items were already analyzed.  Each pair counts towards the
+        "patient_" columns if it is the first of its item pair for the patient,
+        and towards the "encounter_" columns if it is the first of its item pair
+        within a common encounter.  "First" is in order of (item1 index, item2 index), as with the nested loop.
+        Returns boolean array, designating which (not previously analyzed) items were counted in some pair.
+        """
+        itemIds = np.asarray(itemIds, dtype=np.int64);
+        itemSeconds = np.asarray(itemSeconds, dtype=np.float64);
+        analyzedFlags = np.asarray(analyzedFlags, dtype=bool);
+        nItems = len(itemIds);
+        newlyAnalyzed = np.zeros(nItems, dtype=bool);
+        if nItems < 1:
+            return newlyAnalyzed;
+
+        # Compact codes for items and encounters in this patient, so item pairs and
+        #   (item pair, encounter) combinations can be tracked as simple integer codes
+        (uniqueItemIds, itemCodes) = np.unique(itemIds, return_inverse=True);
+        nUniqueItems = len(uniqueItemIds);
+        codeByEncounterId = dict();
+        encounterCodes = np.array([codeByEncounterId.setdefault(encounterId, len(codeByEncounterId)) for encounterId in encounterIds], dtype=np.int64);
+        nEncounters = len(codeByEncounterId);
+
+        # Composite linked item pairs, in which case no meaningful association stats to calculate
+        linkedPairs = None;
+        if linkedItemIdsByBaseId:
+            codeByItemId = dict(zip(uniqueItemIds.tolist(), range(nUniqueItems)));
+            for (itemId, iCode) in codeByItemId.iteritems():
+                for linkedItemId in linkedItemIdsByBaseId.get(itemId, ()):
+                    if linkedItemId in codeByItemId:
+                        if linkedPairs is None:
+                            linkedPairs = np.zeros((nUniqueItems, nUniqueItems), dtype=bool);
+                        jCode = codeByItemId[linkedItemId];
+                        linkedPairs[iCode,jCode] = linkedPairs[jCode,iCode] = True;
+
+        deltaMask = self.deltaMask(deltaSecondsOptions);
+        seenPairCodes = np.zeros(0, dtype=np.int64);
+        seenEncounterPairCodes = np.zeros(0, dtype=np.int64);
+
+        # Enumerate candidate pairs a block of item1 rows at a time to bound memory
+        blockSize = max(1, maxBlockPairs // nItems);
+        for iStart in xrange(0, nItems, blockSize):
+            iEnd = min(iStart+blockSize, nItems);
+            secondsDeltas = np.floor(itemSeconds[np.newaxis,:] - itemSeconds[iStart:iEnd,np.newaxis]);
+            isPairToAnalyze = (secondsDeltas >= 0);   # Only record forward / non-negative associations
+            if linkedPairs is not None:
+                isPairToAnalyze &= ~linkedPairs[itemCodes[iStart:iEnd,np.newaxis], itemCodes[np.newaxis,:]];
+            (rows, cols) = np.nonzero(isPairToAnalyze);    # Row-major order, same as nested loop
+            secondsDeltas = secondsDeltas[rows, cols];
+            rows += iStart;
+
+            # First occurrence of each item pair for the patient, in loop order
+            pairCodes = itemCodes[rows]*nUniqueItems + itemCodes[cols];
+            (uniquePairCodes, firstIndexes, pairInverse) = np.unique(pairCodes, return_index=True, return_inverse=True);
+            isNewPair = np.zeros(len(pairCodes), dtype=bool);
+            isNewPair[firstIndexes[~np.in1d(uniquePairCodes, seenPairCodes, assume_unique=True)]] = True;
+            seenPairCodes = np.union1d(seenPairCodes, uniquePairCodes);
+
+            # First occurrence of each item pair within a common encounter
+            isNewPairWithinEncounter = (encounterCodes[rows] == encounterCodes[cols]);
+            encounterPairCodes = pairCodes[isNewPairWithinEncounter]*nEncounters + encounterCodes[rows[isNewPairWithinEncounter]];
+            isNewPairWithinEncounter[isNewPairWithinEncounter] = self.firstOccurrenceMask(encounterPairCodes, seenEncounterPairCodes);
+            seenEncounterPairCodes = np.union1d(seenEncounterPairCodes, encounterPairCodes);
+
+            # Record the stat update only if this pair has not already been analyzed/recorded before
+            isPairToUpdate = ~(analyzedFlags[rows] & analyzedFlags[cols]);
+            newlyAnalyzed[rows[isPairToUpdate]] = True;
+            newlyAnalyzed[cols[isPairToUpdate]] = True;
+
+            pairInverse = pairInverse[isPairToUpdate];
+            secondsDeltas = secondsDeltas[isPairToUpdate];
+            prefixMasks = (np.ones(len(pairInverse), dtype=bool), isNewPair[isPairToUpdate], isNewPairWithinEncounter[isPairToUpdate]);
+
+            # Only item pairs with some update to record
+            (updatePairIndexes, pairInverse) = np.unique(pairInverse, return_inverse=True);
+            updatePairCodes = uniquePairCodes[updatePairIndexes];
+            keys = packItemIdPairs(uniqueItemIds[updatePairCodes // nUniqueItems], uniqueItemIds[updatePairCodes % nUniqueItems]);
+            increments = self.binnedIncrements(len(keys), pairInverse, secondsDeltas, prefixMasks, deltaMask);
+            slots = self.slotsForKeys(keys);   # May reallocate the counts array
+            self.counts[slots] += increments;
+
+        newlyAnalyzed &= ~analyzedFlags;
+        return newlyAnalyzed;
+
+    def firstOccurrenceMask(self, codes, seenCodes):
+        """Boolean mask of which codes are the first occurrence of their value in the array,
+        and are not found in the (sorted) array of previously seenCodes.
+        """
+        isFirst = np.zeros(len(codes), dtype=bool);
+        (uniqueCodes, firstIndexes) = np.unique(codes, return_index=True);
+        isFirst[firstIndexes[~np.in1d(uniqueCodes, seenCodes, assume_unique=True)]] = True;
+        return isFirst;
+
+    def binnedIncrements(self, nKeys, inverse, secondsDeltas, prefixMasks, deltaMask):
+        """Aggregate count increments per key for observed pairs.
+        inverse - Key index (0 to nKeys-1) of each observed pair
+        secondsDeltas - Time difference of each observed pair
+        prefixMasks - Boolean array per COUNT_PREFIX_OPTIONS, designating which observed pairs count for that prefix
+        deltaMask - Which count_<seconds> time window columns to record
+        Bin each pair by the smallest time window it falls within,
+        then cumulative sums over the bins yield the counts for each time window.
+        """
+        increments = np.zeros((nKeys, N_COLUMNS));
+        deltaBins = np.searchsorted(DELTA_SECONDS_ARRAY, secondsDeltas, side="left");  # N_DELTAS if beyond largest window
+        for (iPrefix, prefixMask) in enumerate(prefixMasks):
+            iStart = iPrefix * N_SUFFIXES;
+            keyIndexes = inverse[prefixMask];
+            prefixDeltas = secondsDeltas[prefixMask];
+            binCounts = np.bincount(keyIndexes*(N_DELTAS+1) + deltaBins[prefixMask], minlength=nKeys*(N_DELTAS+1)).reshape(nKeys, N_DELTAS+1);
+            increments[:,iStart:iStart+N_DELTAS] = np.cumsum(binCounts[:,:N_DELTAS], axis=1) * deltaMask;
+            increments[:,iStart+N_DELTAS] = binCounts.sum(axis=1);  # count_any
+            increments[:,iStart+N_DELTAS+1] = np.bincount(keyIndexes, weights=prefixDeltas, minlength=nKeys);
+            increments[:,iStart+N_DELTAS+2] = np.bincount(keyIndexes, weights=prefixDeltas**2, minlength=nKeys);
+        return increments;
+
+    def merge(self, other):
+        """Add all of the increments from the other buffer into this one"""
+        if other is self or len(other) < 1:
+            return self;
+        slots = self.slotsForKeys(other.keys[:other.nPairs]);
+        self.counts[slots] += other.counts[:other.nPairs];
+        return self;
+
+    def decay(self, decayValue):
+        """Scale all recorded increments by the decayValue"""
+        self.counts[:self.nPairs] *= decayValue;
+        return self;
+
+    def clear(self):
+        """Wipe out all recorded increments, but keep allocated memory for reuse"""
+        self.slotByKey.clear();
+        self.counts[:self.nPairs] = 0;
+        self.nPairs = 0;
+
+    def itemIdPairArrays(self):
+        """Return pair of arrays (itemIds1, itemIds2) for the item pairs in slot order"""
+        return unpackItemIdPairs(self.keys[:self.nPairs]);
+
+    def itemIdPairs(self):
+        """Return list of (itemId1, itemId2) tuples for the item pairs in slot order"""
+        (itemIds1, itemIds2) = self.itemIdPairArrays();
+        return zip(itemIds1.tolist(), itemIds2.tolist());
+
+    def itemIds(self):
+        """Return sorted array of the distinct clinical item IDs in any of the item pairs"""
+        (itemIds1, itemIds2) = self.itemIdPairArrays();
+        return np.union1d(itemIds1, itemIds2);
+
+    def sortedArrays(self):
+        """Return (keys, counts) arrays with the item pairs in ascending packed key order"""
+        keys = self.keys[:self.nPairs];
+        order = np.argsort(keys, kind="mergesort");
+        return (keys[order], self.counts[:self.nPairs][order]);
+
+    def countArray(self):
+        """Return 2D array view of the count increments in slot order"""
+        return self.counts[:self.nPairs];
+
+    def scaleColumns(self, colIndexes, factor):
+        """Scale the count increments in only the given columns by the factor"""
+        self.counts[:self.nPairs, colIndexes] *= factor;
+
+    def activeColumnIndexes(self):
+        """Indexes of count columns with any non-zero increment recorded"""
+        return np.flatnonzero(np.any(self.countArray() != 0, axis=0));
+
+    def iterIncrementData(self):
+        """Iterate over (itemIdPair, incrementData) where incrementData is a dictionary
+        of count column names to non-zero increment values, as in the legacy buffer format.
+        """
+        for (itemIdPair, countRow) in zip(self.itemIdPairs(), self.countArray()):
+            colIndexes = np.flatnonzero(countRow);
+            yield ( itemIdPair, dict(zip([COLUMN_NAMES[iCol] for iCol in colIndexes], countRow[colIndexes].tolist())) );
+
+    def toIncrementDataByItemIdPair(self):
+        """Convert to legacy dictionary format, keyed by str(itemIdPair)"""
+        incrementDataByItemIdPair = dict();
+        for (itemIdPair, incrementData) in self.iterIncrementData():
+            incrementDataByItemIdPair[str(itemIdPair)] = incrementData;
+        return incrementDataByItemIdPair;
+
+    @classmethod
+    def fromArrays(cls, keys, counts):
+        """Build a buffer from arrays of packed item pair keys and their (N_COLUMNS) count increments"""
+        countBuffer = cls(len(keys));
+        countBuffer.addIncrements(keys, counts);
+        return countBuffer;
+
+    @classmethod
+    def fromIncrementDataByItemIdPair(cls, incrementDataByItemIdPair):
+        """Convert from legacy dictionary format, keyed by str(itemIdPair) (or itemIdPair tuples)"""
+        countBuffer = cls(len(incrementDataByItemIdPair));
+        for (itemIdPair, incrementData) in incrementDataByItemIdPair.iteritems():
+            if isinstance(itemIdPair, basestring):
+                itemIdPair = parseItemIdPairStr(itemIdPair);
+            slot = countBuffer.slotForKey(packItemIdPair(*itemIdPair));
+            for (col, increment) in incrementData.iteritems():
+                countBuffer.counts[slot, COLUMN_INDEX_BY_NAME[col]] += increment;
+        return countBuffer;
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""In-memory index of clinical_item_association query results for rapid, repeated recommender queries.
+
+Laid out as a compressed sparse row (CSR) matrix keyed by source item.
+Records are sorted by source item ID (stable, so retaining the database result order within each source item),
+with the offset of each source item's row of records, one array of target item IDs,
+and one array per count column.  Pulling the associations for a set of query items is then just
+a row slice per query item and a vectorized gather, rather than copying a list of dictionaries.
+The recommender aggregates the gathered arrays directly (ItemAssociationRecommender.aggregateRecommendations).
+
+Can be saved to / loaded from a snapshot file, to skip the database query for it in a new process
+(see ItemAssociationRecommender.associationIndexDir).
+"""
+
+import numpy as np;
+
+class AssociationIndex:
+    """CSR style index of association records, keyed by source item ID"""
+    def __init__(self, sourceCol, targetCol, sourceItemIds, targetItemIds, countsByCol):
+        """Build from parallel arrays of source item IDs, target item IDs and, for each count column name,
+        the count values (in the same record order).
+        """
+        self.sourceCol = sourceCol;
+        self.targetCol = targetCol;
+        self.countCols = sorted(countsByCol.keys());
+
+        sourceItemIds = np.asarray(sourceItemIds, dtype=np.int64);
+        order = np.argsort(sourceItemIds, kind="mergesort");
+        sourceItemIds = self.sourceItemIds = sourceItemIds[order];
+
+        # Distinct source item IDs, with each one's row of records in [rowStarts[i], rowStarts[i+1])
+        rowStartMask = np.concatenate(([True], sourceItemIds[1:] != sourceItemIds[:-1])) if len(sourceItemIds) > 0 else np.zeros(0, dtype=bool);
+        self.rowItemIds = sourceItemIds[rowStartMask];
+        self.rowStarts = np.concatenate((np.flatnonzero(rowStartMask), [len(sourceItemIds)])).astype(np.int64);
+
+        self.targetItemIds = np.asarray(targetItemIds, dtype=np.int64)[order];
+        self.countsByCol = dict();
+        for (col, counts) in countsByCol.iteritems():
+            self.countsByCol[col] = np.asarray(counts, dtype=float)[order];
+
+    def __len__(self):
+        return len(self.targetItemIds);
+
+    @property
+    def nbytes(self):
+        """Memory used by the index arrays, for DataCache size accounting"""
+        arrays = [self.sourceItemIds, self.rowItemIds, self.rowStarts, self.targetItemIds] + self.countsByCol.values();
+        return sum([array.nbytes for array in arrays]);
+
+    def recordIndexes(self, queryItemIds):
+        """Return array of the record indexes for all of the associations from the queryItemIds,
+        grouped by query item in the order given.
+        """
+        queryItemIds = np.asarray(list(queryItemIds), dtype=np.int64);
+        rows = np.searchsorted(self.rowItemIds, queryItemIds);
+        found = (rows < len(self.rowItemIds));
+        found[found] = (self.rowItemIds[rows[found]] == queryItemIds[found]);
+        rows = rows[found];
+        if len(rows) < 1:
+            return np.zeros(0, dtype=np.int64);
+
+        # Concatenate the row ranges, without a Python loop over them
+        starts = self.rowStarts[rows];
+        lengths = self.rowStarts[rows+1] - starts;
+        rowOffsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths);
+        return np.arange(lengths.sum(), dtype=np.int64) + rowOffsets;
+
+    def gather(self, recordIndexes):
+        """Return (sourceItemIds, targetItemIds, countsByCol) arrays for the given record indexes"""
+        countsByCol = dict( (col, counts[recordIndexes]) for (col, counts) in self.countsByCol.iteritems() );
+        return (self.sourceItemIds[recordIndexes], self.targetItemIds[recordIndexes], countsByCol);
+
+    @classmethod
+    def fromResultTable(cls, resultTable, sourceCol, targetCol):
+        """Build from a DBUtil.execute result table, with the column names in the first row"""
+        columnNames = list(resultTable[0]);
+        dataRows = resultTable[1:];
+        columnValues = zip(*dataRows) if len(dataRows) > 0 else [[]]*len(columnNames);
+        valuesByCol = dict(zip(columnNames, columnValues));
+        countsByCol = dict( (col, values) for (col, values) in valuesByCol.iteritems() if col not in (sourceCol, targetCol) );
+        return cls(sourceCol, targetCol, valuesByCol[sourceCol], valuesByCol[targetCol], countsByCol);
+
+    def save(self, filename):
+        """Save a snapshot of the index to a (numpy .npz) file, to reload later without querying the database"""
+        arrays = dict( ("count:%s" % col, counts) for (col, counts) in self.countsByCol.iteritems() );
+        np.savez(filename, cols=np.array([self.sourceCol, self.targetCol]), \
+            sourceItemIds=self.sourceItemIds, targetItemIds=self.targetItemIds, **arrays);
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index from a snapshot file previously produced by save"""
+        npzFile = np.load(filename);
+        try:
+            (sourceCol, targetCol) = npzFile["cols"].tolist();
+            countsByCol = dict( (key[len("count:"):], npzFile[key]) for key in npzFile.files if key.startswith("count:") );
+            return cls(sourceCol, targetCol, npzFile["sourceItemIds"], npzFile["targetItemIds"], countsByCol);
+        finally:
+            npzFile.close();
@@ -9,11 +9,17 @@ from optparse import OptionParser
 import math;
 from datetime import datetime;
 from medinfo.common.Util import stdOpen, ProgressDots;
+from medinfo.common.DataCache import DataCache;
 from medinfo.db import DBUtil;
 from medinfo.db.Model import SQLQuery, RowItemModel, generatePlaceholders;
 from medinfo.db.Model import modelListFromTable, modelDictFromList;
 from Util import log;
 
+"""data_cache key for the lazy decay scale factor to apply to all clinical_item_association counts
+(see DecayingWindows.lazyDecay).  Actual count values = stored count values * scale factor.
+"""
+ASSOCIATION_COUNT_SCALE_KEY = "associationCountScale";
+
 class DataManager:
     connFactory = None;
     maxClinicalItemId = None;
@@ -21,9 +27,16 @@ class DataManager:
     def __init__(self):
         self.connFactory = DBUtil.ConnectionFactory();  # Default connection source
         self.maxClinicalItemId = None;  # Can set to a value to limit what items will be processed.  Particularly for setting to 0, so will only work on negative values, generally only test cases, while leaving "real" data alone
-        self.dataCache = dict();  # If set, use as in memory data cache.  Set to None to avoid usage if having memory leak problems with persistent processes
+        self.dataCache = DataCache();  # If set, use as in memory data cache (bounded, see DataCache, or any dict-like object).  Set to None to avoid usage
         self.queryCount = 0;
 
+    def invalidateDataCache(self):
+        """Clear any in memory dataCache, since the clinical item / association data its query results came from has changed.
+        Called by the methods here that modify that data.
+        """
+        if self.dataCache is not None:
+            self.dataCache.clear();
+
     def resetAssociationModel(self, conn=None):
         extConn = True;
         if conn is None:
@@ -61,12 +74,14 @@ class DataManager:
 
             # Flag that any cached association metrics will be out of date
             self.clearCacheData("analyzedPatientCount",conn=conn);
+            self.clearCacheData(ASSOCIATION_COUNT_SCALE_KEY,conn=conn);
 
             # Reset clinical_item denormalized counts
             self.updateClinicalItemCounts(conn=conn);
 
             conn.commit();
             log.debug("Connection committed");
+            self.invalidateDataCache();
         finally:
             if not extConn:
                 conn.close();
@@ -112,11 +127,17 @@ class DataManager:
             resultTable = DBUtil.execute( sqlQuery, includeColumnNames=True, conn=conn );
             resultModels = modelListFromTable( resultTable );
 
+            # Apply any lazy decay scale factor, so the denormalized counts are actual values
+            countScale = self.getAssociationCountScale(conn=conn, useCache=False);
             for result in resultModels:
+                if countScale != 1.0:
+                    for col in ("item_count","patient_count","encounter_count"):
+                        result[col] *= countScale;
                 DBUtil.updateRow("clinical_item", result, result["clinical_item_id"], conn=conn);
 
             # Make a note that this cache data has been updated
             self.setCacheData("clinicalItemCountsUpdated", "True", conn=conn);
+            self.invalidateDataCache();
         finally:
             if not extConn:
                 conn.close();
@@ -178,6 +199,7 @@ class DataManager:
             DBUtil.execute("delete from clinical_item_association where subsequent_item_id in (%s)" % placeholders, tuple(clinicalItemIds), conn=conn );
             # Retroactively clear any prior analyze_date recordings since effectively undoing that work that may be redone later
             DBUtil.execute("update patient_item set analyze_date = null where clinical_item_id in (%s)" % placeholders, tuple(clinicalItemIds), conn=conn );
+            self.invalidateDataCache();
         finally:
             if not extConn:
                 conn.close();
@@ -271,6 +293,7 @@ class DataManager:
                 compositeId = DBUtil.execute( DBUtil.identityQuery("clinical_item"), conn=conn )[0][0];   # Retrieve the just inserted item's ID
 
             self.generatePatientItemsForCompositeId(clinicalItemIds, compositeId, conn=conn);
+            self.invalidateDataCache();
             return compositeId;
         finally:
             if not extConn:
@@ -516,6 +539,32 @@ class DataManager:
                 conn.close();
         return linkedItemIdsByBaseId;
 
+    def getAssociationCountScale(self, conn=None, useCache=True):
+        """Lazy decay scale factor to multiply stored clinical_item_association count values by
+        to get their actual values.  Defaults to 1.0 if none recorded.
+
+        Read through any in memory dataCache (see executeCacheOption), since recommenders need it for every query.
+        (setAssociationCountScale invalidates that.)  Code writing counts relative to the scale should not
+        useCache, to get the current database value, in case another process has since changed it.
+        """
+        if useCache:
+            cacheQuery = "select data_value from data_cache where data_key = %s" % DBUtil.SQL_PLACEHOLDER;
+            cacheResult = self.executeCacheOption(cacheQuery, (ASSOCIATION_COUNT_SCALE_KEY,), conn=conn);
+            dataStr = cacheResult[0][0] if len(cacheResult) > 0 else None;
+        else:
+            dataStr = self.getCacheData(ASSOCIATION_COUNT_SCALE_KEY, conn=conn);
+        if dataStr is not None:
+            return float(dataStr);
+        return 1.0;
+
+    def setAssociationCountScale(self, scale, conn=None):
+        """Record the lazy decay scale factor for clinical_item_association counts"""
+        if scale == 1.0:
+            self.clearCacheData(ASSOCIATION_COUNT_SCALE_KEY, conn=conn);
+        else:
+            self.setCacheData(ASSOCIATION_COUNT_SCALE_KEY, repr(float(scale)), conn=conn);
+        self.invalidateDataCache();
+
     def getCacheData(self,key,conn=None):
         """Utility function to retrieve cached data item from data_cache table.  Returns None if not found"""
         extConn = conn is not None;
@@ -564,21 +613,23 @@ class DataManager:
         """Wrap DBUtil.execute.  If instance's dataCache is present, will check and store any results in there
         to help reduce time for repeat queries.
 
-        Beware, bad idea to store lots of varied, huge results in this cache, otherwise memory leak explosion.
+        Beware, storing lots of varied, huge results in this cache will just evict (or never store) them,
+        unless the dataCache is a plain dict, which will grow until out of memory.
         """
         if connFactory is None:
             connFactory = self.connFactory;
 
-        dataCache = self.dataCache;
-        if dataCache is None:
-            dataCache = dict(); # Create a temporary holder
-
-        queryStr = DBUtil.parameterizeQueryString(query);
-        if queryStr not in dataCache:
-            dataCache[queryStr] = DBUtil.execute( query, parameters, includeColumnNames, incTypeCodes, formatter, conn, connFactory, autoCommit );
+        queryStr = DBUtil.parameterizeQueryString(query, parameters);
+        results = None;
+        if self.dataCache is not None:
+            results = self.dataCache.get(queryStr);
+        if results is None:
+            results = DBUtil.execute( query, parameters, includeColumnNames, incTypeCodes, formatter, conn, connFactory, autoCommit );
             self.queryCount += 1;
+            if self.dataCache is not None:
+                self.dataCache[queryStr] = results;
 
-        dataCopy = list(dataCache[queryStr]);
+        dataCopy = list(results);
 
         return dataCopy;
 
@@ -13,6 +13,12 @@ Terms defined:
 - Counts/Stats/Co-occurrences: Number of occurrences and co-occurrences of items and pairs of items in timeline
 - Delta: Time period intervals to run AssociationAnalysis one at a time
 - Decay: Scalar to decay all values learned each delta by, should be a value in (0.0,1.0)
+- Lazy Decay: Instead of updating every clinical_item_association row after each delta,
+	just multiply a global scale factor (recorded in data_cache) by the decay.
+	New increments are divided by the scale factor before being added to the stored counts,
+	and readers (e.g., ItemAssociationRecommender) multiply stored counts by it to get actual values.
+	The scale factor is only applied to the stored counts (one full table update)
+	when it gets small enough to risk losing floating point precision.
 - Window: Number of delta intervals to pass before expect counts to be decayed down to 1/e (~0.37). 
 	Can use this to calculate decay factor = 1 - (1/window)
 	Corresponds to T = Mean lifetime of the data relevance
@@ -43,8 +49,11 @@ from medinfo.cpoe.test import TestAssociationAnalysis
 from medinfo.cpoe import AssociationAnalysis
 from medinfo.cpoe.test.Const import RUNNER_VERBOSITY
 from medinfo.cpoe.Const import DELTA_NAME_BY_SECONDS, SECONDS_PER_DAY;
+from medinfo.cpoe.DataManager import DataManager
 from Util import log;
 
+MIN_LAZY_DECAY_SCALE = 1e-12;	# Once the lazy decay scale factor gets this small, apply it to the stored counts and reset it
+
 class DecayAnalysisOptions:
 	"""Simple struct to pass filter parameters on which records to do analysis on"""
 	def __init__(self):
@@ -57,6 +66,7 @@ class DecayAnalysisOptions:
 		self.associationsPerCommit = None
 		self.itemsPerUpdate = None
 		self.outputFile = None
+		self.lazyDecay = False;	# If set, then decay the database counts by just updating a global scale factor, rather than updating every association record
 		self.skipLargerCountWindows = True;	# If set, then won't try to update association count fields longer than the given delta time, since will never be a different number than the next largest interval count and just consumes extra memory
 
 
@@ -66,10 +76,38 @@ class DecayingWindows:
 	def __init__(self):
 		"Default constructor"
 		self.connFactory = DBUtil.ConnectionFactory();  # Default connection source
+		self.dataManager = DataManager();
 		self.decayCount = 0
 
-	def standardDecay (self, decayAnalysisOptions):
+	def lazyDecay (self, decayAnalysisOptions):
+		"""Decay the database association counts by only updating the global scale factor for them.
+		Apply it to the stored counts with a standardDecay only if it gets too small,
+		in the same transaction as resetting the scale factor, so the two can't be left out of step.
+		"""
 		conn = self.connFactory.connection()
+		try:
+			countScale = self.dataManager.getAssociationCountScale(conn=conn, useCache=False) * decayAnalysisOptions.decay;
+			if countScale < MIN_LAZY_DECAY_SCALE:
+				log.debug("applying lazy decay scale %s" % countScale);
+				self.standardDecay(decayAnalysisOptions, countScale, conn=conn);
+				countScale = 1.0;
+			self.dataManager.setAssociationCountScale(countScale, conn=conn);
+
+			# Flag that the denormalized item counts will be out of date
+			self.dataManager.clearCacheData("clinicalItemCountsUpdated", conn=conn);
+			conn.commit()
+		finally:
+			conn.close()
+
+	def standardDecay (self, decayAnalysisOptions, decay=None, conn=None):
+		"""Decay all of the database association counts by the decay factor (defaults to the one in the decayAnalysisOptions).
+		If given an external conn, leave it to the caller to commit.
+		"""
+		if decay is None:
+			decay = decayAnalysisOptions.decay
+		extConn = conn is not None;
+		if not extConn:
+			conn = self.connFactory.connection()
 		prefixes = ['', 'patient_', 'encounter_']
 		times = ['0', '3600', '7200', '21600', '43200', '86400', '172800', '345600', '604800', '1209600', '2592000', '7776000', '15552000', '31536000', '63072000', '126144000', 'any']
 		try:
@@ -80,7 +118,7 @@ class DecayingWindows:
 			for prefix in prefixes:
 				for time in times:
 					fieldName = prefix + "count_" + str(time)
-					fields.append(fieldName + '=' + fieldName + "*" + str(decayAnalysisOptions.decay))
+					fields.append(fieldName + '=' + fieldName + "*" + repr(decay))
 
 			"""log.debug("starting to drop indices");
 			sqlQuery = "ALTER TABLE clinical_item_association drop CONSTRAINT clinical_item_association_pkey;"
@@ -119,11 +157,13 @@ class DecayingWindows:
 			log.debug("finished adding indices");
 			"""
 
-			conn.commit()
-			log.debug("finished commit");
+			if not extConn:
+				conn.commit()
+				log.debug("finished commit");
 		finally:
 			curs.close()
-			conn.close()
+			if not extConn:
+				conn.close()
 
 	def decayAnalyzePatientItems(self, decayAnalysisOptions):
 		log.debug("delta = %s" % decayAnalysisOptions.delta);
@@ -155,7 +195,9 @@ class DecayingWindows:
 				analysisOptions.bufferFile = decayAnalysisOptions.outputFile
 
 			# Decay any existing stats before learn new ones to increment
-			if currentBuffer is None:
+			if currentBuffer is None and decayAnalysisOptions.lazyDecay:
+				self.lazyDecay(decayAnalysisOptions)
+			elif currentBuffer is None:
 				self.standardDecay(decayAnalysisOptions)
 			else:
 				log.debug("buffer decay");
@@ -236,6 +278,7 @@ class DecayingWindows:
 		parser.add_option("-a", "--associationsPerCommit", type="int", dest="associationsPerCommit", help="If provided, will commit incremental analysis results to the database when accrue this many association items.  Can help to avoid allowing accrual of too much buffered items whose runtime memory will exceed the 32bit 2GB program limit.")
 		parser.add_option("-u", "--itemsPerUpdate", type="int", dest="itemsPerUpdate", help="If provided, when updating patient_item analyze_dates, will only update this many items at a time to avoid overloading MySQL query.")
 		parser.add_option("-o", "--outputFile", dest="outputFile", help="If provided, send buffer to output file rather than commiting to database")
+		parser.add_option("-l", "--lazyDecay", dest="lazyDecay", action="store_true", help="If set, decay database counts by updating a global scale factor rather than updating every association record after each delta")
 		(options, args) = parser.parse_args(argv[1:])
 
 		decayAnalysisOptions = DecayAnalysisOptions()
@@ -257,6 +300,7 @@ class DecayingWindows:
 
 		if options.outputFile is not None:
 			decayAnalysisOptions.outputFile = options.outputFile
+		decayAnalysisOptions.lazyDecay = bool(options.lazyDecay)
 
 		#set patientIds based on either a file input or args
 		decayAnalysisOptions.patientIds = list()
@@ -8,14 +8,17 @@ items / orders.
 """
 import sys, os
 import time;
+import heapq;
+import hashlib;
 from optparse import OptionParser;
 import json;
 import urlparse;
 import math;
 from datetime import datetime, timedelta;
+import numpy as np;
 from medinfo.common.Const import FALSE_STRINGS, COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
-from medinfo.common.StatsUtil import ContingencyStats, UnrecognizedStatException, DEGENERATE_VALUE_ADJUSTMENT;
+from medinfo.common.StatsUtil import ContingencyStats, ContingencyStatsArray, UnrecognizedStatException, DEGENERATE_VALUE_ADJUSTMENT;
 from medinfo.db import DBUtil;
 from medinfo.db.Model import SQLQuery, RowItemModel;
 from medinfo.db.Model import RowItemFieldComparator;
@@ -23,6 +26,7 @@ from medinfo.db.Model import modelListFromTable, modelDictFromList;
 from medinfo.db.ResultsFormatter import TextResultsFormatter;
 
 from DataManager import DataManager;
+from AssociationIndex import AssociationIndex;
 
 from Util import log;
 from Const import AGGREGATOR_OPTIONS;
@@ -319,6 +323,38 @@ class BaseItemRecommender:
 
     populateDerivedStats = staticmethod(populateDerivedStats);
 
+    def populateDerivedStatsArray(resultModels, statIds):
+        """Equivalent of populateDerivedStats for a whole list of resultModels at once,
+        calculating each stat for all of them with one vectorized StatsUtil.ContingencyStatsArray.
+        """
+        if len(resultModels) < 1:
+            return;
+        for resultModel in resultModels:
+            if "nAB" not in resultModel:    # Baseline query, so just populate with full correlations
+                resultModel["nAB"] = resultModel["nB"];
+                resultModel["nA"] = resultModel["N"];
+
+        contStats = ContingencyStatsArray( *[[resultModel[key] for resultModel in resultModels] for key in ("nAB","nA","nB","N")] );
+        contStats.normalize(truncateNegativeValues=False);
+
+        for statId in statIds:
+            for (resultModel, value) in zip(resultModels, contStats[statId].tolist()):
+                if statId not in resultModel:   # Skip stats that have already been populated
+                    resultModel[statId] = value;
+
+    populateDerivedStatsArray = staticmethod(populateDerivedStatsArray);
+
+    def queryStatIds(query):
+        """Set of the stats needed to sort and filter results by, based on the query.sortField and query.fieldFilters"""
+        statIds = set([query.sortField]);
+        for (fieldOp, value) in query.fieldFilters.iteritems():
+            if value is not None:
+                field = fieldOp[:-1];
+                statIds.add(field);
+        return statIds;
+
+    queryStatIds = staticmethod(queryStatIds);
+
     def populateAggregateStats(aggregateResult, query, statIds=None):
         """Calculate and populate the aggregate result item with stats based
         on its component items (expected in item keyed by "componentResults"
@@ -407,12 +443,20 @@ class BaseItemRecommender:
             nA' = Product((nAi-nAiB)/(N-nB)) * (N-nB) + nAB'
         """
         if statIds is None:
-            statIds = set([query.sortField]);
-            for (fieldOp, value) in query.fieldFilters.iteritems():
-                if value is not None:
-                    field = fieldOp[:-1];
-                    statIds.add(field);
+            statIds = BaseItemRecommender.queryStatIds(query);
+
+        BaseItemRecommender.populateAggregateCounts(aggregateResult, query);
+
+        # Populate derived statistics that may be used as scoring measures
+        BaseItemRecommender.populateDerivedStats(aggregateResult, statIds);
+        aggregateResult["score"] = aggregateResult[query.sortField];
 
+    populateAggregateStats = staticmethod(populateAggregateStats);
+
+    def populateAggregateCounts(aggregateResult, query):
+        """Populate the aggregate result item's virtual nAB, nA, nB, N counts based on its component items,
+        by the query.aggregationMethod (see populateAggregateStats).
+        """
         if "componentResultsById" in aggregateResult:
             componentResultsById = aggregateResult["componentResultsById"];
 
@@ -487,26 +531,81 @@ class BaseItemRecommender:
                 aggregateResult["nAB"] = aggregateResult["Product(nAB/nB)"] * aggregateResult["nB"];
                 aggregateResult["nA"] = aggregateResult["Product((nA-nAB)/(N-nB))"] * (aggregateResult["N"]-aggregateResult["nB"]) + aggregateResult["nAB"];
 
-        # Populate derived statistics that may be used as scoring measures
-        BaseItemRecommender.populateDerivedStats(aggregateResult, statIds);
-        aggregateResult["score"] = aggregateResult[query.sortField];
+    populateAggregateCounts = staticmethod(populateAggregateCounts);
 
-    populateAggregateStats = staticmethod(populateAggregateStats);
+    def aggregateCountArrays(queryRows, targetCols, nAB, nA, nB, N, nTargets, query):
+        """Equivalent of populateAggregateCounts for all target items at once, from parallel arrays of component counts
+        (the association from the query item in row queryRows[i] to the target item in column targetCols[i]).
+        Lays out the component counts as (query item x target item) matrices,
+        and calculates the virtual nAB, nA counts for every target item with matrix reductions
+        (along the query item axis), rather than accruing intermediate fields per aggregate result.
+        Returns (nAB, nA, nB, N) arrays by target item column (nAB, nA None if not a recognized query.aggregationMethod).
+        """
+        shape = (int(queryRows.max())+1 if len(queryRows) > 0 else 0, nTargets);
+        isComponent = np.zeros(shape, dtype=bool);
+        isComponent[queryRows, targetCols] = True;
+        countMatrices = list();
+        for counts in (nAB, nA, nB, N):
+            countMatrix = np.ones(shape);   # Placeholder ones for absent components
+            countMatrix[queryRows, targetCols] = counts;
+            countMatrices.append(countMatrix);
+        (nAB, nA, nB, N) = countMatrices;
+
+        # Fill in baseline counts directly, as values should be identical across components
+        firstComponentRows = np.argmax(isComponent, axis=0);
+        columns = np.arange(nTargets);
+        aggregateNB = nB[firstComponentRows, columns];
+        aggregateN = N[firstComponentRows, columns];
+        aggregateNAB = None;
+        aggregateNA = None;
+
+        errState = np.seterr(divide="ignore", invalid="ignore");
+        try:
+            if query.aggregationMethod in ("weighted","unweighted"):
+                # Standard (weighted) average of component scores
+                weights = np.where(isComponent, 1.0, 0.0);
+                if query.aggregationMethod == "weighted":
+                    # Weighted scaling of scores inversely proportional to the query item frequency
+                    weights = np.where(isComponent, 1.0 / nA, 0.0);
+                sumWeights = weights.sum(axis=0);
+                aggregateNAB = (nAB * weights).sum(axis=0) / sumWeights;
+                aggregateNA = (nA * weights).sum(axis=0) / sumWeights;
 
+            elif query.aggregationMethod in ("NaiveBayes"):
+                # Naive Bayes products, with small adjustment to avoid zero values that will wipe out all information in product
+                nAB_ = np.maximum(nAB, DEGENERATE_VALUE_ADJUSTMENT);
+                nA_ = np.maximum(nA, DEGENERATE_VALUE_ADJUSTMENT);
+                aggregateNAB = np.where(isComponent, nAB_ / nB, 1.0).prod(axis=0) * aggregateNB;
+                aggregateNA = np.where(isComponent, nA_ / N, 1.0).prod(axis=0) * aggregateN;
+
+            elif query.aggregationMethod in ("SerialBayes"):
+                # "Serial" Bayes products of positive likelihood ratios, as virtual counts
+                nAB_ = np.maximum(nAB, DEGENERATE_VALUE_ADJUSTMENT);
+                productNABOverNB = np.where(isComponent, nAB_ / nB, 1.0).prod(axis=0);
+                productNotNABRatio = np.where(isComponent, (nA-nAB_) / (N-nB), 1.0).prod(axis=0);
+                aggregateNAB = productNABOverNB * aggregateNB;
+                aggregateNA = productNotNABRatio * (aggregateN-aggregateNB) + aggregateNAB;
+        finally:
+            np.seterr(**errState);
 
-    def filterAggregateResultsByQuery( self, aggregateResultsByItemId, query ):
-        """Filter down the total collection of aggregateResultsByItemId into
-        and ordered list of aggregateResults based on the query sort and filter options.
-        Should require calculation of summary statistics for each aggregate result based on component results.
+        return (aggregateNAB, aggregateNA, aggregateNB, aggregateN);
+
+    aggregateCountArrays = staticmethod(aggregateCountArrays);
+
+
+    def filterAggregateResultsByQuery( self, aggregateResults, query ):
+        """Filter down the total collection of aggregateResults (with their aggregate counts populated) into
+        an ordered list of aggregateResults based on the query sort and filter options.
+        Should require calculation of summary statistics for each aggregate result based on its counts.
         """
+        # Calculate and populate the aggregate result items with stats
+        #   to enable subsequent sorting and filtering.  Calculated for all of the items at once.
+        self.populateDerivedStatsArray(aggregateResults, self.queryStatIds(query));
+
         # Now collect and sort the aggregated results to return only the top relevant results
         aggregateResultsWithScore = list();
-        for aggregateResult in aggregateResultsByItemId.itervalues():
-            itemId = aggregateResult["clinical_item_id"];
-
-            # Calculate and populate the aggregate result item with stats based on its component items
-            #   to enable subsequent sorting and filtering
-            self.populateAggregateStats(aggregateResult, query);
+        for aggregateResult in aggregateResults:
+            aggregateResult["score"] = aggregateResult[query.sortField];
 
             # Look for value filters
             excludeResult = False;
@@ -521,17 +620,18 @@ class BaseItemRecommender:
             if not excludeResult:
                 aggregateResultsWithScore.append( (aggregateResult[query.sortField], aggregateResult) );
 
-        aggregateResultsWithScore.sort();
-        if query.sortReverse:
-            aggregateResultsWithScore.reverse();    # Descending order of score to get top results
-
-        # Pull out only the top X results to satisfy the query results
-        topAggregateResults = list();
-        for i, (score, aggregateResult) in enumerate(aggregateResultsWithScore):
-            if query.limit is not None and i >= query.limit:
-                break;  # Stop adding more results if only asked for a subset
-            topAggregateResults.append(aggregateResult);
+        # Pull out only the top X results to satisfy the query results.
+        #   Partial (heap) selection if only asked for a subset, rather than sorting every candidate
+        if query.limit is None:
+            aggregateResultsWithScore.sort();
+            if query.sortReverse:
+                aggregateResultsWithScore.reverse();    # Descending order of score to get top results
+        elif query.sortReverse:
+            aggregateResultsWithScore = heapq.nlargest(query.limit, aggregateResultsWithScore);
+        else:
+            aggregateResultsWithScore = heapq.nsmallest(query.limit, aggregateResultsWithScore);
 
+        topAggregateResults = [aggregateResult for (score, aggregateResult) in aggregateResultsWithScore];
         return topAggregateResults;
 
 
@@ -555,6 +655,10 @@ class ItemAssociationRecommender(BaseItemRecommender):
     when don't have much initial information to key recommendations from.
     """
 
+    def __init__(self):
+        BaseItemRecommender.__init__(self);
+        self.associationIndexDir = None;    # If set, directory of AssociationIndex snapshot files to load (and save) instead of querying the database. Clear out after association analysis updates
+
     def __call__(self, query, default=False, conn=None):
         extConn = True;
         if conn is None:
@@ -603,12 +707,14 @@ class ItemAssociationRecommender(BaseItemRecommender):
                 #   Use total number of patient records as a denominator as theoretical number of distinct times an order could be made
                 #   Technically not perfectly accurate, since a single patient can have the same order entered in multiple times.
                 totalPatients = self.totalPatientCount(query, conn);
+                countScale = self.dataManager.getAssociationCountScale(conn=conn);  # Lazy decay factor for stored counts
 
                 for result in resultModels:
-                    nB = result["nB"] = result[query.countPrefix+"count_0"];
+                    nB = result["nB"] = result[query.countPrefix+"count_0"] * countScale;
                     N = result["N"] = totalPatients;
 
-                    self.populateDerivedStats(result, [query.sortField]);
+                self.populateDerivedStatsArray(resultModels, [query.sortField]);
+                for result in resultModels:
                     result["score"] = result[query.sortField];
                 return resultModels;
 
@@ -633,59 +739,73 @@ class ItemAssociationRecommender(BaseItemRecommender):
                 #   # Above will not work however, since single query is pulling data for all query items,
                 #   # and really should be applying cut-off limit to each "sub-query"
                 #print >> sys.stderr, "AssocQuery:", sqlQuery, sqlQuery.params;
-                resultModels = self.loadResultModels( query, sqlQuery, conn=conn );
+                resultArrays = self.loadResultArrays( query, sqlQuery, conn=conn );
 
-                if len(resultModels) < 1:
+                if len(resultArrays[0]) < 1:
                     # Not able to find any recommendations based on this query data.  Just return default recommendations then.
                     return self( query, default=True, conn=conn );
                 else:
-                    aggregateRecs = self.aggregateRecommendations( resultModels, query, countField, conn=conn );
+                    aggregateRecs = self.aggregateRecommendations( resultArrays, query, countField, conn=conn );
                     return aggregateRecs;
         finally:
             if not extConn:
                 conn.close();
 
-    def loadResultModels( self, query, sqlQuery, conn ):
+    def loadResultArrays( self, query, sqlQuery, conn ):
         """Query for the results from the SQL query, but if the dataCache is set on this instance,
         see if this can be retrieved/stored from there as well, to minimize repetitive database hits.
         Instead of serial small DB queries, just do one massive DB query for all possible query items
-        and store in memory (few GB for upto 100K items) and return select subsets as requested for much more rapid serial queries.
+        and store in memory as an AssociationIndex (sparse matrix of counts, keyed by source item),
+        then return select subsets as requested for much more rapid serial queries.
+        Returns the (sourceItemIds, targetItemIds, countsByCol) arrays of the results (see AssociationIndex.gather).
         """
-        simpleSQLQuery = str(sqlQuery).replace(",%s" % DBUtil.SQL_PLACEHOLDER,"");   # Strip down multiple consecutive placeholders
-
-        # Populate a cache if it has not already been so
-        dataCache = self.dataManager.dataCache;
-        if dataCache is None: dataCache = dict();
-        if simpleSQLQuery not in dataCache:
-            dataCache[simpleSQLQuery] = dict();
+        associationIndex = self.loadAssociationIndex( query, sqlQuery, conn=conn );
 
-            #print >> sys.stderr, sqlQuery;
+        # Pull out the relevant results of interest, and apply filters, without building any per result dictionaries
+        recordIndexes = associationIndex.recordIndexes(query.queryItemIds);
+        targetItemIds = associationIndex.targetItemIds[recordIndexes];
+        recordIndexes = recordIndexes[self.filterResultItemMask(targetItemIds, query)];
 
-            newResultsTable = DBUtil.execute( sqlQuery, includeColumnNames=True, conn=conn );
-            newResultModels = modelListFromTable(newResultsTable);
-            self.dataManager.queryCount += 1;
+        return associationIndex.gather(recordIndexes);
 
-            for result in newResultModels:
-                #print >> sys.stderr, "CACHE IT:", (result);
-                sourceItemId = result[query.sourceCol()];
-                if sourceItemId not in dataCache[simpleSQLQuery]:
-                    dataCache[simpleSQLQuery][sourceItemId] = list();
-                resultCopy = dict(result);
-                dataCache[simpleSQLQuery][sourceItemId].append(resultCopy);
-
-        # Pull out the relevant results of interest
-        resultModels = list();
-        # See if can find what we want from the previously cached results
-        for queryItemId in query.queryItemIds:
-            if queryItemId in dataCache[simpleSQLQuery]:
-                for result in dataCache[simpleSQLQuery][queryItemId]:
-                    resultCopy = dict(result);
-                    resultModels.append( resultCopy );
-                    #print >> sys.stderr, "PULL IT", resultCopy;
-
-        resultModels = self.filterResultItems(resultModels, query);
-        return resultModels;
+    def loadAssociationIndex( self, query, sqlQuery, conn ):
+        """Retrieve the AssociationIndex of all results for the SQL query (regardless of query items)
+        from the dataCache, or a snapshot file in the associationIndexDir (if set),
+        or query the database for it if it has not already been cached (saving a snapshot file if associationIndexDir set).
+        """
+        simpleSQLQuery = str(sqlQuery).replace(",%s" % DBUtil.SQL_PLACEHOLDER,"");   # Strip down multiple consecutive placeholders
 
+        dataCache = self.dataManager.dataCache;
+        associationIndex = None;
+        if dataCache is not None:
+            associationIndex = dataCache.get(simpleSQLQuery);
+        if associationIndex is None:
+            snapshotFilename = None;
+            if self.associationIndexDir is not None:
+                snapshotFilename = os.path.join(self.associationIndexDir, "%s.npz" % hashlib.md5(simpleSQLQuery).hexdigest());
+            if snapshotFilename is not None and os.path.exists(snapshotFilename):
+                associationIndex = AssociationIndex.load(snapshotFilename);
+            else:
+                newResultsTable = DBUtil.execute( sqlQuery, includeColumnNames=True, conn=conn );
+                self.dataManager.queryCount += 1;
+                associationIndex = AssociationIndex.fromResultTable(newResultsTable, query.sourceCol(), query.targetCol());
+                if snapshotFilename is not None:
+                    associationIndex.save(snapshotFilename);
+            if dataCache is not None:
+                dataCache[simpleSQLQuery] = associationIndex;
+        return associationIndex;
+
+    def filterResultItemMask(self, targetItemIds, query):
+        """Vectorized equivalent of filterResultItems.
+        Return boolean mask array for which of the (array of) result target item IDs to keep.
+        """
+        if query.targetItemIds:
+            keepMask = np.in1d(targetItemIds, list(query.targetItemIds)); # Caller only interested in certain target items
+        else:
+            keepMask = ~np.in1d(targetItemIds, list(query.queryItemIds));   # Query items generally have no reason to be in recommended set
+        if query.excludeItemIds:
+            keepMask &= ~np.in1d(targetItemIds, list(query.excludeItemIds));   # Caller does not want these to be among the suggested items
+        return keepMask;
 
     def filterResultItems(self,resultModels,query):
         """Application level item filtering so get more DB results that can be cached in local memory
@@ -706,30 +826,39 @@ class ItemAssociationRecommender(BaseItemRecommender):
             filteredModels.append(result);
         return filteredModels;
 
-    def aggregateRecommendations( self, resultModels, query, countField, conn=None ):
-        """Given all of the resultModels from an association query from multiple
-        key clinical items, aggregate them into a single recommendation list
-        (with option of link back to component results).
+    def aggregateRecommendations( self, resultArrays, query, countField, conn=None ):
+        """Given all of the results from an association query from multiple key clinical items,
+        as (sourceItemIds, targetItemIds, countsByCol) arrays (see loadResultArrays),
+        aggregate them into a single recommendation list.
 
         Should be sorted and filtered by any sort and filter options as specified in the query.
         """
-        if len(resultModels) < 1:
+        (sourceItemIds, targetItemIds, countsByCol) = resultArrays;
+        if len(sourceItemIds) < 1:
             # Not able to find any recommendations based on this query data.  Just return default recommendations then.
             return self( query, default=True, conn=conn );
 
         # Ensure core association count statistics are available for each result
-        self.populateResultCounts( resultModels, query, countField, conn=conn );
+        (nAB, nA, nB, N) = self.resultCountArrays( resultArrays, query, countField, conn=conn );
+
+        # Organize all possible results by target item ID (columns), with component results by query item (rows)
+        (queryItemIds, queryRows) = np.unique(sourceItemIds, return_inverse=True);
+        (aggregateItemIds, targetCols) = np.unique(targetItemIds, return_inverse=True);
+        aggregateCounts = self.aggregateCountArrays(queryRows, targetCols, nAB, nA, nB, N, len(aggregateItemIds), query);
 
-        # Organize all possible results by target item ID, with component results as sub items
-        aggregateResultsByItemId = self.collateAggregateResuls( resultModels, query );
+        aggregateResults = [RowItemModel({"clinical_item_id": itemId}) for itemId in aggregateItemIds.tolist()];
+        for (key, counts) in zip(("nAB","nA","nB","N"), aggregateCounts):
+            if counts is not None:
+                for (aggregateResult, value) in zip(aggregateResults, counts.tolist()):
+                    aggregateResult[key] = value;
 
         # Now filter down the total list based on the query sort and filter options
-        filteredAggregateResults = self.filterAggregateResultsByQuery( aggregateResultsByItemId, query );
+        filteredAggregateResults = self.filterAggregateResultsByQuery( aggregateResults, query );
 
         return filteredAggregateResults;
 
-    def populateResultCounts( self, resultModels, query, countField, conn=None ):
-        """Ensure core association counts are populated for each result model.
+    def resultCountArrays( self, resultArrays, query, countField, conn=None ):
+        """Return (nAB, nA, nB, N) arrays of the core association counts for each result in the resultArrays.
         Assume ordering of A as source-query item and B as target-recommended item.  Then,
         nAB = Number of occurrences of item B occuring after A (within a timeframe specified in the query)
         nA = Number of occurrences of item A
@@ -743,6 +872,7 @@ class ItemAssociationRecommender(BaseItemRecommender):
         Query options should be available to specify preference for n counts to be based on patient occurrences
         ("Number of patients where item B occurs after item A") to fill a properly scaled 2x2 table.
         """
+        (sourceItemIds, targetItemIds, countsByCol) = resultArrays;
         extConn = True;
         if conn is None:
             conn = self.connFactory.connection();
@@ -761,43 +891,28 @@ class ItemAssociationRecommender(BaseItemRecommender):
             baseCountQuery.addFrom("clinical_item as ci");
             baseCountQuery.addWhere("analysis_status <> 0");    # Will need all records fit for analysis to scale any suggested item
             baseCountResultTable = self.dataManager.executeCacheOption( baseCountQuery, includeColumnNames=True, conn=conn );
+            baseCountByItemId = dict( (row[0], row[1]) for row in baseCountResultTable[1:] );
+
+            def baseCounts(itemIds):
+                """Base counts for an array of item IDs, looking up each distinct item once"""
+                (distinctItemIds, inverse) = np.unique(itemIds, return_inverse=True);
+                return np.array([float(baseCountByItemId[itemId]) for itemId in distinctItemIds.tolist()])[inverse];
 
-            baseCountResultsByItemId = modelDictFromList( modelListFromTable(baseCountResultTable), "clinical_item_id");
             # Count up total number of patients to turn counts into per patient frequency
             totalPatients = self.totalPatientCount(query, conn);
-
-            for result in resultModels:
-                queryItemId = result[""+query.sourceCol()+""];
-                targetItemId = result[""+query.targetCol()+""];
-                baseCountResultsByItemId[queryItemId][countPrefix+"count"]
-
-                # Ensure component items have core association counts.  Convert to floats to facilitate calculations
-                nAB = result["nAB"] = float(result[countField]);
-                nA = result["nA"] = float(baseCountResultsByItemId[queryItemId][countPrefix+"count"]);
-                nB = result["nB"] = float(baseCountResultsByItemId[targetItemId][countPrefix+"count"]);
-                N = result["N"] = float(totalPatients);
-
+            # Lazy decay factor for the stored association counts (base counts already have it applied)
+            countScale = self.dataManager.getAssociationCountScale(conn=conn);
+
+            # Convert to floats to facilitate calculations
+            nAB = countsByCol[countField] * countScale;
+            nA = baseCounts(sourceItemIds);
+            nB = baseCounts(targetItemIds);
+            N = np.repeat(float(totalPatients), len(sourceItemIds));
+            return (nAB, nA, nB, N);
         finally:
             if not extConn:
                 conn.close();
 
-    def collateAggregateResuls( self, resultModels, query ):
-        """Organize result models into a new set per target item ID,
-        with links back to the component result models.
-        """
-        aggregateResultsByItemId = dict();
-        for result in resultModels:
-            targetItemId = result[query.targetCol()];
-
-            if targetItemId not in aggregateResultsByItemId:
-                aggregateResultsByItemId[targetItemId] = RowItemModel();
-                aggregateResultsByItemId[targetItemId]["clinical_item_id"] = targetItemId;
-
-                # Keep references to original results to allow reconstruction and summary stats later
-                aggregateResultsByItemId[targetItemId]["componentResultsById"] = dict();
-            aggregateResultsByItemId[targetItemId]["componentResultsById"][result[query.sourceCol()]] = result;
-        return aggregateResultsByItemId;
-
     def organizeByCategory(self, resultModels):
         """Given a collection of recommendation result models,
         reorder them by category, but do so by which categories overall
@@ -868,11 +983,14 @@ class ItemAssociationRecommender(BaseItemRecommender):
                     "   <outputFile>    Tab-delimited table of recommender results..\n"+\
                     "                       Leave blank or specify \"-\" to send to stdout.\n"
         parser = OptionParser(usage=usageStr)
+        parser.add_option("-i", "--associationIndexDir", dest="associationIndexDir", help="Directory of association index snapshot files to load association counts from (saving new ones as needed), instead of querying the database each run.  Clear out after association analysis updates.");
 
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
         timer = time.time();
+        if options.associationIndexDir is not None:
+            self.associationIndexDir = options.associationIndexDir;
         if len(args) > 0:
             queryStr = args[0];
             # Format the results for output
@@ -11,6 +11,8 @@ import json;
 import urlparse;
 import math;
 from datetime import datetime, timedelta;
+import numpy as np;
+from scipy.sparse import csr_matrix;
 from medinfo.common.Const import FALSE_STRINGS, COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
 from medinfo.common.StatsUtil import ContingencyStats, UnrecognizedStatException, DEGENERATE_VALUE_ADJUSTMENT;
@@ -45,6 +47,11 @@ class OrderSetRecommender(BaseItemRecommender):
     Estimate P(item) = |OrderSets containing item| / |Items in Any Order Set|
         Can derive this by summing over all order sets for P(item|OrderSet_j)*P(OrderSet_j);
     Use above to generate TF*IDF, lift estimates with P(item|query) / P(item)
+
+    Order set membership is held as a sparse binary (item x order set) matrix M, so with a binary query item vector q,
+        P(OrderSet|queryItems) = (q M) / |queryItems in Any OrderSet|
+        P(item|queryItems) = M (P(OrderSet|queryItems) / |OrderSet|)
+    and many query vectors can be scored at once as sparse matrix products (see recommendBatch).
     """
     def __init__(self):
         """Initialize module with prior generated model and word document counts from TopicModel module.
@@ -60,6 +67,14 @@ class OrderSetRecommender(BaseItemRecommender):
         self.itemIdsByOrderSetId = None;
         self.orderSetIdsByItemId = None;
 
+        # Sparse order set membership matrix, with rows for each item in any order set and columns for each order set
+        self.orderSetIds = None;
+        self.orderSetItemIds = None;
+        self.itemIndexById = None;
+        self.itemOrderSetMatrix = None;
+        self.orderSetSizes = None;
+        self.orderSetCountByItem = None;
+
     def initItemLookups(self, query):
         """Load lookup info and save into local member variables for reuse later
         so don't have to do wasteful repeat DB lookups for serial queries
@@ -84,6 +99,7 @@ class OrderSetRecommender(BaseItemRecommender):
             if itemId not in self.orderSetIdsByItemId:
                 self.orderSetIdsByItemId[itemId] = set();
             self.orderSetIdsByItemId[itemId].add(orderSetId);
+        self.initOrderSetMatrix();
 
         self.itemsById = DBUtil.loadTableAsDict("clinical_item");
         self.categoryIdByItemId = dict();
@@ -97,43 +113,103 @@ class OrderSetRecommender(BaseItemRecommender):
             if self.isItemRecommendable(itemId, emptyQuerySet, query, self.categoryIdByItemId):
                 self.candidateItemIds.add(itemId);
 
+    def initOrderSetMatrix(self):
+        """Build the sparse (item x order set) binary membership matrix from the itemIdsByOrderSetId lookup,
+        along with the size of each order set and the number of order sets each item is in.
+        """
+        self.orderSetIds = sorted(self.itemIdsByOrderSetId.keys());
+        self.orderSetItemIds = sorted(self.orderSetIdsByItemId.keys());
+        self.itemIndexById = dict( (itemId, iItem) for (iItem, itemId) in enumerate(self.orderSetItemIds) );
+
+        rows = list();
+        cols = list();
+        for iOrderSet, orderSetId in enumerate(self.orderSetIds):
+            for itemId in self.itemIdsByOrderSetId[orderSetId]:
+                rows.append(self.itemIndexById[itemId]);
+                cols.append(iOrderSet);
+        self.itemOrderSetMatrix = csr_matrix( (np.ones(len(rows)), (rows, cols)), shape=(len(self.orderSetItemIds), len(self.orderSetIds)) );
+        self.orderSetSizes = np.asarray(self.itemOrderSetMatrix.sum(axis=0), dtype=float).ravel();
+        self.orderSetCountByItem = np.asarray(self.itemOrderSetMatrix.sum(axis=1), dtype=float).ravel();
+
     def __call__(self, query):
         # Given query items, lookup existing order sets to find and score related items
+        return self.recommendBatch([query])[0];
+
+    def recommendBatch(self, queries):
+        """Score many queries at once (e.g., for evaluation runs), returning a list with the
+        recommendedData for each query (as __call__ would return for each individually).
+        All of the order set weights and item scores are calculated together as sparse matrix products.
+        """
+        if len(queries) < 1:
+            return list();
 
         # Load item lookup information
         if self.itemsById is None:
-            self.initItemLookups(query);
+            self.initItemLookups(queries[0]);
+
+        queryItemCountByIdList = [self.queryItemCountById(query) for query in queries];
+
+        # Primary execution.  Apply queries to generate scored relationship to each order set, and then to each item
+        orderSetWeights = self.estimateOrderSetWeightMatrix(queryItemCountByIdList);
+        itemScores = self.itemOrderSetMatrix.dot( (orderSetWeights * (1.0/self.orderSetSizes)).T ).T;
+        numItemsInAnyOrderSet = len(self.orderSetItemIds);
+        itemTFIDFs = itemScores * numItemsInAnyOrderSet / self.orderSetCountByItem;  # Scale TF*IDF score based on baseline order set counts to prioritize disproportionately common items
+
+        recommendedDataList = list();
+        for iQuery, query in enumerate(queries):
+            recommendedData = self.recommendedDataFromScores(query, queryItemCountByIdList[iQuery], orderSetWeights[iQuery], itemScores[iQuery], itemTFIDFs[iQuery]);
+            recommendedDataList.append(recommendedData);
+        return recommendedDataList;
 
-        # Adapt query into dictionary format
+    def queryItemCountById(self, query):
+        """Adapt query items into dictionary format"""
         queryItemCountById = query.queryItemIds;
         if not isinstance(queryItemCountById, dict):    # Not a dictionary, probably a one dimensional list/set, then just add counts of 1
             itemIds = queryItemCountById;
             queryItemCountById = dict();
             for itemId in itemIds:
                 queryItemCountById[itemId] = 1;
+        return queryItemCountById;
 
-        # Primary execution.  Apply query to generate scored relationship to each order set.
-        weightByOrderSetId = self.estimateOrderSetWeights(queryItemCountById, self.itemIdsByOrderSetId, self.orderSetIdsByItemId);
+    def estimateOrderSetWeightMatrix(self, queryItemCountByIdList):
+        """Matrix version of estimateOrderSetWeights.  Returns dense (query x order set) array of
+        P(OrderSet|queryItems) = |Intersect(OrderSet,queryItems)| / |queryItems in Any OrderSet|
+        for each query, with the intersection sizes from the sparse product of the query vectors with the membership matrix.
+        """
+        rows = list();
+        cols = list();
+        for iQuery, queryItemCountById in enumerate(queryItemCountByIdList):
+            for itemId in queryItemCountById:
+                if itemId in self.itemIndexById:
+                    rows.append(iQuery);
+                    cols.append(self.itemIndexById[itemId]);
+        queryMatrix = csr_matrix( (np.ones(len(rows)), (rows, cols)), shape=(len(queryItemCountByIdList), len(self.orderSetItemIds)) );
 
-        # Composite scores for (recommendable) items by taking weighted average across the top items for each topic
-        recScoreByItemId = dict();
-        for itemId in self.candidateItemIds:
-            if self.isItemRecommendable(itemId, queryItemCountById, query, self.categoryIdByItemId):
-                recScoreByItemId[itemId] = 0.0;
-        for orderSetId, orderSetWeight in weightByOrderSetId.iteritems():
-            for itemId in recScoreByItemId.keys():
-                itemWeight = self.itemOrderSetWeight(itemId, orderSetId, self.itemIdsByOrderSetId);
-                recScoreByItemId[itemId] += orderSetWeight*itemWeight;
-
-        # Build 2-pls with lists to sort by score
-        recommendedData = list();
-        numItemsInAnyOrderSet = len(self.orderSetIdsByItemId);
-        for itemId, totalItemWeight in recScoreByItemId.iteritems():
-            tfidf = 0.0;
+        numQueryItemsInAnyOrderSet = np.asarray(queryMatrix.sum(axis=1), dtype=float).ravel();
+        intersectionSizes = (queryMatrix * self.itemOrderSetMatrix).toarray();
+
+        # Blank query or otherwise searching for things we have no data.
+        #   Treat as if effectively querying for all possible query items equally
+        blankQueries = (numQueryItemsInAnyOrderSet < 1);
+        intersectionSizes[blankQueries,:] = self.orderSetSizes;
+        numQueryItemsInAnyOrderSet[blankQueries] = len(self.orderSetItemIds);
+
+        return intersectionSizes / numQueryItemsInAnyOrderSet[:,np.newaxis];
 
-            if itemId in self.orderSetIdsByItemId:
-                numOrderSetsWithItem = len(self.orderSetIdsByItemId[itemId]);
-                tfidf = totalItemWeight * numItemsInAnyOrderSet / numOrderSetsWithItem;    # Scale TF*IDF score based on baseline order set counts to prioritize disproportionately common items
+    def recommendedDataFromScores(self, query, queryItemCountById, orderSetWeights, itemScores, itemTFIDFs):
+        """Build the sorted recommendedData list of item models for one query,
+        given its order set weights and the (TF and TF*IDF) scores for every item in any order set.
+        """
+        weightByOrderSetId = dict( zip(self.orderSetIds, orderSetWeights.tolist()) );
+
+        # Build 2-pls with lists to sort by score, for (recommendable) items
+        recommendedData = list();
+        for itemId in self.candidateItemIds:
+            if not self.isItemRecommendable(itemId, queryItemCountById, query, self.categoryIdByItemId):
+                continue;
+            iItem = self.itemIndexById[itemId];
+            totalItemWeight = float(itemScores[iItem]);
+            tfidf = float(itemTFIDFs[iItem]);
             itemModel = \
                 {   "totalItemWeight": totalItemWeight, "tf": totalItemWeight, "PPV": totalItemWeight, "P(item|query)": totalItemWeight, "P(B|A)": totalItemWeight,
                     "tfidf": tfidf, "lift": tfidf, "interest": tfidf, "P(item|query)/P(item)": tfidf, "P(B|A)/P(B)": tfidf,
@@ -146,7 +222,7 @@ class OrderSetRecommender(BaseItemRecommender):
         return recommendedData;
 
     def estimateOrderSetWeights(self, queryItemIds, itemIdsByOrderSetId, orderSetIdsByItemId):
-        """
+        """Set based (single query) reference version of estimateOrderSetWeightMatrix.
         Estimate each P(OrderSet|queryItems) = |Intersect(OrderSet,queryItems)| / |queryItems in Any OrderSets|
 
         If blank query or no order set matches found, then use alternative estimate for
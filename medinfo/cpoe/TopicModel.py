@@ -7,6 +7,7 @@ likely generated through PreparePatientItems.
 import sys, os
 import time;
 import json;
+import tempfile;
 from optparse import OptionParser
 from cStringIO import StringIO;
 from datetime import timedelta;
@@ -22,6 +23,13 @@ from Util import log;
 
 DEFAULT_TOPIC_ITEM_COUNT = 100; # When using or printing out topic information, number of top scored items to consider
 BUFFER_UPDATE_SIZE = 100000;   # Number of document Bag-of-Words to keep in memory before performing model updates.
+CORPUS_SUFFIX = ".mm";  # Filename suffix for serialized (MatrixMarket format) bag-of-words corpus files
+DOC_COUNT_SUFFIX = ".docCounts.json";   # Filename suffix for the word document counts saved alongside a serialized corpus
+
+class IdentityMap(dict):
+    """Stand-in for a model's id2word, so topic items are reported by item ID, including any outside a sparse vocabulary map"""
+    def __missing__(self, key):
+        return key;
 
 class TopicModel:
     def __init__(self):
@@ -39,14 +47,7 @@ class TopicModel:
         Return (model, docCountByWordId);
         """
         # Load dictionary to translate item IDs to descriptions
-        itemsById = DBUtil.loadTableAsDict("clinical_item");
-        id2word = dict();   # Models expect a pair for every possible item ID, and judges vocabulary size by length of this dictionary rather than the maximum ID values.  That means have to populate all of the empty ones as well.
-        maxId = max(itemsById.iterkeys());
-        for itemId in xrange(maxId+1):
-            description = str(itemId);  # Default to just the same as the ID string
-            if itemId in itemsById:
-                description = itemsById[itemId]["description"];
-            id2word[itemId] = description;
+        id2word = self.buildId2Word();
 
         # Stream in progressive updates from corpus generator so don't have to load all into memory
         # Do a batch of many at a time, otherwise very slow to increment one at a time
@@ -75,6 +76,84 @@ class TopicModel:
         return (self.model, self.docCountByWordId);
 
 
+    def buildId2Word(self, itemIds=None):
+        """Build dictionary to translate item IDs to descriptions.
+        If itemIds are specified, only include those (a sparse vocabulary map, which LDA models accept,
+        as they judge the vocabulary size by the maximum ID value).  Otherwise, HDP models expect a pair for
+        every possible item ID, and judge vocabulary size by length of this dictionary rather than the maximum ID values.
+        That means have to populate all of the empty ones as well.
+        """
+        itemsById = DBUtil.loadTableAsDict("clinical_item");
+        if itemIds is None:
+            itemIds = xrange(max(itemsById.iterkeys())+1);
+        id2word = dict();
+        for itemId in itemIds:
+            description = str(itemId);  # Default to just the same as the ID string
+            if itemId in itemsById:
+                description = itemsById[itemId]["description"];
+            id2word[itemId] = description;
+        return id2word;
+
+    def serializeCorpus(self, corpusBOWGenerator, corpusFilename):
+        """Stream the bag-of-words corpus (e.g., from PreparePatientItems.convertResultsFileToBagOfWordsCorpus)
+        into a MatrixMarket format corpus file (with an offset index for random access), so models can be
+        (re-)trained from it repeatedly (see buildModelFromCorpusFile) without re-reading and parsing the source data.
+        The docCountByWordId counts are tallied along the way and saved alongside the corpus file.
+        Return docCountByWordId.
+        """
+        import gensim;  # Only import external module as needed
+        docCountByWordId = {None: 0};   # Use None key to represent count of all documents
+
+        def countingCorpus():
+            prog = ProgressDots();
+            for document in corpusBOWGenerator:
+                for (wordId, wordCount) in document:    # Assuming uniqueness of wordId keys for each document
+                    if wordId not in docCountByWordId:
+                        docCountByWordId[wordId] = 0;
+                    docCountByWordId[wordId] += 1;
+                docCountByWordId[None] += 1;
+                yield document;
+                prog.update();
+
+        gensim.corpora.MmCorpus.serialize(corpusFilename, countingCorpus());
+
+        docCountFile = open(corpusFilename+DOC_COUNT_SUFFIX, "w");
+        json.dump(docCountByWordId.items(), docCountFile);    # As list of pairs, since JSON would convert keys to strings
+        docCountFile.close();
+        return docCountByWordId;
+
+    def loadCorpus(self, corpusFilename):
+        """Load a corpus file produced by serializeCorpus, returning (corpus, docCountByWordId).
+        The corpus is streamed from the file on each pass rather than loaded into memory.
+        """
+        import gensim;  # Only import external module as needed
+        corpus = gensim.corpora.MmCorpus(corpusFilename);
+        docCountFile = open(corpusFilename+DOC_COUNT_SUFFIX);
+        docCountByWordId = dict( (wordId, docCount) for (wordId, docCount) in json.load(docCountFile) );
+        docCountFile.close();
+        return (corpus, docCountByWordId);
+
+    def buildModelFromCorpusFile(self, corpusFilename, numTopics, workers=None):
+        """Build topic model from a corpus file produced by serializeCorpus.
+        LDA models are trained over the whole corpus with a sparse vocabulary map of only the items present,
+        and in parallel with gensim's LdaMulticore if workers (number of worker processes) is specified.
+
+        Return (model, docCountByWordId);
+        """
+        import gensim;  # Only import external module as needed
+        (corpus, docCountByWordId) = self.loadCorpus(corpusFilename);
+        if numTopics < 1:
+            id2word = self.buildId2Word();
+            self.model = gensim.models.hdpmodel.HdpModel( corpus, id2word=id2word, random_state=self.randomState );
+        else:
+            id2word = self.buildId2Word( wordId for wordId in docCountByWordId.iterkeys() if wordId is not None );
+            if workers is not None:
+                self.model = gensim.models.LdaMulticore( corpus, id2word=id2word, num_topics=numTopics, workers=workers, chunksize=BUFFER_UPDATE_SIZE, random_state=self.randomState );
+            else:
+                self.model = gensim.models.LdaModel( corpus, id2word=id2word, num_topics=numTopics, chunksize=BUFFER_UPDATE_SIZE, random_state=self.randomState );
+        self.docCountByWordId = docCountByWordId;
+        return (self.model, self.docCountByWordId);
+
     def updateModel(self, model, docBuffer, id2word, numTopics):
         """Update the given model object with the document buffer.
         If the model does not yet exist,
@@ -110,14 +189,14 @@ class TopicModel:
         """
         # Use raw IDs instead of word translation
         id2word = model.id2word;
-        id2id = dict();
+        id2id = IdentityMap();
         for id in id2word:
             id2id[id] = id;
         model.id2word = id2id;
 
         import gensim; # External import as needed
         if isinstance(model, gensim.models.HdpModel):   # Has different topic API for no good reason
-            topics = model.show_topics(num_topics=-1, num_words=itemsPerCluster, formatted=False);
+            topics = model.show_topics(num_topics=model.m_T, num_words=itemsPerCluster, formatted=False);  # Explicit count of (truncated) topics, as -1 yields none
             for topicId, topicItems in topics:
                 #for (itemId, itemWeight) in topicItems:  # 2-ple order is also reversed for no good reason
                 #    print topicId, itemDescr, itemWeight;
@@ -148,7 +227,7 @@ class TopicModel:
         id2word = model.id2word;
         for (topicId, topicItems) in self.enumerateTopics(model, itemsPerCluster):
             for (itemId, itemScore) in topicItems:
-                itemDescription = id2word[itemId];
+                itemDescription = id2word[itemId] if itemId in id2word else str(itemId);   # May be outside a sparse vocabulary map
                 tfidf = 0.0;
                 if itemId in docCountByWordId and docCountByWordId[itemId] > 0:
                     tfidf = itemScore * docCountByWordId[None] / docCountByWordId[itemId];
@@ -226,6 +305,8 @@ class TopicModel:
                     "   <outputFile>   Binary / pickle output file to save model for reuse later.\n"
         parser = OptionParser(usage=usageStr)
         parser.add_option("-n", "--numTopics",  dest="numTopics", help="Numbers of topics to model.  Specify 0 to use non-parameteric Hierarchical Dirichlet Process model instead.");
+        parser.add_option("-c", "--corpusFile",  dest="corpusFile", help="Serialized (MatrixMarket format, %s suffix) corpus file to train from.  If it does not exist yet, the inputFile corpus will be serialized into it first.  If it does exist, inputFile is not read at all, so models can be re-trained (e.g., with a different number of topics) without re-reading the source data." % CORPUS_SUFFIX);
+        parser.add_option("-w", "--workers",  dest="workers", help="Number of worker processes to train LDA models with in parallel (gensim LdaMulticore).  Uses a serialized corpus file (temporary, if corpusFile not specified).");
         parser.add_option("-i", "--itemsPerCluster",  dest="itemsPerCluster", default=DEFAULT_TOPIC_ITEM_COUNT, help="Specify number of top topic words to store in an additional tab-delimited file with the top N words for each topic by score, as well as the total docCountByWordId.");
 
         (options, args) = parser.parse_args(argv[1:])
@@ -240,13 +321,32 @@ class TopicModel:
             if len(args) > 1:
                 outputFilename = args[1];
 
-            corpusBOWGenerator = self.jsonGeneratorFromFile(stdOpen(inputFilename));
-
             # Parse some options
             numTopics = int(options.numTopics);
+            workers = None;
+            if options.workers is not None:
+                workers = int(options.workers);
 
             # Main Model construction
-            (model, docCountByWordId) = self.buildModel(corpusBOWGenerator, numTopics);
+            if options.corpusFile is None and workers is None:
+                corpusBOWGenerator = self.jsonGeneratorFromFile(stdOpen(inputFilename));
+                (model, docCountByWordId) = self.buildModel(corpusBOWGenerator, numTopics);
+            else:
+                corpusFilename = options.corpusFile;
+                tempCorpusFilename = None;
+                if corpusFilename is None:
+                    (fd, tempCorpusFilename) = tempfile.mkstemp(suffix=CORPUS_SUFFIX);
+                    os.close(fd);
+                    corpusFilename = tempCorpusFilename;
+                try:
+                    if tempCorpusFilename is not None or not os.path.exists(corpusFilename):
+                        self.serializeCorpus(self.jsonGeneratorFromFile(stdOpen(inputFilename)), corpusFilename);
+                    (model, docCountByWordId) = self.buildModelFromCorpusFile(corpusFilename, numTopics, workers);
+                finally:
+                    if tempCorpusFilename is not None:
+                        for filename in (tempCorpusFilename, tempCorpusFilename+".index", tempCorpusFilename+DOC_COUNT_SUFFIX):
+                            if os.path.exists(filename):
+                                os.remove(filename);
 
             # Save in binary format for reuse later
             model.save(outputFilename);
@@ -11,6 +11,7 @@ import json;
 import urlparse;
 import math;
 from datetime import datetime, timedelta;
+import numpy as np;
 from medinfo.common.Const import FALSE_STRINGS, COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
 from medinfo.common.StatsUtil import ContingencyStats, UnrecognizedStatException, DEGENERATE_VALUE_ADJUSTMENT;
@@ -23,9 +24,14 @@ from medinfo.cpoe.ItemRecommender import BaseItemRecommender;
 from medinfo.cpoe.TopicModel import TopicModel;
 from Util import log;
 
+TFIDF_FIELDS = ("tfidf","lift","interest","P(item|query)/P(item)","P(B|A)/P(B)");  # Item model score fields based on the TF*IDF scaled weight, rather than the raw (TF) weight
+
 class TopicModelRecommender(BaseItemRecommender):
     """Implementation class for item (e.g., order) recommendation based on topic models 
     (LDA Latent Dirichlet Allocation or HDP Hierarchical Dirichlet Process).
+
+    The (top itemsPerCluster) item weights for each topic are cached as a dense (topic x item) matrix,
+    so scoring a batch of queries is one product of their (query x topic) weight matrix with it (see recommendBatch).
     """
     def __init__(self, model, docCountByWordId=None):
         """Initialize module with prior generated model and word document counts from TopicModel module.
@@ -45,6 +51,14 @@ class TopicModelRecommender(BaseItemRecommender):
         self.categoryIdByItemId = None;
         self.candidateItemIds = None;
         self.weightByItemIdByTopicId = None;
+
+        # Dense topic x item weight matrix, with columns for the (sorted) items the model has document counts for
+        self.topicIds = None;
+        self.topicIndexById = None;
+        self.modelItemIds = None;
+        self.itemIndexById = None;
+        self.topicItemWeights = None;
+        self.itemTFIDFScales = None;
     
     def initItemLookups(self, query):
         self.itemsById = DBUtil.loadTableAsDict("clinical_item");
@@ -57,53 +71,125 @@ class TopicModelRecommender(BaseItemRecommender):
             if self.isItemRecommendable(itemId, emptyQuerySet, query, self.categoryIdByItemId):
                 self.candidateItemIds.add(itemId);
     
+    def initTopicItemWeights(self, itemsPerCluster):
+        """Extract the model weight parameters once (to save time on serial queries) into the
+        weightByItemIdByTopicId lookup and the equivalent dense topicItemWeights matrix,
+        along with the TF*IDF scaling factor for each item, based on baseline document counts.
+        """
+        self.weightByItemIdByTopicId = self.modeler.generateWeightByItemIdByTopicId(self.model, itemsPerCluster);
+
+        self.topicIds = sorted(self.weightByItemIdByTopicId.keys());
+        self.topicIndexById = dict( (topicId, iTopic) for (iTopic, topicId) in enumerate(self.topicIds) );
+        self.modelItemIds = sorted( itemId for itemId in self.docCountByWordId.iterkeys() if itemId is not None );
+        self.itemIndexById = dict( (itemId, iItem) for (iItem, itemId) in enumerate(self.modelItemIds) );
+
+        self.topicItemWeights = np.zeros( (len(self.topicIds), len(self.modelItemIds)) );
+        for (iTopic, topicId) in enumerate(self.topicIds):
+            for (itemId, weight) in self.weightByItemIdByTopicId[topicId].iteritems():
+                if itemId in self.itemIndexById:
+                    self.topicItemWeights[iTopic, self.itemIndexById[itemId]] = weight;
+
+        # Scale TF*IDF score based on baseline document counts to prioritize disproportionately common items
+        docCounts = np.array( [self.docCountByWordId[itemId] for itemId in self.modelItemIds], dtype=float );
+        self.itemTFIDFScales = np.zeros(len(self.modelItemIds));
+        self.itemTFIDFScales[docCounts > 0.0] = float(self.docCountByWordId[None]) / docCounts[docCounts > 0.0];
+
     def __call__(self, query):
         # Given query items, use model to find related topics with relationship scores
+        return self.recommendBatch([query])[0];
+
+    def recommendBatch(self, queries, limit=None):
+        """Score many queries at once (e.g., for evaluation runs), returning a list with the
+        recommendedData for each query (as __call__ would return for each individually).
+        Topic weights for all of the queries are inferred together (see inferTopicWeights)
+        and item scores come from a single (query x topic) by (topic x item) matrix product.
+        If limit is specified, only the top limit scored items are returned for each query.
+        """
+        if len(queries) < 1:
+            return list();
 
         # Load item category lookup information
         if self.itemsById is None:
-            self.initItemLookups(query);
+            self.initItemLookups(queries[0]);
 
         # Load model weight parameters once to save time on serial queries
-        if self.weightByItemIdByTopicId is None:
-            self.weightByItemIdByTopicId = self.modeler.generateWeightByItemIdByTopicId(self.model, query.itemsPerCluster);
-
-        # Adapt query into bag-of-words format
-        queryItemCountById = query.queryItemIds;
-        if not isinstance(queryItemCountById, dict):    # Not a dictionary, probably a one dimensional list/set, then just add counts of 1
-            itemIds = queryItemCountById;
-            queryItemCountById = dict();
-            for itemId in itemIds:
-                queryItemCountById[itemId] = 1;
-        observedIds = set();
-        queryBag = list(self.modeler.itemCountByIdToBagOfWords(queryItemCountById, observedIds, self.itemsById, query.excludeCategoryIds));
-
-        # Primary model execute.  Apply to query to generate scored relationship to each "topic"
-        topicWeights = self.model[queryBag];
-        weightByTopicId = dict();
-        for (topicId, topicWeight) in topicWeights:
-            weightByTopicId[topicId] = topicWeight;
-
-        # Composite scores for (recommendable) items by taking weighted average across the top items for each topic
-        recScoreByItemId = dict();
+        if self.topicItemWeights is None:
+            self.initTopicItemWeights(queries[0].itemsPerCluster);
+
+        # Adapt queries into bag-of-words format
+        queryItemCountByIdList = list();
+        queryBags = list();
+        for query in queries:
+            queryItemCountById = query.queryItemIds;
+            if not isinstance(queryItemCountById, dict):    # Not a dictionary, probably a one dimensional list/set, then just add counts of 1
+                itemIds = queryItemCountById;
+                queryItemCountById = dict();
+                for itemId in itemIds:
+                    queryItemCountById[itemId] = 1;
+            observedIds = set();
+            queryBag = list(self.modeler.itemCountByIdToBagOfWords(queryItemCountById, observedIds, self.itemsById, query.excludeCategoryIds));
+            queryItemCountByIdList.append(queryItemCountById);
+            queryBags.append(queryBag);
+
+        # Primary model execute.  Apply to queries to generate scored relationship to each "topic"
+        topicWeightsList = self.inferTopicWeights(queryBags);
+
+        # Composite scores for items by taking weighted average across the top items for each topic
+        queryTopicWeights = np.zeros( (len(queries), len(self.topicIds)) );
+        for (iQuery, topicWeights) in enumerate(topicWeightsList):
+            for (topicId, topicWeight) in topicWeights:
+                if topicWeight > queries[iQuery].minClusterWeight:    # Ignore topics with tiny contribution
+                    queryTopicWeights[iQuery, self.topicIndexById[topicId]] = topicWeight;
+        itemScores = np.dot(queryTopicWeights, self.topicItemWeights);
+        itemTFIDFs = itemScores * self.itemTFIDFScales;
+
+        recommendedDataList = list();
+        for (iQuery, query) in enumerate(queries):
+            weightByTopicId = dict(topicWeightsList[iQuery]);
+            recommendedData = self.recommendedDataFromScores(query, queryItemCountByIdList[iQuery], weightByTopicId, itemScores[iQuery], itemTFIDFs[iQuery], limit);
+            recommendedDataList.append(recommendedData);
+        return recommendedDataList;
+
+    def inferTopicWeights(self, queryBags):
+        """Return list of the (topicId, topicWeight) lists for each query bag-of-words, as from self.model[queryBag].
+        For LDA models, the topic distributions of all of the query bags are inferred in one batch.
+        """
+        import gensim;  # External import as needed
+        if not isinstance(self.model, gensim.models.LdaModel) or len(queryBags) < 2:
+            return [self.model[queryBag] for queryBag in queryBags];
+
+        (gamma, sstats) = self.model.inference(queryBags);
+        topicDists = gamma / gamma.sum(axis=1)[:,np.newaxis];  # Normalize distributions
+        minimumProbability = max(self.model.minimum_probability, 1e-8);
+        topicWeightsList = list();
+        for topicDist in topicDists:
+            topicWeightsList.append( [(topicId, topicWeight) for (topicId, topicWeight) in enumerate(topicDist) if topicWeight >= minimumProbability] );
+        return topicWeightsList;
+
+    def recommendedDataFromScores(self, query, queryItemCountById, weightByTopicId, itemScores, itemTFIDFs, limit=None):
+        """Build the sorted recommendedData list of item models for one query,
+        given its topic weights and the (TF and TF*IDF) scores for every item in the model.
+        If limit is specified, only build models for the top limit scored items.
+        """
+        # Only consider (recommendable) items
+        itemIndexes = list();
         for itemId in self.candidateItemIds:
             if self.isItemRecommendable(itemId, queryItemCountById, query, self.categoryIdByItemId):
-                recScoreByItemId[itemId] = 0.0;
-        for topicId, topicWeight in weightByTopicId.iteritems():
-            if topicWeight > query.minClusterWeight:    # Ignore topics with tiny contribution
-                weightByItemId = self.weightByItemIdByTopicId[topicId];
-                for itemId in recScoreByItemId.keys():
-                    itemWeight = 0.0;
-                    if itemId in weightByItemId:
-                        itemWeight = weightByItemId[itemId];
-                    recScoreByItemId[itemId] += topicWeight*itemWeight;
-
-        # Build 2-pls with lists to sort by score
+                itemIndexes.append(self.itemIndexById[itemId]);
+        itemIndexes = np.array(sorted(itemIndexes), dtype=int);
+
+        sortScores = itemTFIDFs[itemIndexes] if query.sortField in TFIDF_FIELDS else itemScores[itemIndexes];
+        if limit is not None and limit < len(itemIndexes):
+            itemIndexes = itemIndexes[np.argpartition(-sortScores, limit)[:limit]]; # Top-k selection without a full sort
+            sortScores = itemTFIDFs[itemIndexes] if query.sortField in TFIDF_FIELDS else itemScores[itemIndexes];
+        itemIndexes = itemIndexes[np.argsort(-sortScores, kind="mergesort")];
+
+        # Build 2-pls with lists sorted by score
         recommendedData = list();
-        for itemId, totalItemWeight in recScoreByItemId.iteritems():
-            tfidf = 0.0;
-            if itemId in self.docCountByWordId and self.docCountByWordId[itemId] > 0.0:
-                tfidf = totalItemWeight * self.docCountByWordId[None] / self.docCountByWordId[itemId];    # Scale TF*IDF score based on baseline document counts to prioritize disproportionately common items
+        for iItem in itemIndexes:
+            itemId = self.modelItemIds[iItem];
+            totalItemWeight = float(itemScores[iItem]);
+            tfidf = float(itemTFIDFs[iItem]);
             itemModel = \
                 {   "totalItemWeight": totalItemWeight, "tf": totalItemWeight, "PPV": totalItemWeight, "P(item|query)": totalItemWeight, "P(B|A)": totalItemWeight,
                     "tfidf": tfidf, "lift": tfidf, "interest": tfidf, "P(item|query)/P(item)": tfidf, "P(B|A)/P(B)": tfidf,
@@ -112,7 +198,6 @@ class TopicModelRecommender(BaseItemRecommender):
                 };
             itemModel["score"] = itemModel[query.sortField];
             recommendedData.append(itemModel);
-        recommendedData.sort( RowItemFieldComparator("score"), reverse=True);
         return recommendedData;
 
     def main(self, argv):
@@ -23,3 +23,7 @@ Exception if next item >=1 day away (option here), suggesting that items themsel
 instead of time, so just start from the base item time.
 """
 MAX_BASE_ITEM_TIME_RESOLUTION = timedelta(1);    # 1 day
+
+"""Patient records to queue up per parallel evaluation worker process, and seconds to wait on the queues before checking on the workers"""
+PATIENTS_PER_WORKER_QUEUE = 8;
+WORKER_POLL_SECONDS = 30;
@@ -20,6 +20,7 @@ from cStringIO import StringIO;
 from datetime import timedelta;
 from medinfo.common.Const import COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots;
+from medinfo.common.DataCache import DataCache;
 from medinfo.db.ResultsFormatter import TextResultsFormatter;
 from medinfo.db import DBUtil;
 from medinfo.db.Model import SQLQuery, RowItemModel;
@@ -215,7 +216,7 @@ class OutcomePredictionAnalysis(BaseCPOEAnalysis):
             # Parse out the query parameters
             query = AnalysisQuery();
             query.recommender = RECOMMENDER_CLASS_BY_NAME[options.recommender]();
-            query.recommender.dataManager.dataCache = dict(); # Use local cache to speed up repeat queries
+            query.recommender.dataManager.dataCache = DataCache(); # Use local cache to speed up repeat queries
 
             query.baseRecQuery = RecommenderQuery();
             if options.preparedPatientItemFile:
@@ -22,7 +22,7 @@ from medinfo.db import DBUtil;
 from medinfo.db.Model import SQLQuery, RowItemModel;
 from medinfo.db.Model import modelListFromTable, modelDictFromList;
 from medinfo.cpoe.ItemRecommender import RecommenderQuery, ItemAssociationRecommender;
-from medinfo.cpoe.TopicModel import TopicModel;
+from medinfo.cpoe.TopicModel import TopicModel, CORPUS_SUFFIX;
 from medinfo.cpoe.Const import AD_HOC_SECTION;
 from Util import log;
 from Const import MAX_BASE_ITEM_TIME_RESOLUTION;
@@ -67,10 +67,7 @@ class PreparePatientItems(BaseCPOEAnalysis):
         instead of doing a big DB query and manipulation
         """
         # Preload some lookup data to facilitate subsequent checks
-        self.categoryIdByItemId = dict();
-        lookupTable = DBUtil.execute("select clinical_item_id, clinical_item_category_id from clinical_item", conn=conn);
-        for (clinicalItemId, categoryId) in lookupTable:
-            self.categoryIdByItemId[clinicalItemId] = categoryId;
+        self.loadCategoryIdByItemId(conn=conn);
 
         if analysisQuery.preparedPatientItemFile is None:
             for (patientId, patientItemList) in self.queryPatientClinicalItemData(analysisQuery, conn=conn):
@@ -82,6 +79,14 @@ class PreparePatientItems(BaseCPOEAnalysis):
             for patientItemData in self.parsePreparedResultFile(analysisQuery.preparedPatientItemFile, analysisQuery):
                 yield patientItemData;
 
+    def loadCategoryIdByItemId(self, conn=None):
+        """Load (and return) the self.categoryIdByItemId lookup of clinical item category IDs by clinical item ID"""
+        self.categoryIdByItemId = dict();
+        lookupTable = DBUtil.execute("select clinical_item_id, clinical_item_category_id from clinical_item", conn=conn);
+        for (clinicalItemId, categoryId) in lookupTable:
+            self.categoryIdByItemId[clinicalItemId] = categoryId;
+        return self.categoryIdByItemId;
+
     def queryPatientClinicalItemData(self, analysisQuery, conn):
         """Query for all of the order / item data for each patient
         noted in the analysisQuery and yield them one list of clinicalItemIds
@@ -501,7 +506,7 @@ class PreparePatientItems(BaseCPOEAnalysis):
         parser.add_option("-E", "--endDate",  dest="endDate",  help="Only look for test data occuring before this end date.");
         parser.add_option("-t", "--timeDeltaMax",  dest="timeDeltaMax",  help="Time delta in seconds to look for the occurrence of outcomes starting from the begining of the query time, which may be 0 seconds, 1 hour (3600), 1 day (86400), or 1 week (604800), etc.  Defaults to counting items occurring at ANY recorded time after query items.");
         parser.add_option("-M", "--featureMatrixConvert",  dest="featureMatrixConvert", action="store_true", help="If set, will ignore earlier parameters, and interpret inputFile as a prepared patient item result file and then output it back in a sparse 'feature matrix' format with a column for each clinical item and 0/1 for the binary presence of each item for each patient in the query OR verify item sets.");
-        parser.add_option("-B", "--bagOfWordsConvert",  dest="bagOfWordsConvert", help="If set, instead interpret inputFile as a prepared patient item result file and then output it back in a sparse 'bag of words' format compatible with GenSim.  List of 2-ples (itemId, itemCount).  Given binary labels, counts will just be 0 or 1 for the presence of each item for each patient.  Include parameter characters 'q' and 'v' to specify which (or both) query and verify item sets to include. Include 'o' character to also include any outcome items.");
+        parser.add_option("-B", "--bagOfWordsConvert",  dest="bagOfWordsConvert", help="If set, instead interpret inputFile as a prepared patient item result file and then output it back in a sparse 'bag of words' format compatible with GenSim.  List of 2-ples (itemId, itemCount).  Given binary labels, counts will just be 0 or 1 for the presence of each item for each patient.  Include parameter characters 'q' and 'v' to specify which (or both) query and verify item sets to include. Include 'o' character to also include any outcome items.  If the outputFile name ends with %s, serialize the corpus into that (MatrixMarket format) corpus file for TopicModel training instead." % CORPUS_SUFFIX);
         parser.add_option("-X", "--excludeCategoryIds",  dest="excludeCategoryIds", help="For conversion, exclude / skip any items who fall under one of the comma-separated category Ids.  For extraction, will use default item and category exclusions regardless of this parameter.");
         (options, args) = parser.parse_args(argv[1:])
 
@@ -517,7 +522,6 @@ class PreparePatientItems(BaseCPOEAnalysis):
                 outputFilename = None;
                 if len(args) > 1:
                     outputFilename = args[1];
-                outputFile = stdOpen(outputFilename,"w");
 
                 queryItems = ("q" in options.bagOfWordsConvert);
                 verifyItems = ("v" in options.bagOfWordsConvert);
@@ -527,12 +531,15 @@ class PreparePatientItems(BaseCPOEAnalysis):
                 if options.excludeCategoryIds is not None:
                     excludeCategoryIds = set(int(idStr) for idStr in options.excludeCategoryIds.split(","));
 
-                print >> outputFile, COMMENT_TAG, json.dumps({"argv":argv});    # Print comment line with analysis arguments to allow for deconstruction later
-
                 # Run the actual analysis / data extraction
                 rowGenerator = self.convertResultsFileToBagOfWordsCorpus(inputFile, queryItems, verifyItems, outcomeItems, excludeCategoryIds);
-                for row in rowGenerator:
-                    print >> outputFile, json.dumps(row);
+                if outputFilename is not None and outputFilename.endswith(CORPUS_SUFFIX):
+                    TopicModel().serializeCorpus(rowGenerator, outputFilename);
+                else:
+                    outputFile = stdOpen(outputFilename,"w");
+                    print >> outputFile, COMMENT_TAG, json.dumps({"argv":argv});    # Print comment line with analysis arguments to allow for deconstruction later
+                    for row in rowGenerator:
+                        print >> outputFile, json.dumps(row);
 
             elif options.featureMatrixConvert:
                 # Convert results file into full feature matrix format
@@ -11,6 +11,9 @@ Rough approach
 
 import sys, os
 import time;
+import traceback;
+import multiprocessing;
+import Queue;
 from optparse import OptionParser;
 import json;
 from cStringIO import StringIO;
@@ -18,6 +21,7 @@ from math import sqrt;
 from datetime import timedelta;
 from medinfo.common.Const import COMMENT_TAG;
 from medinfo.common.Util import stdOpen, ProgressDots, loadJSONDict;
+from medinfo.common.DataCache import DataCache;
 from medinfo.db.ResultsFormatter import TextResultsFormatter, TabDictReader;
 from medinfo.db import DBUtil;
 from medinfo.db.Model import SQLQuery, RowItemModel;
@@ -28,6 +32,7 @@ from medinfo.cpoe.ItemRecommender import ItemAssociationRecommender, BaselineFre
 from medinfo.cpoe.OrderSetRecommender import OrderSetRecommender;
 from Util import log;
 
+from Const import PATIENTS_PER_WORKER_QUEUE, WORKER_POLL_SECONDS;
 from BaseCPOEAnalysis import BaseCPOEAnalysis;
 from BaseCPOEAnalysis import RECOMMENDER_CLASS_LIST, RECOMMENDER_CLASS_BY_NAME, AnalysisQuery;
 from BaseCPOEAnalysis import AGGREGATOR_OPTIONS;
@@ -38,10 +43,16 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
     """Driver class to review given patient data and run sample recommendation queries against
     them and collect comparison statistics between the recommended items vs. the patients'
     actual subsequent orders / items.
+
+    If nWorkers is more than 1, the test patient records are dealt out to that many worker processes
+    (see evaluatePatientsParallel), with results collected back in the original patient order.
     """
+    nWorkers = None;    # Number of parallel worker processes to evaluate patients with.  If None (or 1), evaluate all patients in this process
+
     def __init__(self):
         BaseCPOEAnalysis.__init__(self);
         self.supportRecommender = OrderSetRecommender();
+        self.nWorkers = None;
 
     def __call__(self, analysisQuery, conn=None):
         extConn = True;
@@ -59,6 +70,9 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
             # Start building basic recommendation query to use for testing
             recQuery = analysisQuery.baseRecQuery;
 
+            if self.nWorkers is not None and self.nWorkers > 1:
+                return self.evaluatePatientsParallel(analysisQuery, baseCountByItemId, self.nWorkers, conn=conn);
+
             # Start building results data
             resultsStatDataList = list();
             progress = ProgressDots(50,1,"Patients");
@@ -66,23 +80,8 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
             # Query for all of the order / item data for the test patients.  Load one patient's data at a time
             preparer = PreparePatientItems();
             for patientItemData in preparer.loadPatientItemData(analysisQuery, conn=conn):
-                patientId = patientItemData["patient_id"];
-
-                analysisResults = \
-                    self.analyzePatientItems \
-                    (   patientItemData,
-                        analysisQuery,
-                        recQuery,
-                        patientId,
-                        recommender,
-                        preparer,
-                        conn=conn
-                    );
-
-                if analysisResults is not None:
-                    (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
-                    # Start aggregating and calculating result stats
-                    resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, baseCountByItemId, recQuery, recommendedData );
+                resultsStatData = self.evaluatePatient(patientItemData, analysisQuery, recQuery, recommender, preparer, baseCountByItemId, conn=conn);
+                if resultsStatData is not None:
                     if "baseItemId" in patientItemData:
                         analysisQuery.baseItemId = patientItemData["baseItemId"]; # Record something here, so know to report back in result headers
                     resultsStatDataList.append(resultsStatData);
@@ -97,6 +96,136 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
                 conn.close();
 
 
+    def evaluatePatient(self, patientItemData, analysisQuery, recQuery, recommender, preparer, baseCountByItemId, conn):
+        """Run the recommender for one test patient record from PreparePatientItems
+        and return the calculateResultStats comparing the recommendations to the patient's verify items,
+        or None if the record has no query / verify data to evaluate.
+        """
+        patientId = patientItemData["patient_id"];
+
+        analysisResults = \
+            self.analyzePatientItems \
+            (   patientItemData,
+                analysisQuery,
+                recQuery,
+                patientId,
+                recommender,
+                preparer,
+                conn=conn
+            );
+
+        if analysisResults is None:
+            return None;
+        (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
+        # Start aggregating and calculating result stats
+        return self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, baseCountByItemId, recQuery, recommendedData );
+
+    def evaluatePatientsParallel(self, analysisQuery, baseCountByItemId, nWorkers, conn):
+        """Parallel version of the evaluation loop in __call__.
+        This (parent) process streams the test patient records from PreparePatientItems.loadPatientItemData
+        (whether from the database or a prepared file) onto a bounded task queue,
+        tagged with their position in the stream.  Each of nWorkers forked processes
+        (see evaluatePatientsWorker) keeps its own copy of the recommender, with any model data cache
+        it accrues staying warm across all the patients it evaluates, and its own DB connection.
+        Result stats are collected back and returned in the original stream order,
+        so output is the same as a serial run.
+        """
+        # Bounded task queue, so patient records are not all loaded into memory ahead of the workers
+        taskQueue = multiprocessing.Queue(nWorkers*PATIENTS_PER_WORKER_QUEUE);
+        resultQueue = multiprocessing.Queue();
+        workers = list();
+        doneWorkers = set();
+        resultsStatDataByIndex = dict();
+        progress = ProgressDots(50,1,"Patients");
+        try:
+            for iWorker in xrange(nWorkers):
+                worker = multiprocessing.Process(target=self.evaluatePatientsWorker, args=(analysisQuery, baseCountByItemId, iWorker, taskQueue, resultQueue));
+                worker.start();
+                workers.append(worker);
+
+            preparer = PreparePatientItems();
+            for iPatient, patientItemData in enumerate(preparer.loadPatientItemData(analysisQuery, conn=conn)):
+                while True:
+                    self.receiveWorkerResults(resultQueue, workers, doneWorkers, resultsStatDataByIndex, progress, timeout=None);
+                    try:
+                        taskQueue.put( (iPatient, patientItemData), timeout=WORKER_POLL_SECONDS );
+                        break;
+                    except Queue.Full:
+                        pass;
+            for worker in workers:
+                taskQueue.put(None);    # Signal workers that there are no more patients
+
+            while len(doneWorkers) < nWorkers:
+                self.receiveWorkerResults(resultQueue, workers, doneWorkers, resultsStatDataByIndex, progress, timeout=WORKER_POLL_SECONDS);
+        finally:
+            for worker in workers:
+                if worker.is_alive() and len(doneWorkers) < nWorkers:
+                    worker.terminate(); # Abandoning the run.  Don't leave workers stalled on the task queue
+                worker.join();
+
+        resultsStatDataList = list();
+        for iPatient in sorted(resultsStatDataByIndex.iterkeys()):
+            resultsStatData = resultsStatDataByIndex[iPatient];
+            if resultsStatData is not None:
+                if "baseItemId" in resultsStatData:
+                    analysisQuery.baseItemId = resultsStatData["baseItemId"]; # Record something here, so know to report back in result headers
+                resultsStatDataList.append(resultsStatData);
+        return resultsStatDataList;
+
+    def receiveWorkerResults(self, resultQueue, workers, doneWorkers, resultsStatDataByIndex, progress, timeout):
+        """Collect any (iWorker, messageType, message) results from the evaluation workers into resultsStatDataByIndex,
+        waiting up to timeout seconds for the first one (or not at all if timeout is None).
+        Raise an exception if any worker has failed.
+        """
+        try:
+            if timeout is None:
+                message = resultQueue.get_nowait();
+            else:
+                message = resultQueue.get(timeout=timeout);
+        except Queue.Empty:
+            for (iWorker, worker) in enumerate(workers):
+                if iWorker not in doneWorkers and not worker.is_alive():
+                    raise Exception("Recommendation analysis worker %d exited (code %s) without completing" % (iWorker, worker.exitcode) );
+            return;
+
+        while message is not None:
+            (iWorker, messageType, result) = message;
+            if messageType == "error":
+                raise Exception("Recommendation analysis worker %d failed:\n%s" % (iWorker, result) );
+            elif messageType == "done":
+                doneWorkers.add(iWorker);
+            else:   # "result"
+                (iPatient, resultsStatData) = result;
+                resultsStatDataByIndex[iPatient] = resultsStatData;
+                progress.Update();
+            try:
+                message = resultQueue.get_nowait();
+            except Queue.Empty:
+                message = None;
+
+    def evaluatePatientsWorker(self, analysisQuery, baseCountByItemId, iWorker, taskQueue, resultQueue):
+        """Worker process body for evaluatePatientsParallel.
+        Evaluate (iPatient, patientItemData) tasks from the taskQueue until receiving None,
+        putting (iWorker, "result", (iPatient, resultsStatData)) messages on the resultQueue,
+        then (iWorker, "done", None) (or (iWorker, "error", traceback) on failure).
+        """
+        try:
+            conn = self.connFactory.connection();
+            try:
+                preparer = PreparePatientItems();
+                preparer.loadCategoryIdByItemId(conn=conn);
+                task = taskQueue.get();
+                while task is not None:
+                    (iPatient, patientItemData) = task;
+                    resultsStatData = self.evaluatePatient(patientItemData, analysisQuery, analysisQuery.baseRecQuery, analysisQuery.recommender, preparer, baseCountByItemId, conn=conn);
+                    resultQueue.put( (iWorker, "result", (iPatient, resultsStatData)) );
+                    task = taskQueue.get();
+            finally:
+                conn.close();
+            resultQueue.put( (iWorker, "done", None) );
+        except Exception:
+            resultQueue.put( (iWorker, "error", traceback.format_exc()) );
+
     def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender, preparer, conn):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
@@ -344,16 +473,20 @@ class RecommendationClassificationAnalysis(BaseCPOEAnalysis):
         parser.add_option("-a", "--aggregationMethod",  dest="aggregationMethod",  help="Aggregation method to use for recommendations based off multiple query items.  Options: %s." % list(AGGREGATOR_OPTIONS) );
         parser.add_option("-p", "--countPrefix",  dest="countPrefix",  help="Prefix for how to do counts.  Blank for default item counting allowing repeats, otherwise ignore repeats for patient_ or encounter_");
         parser.add_option("-m", "--maxRecommendedId",  dest="maxRecommendedId",  help="Specify a maximum ID value to accept for recommended items.  More used to limit output in test cases");
+        parser.add_option("-w", "--nWorkers",  dest="nWorkers",  help="If provided, evaluate the test patients across this many parallel worker processes.  Results are reported in the same order as a serial run.");
 
         (options, args) = parser.parse_args(argv[1:])
 
         log.info("Starting: "+str.join(" ", argv))
         timer = time.time();
         if len(args) >= 1:
+            if options.nWorkers is not None:
+                self.nWorkers = int(options.nWorkers);
+
             # Parse out the query parameters
             query = AnalysisQuery();
             query.recommender = RECOMMENDER_CLASS_BY_NAME[options.recommender]();
-            query.recommender.dataManager.dataCache = dict();   # Use a dataCache to facilitate repeat queries
+            query.recommender.dataManager.dataCache = DataCache();   # Use a dataCache to facilitate repeat queries
 
             if options.preparedPatientItemFile:
                 # Don't reconstruct validation data through database, just read off validation file
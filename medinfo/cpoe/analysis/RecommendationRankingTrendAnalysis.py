@@ -22,6 +22,7 @@ from cStringIO import StringIO;
 from datetime import timedelta;
 from math import sqrt;
 from medinfo.common.Util import stdOpen, ProgressDots;
+from medinfo.common.DataCache import DataCache;
 from medinfo.db.ResultsFormatter import TextResultsFormatter;
 from medinfo.db import DBUtil;
 from medinfo.db.Model import SQLQuery, RowItemModel;
@@ -262,7 +263,7 @@ class RecommendationRankingTrendAnalysis(BaseCPOEAnalysis):
             # Parse out the query parameters
             query = AnalysisQuery();
             query.recommender = RECOMMENDER_CLASS_BY_NAME[options.recommender]();
-            query.recommender.dataManager.dataCache = dict();   # Use a local cahce to speed up repeat queries
+            query.recommender.dataManager.dataCache = DataCache();   # Use a local cahce to speed up repeat queries
 
             patientIdsParam = args[0];
             try:
@@ -6,6 +6,7 @@ and evaluate using RecommendationClassificationAnalysis framework.
 
 import sys, os
 import time;
+import copy;
 import json;
 from optparse import OptionParser
 from cStringIO import StringIO;
@@ -33,6 +34,7 @@ DEFAULT_TOPIC_ITEM_COUNT = 1000; # When using or printing out topic information,
 DEFAULT_RECOMMENDED_ITEM_COUNT = 10;    # When doing validation calculations, number of items to recommend when calculating precision and recall
 DEFAULT_MIN_TOPIC_WEIGHT = 0.001; # When using topic models, ignore topics that contribute less than this score to avoid wasting time on low value items
 DEFAULT_SORT_FIELD = "totalItemWeight";
+PATIENTS_PER_BATCH = 100;   # Number of test patients to run recommender queries for together in one TopicModelRecommender.recommendBatch
 
 class TopicModelAnalysis(RecommendationClassificationAnalysis):
     def __init__(self):
@@ -50,35 +52,59 @@ class TopicModelAnalysis(RecommendationClassificationAnalysis):
             id2id[id] = id;
         analysisQuery.recommender.model.id2word = id2id;
 
+        # Run recommender queries for batches of patients at a time, to infer topics and score items for all of them together
         # progress = ProgressDots(50,1,"Patients");
+        patientItemDataBatch = list();
         for patientItemData in preparer.loadPatientItemData(analysisQuery):
-            patientId = patientItemData["patient_id"];
+            if "queryItemCountById" not in patientItemData:
+                # Apparently not able to find / extract relevant data, so skip this record
+                continue;
+            patientItemDataBatch.append(patientItemData);
+            if len(patientItemDataBatch) >= PATIENTS_PER_BATCH:
+                for resultsStatData in self.analyzePatientItemsBatch(patientItemDataBatch, analysisQuery, preparer):
+                    yield resultsStatData;
+                patientItemDataBatch = list();
+            # progress.Update();
+        for resultsStatData in self.analyzePatientItemsBatch(patientItemDataBatch, analysisQuery, preparer):
+            yield resultsStatData;
+
+        # progress.PrintStatus();
+
+    def analyzePatientItemsBatch(self, patientItemDataBatch, analysisQuery, preparer):
+        """Run the recommender queries for a batch of test patients with one TopicModelRecommender.recommendBatch call,
+        then yield the result stats for each patient in order.
+        """
+        recQueries = list();
+        for patientItemData in patientItemDataBatch:
+            recQuery = copy.copy(analysisQuery.baseRecQuery);   # Separate query for each patient, but with the same base parameters
+            recQuery.queryItemIds = patientItemData["queryItemCountById"];
+            recQueries.append(recQuery);
+        recommendedDataList = analysisQuery.recommender.recommendBatch(recQueries);
+
+        for (patientItemData, recQuery, recommendedData) in zip(patientItemDataBatch, recQueries, recommendedDataList):
             analysisResults = \
                 self.analyzePatientItems \
                 (   patientItemData,
                     analysisQuery,
-                    analysisQuery.baseRecQuery,
-                    patientId,
+                    recQuery,
+                    patientItemData["patient_id"],
                     analysisQuery.recommender,
-                    preparer
+                    preparer,
+                    recommendedData
                 );
 
-            if analysisResults is not None:
-                (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
-                # Start aggregating and calculating result stats
-                resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, analysisQuery.recommender.docCountByWordId, analysisQuery.baseRecQuery, recommendedData );
-                if "baseItemId" in patientItemData:
-                    analysisQuery.baseItemId = patientItemData["baseItemId"]; # Record something here, so know to report back in result headers
-                yield resultsStatData;
-
-            # progress.Update();
-
-        # progress.PrintStatus();
+            (queryItemCountById, verifyItemCountById, recommendedItemIds, recommendedData) = analysisResults;  # Unpack results
+            # Start aggregating and calculating result stats
+            resultsStatData = self.calculateResultStats( patientItemData, queryItemCountById, verifyItemCountById, recommendedItemIds, analysisQuery.recommender.docCountByWordId, recQuery, recommendedData );
+            if "baseItemId" in patientItemData:
+                analysisQuery.baseItemId = patientItemData["baseItemId"]; # Record something here, so know to report back in result headers
+            yield resultsStatData;
 
-    def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender, preparer):
+    def analyzePatientItems(self, patientItemData, analysisQuery, recQuery, patientId, recommender, preparer, recommendedData=None):
         """Given the primary query data and clinical item list for a given test patient,
         Parse through the item list and run a query to get the top recommended IDs
-        to produce the relevant verify and recommendation item ID sets for comparison
+        to produce the relevant verify and recommendation item ID sets for comparison.
+        If recommendedData is provided (as from a recommendBatch), use that rather than running the query again.
         """
         if "queryItemCountById" not in patientItemData:
             # Apparently not able to find / extract relevant data, so skip this record
@@ -90,7 +116,8 @@ class TopicModelAnalysis(RecommendationClassificationAnalysis):
         # recQuery.limit = analysisQuery.numRecommendations;
 
         # Query for recommended orders / items
-        recommendedData = recommender( recQuery );
+        if recommendedData is None:
+            recommendedData = recommender( recQuery );
 
         # Customize number of recommendations if comparing against specific order set usage
         self.customizeNumRecommendations(patientItemData, analysisQuery, recQuery, preparer);
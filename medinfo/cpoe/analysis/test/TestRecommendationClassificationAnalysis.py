@@ -525,6 +525,33 @@ class TestRecommendationClassificationAnalysis(DBTestCase):
         self.assertEqualStatResultsTextOutput(expectedResults, textOutput, colNames);
 
 
+    def test_recommenderAnalysis_parallel(self):
+        # Evaluate several patients across worker processes, expecting output identical to a serial run
+        analysisQuery = AnalysisQuery();
+        analysisQuery.patientIds = set([-11111,-22222,-33333]);
+        analysisQuery.numQueryItems = 1;
+        analysisQuery.numVerifyItems = 1;
+        analysisQuery.numRecommendations = 3;
+        analysisQuery.recommender = ItemAssociationRecommender();
+        analysisQuery.recommender.dataManager.dataCache = dict();
+        analysisQuery.baseRecQuery = RecommenderQuery();
+        analysisQuery.baseRecQuery.maxRecommendedId = 0; # Restrict to test data
+        analysisQuery.baseRecQuery.excludeCategoryIds = analysisQuery.recommender.defaultExcludedClinicalItemCategoryIds();
+        analysisQuery.baseRecQuery.excludeItemIds = analysisQuery.recommender.defaultExcludedClinicalItemIds();
+
+        colNames = self.analyzer.resultHeaders(analysisQuery);
+
+        serialResults = self.analyzer(analysisQuery);
+        serialOutput = StringIO();
+        TextResultsFormatter(serialOutput).formatResultDicts(serialResults, colNames);
+        self.assertEqual(3, len(serialResults));
+
+        self.analyzer.nWorkers = 2;
+        parallelResults = self.analyzer(analysisQuery);
+        parallelOutput = StringIO();
+        TextResultsFormatter(parallelOutput).formatResultDicts(parallelResults, colNames);
+        self.assertEqual(serialOutput.getvalue(), parallelOutput.getvalue());
+
     def test_numRecsByOrderSet(self):
         # Designate number of recommendations indirectly via linked order set id 
 
@@ -6,6 +6,8 @@ from cStringIO import StringIO
 from datetime import datetime;
 import unittest
 
+import numpy as np;
+
 from Const import LOGGER_LEVEL, RUNNER_VERBOSITY;
 from Util import log;
 
@@ -14,6 +16,7 @@ from medinfo.db.test.Util import DBTestCase;
 from medinfo.db import DBUtil
 from medinfo.db.Model import SQLQuery, RowItemModel;
 
+from medinfo.cpoe import AssociationAnalysis as AssociationAnalysisModule;
 from medinfo.cpoe.AssociationAnalysis import AssociationAnalysis, AnalysisOptions;
 
 class TestAssociationAnalysis(DBTestCase):
@@ -236,6 +239,100 @@ class TestAssociationAnalysis(DBTestCase):
         associationStats = DBUtil.execute(associationQuery);
         self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
 
+    def test_analyzePatientItems_bulkCommit(self):
+        # Same results expected when committing via staging tables and set-based upsert queries,
+        #   with the baseline item pairs staged a few source items at a time,
+        #   and with staging tables left over on the connection from a prior failed commit
+        self.analyzer.bulkCommit = True;
+        conn = DBUtil.connection();
+        self.analyzer.createStageTables(conn);
+        conn.commit();
+        conn.close();   # Back to the connection pool for reuse
+        origBlockPairs = AssociationAnalysisModule.BASELINE_BLOCK_PAIRS;
+        AssociationAnalysisModule.BASELINE_BLOCK_PAIRS = 20;
+        try:
+            self.test_analyzePatientItems();
+        finally:
+            AssociationAnalysisModule.BASELINE_BLOCK_PAIRS = origBlockPairs;
+
+    def test_baselineItemIdPairBlocks(self):
+        # Blocks of source items, together covering every combination of the items except linked pairs (either direction)
+        itemIds = np.array([-4,-3,-2,-1]);
+        blocks = list(self.analyzer.baselineItemIdPairBlocks(itemIds, {-3: set([-1,-100])}, blockPairs=9));
+        self.assertEqual([[-4,-3],[-2,-1]], [sourceItemIds.tolist() for (sourceItemIds, itemIds1, itemIds2) in blocks]);
+        itemIdPairs = [itemIdPair for (sourceItemIds, itemIds1, itemIds2) in blocks for itemIdPair in zip(itemIds1.tolist(), itemIds2.tolist())];
+        expectedPairs = [(itemId1, itemId2) for itemId1 in itemIds.tolist() for itemId2 in itemIds.tolist() if (itemId1, itemId2) not in [(-3,-1),(-1,-3)]];
+        self.assertEqual(expectedPairs, itemIdPairs);
+
+    def test_analyzePatientItems_streamQuery(self):
+        # Same results expected when streaming the patient items through a server-side cursor
+        self.analyzer.streamQuery = True;
+        self.test_analyzePatientItems();
+
+    def test_analyzePatientItems_parallel(self):
+        # Run the association analysis sharded across worker processes, expecting the same stats as a serial run
+        associationQuery = \
+            """
+            select
+                clinical_item_id, subsequent_item_id,
+                patient_count_0, patient_count_3600, patient_count_86400, patient_count_604800,
+                patient_count_2592000, patient_count_7776000, patient_count_31536000,
+                patient_count_any,
+                patient_time_diff_sum, patient_time_diff_sum_squares
+            from
+                clinical_item_association
+            where
+                clinical_item_id < 0
+            order by
+                clinical_item_id, subsequent_item_id
+            """;
+
+        log.debug("Use incremental update, including date filters to start.");
+        analysisOptions = AnalysisOptions();
+        analysisOptions.patientIds = [-22222, -33333];
+        analysisOptions.startDate = datetime(2000,1,9);
+        analysisOptions.endDate = datetime(2000,2,11);
+        self.analyzer.analyzePatientItems( analysisOptions, nWorkers=2 );
+
+        expectedAssociationStats = \
+            [
+                [-11,-11,   1, 1, 1, 1, 1, 1, 1, 1,  0.0, 0.0],
+                [-11, -6,   1, 1, 1, 1, 1, 1, 1, 1,  0.0, 0.0],
+                [ -6,-11,   1, 1, 1, 1, 1, 1, 1, 1,  0.0, 0.0],
+                [ -6, -6,   2, 2, 2, 2, 2, 2, 2, 2,  0.0, 0.0],
+            ];
+
+        associationStats = DBUtil.execute(associationQuery);
+        self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
+
+        log.debug("Incremental update on the rest of the data, with interval commits across workers.");
+        analysisOptions = AnalysisOptions();
+        analysisOptions.patientIds = [-22222, -33333];
+        self.analyzer.associationsPerCommit = 1;
+        self.analyzer.analyzePatientItems( analysisOptions, nWorkers=2 );
+
+        expectedAssociationStats = \
+            [
+                [-11,-11,   2, 2, 2, 2, 2, 2, 2, 2,  0.0, 0.0],
+                [-11, -7,   0, 0, 0, 0, 0, 0, 0, 0,  0.0, 0.0],
+                [-11, -6,   1, 1, 1, 1, 1, 1, 1, 1,  0.0, 0.0],
+                [ -7,-11,   0, 0, 0, 1, 1, 1, 1, 1,  345600.0, 119439360000.0],
+                [ -7, -7,   1, 1, 1, 1, 1, 1, 1, 1,  0.0, 0.0],
+                [ -7, -6,   0, 0, 0, 1, 1, 1, 1, 1,  345600.0, 119439360000.0],
+
+                [ -6,-11,   1, 1, 1, 2, 2, 2, 2, 2, 172800.0, 29859840000.0],
+                [ -6, -7,   0, 0, 0, 0, 0, 0, 0, 0,  0.0, 0.0],
+                [ -6, -6,   2, 2, 2, 2, 2, 2, 2, 2,  0.0, 0.0],
+            ];
+
+        associationStats = DBUtil.execute(associationQuery);
+        self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
+
+        log.debug("Negative test case, repeating analysis should not change any results");
+        self.analyzer.analyzePatientItems( analysisOptions, nWorkers=2 );
+        associationStats = DBUtil.execute(associationQuery);
+        self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
+
     def test_analyzePatientItems(self):
         # Run the association analysis against the mock test data above and verify
         #   expected stats afterwards.
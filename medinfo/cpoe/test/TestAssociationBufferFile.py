@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Test case for respective module in application package"""
+
+import sys, os
+import tempfile;
+import unittest
+
+import numpy as np;
+
+from Const import LOGGER_LEVEL, RUNNER_VERBOSITY;
+from Util import log;
+
+from medinfo.common.test.Util import MedInfoTestCase;
+
+from medinfo.cpoe.AssociationCountBuffer import AssociationCountBuffer, packItemIdPairs, N_COLUMNS;
+from medinfo.cpoe.AssociationBufferFile import AssociationBufferFileReader, saveBufferFile, mergeBufferFiles, isBufferFile;
+
+class TestAssociationBufferFile(MedInfoTestCase):
+    def setUp(self):
+        """Prepare state for test cases"""
+        MedInfoTestCase.setUp(self);
+        self.tempDir = tempfile.mkdtemp();
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        for filename in os.listdir(self.tempDir):
+            os.remove(os.path.join(self.tempDir, filename));
+        os.rmdir(self.tempDir);
+        MedInfoTestCase.tearDown(self);
+
+    def randomCountBuffer(self, randomState, nPairs):
+        keys = packItemIdPairs(randomState.randint(-50, 0, nPairs), randomState.randint(-50, 0, nPairs));
+        counts = randomState.randint(0, 5, (nPairs, N_COLUMNS)).astype(float);
+        return AssociationCountBuffer.fromArrays(keys, counts);
+
+    def countsByKey(self, keys, counts):
+        return dict( zip(np.asarray(keys).tolist(), np.asarray(counts).tolist()) );
+
+    def test_saveLoad(self):
+        randomState = np.random.RandomState(1);
+        countBuffer = self.randomCountBuffer(randomState, 500);
+        filename = os.path.join(self.tempDir, "buffer.acb");
+        saveBufferFile(filename, countBuffer, set([-3,-1,-2]), rowsPerChunk=64);
+
+        self.assertTrue(isBufferFile(filename));
+        reader = AssociationBufferFileReader(filename);
+        self.assertEqual(len(countBuffer), len(reader));
+        self.assertEqual([-3,-2,-1], reader.analyzedPatientItemIds.tolist());
+        keys = reader.records["key"];
+        self.assertTrue(np.all(keys[1:] > keys[:-1]));  # Sorted by key
+
+        loadedBuffer = reader.toCountBuffer();
+        self.assertEqual(self.countsByKey(countBuffer.keys[:len(countBuffer)], countBuffer.countArray()), self.countsByKey(loadedBuffer.keys[:len(loadedBuffer)], loadedBuffer.countArray()));
+        self.assertEqual(countBuffer.itemIds().tolist(), reader.itemIds(rowsPerChunk=64).tolist());
+        self.assertEqual(len(countBuffer), sum(len(chunkBuffer) for chunkBuffer in reader.iterCountBuffers(rowsPerChunk=64)));
+        reader.close();
+
+        # Empty buffer
+        saveBufferFile(filename, AssociationCountBuffer());
+        reader = AssociationBufferFileReader(filename);
+        self.assertEqual(0, len(reader));
+        self.assertEqual([], reader.analyzedPatientItemIds.tolist());
+
+        # Not a buffer file
+        otherFilename = os.path.join(self.tempDir, "buffer.json");
+        ofs = open(otherFilename, "w");
+        ofs.write("{}");
+        ofs.close();
+        self.assertFalse(isBufferFile(otherFilename));
+        self.assertRaises(ValueError, AssociationBufferFileReader, otherFilename);
+
+    def test_mergeBufferFiles(self):
+        randomState = np.random.RandomState(2);
+        filenames = list();
+        expectedBuffer = AssociationCountBuffer();
+        for iFile in xrange(4):
+            countBuffer = self.randomCountBuffer(randomState, randomState.randint(0, 800));
+            expectedBuffer.merge(countBuffer);
+            filename = os.path.join(self.tempDir, "buffer.%d.acb" % iFile);
+            saveBufferFile(filename, countBuffer, [iFile, -iFile]);
+            filenames.append(filename);
+
+        mergedFilename = os.path.join(self.tempDir, "merged.acb");
+        mergeBufferFiles(filenames, mergedFilename, rowsPerChunk=37);  # Small chunks to force many merge rounds
+
+        reader = AssociationBufferFileReader(mergedFilename);
+        keys = reader.records["key"];
+        self.assertTrue(np.all(keys[1:] > keys[:-1]));
+        self.assertEqual(self.countsByKey(expectedBuffer.keys[:len(expectedBuffer)], expectedBuffer.countArray()), self.countsByKey(keys, reader.records["counts"]));
+        self.assertEqual([-3,-2,-1,0,1,2,3], reader.analyzedPatientItemIds.tolist());
+
+def suite():
+    """Returns the suite of tests to run for this test class / module.
+    Use unittest.makeSuite methods which simply extracts all of the
+    methods for the given class whose name starts with "test"
+    """
+    suite = unittest.TestSuite();
+    suite.addTest(unittest.makeSuite(TestAssociationBufferFile));
+
+    return suite;
+
+if __name__=="__main__":
+    log.setLevel(LOGGER_LEVEL)
+
+    unittest.TextTestRunner(verbosity=RUNNER_VERBOSITY).run(suite())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Test case for respective module in application package"""
+
+import sys, os
+import cPickle as pickle;
+import unittest
+
+import numpy as np;
+
+from Const import LOGGER_LEVEL, RUNNER_VERBOSITY;
+from Util import log;
+
+from medinfo.common.test.Util import MedInfoTestCase;
+
+from medinfo.cpoe.AssociationCountBuffer import AssociationCountBuffer, asAssociationCountBuffer;
+from medinfo.cpoe.AssociationCountBuffer import packItemIdPairs, unpackItemIdPairs, parseItemIdPairStr, COLUMN_INDEX_BY_NAME, N_COLUMNS;
+
+class TestAssociationCountBuffer(MedInfoTestCase):
+    def setUp(self):
+        """Prepare state for test cases"""
+        MedInfoTestCase.setUp(self);
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        MedInfoTestCase.tearDown(self);
+
+    def test_packItemIdPairs(self):
+        itemIds1 = [-12, -1, 0, 1, 3000, 2**31-1];
+        itemIds2 = [-3, 5, -2**31, 0, -7, -1];
+        keys = packItemIdPairs(itemIds1, itemIds2);
+        self.assertEqual(len(set(keys.tolist())), len(keys));  # All distinct
+        (unpackIds1, unpackIds2) = unpackItemIdPairs(keys);
+        self.assertEqual(itemIds1, unpackIds1.tolist());
+        self.assertEqual(itemIds2, unpackIds2.tolist());
+
+        self.assertEqual( (-10, -12), parseItemIdPairStr(str((-10,-12))) );
+        self.assertEqual( (10, 12), parseItemIdPairStr("(10L, 12L)") );
+
+    def test_addPairIncrement(self):
+        countBuffer = AssociationCountBuffer(capacity=1);   # Force capacity growth
+        countBuffer.addPairIncrement( (-10,-12), 7200, ["","patient_"] );
+        countBuffer.addPairIncrement( (-10,-12), 86400, [""] );
+        countBuffer.addPairIncrement( (-4,-10), 0, ["","patient_","encounter_"], deltaSecondsOptions=[0,3600] );
+        self.assertEqual(2, len(countBuffer));
+
+        expectedIncrementDataByItemIdPair = \
+            {   str((-10,-12)):
+                {   "count_7200": 1, "count_21600": 1, "count_43200": 1, "count_86400": 2, "count_172800": 2, "count_345600": 2,
+                    "count_604800": 2, "count_1209600": 2, "count_2592000": 2, "count_7776000": 2, "count_15552000": 2,
+                    "count_31536000": 2, "count_63072000": 2, "count_126144000": 2, "count_any": 2,
+                    "time_diff_sum": 93600, "time_diff_sum_squares": 7200**2+86400**2,
+                    "patient_count_7200": 1, "patient_count_21600": 1, "patient_count_43200": 1, "patient_count_86400": 1, "patient_count_172800": 1, "patient_count_345600": 1,
+                    "patient_count_604800": 1, "patient_count_1209600": 1, "patient_count_2592000": 1, "patient_count_7776000": 1, "patient_count_15552000": 1,
+                    "patient_count_31536000": 1, "patient_count_63072000": 1, "patient_count_126144000": 1, "patient_count_any": 1,
+                    "patient_time_diff_sum": 7200, "patient_time_diff_sum_squares": 7200**2,
+                },
+                str((-4,-10)):
+                {   "count_0": 1, "count_3600": 1, "count_any": 1,
+                    "patient_count_0": 1, "patient_count_3600": 1, "patient_count_any": 1,
+                    "encounter_count_0": 1, "encounter_count_3600": 1, "encounter_count_any": 1,
+                },
+            };
+        self.assertEqual(expectedIncrementDataByItemIdPair, countBuffer.toIncrementDataByItemIdPair());
+
+        # Round trip through legacy format
+        legacyBuffer = asAssociationCountBuffer(expectedIncrementDataByItemIdPair);
+        self.assertEqual(expectedIncrementDataByItemIdPair, legacyBuffer.toIncrementDataByItemIdPair());
+
+        # Round trip through pickling (as between worker processes)
+        pickledBuffer = pickle.loads(pickle.dumps(countBuffer, pickle.HIGHEST_PROTOCOL));
+        self.assertEqual(expectedIncrementDataByItemIdPair, pickledBuffer.toIncrementDataByItemIdPair());
+        pickledBuffer.addPairIncrement( (-10,-12), 0, [""] );   # Key lookups rebuilt
+        self.assertEqual(2, len(pickledBuffer));
+
+    def test_addPatientItems(self):
+        # Item -1 twice in separate encounters, item -2 in between.  Last item already analyzed.
+        itemIds = [-1, -2, -1];
+        encounterIds = [-111, -111, -112];
+        itemSeconds = [0, 3600, 7200];
+        analyzedFlags = [False, False, True];
+
+        countBuffer = AssociationCountBuffer();
+        newlyAnalyzed = countBuffer.addPatientItems(itemIds, encounterIds, itemSeconds, analyzedFlags);
+        self.assertEqual([True, True, False], newlyAnalyzed.tolist());
+
+        columns = ["count_0","count_3600","count_7200","count_any","time_diff_sum","patient_count_any","patient_time_diff_sum","encounter_count_0","encounter_count_any"];
+        expectedCountsByItemIdPair = \
+            {   (-1,-1): [1, 1, 2, 2, 7200, 1, 0, 1, 1],  # Repeat only counted once per patient. Self pair of the analyzed item not counted again
+                (-1,-2): [0, 1, 1, 1, 3600, 1, 3600, 0, 1],
+                (-2,-2): [1, 1, 1, 1, 0, 1, 0, 1, 1],
+                (-2,-1): [0, 1, 1, 1, 3600, 1, 3600, 0, 0],   # Not within a common encounter
+            };
+        countsByItemIdPair = dict();
+        for (itemIdPair, incrementData) in countBuffer.iterIncrementData():
+            countsByItemIdPair[itemIdPair] = [incrementData.get(col,0) for col in columns];
+        self.assertEqual(expectedCountsByItemIdPair, countsByItemIdPair);
+
+        # Linked items excluded, and pairs of already analyzed items not counted again
+        countBuffer = AssociationCountBuffer();
+        newlyAnalyzed = countBuffer.addPatientItems(itemIds, encounterIds, itemSeconds, [True, False, True], {-2: set([-1])}, maxBlockPairs=1);
+        self.assertEqual([False, True, False], newlyAnalyzed.tolist());
+        self.assertEqual([(-2,-2)], countBuffer.itemIdPairs());
+
+    def test_addIncrementsMergeDecay(self):
+        keys = packItemIdPairs([-1,-2,-1,-3], [-2,-1,-2,-3]);
+        increments = np.zeros((4, N_COLUMNS));
+        increments[:,COLUMN_INDEX_BY_NAME["count_any"]] = [1,2,3,4];
+
+        bufferOne = AssociationCountBuffer();
+        bufferOne.addIncrements(keys, increments);
+        self.assertEqual(3, len(bufferOne));
+
+        bufferTwo = AssociationCountBuffer();
+        bufferTwo.addPairIncrement( (-3,-3), 0, [""] );
+        bufferTwo.addPairIncrement( (-5,-1), 0, [""] );
+
+        bufferOne.merge(bufferTwo).decay(0.5);
+        self.assertEqual(4, len(bufferOne));
+
+        countAnyByItemIdPair = dict( (itemIdPair, incrementData["count_any"]) for (itemIdPair, incrementData) in bufferOne.iterIncrementData() );
+        expectedCountAnyByItemIdPair = { (-1,-2): 2.0, (-2,-1): 1.0, (-3,-3): 2.5, (-5,-1): 0.5 };
+        self.assertEqual(expectedCountAnyByItemIdPair, countAnyByItemIdPair);
+
+        bufferOne.clear();
+        self.assertEqual(0, len(bufferOne));
+        self.assertEqual([], list(bufferOne.iterIncrementData()));
+
+def suite():
+    """Returns the suite of tests to run for this test class / module.
+    Use unittest.makeSuite methods which simply extracts all of the
+    methods for the given class whose name starts with "test"
+    """
+    suite = unittest.TestSuite();
+    suite.addTest(unittest.makeSuite(TestAssociationCountBuffer));
+
+    return suite;
+
+if __name__=="__main__":
+    log.setLevel(LOGGER_LEVEL)
+
+    unittest.TextTestRunner(verbosity=RUNNER_VERBOSITY).run(suite())
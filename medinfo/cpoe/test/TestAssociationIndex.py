@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Test case for respective module in application package"""
+
+import sys, os
+import tempfile;
+import unittest
+
+from Const import LOGGER_LEVEL, RUNNER_VERBOSITY;
+from Util import log;
+
+from medinfo.common.test.Util import MedInfoTestCase;
+
+from medinfo.cpoe.AssociationIndex import AssociationIndex;
+
+class TestAssociationIndex(MedInfoTestCase):
+    def setUp(self):
+        """Prepare state for test cases"""
+        MedInfoTestCase.setUp(self);
+        self.resultTable = \
+            [   ["clinical_item_id","subsequent_item_id","count_0","count_any"],
+                [-2, -1, 1.0, 3.0],
+                [-1, -2, 0.0, 2.0],
+                [-2, -3, 5.0, 5.0],
+                [-4, -1, 1.5, 2.5],
+                [-2, -2, 7.0, 7.0],
+            ];
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        MedInfoTestCase.tearDown(self);
+
+    def test_gather(self):
+        associationIndex = AssociationIndex.fromResultTable(self.resultTable, "clinical_item_id", "subsequent_item_id");
+        self.assertEqual(5, len(associationIndex));
+
+        # Grouped by query item in the order given, retaining the original record order within each.  Unknown query items ignored
+        recordIndexes = associationIndex.recordIndexes([-2, -99, -4]);
+        expectedData = \
+            (   [-2, -2, -2, -4],
+                [-1, -3, -2, -1],
+                {"count_0": [1.0, 5.0, 7.0, 1.5], "count_any": [3.0, 5.0, 7.0, 2.5]},
+            );
+        self.assertEqualGathered(expectedData, associationIndex.gather(recordIndexes));
+
+        self.assertEqualGathered(([], [], {"count_0": [], "count_any": []}), associationIndex.gather(associationIndex.recordIndexes([-99])));
+
+        # Round trip through snapshot file
+        (fd, filename) = tempfile.mkstemp(suffix=".npz");
+        os.close(fd);
+        try:
+            associationIndex.save(filename);
+            loadedIndex = AssociationIndex.load(filename);
+        finally:
+            os.remove(filename);
+        self.assertEqualGathered(expectedData, loadedIndex.gather(loadedIndex.recordIndexes([-2, -99, -4])));
+
+    def assertEqualGathered(self, expectedData, gathered):
+        (sourceItemIds, targetItemIds, countsByCol) = gathered;
+        self.assertEqual(expectedData[0], sourceItemIds.tolist());
+        self.assertEqual(expectedData[1], targetItemIds.tolist());
+        self.assertEqual(expectedData[2], dict( (col, counts.tolist()) for (col, counts) in countsByCol.iteritems() ));
+
+def suite():
+    """Returns the suite of tests to run for this test class / module.
+    Use unittest.makeSuite methods which simply extracts all of the
+    methods for the given class whose name starts with "test"
+    """
+    suite = unittest.TestSuite();
+    suite.addTest(unittest.makeSuite(TestAssociationIndex));
+
+    return suite;
+
+if __name__=="__main__":
+    log.setLevel(LOGGER_LEVEL)
+
+    unittest.TextTestRunner(verbosity=RUNNER_VERBOSITY).run(suite())
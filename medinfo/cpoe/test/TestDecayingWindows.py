@@ -102,6 +102,7 @@ class TestDecayingWindows(DBTestCase):
 
         self.decayAnalyzer = DecayingWindows() # DecayingWindows instance to test on, *** remember to change database to medinfo_copy
         self.dataManager = DataManager();
+        self.lazyDecay = False;
 
     def tearDown(self):
         """Restore state from any setUp or test steps"""
@@ -112,6 +113,7 @@ class TestDecayingWindows(DBTestCase):
         DBUtil.execute("delete from patient_item where patient_item_id < 0");
         DBUtil.execute("delete from clinical_item where clinical_item_id < 0");
         DBUtil.execute("delete from clinical_item_category where clinical_item_category_id in (%s)" % str.join(",", self.clinicalItemCategoryIdStrList) );
+        self.dataManager.setAssociationCountScale(1.0);
 
         # Purge temporary buffer files. May not match exact name if modified for other purpose
         for filename in os.listdir("."):
@@ -294,6 +296,7 @@ class TestDecayingWindows(DBTestCase):
         decayAnalysisOptions.decay = 0.9
         decayAnalysisOptions.delta = timedelta(weeks=4)
         decayAnalysisOptions.patientIds = [-22222, -33333]
+        decayAnalysisOptions.lazyDecay = self.lazyDecay
 
         self.decayAnalyzer.decayAnalyzePatientItems (decayAnalysisOptions)
 
@@ -317,7 +320,7 @@ class TestDecayingWindows(DBTestCase):
                 [ -6, -6,   1.9, 1.9, 1.9, 1.9, 1.9, 0, 0, 1.9],
             ];
 
-        associationStats = DBUtil.execute(associationQuery)
+        associationStats = self.scaledAssociationStats(associationQuery)
         self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
 
         #DBUtil.execute("delete from clinical_item_association")
@@ -331,6 +334,7 @@ class TestDecayingWindows(DBTestCase):
         decayAnalysisOptions.decay = 0.9
         decayAnalysisOptions.delta = timedelta(weeks=4)
         decayAnalysisOptions.patientIds = [-22222, -33333]
+        decayAnalysisOptions.lazyDecay = self.lazyDecay
 
         self.decayAnalyzer.decayAnalyzePatientItems (decayAnalysisOptions)
 
@@ -361,7 +365,7 @@ class TestDecayingWindows(DBTestCase):
                 [-6L, -6L, 1.539, 1.539, 1.539, 1.539, 1.539, 0.0, 0.0, 1.539],
             ];
 
-        associationStats = DBUtil.execute(associationQuery)
+        associationStats = self.scaledAssociationStats(associationQuery)
         #for row in expectedAssociationStats:
         #    print >> sys.stderr, row;
         #print >> sys.stderr, "============"
@@ -370,6 +374,46 @@ class TestDecayingWindows(DBTestCase):
         #print >> sys.stderr, "============"
         self.assertEqualTable( expectedAssociationStats, associationStats, precision=3 );
 
+    def test_decayingWindows_lazyDecay(self):
+        # Same results expected when decay by only updating a global scale factor rather than every association record
+        self.lazyDecay = True;
+        self.test_decayingWindows();
+        self.assertAlmostEqual(0.9**4, self.dataManager.getAssociationCountScale(useCache=False));
+
+        # Denormalized item counts should also reflect the scale factor
+        self.dataManager.updateClinicalItemCounts();
+        itemCount = DBUtil.execute("select patient_count from clinical_item where clinical_item_id = -11")[0][0];
+        self.assertAlmostEqual(1.539, itemCount, 3);
+
+    def test_lazyDecay_applyScale(self):
+        # Once the scale factor gets too small, it is applied to the stored counts and reset, in one transaction
+        DBUtil.findOrInsertItem("clinical_item_association", RowItemModel({"clinical_item_id": -1, "subsequent_item_id": -3, "count_0": 10.0}) );
+        self.dataManager.setAssociationCountScale(1e-11);
+        decayAnalysisOptions = DecayAnalysisOptions();
+        decayAnalysisOptions.decay = 0.05;
+        countQuery = "select count_0 from clinical_item_association where clinical_item_id = -1 and subsequent_item_id = -3";
+
+        # Failure resetting the scale factor leaves the decayed counts uncommitted too
+        def failSetScale(scale, conn=None):
+            raise ValueError(scale);
+        self.decayAnalyzer.dataManager.setAssociationCountScale = failSetScale;
+        self.assertRaises(ValueError, self.decayAnalyzer.lazyDecay, decayAnalysisOptions);
+        self.assertEqual(10.0, DBUtil.execute(countQuery)[0][0]);
+        self.assertAlmostEqual(1e-11, self.dataManager.getAssociationCountScale(useCache=False));
+
+        del self.decayAnalyzer.dataManager.setAssociationCountScale;
+        self.decayAnalyzer.lazyDecay(decayAnalysisOptions);
+        self.assertAlmostEqual(10.0*5e-13, DBUtil.execute(countQuery)[0][0], 20);
+        self.assertEqual(1.0, self.dataManager.getAssociationCountScale(useCache=False));
+
+    def scaledAssociationStats(self, associationQuery):
+        """Query for association count stats (after the two item ID columns),
+        multiplied by any lazy decay scale factor to get the actual values.
+        (Current database value, as set by the decay's own DataManager, not any cached one.)
+        """
+        countScale = self.dataManager.getAssociationCountScale(useCache=False);
+        associationStats = DBUtil.execute(associationQuery);
+        return [list(row[:2]) + [value*countScale for value in row[2:]] for row in associationStats];
 
     def test_resetModel(self):
         associationQuery = \
@@ -2,10 +2,14 @@
 """Test case for respective module in application package"""
 
 import sys, os
+import shutil;
+import tempfile;
 from cStringIO import StringIO
 from datetime import datetime, timedelta;
 import unittest
 
+import numpy as np;
+
 from Const import LOGGER_LEVEL, RUNNER_VERBOSITY;
 from Util import log;
 
@@ -306,6 +310,38 @@ class TestItemRecommender(DBTestCase):
         recommendedData = self.recommender( query );
         self.assertEqualRecommendedData( expectedData, recommendedData, query );
 
+    def test_aggregateCountArrays(self):
+        # Matrix based aggregation should match aggregating each result individually, including for target items missing some components
+        componentCountsByTargetId = \
+            {   -4: { -2: (5.0, 10.0, 20.0, 100.0), -5: (0.0, 30.0, 20.0, 100.0), -7: (12.0, 12.0, 20.0, 100.0) },
+                -6: { -5: (3.0, 30.0, 8.0, 100.0) },
+                -8: { -2: (1.0, 10.0, 50.0, 100.0), -7: (6.0, 12.0, 50.0, 100.0) },
+            };
+        queryItemIds = [-2, -5, -7];
+        targetItemIds = sorted(componentCountsByTargetId.keys());
+
+        # Parallel arrays of component counts, by (query item row, target item column)
+        queryRows = list();
+        targetCols = list();
+        componentCounts = list();
+        for (targetCol, targetItemId) in enumerate(targetItemIds):
+            for (queryItemId, counts) in componentCountsByTargetId[targetItemId].iteritems():
+                queryRows.append(queryItemIds.index(queryItemId));
+                targetCols.append(targetCol);
+                componentCounts.append(counts);
+        countArrays = [np.array(counts) for counts in zip(*componentCounts)];
+
+        query = RecommenderQuery();
+        for aggregationMethod in ("weighted","unweighted","NaiveBayes","SerialBayes"):
+            query.aggregationMethod = aggregationMethod;
+            aggregateCounts = ItemAssociationRecommender.aggregateCountArrays(np.array(queryRows), np.array(targetCols), *(countArrays+[len(targetItemIds), query]));
+            for (targetCol, targetItemId) in enumerate(targetItemIds):
+                componentResultsById = dict( (queryItemId, dict(zip(("nAB","nA","nB","N"), counts))) for (queryItemId, counts) in componentCountsByTargetId[targetItemId].iteritems() );
+                expectedResult = {"clinical_item_id": targetItemId, "componentResultsById": componentResultsById};
+                ItemAssociationRecommender.populateAggregateCounts(expectedResult, query);
+                for (key, counts) in zip(("nAB","nA","nB","N"), aggregateCounts):
+                    self.assertAlmostEquals(expectedResult[key], counts[targetCol], 10);
+
     def assertEqualRecommendedData(self, expectedData, recommendedData, query):
         """Run assertEqualGeneral on the key components of the contents of the recommendation data.
         Don't necessarily care about the specific numbers that come out of the recommendations,
@@ -461,6 +497,10 @@ class TestItemRecommender(DBTestCase):
             # prog.update();
         # prog.printStatus();
 
+        # Lazy decay count scale is read through the cache too, rather than queried on every call
+        scaleQueries = [key for key in self.recommender.dataManager.dataCache if "data_cache" in key];
+        self.assertEqual( 1, len(scaleQueries) );
+
         # Query for subset should still yield no new query
         query.queryItemIds = set([-2]);
         newData = self.recommender( query );
@@ -490,6 +530,43 @@ class TestItemRecommender(DBTestCase):
         self.assertEqualRecommendedData( baselineData, newData, query );
         self.assertEqual( baselineQueryCount, newQueryCount );  # Expect no queries for subsets
 
+        # Updating the item counts invalidates the cached results, so expect new queries
+        self.recommender.dataManager.updateClinicalItemCounts();
+        self.assertEqual( 0, len(self.recommender.dataManager.dataCache) );
+        newData = self.recommender( query );
+        newQueryCount = self.recommender.dataManager.queryCount;
+        self.assertEqualRecommendedData( baselineData, newData, query );
+        self.assertNotEqual( baselineQueryCount, newQueryCount );
+
+    def test_associationIndexDir(self):
+        # Test that association index snapshot files are reused by new recommender instances instead of querying the database
+        query = RecommenderQuery();
+        query.countPrefix = "patient_";
+        query.queryItemIds = set([-2,-5]);
+        query.limit = 3;    # Just get top 3 ranks for simplicity
+        query.maxRecommendedId = 0; # Artificial constraint to focus only on test data
+
+        baselineData = self.recommender( query );
+
+        associationIndexDir = tempfile.mkdtemp();
+        try:
+            # First instance queries the database for the association index and saves it
+            recommender = ItemAssociationRecommender();
+            recommender.associationIndexDir = associationIndexDir;
+            newData = recommender( query );
+            baselineQueryCount = recommender.dataManager.queryCount;
+            self.assertEqualRecommendedData( baselineData, newData, query );
+            self.assertEqual( 1, len(os.listdir(associationIndexDir)) );
+
+            # New instance (empty data cache) loads it from the snapshot file instead, for one less query
+            recommender = ItemAssociationRecommender();
+            recommender.associationIndexDir = associationIndexDir;
+            newData = recommender( query );
+            self.assertEqualRecommendedData( baselineData, newData, query );
+            self.assertEqual( baselineQueryCount-1, recommender.dataManager.queryCount );
+        finally:
+            shutil.rmtree(associationIndexDir);
+
 def suite():
     """Returns the suite of tests to run for this test class / module.
     Use unittest.makeSuite methods which simply extracts all of the
@@ -335,6 +335,42 @@ class TestOrderSetRecommender(DBTestCase):
         recommendedData = self.recommender( query );
         self.assertEqualRecommendedData( expectedData, recommendedData, query );
 
+    def test_recommendBatch(self):
+        # Scoring several queries at once with sparse matrix products should match the set based reference calculations for each query
+        queries = list();
+        for (queryItemIds, excludeCategoryIds) in [ (set(), set()), (set([-2,-5,-100]), set()), (set([-100]), set([-1,-4,-5,-6])), (set([-2,-5,-100]), set([-2,-4,-5,-6])) ]:
+            query = RecommenderQuery();
+            query.sortField = "tf";
+            query.maxRecommendedId = 0; # Artificial constraint to focus only on test data
+            query.queryItemIds = queryItemIds;
+            query.excludeCategoryIds = excludeCategoryIds;
+            queries.append(query);
+
+        recommendedDataList = self.recommender.recommendBatch(queries);
+        self.assertEqual(len(queries), len(recommendedDataList));
+
+        itemIdsByOrderSetId = self.recommender.itemIdsByOrderSetId;
+        orderSetIdsByItemId = self.recommender.orderSetIdsByItemId;
+        numItemsInAnyOrderSet = float(len(orderSetIdsByItemId));
+        headers = ["clinical_item_id","score","tfidf"];
+        for query, batchRecommendedData in zip(queries, recommendedDataList):
+            # P(item|queryItems) = Sum_j[ P(item|OrderSet_j)*P(OrderSet_j|queryItems) ], scaled by item order set frequency for TF*IDF
+            weightByOrderSetId = self.recommender.estimateOrderSetWeights(query.queryItemIds, itemIdsByOrderSetId, orderSetIdsByItemId);
+            expectedData = list();
+            for itemId in orderSetIdsByItemId.iterkeys():
+                if self.recommender.isItemRecommendable(itemId, query.queryItemIds, query, self.recommender.categoryIdByItemId):
+                    tf = sum( self.recommender.itemOrderSetWeight(itemId, orderSetId, itemIdsByOrderSetId) * weight for (orderSetId, weight) in weightByOrderSetId.iteritems() );
+                    tfidf = tf * numItemsInAnyOrderSet / len(orderSetIdsByItemId[itemId]);
+                    expectedData.append( RowItemModel([itemId, tf, tfidf], headers) );
+            expectedData.sort( key=lambda itemModel: (itemModel["score"], itemModel["clinical_item_id"]), reverse=True );
+            self.assertEqualRecommendedData( expectedData, batchRecommendedData, query );
+
+            for itemModel in batchRecommendedData:
+                for (orderSetId, weight) in weightByOrderSetId.iteritems():
+                    self.assertAlmostEquals(weight, itemModel["weightByOrderSetId"][orderSetId], 10);
+
+        self.assertEqual([], self.recommender.recommendBatch([]));
+
     def assertEqualRecommendedData(self, expectedData, recommendedData, query):
         """Run assertEqualGeneral on the key components of the contents of the recommendation data.
         Don't necessarily care about the specific numbers that come out of the recommendations,
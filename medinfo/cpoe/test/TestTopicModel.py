@@ -6,6 +6,8 @@ from cStringIO import StringIO
 from datetime import datetime;
 import unittest
 
+import numpy as np;
+
 from Const import RUNNER_VERBOSITY;
 from Util import log;
 
@@ -17,6 +19,8 @@ from medinfo.db.Model import SQLQuery, RowItemModel;
 from medinfo.db.ResultsFormatter import TabDictReader;
 
 from medinfo.cpoe.TopicModel import TopicModel;
+from medinfo.cpoe.TopicModelRecommender import TopicModelRecommender;
+from medinfo.cpoe.ItemRecommender import RecommenderQuery;
 
 TEST_FILE_PREFIX = "TestTopicModel.model";
 ITEMS_PER_TOPIC = 5;
@@ -120,6 +124,69 @@ class TestTopicModel(DBTestCase):
                 {1:3, 2:3, 3:3, 4:4, 5:3, None:5, 9:3, 10:3, 11:2, 12:4, 13:4, 14:1, 15:2, 16:4, 8:3}
         self.assertExpectedTopItems( expectedDocCountByWordId, model, topTopicFile );
 
+    def test_topicModel_corpusFile(self):
+        # Serialize the corpus once, then train (in parallel) from it without re-reading the input
+        corpusFilename = TEST_FILE_PREFIX+".corpus.mm";
+        docCountByWordId = self.instance.serializeCorpus(self.instance.jsonGeneratorFromFile(StringIO(self.inputBOWFileStr)), corpusFilename);
+        expectedDocCountByWordId = \
+                {1:3, 2:3, 3:3, 4:4, 5:3, None:5, 9:3, 10:3, 11:2, 12:4, 13:4, 14:1, 15:2, 16:4, 8:3}
+        self.assertEqual(expectedDocCountByWordId, docCountByWordId);
+        (corpus, docCountByWordId) = self.instance.loadCorpus(corpusFilename);
+        self.assertEqual(expectedDocCountByWordId, docCountByWordId);
+        self.assertEqual(5, len(corpus));
+
+        sys.stdin = StringIO("");   # Input should not be read with existing corpus file
+        subargv = ["TopicModel", "-n", "3", "-w", "2", "-c", corpusFilename, "-i",str(ITEMS_PER_TOPIC), "-", TEST_FILE_PREFIX];
+        self.instance.main(subargv);
+        model = self.instance.loadModel(TEST_FILE_PREFIX);
+        self.assertEqual(3, model.num_topics);
+        self.assertExpectedTopItems( expectedDocCountByWordId, model, open(self.instance.topTopicFilename(TEST_FILE_PREFIX)) );
+
+        # Re-train with a different number of topics from the same corpus file
+        subargv = ["TopicModel", "-n", "2", "-c", corpusFilename, "-i",str(ITEMS_PER_TOPIC), "-", TEST_FILE_PREFIX];
+        self.instance.main(subargv);
+        model = self.instance.loadModel(TEST_FILE_PREFIX);
+        self.assertEqual(2, model.num_topics);
+        self.assertExpectedTopItems( expectedDocCountByWordId, model, open(self.instance.topTopicFilename(TEST_FILE_PREFIX)) );
+
+    def test_recommendBatch(self):
+        # Scoring several queries at once through the topic x item weight matrix should match one at a time
+        self.instance.randomState = np.random.RandomState(10);
+        (model, docCountByWordId) = self.instance.buildModel(self.instance.jsonGeneratorFromFile(StringIO(self.inputBOWFileStr)), 3);
+        recommender = TopicModelRecommender(model, docCountByWordId);
+
+        queries = list();
+        for (queryItemIds, sortField) in [ ([1,4], "tf"), ([9,12,13], "tf"), ([5], "lift"), ([], "tf") ]:
+            query = RecommenderQuery();
+            query.queryItemIds = queryItemIds;
+            query.sortField = sortField;
+            query.itemsPerCluster = ITEMS_PER_TOPIC;
+            query.minClusterWeight = 0.0;
+            queries.append(query);
+
+        # Same random initialization of the topic inference for each run
+        model.random_state = np.random.RandomState(1);
+        expectedDataList = [recommender(query) for query in queries];
+        model.random_state = np.random.RandomState(1);
+        recommendedDataList = recommender.recommendBatch(queries);
+
+        self.assertEqual(len(queries), len(recommendedDataList));
+        for (expectedData, recommendedData) in zip(expectedDataList, recommendedDataList):
+            self.assertTrue(len(recommendedData) > 0);
+            self.assertEqual(len(expectedData), len(recommendedData));
+            expectedScoreByItemId = dict( (itemModel["clinical_item_id"], itemModel["score"]) for itemModel in expectedData );
+            for (iItem, itemModel) in enumerate(recommendedData):
+                self.assertAlmostEqual(expectedScoreByItemId[itemModel["clinical_item_id"]], itemModel["score"], places=5);
+                if iItem > 0:
+                    self.assertTrue(itemModel["score"] <= recommendedData[iItem-1]["score"]);
+
+        # Top items only
+        model.random_state = np.random.RandomState(1);
+        topDataList = recommender.recommendBatch(queries, limit=2);
+        for (recommendedData, topData) in zip(recommendedDataList, topDataList):
+            self.assertEqual(2, len(topData));
+            self.assertEqual([itemModel["score"] for itemModel in recommendedData[:2]], [itemModel["score"] for itemModel in topData]);
+
     def assertExpectedTopItems(self, expectedDocCountByWordId, model, topTopicFile):
         # With randomized optimization algorithm, cannot depend on stable
         # Test results with each run.  Instead make sure internally consistent,
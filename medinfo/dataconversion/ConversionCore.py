@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""Shared core for the STRIDE / STARR data conversion modules,
+to resolve clinical item keys and write patient_items in batches,
+rather than with several database round trips per source row
+(DBUtil.findOrInsertItem for the clinical_item_category and clinical_item,
+then an insert and identity query for the patient_item).
+"""
+
+from medinfo.db import DBUtil;
+from medinfo.db.Model import RowItemModel;
+
+from Util import log;
+from Const import TEMPLATE_MEDICATION_PREFIX;
+
+ROWS_PER_FLUSH = 10000;  # Patient items to buffer in a PatientItemWriter before writing them to the database
+
+CATEGORY_KEY_COLS = ("source_table","description");
+CLINICAL_ITEM_KEY_COLS = ("clinical_item_category_id","external_id","name","description");
+CLINICAL_ITEM_IDENTITY_COLS = ("clinical_item_category_id","external_id","name");  # For converters that simplify the description of an item as they go
+PATIENT_ITEM_KEY_COLS = ("patient_id","clinical_item_id","item_date");   # Unique composite key of patient_item
+COLLECTION_LINK_KEY_COLS = ("patient_item_id","item_collection_item_id");
+
+def itemKey(itemModel, keyColNames):
+    return tuple([itemModel.get(col) for col in keyColNames]);
+
+def descriptionRank(description):
+    """Sort key to prefer between different descriptions of the same clinical item.
+    Anything over a generic template description, then the shortest, then alphabetical,
+    so the preferred one of a set of descriptions does not depend on the order they were found in.
+    """
+    return (description.startswith(TEMPLATE_MEDICATION_PREFIX), len(description), description);
+
+class ClinicalItemKeyCache:
+    """In-memory cache of clinical_item_category and clinical_item IDs,
+    keyed by the same column values that DBUtil.findOrInsertItem would search by.
+
+    Prewarmed with one query for all existing categories (and their clinical items) of a source table.
+    New clinical items are queued until resolvePendingItems, which inserts them in
+    batched insert ... returning queries, in the order they were first added.
+
+    Clinical items are keyed by keyCols.  Converters that simplify an item's description as they go (preferDescription)
+    should use CLINICAL_ITEM_IDENTITY_COLS, so items found with a different description are still the same item.
+
+    If collectOnly, nothing is inserted or updated.  New categories get provisional IDs (their key values)
+    and new clinical items just stay pending, for newItemRows to report, so a pre-pass over the source data
+    can find all of the new items (and preferred descriptions) to write in one deterministic batch (insertNewItemRows).
+    """
+    def __init__(self, collectOnly=False, keyCols=CLINICAL_ITEM_KEY_COLS):
+        self.collectOnly = collectOnly;
+        self.keyCols = keyCols;
+        self.categoryIdByKey = dict();
+        self.categoryKeyById = dict();
+        self.clinicalItemIdByKey = dict();
+        self.descriptionById = dict();  # Current description of existing clinical items
+        self.describedItemsById = dict();   # Existing clinical item models with a preferred description not yet written, when collectOnly
+        self.prewarmedSourceTables = set();
+
+        self.newCategoryByKey = dict(); # Category models with provisional IDs, when collectOnly
+
+        self.pendingItemKeys = list();  # Keys of new clinical items not yet inserted, in the order added
+        self.pendingItemsByKey = dict();    # Clinical item models waiting for each of those keys
+
+    def prewarm(self, sourceTable, conn):
+        """Load the IDs of all existing categories for the sourceTable and their clinical items in one query.
+        If there are duplicate records with the same key values, use the first (lowest) ID.
+        """
+        if sourceTable in self.prewarmedSourceTables:
+            return;
+        query = \
+            """select cic.clinical_item_category_id, cic.source_table, cic.description,
+                ci.clinical_item_id, ci.external_id, ci.name, ci.description
+            from clinical_item_category as cic
+                left join clinical_item as ci on cic.clinical_item_category_id = ci.clinical_item_category_id
+            where cic.source_table = %s
+            order by cic.clinical_item_category_id, ci.clinical_item_id
+            """ % DBUtil.SQL_PLACEHOLDER;
+        results = DBUtil.execute(query, (sourceTable,), conn=conn);
+        for row in results:
+            categoryKey = tuple(row[1:3]);
+            if categoryKey not in self.categoryIdByKey:
+                self.categoryIdByKey[categoryKey] = row[0];
+                self.categoryKeyById[row[0]] = categoryKey;
+            if row[3] is not None:
+                clinicalItemKey = itemKey(RowItemModel((row[0],) + tuple(row[4:7]), CLINICAL_ITEM_KEY_COLS), self.keyCols);
+                if clinicalItemKey not in self.clinicalItemIdByKey:
+                    self.clinicalItemIdByKey[clinicalItemKey] = row[3];
+                    self.descriptionById[row[3]] = row[6];
+        log.debug("Prewarmed %d clinical items for %s" % (len(self.clinicalItemIdByKey), sourceTable) );
+        self.prewarmedSourceTables.add(sourceTable);
+
+    def categoryId(self, category, conn):
+        """Return the ID of the clinical_item_category matching the category model, inserting a new one if needed.
+        Prewarms the cache for the category's source table on first use.
+        """
+        self.prewarm(category["source_table"], conn);
+        categoryKey = itemKey(category, CATEGORY_KEY_COLS);
+        if categoryKey not in self.categoryIdByKey:
+            columnNames = [col for col in category.keys() if col != "clinical_item_category_id"];
+            if self.collectOnly:
+                self.categoryIdByKey[categoryKey] = categoryKey;    # Provisional ID, can't match a real (integer) one
+                self.newCategoryByKey[categoryKey] = dict([(col, category[col]) for col in columnNames]);
+            else:
+                (self.categoryIdByKey[categoryKey],) = DBUtil.insertRowsReturningIds("clinical_item_category", columnNames, [[category[col] for col in columnNames]], conn);
+                conn.commit();
+            self.categoryKeyById[self.categoryIdByKey[categoryKey]] = categoryKey;
+        return self.categoryIdByKey[categoryKey];
+
+    def addClinicalItem(self, clinicalItem):
+        """Set the clinical_item_id of the clinicalItem model (with a clinical_item_category_id from categoryId).
+        If an existing clinical item, also set its current description (which may differ, if not one of the keyCols).
+        If not, set to None for now, and queue the item to be inserted
+        and have its ID set on the next resolvePendingItems.
+        """
+        clinicalItemKey = itemKey(clinicalItem, self.keyCols);
+        if clinicalItemKey in self.clinicalItemIdByKey:
+            clinicalItem["clinical_item_id"] = self.clinicalItemIdByKey[clinicalItemKey];
+            if clinicalItem["clinical_item_id"] in self.descriptionById:
+                clinicalItem["description"] = self.descriptionById[clinicalItem["clinical_item_id"]];
+        else:
+            clinicalItem["clinical_item_id"] = None;
+            if clinicalItemKey not in self.pendingItemsByKey:
+                self.pendingItemKeys.append(clinicalItemKey);
+                self.pendingItemsByKey[clinicalItemKey] = list();
+            self.pendingItemsByKey[clinicalItemKey].append(clinicalItem);
+
+    def preferDescription(self, clinicalItem, description, conn):
+        """Replace the description of the clinicalItem model (previously added) if the given one is preferred (see descriptionRank).
+        Updates the database record if an existing item, unless collectOnly, in which case newItemRows reports it instead.
+        Pending new items will just be inserted with their preferred description.
+        """
+        clinicalItems = self.pendingItemsByKey.get(itemKey(clinicalItem, self.keyCols), [clinicalItem]);
+        if descriptionRank(description) >= descriptionRank(clinicalItems[0]["description"]):
+            return;
+        for item in clinicalItems:
+            item["description"] = description;
+        clinicalItemId = clinicalItem.get("clinical_item_id");
+        if clinicalItemId is not None:
+            self.descriptionById[clinicalItemId] = description;
+            if self.collectOnly:
+                self.describedItemsById[clinicalItemId] = clinicalItem;
+            else:
+                DBUtil.updateRow("clinical_item", RowItemModel({"description": description}), clinicalItemId, conn=conn);
+
+    def resolvePendingItems(self, conn):
+        """Insert all of the pending new clinical items, in batches, and set their IDs into the queued models"""
+        if len(self.pendingItemKeys) < 1:
+            return;
+        if self.collectOnly:
+            raise ValueError("Cannot insert clinical items with a collectOnly key cache");
+        # Batch together items with the same columns to insert
+        keysByColumnNames = dict();
+        columnNamesList = list();
+        for clinicalItemKey in self.pendingItemKeys:
+            columnNames = tuple(sorted([col for col in self.pendingItemsByKey[clinicalItemKey][0].keys() if col != "clinical_item_id"]));
+            if columnNames not in keysByColumnNames:
+                keysByColumnNames[columnNames] = list();
+                columnNamesList.append(columnNames);
+            keysByColumnNames[columnNames].append(clinicalItemKey);
+
+        for columnNames in columnNamesList:
+            clinicalItemKeys = keysByColumnNames[columnNames];
+            rows = [[self.pendingItemsByKey[clinicalItemKey][0][col] for col in columnNames] for clinicalItemKey in clinicalItemKeys];
+            clinicalItemIds = DBUtil.insertRowsReturningIds("clinical_item", columnNames, rows, conn);
+            for (clinicalItemKey, clinicalItemId) in zip(clinicalItemKeys, clinicalItemIds):
+                self.clinicalItemIdByKey[clinicalItemKey] = clinicalItemId;
+                self.descriptionById[clinicalItemId] = self.pendingItemsByKey[clinicalItemKey][0].get("description");
+                for clinicalItem in self.pendingItemsByKey[clinicalItemKey]:
+                    clinicalItem["clinical_item_id"] = clinicalItemId;
+        conn.commit();
+        log.debug("Inserted %d new clinical items" % len(self.pendingItemKeys) );
+
+        self.pendingItemKeys = list();
+        self.pendingItemsByKey.clear();
+
+    def newItemRows(self):
+        """Return (categoryRows, clinicalItemRows), lists of dictionaries with the column values
+        of the new categories and pending new clinical items found so far,
+        plus existing clinical items with a preferred description (see preferDescription).
+        Since new categories only have provisional IDs, the clinical_item_category_id of each clinical item row
+        is replaced by its category's key values (CATEGORY_KEY_COLS).
+        """
+        categoryRows = self.newCategoryByKey.values();
+        clinicalItems = [self.pendingItemsByKey[clinicalItemKey][0] for clinicalItemKey in self.pendingItemKeys];
+        clinicalItems.extend(self.describedItemsById.values());
+        clinicalItemRows = list();
+        for clinicalItem in clinicalItems:
+            clinicalItemRow = dict(clinicalItem);
+            clinicalItemRow.pop("clinical_item_id", None);
+            clinicalItemRow["clinical_item_category_id"] = self.categoryKeyById[clinicalItemRow["clinical_item_category_id"]];
+            clinicalItemRows.append(clinicalItemRow);
+        return (categoryRows, clinicalItemRows);
+
+    def insertNewItemRows(self, categoryRows, clinicalItemRows, conn):
+        """Insert categories and clinical items, as collected by newItemRows (possibly from several caches with the same keyCols),
+        skipping any that already exist or are repeated.  Inserted in sorted order of their key values
+        (rather than in order found), so the same source data always produces the same IDs.
+        Items repeated (or existing) with different descriptions get the preferred one (see preferDescription),
+        regardless of the order the rows are in.
+        """
+        for categoryRow in sorted(categoryRows, key=lambda row: itemKey(row, CATEGORY_KEY_COLS)):
+            self.categoryId(RowItemModel(categoryRow), conn);
+        for clinicalItemRow in clinicalItemRows:
+            self.prewarm(clinicalItemRow["clinical_item_category_id"][0], conn);   # Source table of the category key
+
+        # Sort by category key values, rather than (possibly new) IDs
+        for clinicalItemRow in sorted(clinicalItemRows, key=lambda row: itemKey(row, self.keyCols)):
+            clinicalItem = RowItemModel(clinicalItemRow);
+            clinicalItem["clinical_item_category_id"] = self.categoryIdByKey[clinicalItemRow["clinical_item_category_id"]];
+            self.addClinicalItem(clinicalItem);
+            self.preferDescription(clinicalItem, clinicalItemRow["description"], conn);
+        self.resolvePendingItems(conn);
+        conn.commit();
+
+    def clinicalItemId(self, clinicalItem, conn):
+        """Return the ID of the clinicalItem model, first inserting any pending new items if it is one of them"""
+        if clinicalItem.get("clinical_item_id") is None:
+            self.addClinicalItem(clinicalItem);
+            self.resolvePendingItems(conn);
+        return clinicalItem["clinical_item_id"];
+
+class PatientItemWriter:
+    """Buffer patient_item records (and any patient_item_collection_links to them) to write in bulk
+    (see DBUtil.bulkInsertNewRows), after first resolving any pending clinical items they reference.
+    Patient items duplicating existing ones (by patient, clinical item and item date) are skipped set-wise,
+    rather than by catching an integrity error for each row.
+    """
+    def __init__(self, keyCache, retrieveIds=False, rowsPerFlush=ROWS_PER_FLUSH):
+        """Initialize with the ClinicalItemKeyCache to resolve clinical items with.
+        If retrieveIds, then set the patient_item_id (of the new or existing record) into each patient item model on flush.
+        Those with collection links to write always will.
+        """
+        self.keyCache = keyCache;
+        self.retrieveIds = retrieveIds;
+        self.rowsPerFlush = rowsPerFlush;
+
+        self.patientItemPairs = list(); # (patientItem, clinicalItem) model pairs to write
+        self.collectionLinkPairs = list();  # (patientItem, collectionItem) model pairs to write
+
+    def addPatientItem(self, patientItem, clinicalItem, conn):
+        """Buffer the patientItem model to write, with its clinical_item_id to be taken from the clinicalItem model.
+        Flushes the buffer to the database via the conn once full.
+        """
+        self.patientItemPairs.append( (patientItem, clinicalItem) );
+        if len(self.patientItemPairs) >= self.rowsPerFlush:
+            self.flush(conn);
+
+    def addCollectionLink(self, patientItem, collectionItem):
+        """Buffer a patient_item_collection_link to write, for a patientItem model previously added"""
+        self.collectionLinkPairs.append( (patientItem, collectionItem) );
+
+    def flush(self, conn):
+        """Write all of the buffered records to the database and commit.
+        If the bulk insert fails (e.g., a row with a null item_date), write them one at a time instead,
+        just logging the rows with errors like the original conversion code.
+        """
+        self.keyCache.resolvePendingItems(conn);
+        for (patientItem, clinicalItem) in self.patientItemPairs:
+            patientItem["clinical_item_id"] = clinicalItem["clinical_item_id"];
+        try:
+            self.bulkInsertPatientItems(conn);
+            self.bulkInsertCollectionLinks(conn);
+            conn.commit();
+        except conn.DatabaseError, err:
+            log.info(err);
+            conn.rollback();
+            self.insertRowByRow(conn);
+        self.patientItemPairs = list();
+        self.collectionLinkPairs = list();
+
+    def bulkInsertPatientItems(self, conn):
+        if len(self.patientItemPairs) < 1:
+            return;
+        columnNames = [col for col in self.patientItemPairs[0][0].keys() if col != "patient_item_id"];
+        rows = [[patientItem.get(col) for col in columnNames] for (patientItem, clinicalItem) in self.patientItemPairs];
+        retrieveCol = None;
+        if self.retrieveIds or len(self.collectionLinkPairs) > 0:
+            retrieveCol = "patient_item_id";
+        patientItemIds = DBUtil.bulkInsertNewRows("patient_item", columnNames, PATIENT_ITEM_KEY_COLS, rows, conn, retrieveCol=retrieveCol);
+        if patientItemIds is not None:
+            for ((patientItem, clinicalItem), patientItemId) in zip(self.patientItemPairs, patientItemIds):
+                patientItem["patient_item_id"] = patientItemId;
+
+    def bulkInsertCollectionLinks(self, conn):
+        if len(self.collectionLinkPairs) < 1:
+            return;
+        rows = [(patientItem["patient_item_id"], collectionItem["item_collection_item_id"]) for (patientItem, collectionItem) in self.collectionLinkPairs];
+        DBUtil.bulkInsertNewRows("patient_item_collection_link", COLLECTION_LINK_KEY_COLS, COLLECTION_LINK_KEY_COLS, rows, conn);
+
+    def insertRowByRow(self, conn):
+        for (patientItem, clinicalItem) in self.patientItemPairs:
+            searchItem = RowItemModel( [patientItem.get(col) for col in PATIENT_ITEM_KEY_COLS], PATIENT_ITEM_KEY_COLS );
+            insertItem = RowItemModel( dict([(col, value) for (col, value) in patientItem.iteritems() if col != "patient_item_id"]) );
+            try:
+                (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchItem, insertItem, conn=conn);
+            except conn.DatabaseError, err:
+                # Just note the problem row and continue to insert whatever else is possible
+                log.info(err);
+                conn.rollback();
+        for (patientItem, collectionItem) in self.collectionLinkPairs:
+            if patientItem.get("patient_item_id") is None:
+                continue;
+            linkItem = RowItemModel( [patientItem["patient_item_id"], collectionItem["item_collection_item_id"]], COLLECTION_LINK_KEY_COLS );
+            try:
+                DBUtil.findOrInsertItem("patient_item_collection_link", linkItem, conn=conn);
+            except conn.DatabaseError, err:
+                log.info(err);
+                conn.rollback();
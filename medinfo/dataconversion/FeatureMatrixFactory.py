@@ -14,6 +14,7 @@ matrix = factory.getMatrixAsBaz()
 
 import csv
 import datetime
+import multiprocessing
 import numpy as np
 import os
 import time
@@ -37,11 +38,36 @@ elif LocalEnv.DATABASE_CONNECTOR_NAME == 'sqlite3':
 from medinfo.common.Util import log
 import Util
 
+# Bound on (index times x window results) values gathered at once when
+# summarizing result windows, to limit memory use for long result histories.
+RESULT_WINDOW_CHUNK_ELEMENTS = 2**22
+
+def _initFeaturePlanWorker(factory):
+    global _workerFactory
+    _workerFactory = factory
+
+def _executeFeaturePlanStep(step):
+    """
+    Run one (methodName, args, kwargs) feature plan step on the worker's copy
+    of the factory and return the temp file names it produced.
+    """
+    (methodName, args, kwargs) = step
+    _workerFactory._featureTempFileNames = list()
+    getattr(_workerFactory, methodName)(*args, **kwargs)
+    return _workerFactory._featureTempFileNames
+
 class FeatureMatrixFactory:
     FEATURE_MATRIX_COLUMN_NAMES = [
         "patient_id"
     ]
 
+    # Summary features derived for each (lab / flowsheet) result base name.
+    RESULT_FEATURE_SUFFIXES = [
+        "count", "countInRange", "min", "max", "median", "mean", "std",
+        "first", "last", "diff", "slope", "proximate",
+        "firstTimeDays", "lastTimeDays", "proximateTimeDays"
+    ]
+
     def __init__(self, cacheDBResults = True, PID=None):
         self.dbCache = None
         self.patientListInput = None
@@ -659,82 +685,99 @@ class FeatureMatrixFactory:
                 tempFile.write("\t".join("%s.%dd" % (postLabel, dayBin) for dayBin in dayBins))
         tempFile.write("\n")
 
-        # Write patient episode data to tempFile.
+        # Read patient episodes, to count up item events for all of a patient's episodes at once.
+        patientIds = list()
+        episodeTimes = list()
         for patientEpisode in patientEpisodes:
-            # Initialize data to write to tempFile for patientEpisode.
-            episodeData = {}
-            patientId = int(patientEpisode[self.patientEpisodeIdColumn])
-            episodeTime = DBUtil.parseDateValue(patientEpisode[self.patientEpisodeTimeColumn])
-            # Time delta between index time and most closest past item event.
-            episodeData[preTimeDaysLabel] = None
-            # Time delta between index time and most closest future item event.
-            episodeData[postTimeDaysLabel] = None
-            # Number of item events before index time.
-            episodeData[preLabel] = 0
-            # Number of item events after index time.
-            episodeData[postLabel] = 0
-            # Number of item events within dayBin.
-            for dayBin in dayBins:
-                episodeData["%s.%dd" % (preLabel, dayBin)] = 0
-                episodeData["%s.%dd" % (postLabel, dayBin)] = 0
-
-            # Aggregate item events by day buckets.
-            if patientId in itemTimesByPatientId:
-                itemTimes = itemTimesByPatientId[patientId]
-                if itemTimes is not None:
-                    for itemTime in itemTimes:
-                        # Need this extra check because if a given event
-                        # has not occurred yet, but will occur, itemTime will
-                        # be none while itemTimes is not None.
-                        if (itemTime is None) or (not isinstance(itemTime, datetime.datetime)):
-                            continue
-                        timeDiffSeconds = (itemTime - episodeTime).total_seconds()
-                        timeDiffDays = timeDiffSeconds / SECONDS_PER_DAY
-                        # If event occurred before index time...
-                        if timeDiffDays < 0:
-                            if episodeData[preTimeDaysLabel] is None:
-                                episodeData[preTimeDaysLabel] = timeDiffDays
-                            elif abs(timeDiffDays) < abs(episodeData[preTimeDaysLabel]):
-                                # Found more recent item event
-                                episodeData[preTimeDaysLabel] = timeDiffDays
-                            episodeData[preLabel] += 1
-                            for dayBin in dayBins:
-                                if abs(timeDiffDays) <= dayBin:
-                                    episodeData["%s.%dd" % (preLabel, dayBin)] += 1
-                        # Event occurred after index time...
-                        else:
-                            if episodeData[postTimeDaysLabel] is None:
-                                episodeData[postTimeDaysLabel] = timeDiffDays
-                            elif abs(timeDiffDays) < abs(episodeData[postTimeDaysLabel]):
-                                # Found more proximate future event
-                                episodeData[postTimeDaysLabel] = timeDiffDays
-                            episodeData[postLabel] += 1
-                            for dayBin in dayBins:
-                                if abs(timeDiffDays) <= dayBin:
-                                    episodeData["%s.%dd" % (postLabel, dayBin)] += 1
-
-            # Write data to tempFile.
-            tempFile.write("%s\t%s" % (patientId, episodeTime))
+            patientIds.append(int(patientEpisode[self.patientEpisodeIdColumn]))
+            episodeTimes.append(DBUtil.parseDateValue(patientEpisode[self.patientEpisodeTimeColumn]))
+        nEpisodes = len(patientIds)
+
+        # Time delta between index time and most closest past / future item event.
+        preTimeDays = [None] * nEpisodes
+        postTimeDays = [None] * nEpisodes
+        # Number of item events before / after index time, then within each dayBin.
+        preCounts = np.zeros((nEpisodes, 1 + len(dayBins)), dtype=np.int64)
+        postCounts = np.zeros((nEpisodes, 1 + len(dayBins)), dtype=np.int64)
+
+        iEpisodesByPatientId = dict()
+        for iEpisode, patientId in enumerate(patientIds):
+            if patientId in itemTimesByPatientId and itemTimesByPatientId[patientId] is not None:
+                iEpisodesByPatientId.setdefault(patientId, list()).append(iEpisode)
+
+        # Aggregate item events by day buckets.
+        for patientId, iEpisodes in iEpisodesByPatientId.iteritems():
+            # Need this extra check because if a given event
+            # has not occurred yet, but will occur, itemTime will
+            # be none while itemTimes is not None.
+            itemTimes = [itemTime for itemTime in itemTimesByPatientId[patientId] if isinstance(itemTime, datetime.datetime)]
+            if len(itemTimes) < 1:
+                continue
+            itemMicros = np.sort(self._datetimeMicros(itemTimes))
+            episodeMicros = self._datetimeMicros([episodeTimes[iEpisode] for iEpisode in iEpisodes])
+            (patientPreTimeDays, patientPreCounts, patientPostTimeDays, patientPostCounts) = \
+                self._countItemEvents(itemMicros, episodeMicros, dayBins)
+            for i, iEpisode in enumerate(iEpisodes):
+                preTimeDays[iEpisode] = patientPreTimeDays[i]
+                postTimeDays[iEpisode] = patientPostTimeDays[i]
+            preCounts[iEpisodes] = patientPreCounts
+            postCounts[iEpisodes] = patientPostCounts
+
+        # Write data to tempFile as one block.
+        preCountRows = preCounts.tolist()
+        postCountRows = postCounts.tolist()
+        lines = list()
+        for iEpisode in xrange(nEpisodes):
+            fields = [str(patientIds[iEpisode]), str(episodeTimes[iEpisode])]
             # Include counts for events before episode_time.
             if features != "post":
-                tempFile.write("\t%s" % episodeData[preTimeDaysLabel])
-                tempFile.write("\t%s" % episodeData[preLabel])
-                if len(dayBins) > 0:
-                    tempFile.write("\t")
-                    tempFile.write("\t".join([str(episodeData["%s.%dd" % (preLabel, dayBin)]) for dayBin in dayBins]))
+                fields.append(str(preTimeDays[iEpisode]))
+                fields.extend([str(count) for count in preCountRows[iEpisode]])
             # Include counts for events after episode_time.
             if features != "pre":
-                tempFile.write("\t%s" % episodeData[postTimeDaysLabel])
-                tempFile.write("\t%s" % episodeData[postLabel])
-                if len(dayBins) > 0:
-                    tempFile.write("\t")
-                    tempFile.write("\t".join([str(episodeData["%s.%dd" % (postLabel, dayBin)]) for dayBin in dayBins]))
-            tempFile.write("\n")
+                fields.append(str(postTimeDays[iEpisode]))
+                fields.extend([str(count) for count in postCountRows[iEpisode]])
+            lines.append("\t".join(fields))
+            lines.append("\n")
+        tempFile.write("".join(lines))
 
         tempFile.close()
         # Add tempFileName to list of feature temp files.
         self._featureTempFileNames.append(tempFileName)
 
+    def _countItemEvents(self, itemMicros, episodeMicros, dayBins):
+        """
+        Given sorted item event times and a patient's episode (index) times,
+        as integer microseconds, find for each episode by binary search:
+        - Days from the index time to the most recent past event (None if none)
+        - Count of events before the index time, then those within each of the dayBins
+        - Days to the most proximate event at or after the index time (None if none)
+        - Count of events at or after the index time, then those within each of the dayBins
+        Return as (preTimeDays, preCounts, postTimeDays, postCounts), with the
+        counts as (episodes x 1+dayBins) arrays.
+        """
+        nItems = len(itemMicros)
+        dayBinMicros = np.array(dayBins, dtype=float) * (SECONDS_PER_DAY * 10**6)
+
+        iSplit = np.searchsorted(itemMicros, episodeMicros, "left")
+        preCounts = np.empty((len(episodeMicros), 1 + len(dayBins)), dtype=np.int64)
+        postCounts = np.empty((len(episodeMicros), 1 + len(dayBins)), dtype=np.int64)
+        preCounts[:, 0] = iSplit
+        postCounts[:, 0] = nItems - iSplit
+        for iBin in xrange(len(dayBins)):
+            preCounts[:, 1 + iBin] = iSplit - np.searchsorted(itemMicros, episodeMicros - dayBinMicros[iBin], "left")
+            postCounts[:, 1 + iBin] = np.searchsorted(itemMicros, episodeMicros + dayBinMicros[iBin], "right") - iSplit
+
+        preTimeDays = ((itemMicros[np.maximum(iSplit - 1, 0)] - episodeMicros) / 1e6 / SECONDS_PER_DAY).tolist()
+        postTimeDays = ((itemMicros[np.minimum(iSplit, nItems - 1)] - episodeMicros) / 1e6 / SECONDS_PER_DAY).tolist()
+        for i, iItem in enumerate(iSplit.tolist()):
+            if iItem < 1:
+                preTimeDays[i] = None
+            if iItem >= nItems:
+                postTimeDays[i] = None
+
+        return (preTimeDays, preCounts, postTimeDays, postCounts)
+
     def addLabResultFeatures(self, labNames, labIsPanel = True, preTimeDelta = None, postTimeDelta = None):
         """
         Query stride_order_proc and stride_order_results for the lab orders and
@@ -940,15 +983,34 @@ class FeatureMatrixFactory:
 
     def colsFromBaseNames(self, baseNames, preTimeDays, postTimeDays):
         """Enumerate derived column/feature names given a set of (lab) result base names"""
-        suffixes = ["count","countInRange","min","max","median","mean","std","first","last","diff","slope","proximate","firstTimeDays","lastTimeDays","proximateTimeDays"]
         colNames = list()
         for baseName in baseNames:
-            for suffix in suffixes:
+            for suffix in self.RESULT_FEATURE_SUFFIXES:
                 colName = "%s.%s_%s.%s" % (baseName, preTimeDays, postTimeDays, suffix)
                 colNames.extend([colName])
 
         return colNames
 
+    def _resultColumnsByBaseName(self, baseNames, preTimeDelta, postTimeDelta):
+        """
+        Precompute the derived column names for each result base name,
+        as a dictionary keyed by base name of dictionaries keyed by feature suffix.
+        """
+        preTimeDays = None
+        if preTimeDelta is not None:
+            preTimeDays = preTimeDelta.days
+        postTimeDays = None
+        if postTimeDelta is not None:
+            postTimeDays = postTimeDelta.days
+
+        colBySuffixByBaseName = dict()
+        for baseName in baseNames:
+            colBySuffix = dict()
+            for suffix in self.RESULT_FEATURE_SUFFIXES:
+                colBySuffix[suffix] = "%s.%s_%s.%s" % (baseName, preTimeDays, postTimeDays, suffix)
+            colBySuffixByBaseName[baseName] = colBySuffix
+        return colBySuffixByBaseName
+
     def _processResultEvents(self, patientEpisodeByIndexTimeById, resultsByNameByPatientId, resultNames, valueCol, datetimeCol, preTimeDelta, postTimeDelta):
         """
         Add on summary features to the patient-time instances.
@@ -963,6 +1025,9 @@ class FeatureMatrixFactory:
 
         Store results in a temp file.
         """
+        # Column names are the same for every patient, so only build them once.
+        colBySuffixByBaseName = self._resultColumnsByBaseName(resultNames, preTimeDelta, postTimeDelta)
+
         # Use results generator as outer loop as will not be able to random
         # access the contents.
         for patientId, resultsByName in resultsByNameByPatientId.iteritems():
@@ -972,7 +1037,7 @@ class FeatureMatrixFactory:
                 resultsByName = resultsByNameByPatientId[patientId]
                 self._addResultFeatures_singlePatient(patientEpisodeByIndexTime, \
                     resultsByName, resultNames, valueCol, datetimeCol, preTimeDelta, \
-                    postTimeDelta)
+                    postTimeDelta, colBySuffixByBaseName)
 
         # Separate loop to verify all patient records addressed, even if no
         # results available (like an outer join).
@@ -980,9 +1045,9 @@ class FeatureMatrixFactory:
         for patientId, patientEpisodeByIndexTime in patientEpisodeByIndexTimeById.iteritems():
             self._addResultFeatures_singlePatient(patientEpisodeByIndexTime, \
                 resultsByName, resultNames, valueCol, datetimeCol, preTimeDelta, \
-                postTimeDelta)
+                postTimeDelta, colBySuffixByBaseName)
 
-    def _addResultFeatures_singlePatient(self, patientEpisodeByIndexTime, resultsByName, baseNames, valueCol, datetimeCol, preTimeDelta, postTimeDelta):
+    def _addResultFeatures_singlePatient(self, patientEpisodeByIndexTime, resultsByName, baseNames, valueCol, datetimeCol, preTimeDelta, postTimeDelta, colBySuffixByBaseName=None):
         """
         Add summary features to the patient-time instances.
         With respect to each index time, look for results within
@@ -993,96 +1058,199 @@ class FeatureMatrixFactory:
         If resultsByName is None, then no results to match.
         Just make sure default / zero value columns are populated if
         they are not already.
+
+        colBySuffixByBaseName: Optional precomputed column names from _resultColumnsByBaseName.
         """
-        preTimeDays = None
-        if preTimeDelta is not None:
-            preTimeDays = preTimeDelta.days
-        postTimeDays = None
-        if postTimeDelta is not None:
-            postTimeDays = postTimeDelta.days
+        if colBySuffixByBaseName is None:
+            colBySuffixByBaseName = self._resultColumnsByBaseName(baseNames, preTimeDelta, postTimeDelta)
 
         # Init summary values to null for all results
         for indexTime, patient in patientEpisodeByIndexTime.iteritems():
             for baseName in baseNames:
-                if resultsByName is not None or ("%s.%s_%s.count" % (baseName, preTimeDays, postTimeDays)) not in patient:
+                colBySuffix = colBySuffixByBaseName[baseName]
+                if resultsByName is not None or colBySuffix["count"] not in patient:
                     # Default to null for all values
-                    patient["%s.%s_%s.count" % (baseName,preTimeDays,postTimeDays)] = 0
-                    patient["%s.%s_%s.countInRange" % (baseName,preTimeDays,postTimeDays)] = 0
-                    patient["%s.%s_%s.min" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.max" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.median" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.mean" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.std" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.first" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.last" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.diff" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.slope" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.proximate" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.firstTimeDays" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.lastTimeDays" % (baseName,preTimeDays,postTimeDays)] = None
-                    patient["%s.%s_%s.proximateTimeDays" % (baseName,preTimeDays,postTimeDays)] = None
+                    for colName in colBySuffix.itervalues():
+                        patient[colName] = None
+                    patient[colBySuffix["count"]] = 0
+                    patient[colBySuffix["countInRange"]] = 0
 
         # Have results available for this patient?
         if resultsByName is not None:
-            for indexTime, patient in patientEpisodeByIndexTime.iteritems():
-                # Time range limits on labs to consider
-                preTimeLimit = None;
-                postTimeLimit = None;
-
-                # Time range limits on labs to consider
-                if preTimeDelta is not None:
-                    preTimeLimit = indexTime + preTimeDelta
-                if postTimeDelta is not None:
-                    postTimeLimit = indexTime + postTimeDelta
-
-                for baseName in baseNames:
-                    proximateValue = None
-                    # Not all patients will have all labs checked
-                    if resultsByName is not None and baseName in resultsByName:
-                        firstItem = None
-                        lastItem = None
-                        # Item closest to the index time in time
-                        proximateItem = None
-                        filteredResults = list()
-                        for result in resultsByName[baseName]:
-                            resultTime = result[datetimeCol]
-                            if resultTime is not None:
-                                if (preTimeLimit is None or preTimeLimit <= resultTime) \
-                                   and (postTimeLimit is None or resultTime < postTimeLimit):
-                                    # Occurs within timeframe of interest, so record valueCol
-                                    filteredResults.append(result)
-
-                                    if firstItem is None or resultTime < firstItem[datetimeCol]:
-                                        firstItem = result
-                                    if lastItem is None or lastItem[datetimeCol] < resultTime:
-                                        lastItem = result
-                                    if proximateItem is None or (abs(resultTime - indexTime) < abs(proximateItem[datetimeCol] - indexTime)):
-                                        proximateItem = result
-
-                        if len(filteredResults) > 0:
-                            # Count up number of values specifically labeled "in range"
-                            valueList = columnFromModelList(filteredResults, valueCol)
-                            patient["%s.%s_%s.count" % (baseName,preTimeDays,postTimeDays)] = len(valueList);
-                            patient["%s.%s_%s.countInRange" % (baseName,preTimeDays,postTimeDays)] = self._countResultsInRange(filteredResults);
-                            patient["%s.%s_%s.min" % (baseName,preTimeDays,postTimeDays)] = np.min(valueList);
-                            patient["%s.%s_%s.max" % (baseName,preTimeDays,postTimeDays)] = np.max(valueList);
-                            patient["%s.%s_%s.median" % (baseName,preTimeDays,postTimeDays)] = np.median(valueList);
-                            patient["%s.%s_%s.mean" % (baseName,preTimeDays,postTimeDays)] = np.mean(valueList);
-                            patient["%s.%s_%s.std" % (baseName,preTimeDays,postTimeDays)] = np.std(valueList);
-                            patient["%s.%s_%s.first" % (baseName,preTimeDays,postTimeDays)] = firstItem[valueCol];
-                            patient["%s.%s_%s.last" % (baseName,preTimeDays,postTimeDays)] = lastItem[valueCol];
-                            patient["%s.%s_%s.diff" % (baseName,preTimeDays,postTimeDays)] = lastItem[valueCol] - firstItem[valueCol];
-                            patient["%s.%s_%s.slope" % (baseName,preTimeDays,postTimeDays)] = 0.0;
-                            timeDiffDays = ((lastItem[datetimeCol]-firstItem[datetimeCol]).total_seconds() / SECONDS_PER_DAY);
-                            if timeDiffDays > 0.0:
-                                patient["%s.%s_%s.slope" % (baseName,preTimeDays,postTimeDays)] = (lastItem[valueCol]-firstItem[valueCol]) / timeDiffDays;
-                            patient["%s.%s_%s.proximate" % (baseName,preTimeDays,postTimeDays)] = proximateItem[valueCol];
-                            patient["%s.%s_%s.firstTimeDays" % (baseName,preTimeDays,postTimeDays)] = (firstItem[datetimeCol]-indexTime).total_seconds() / SECONDS_PER_DAY;
-                            patient["%s.%s_%s.lastTimeDays" % (baseName,preTimeDays,postTimeDays)] = (lastItem[datetimeCol]-indexTime).total_seconds() / SECONDS_PER_DAY;
-                            patient["%s.%s_%s.proximateTimeDays" % (baseName,preTimeDays,postTimeDays)] = (proximateItem[datetimeCol]-indexTime).total_seconds() / SECONDS_PER_DAY;
+            # Index times and time range limits on results to consider,
+            # as integer microseconds to compare against sorted result times.
+            indexTimes = patientEpisodeByIndexTime.keys()
+            indexMicros = self._datetimeMicros(indexTimes)
+            preLimitMicros = None
+            if preTimeDelta is not None:
+                preLimitMicros = indexMicros + self._timedeltaMicros(preTimeDelta)
+            postLimitMicros = None
+            if postTimeDelta is not None:
+                postLimitMicros = indexMicros + self._timedeltaMicros(postTimeDelta)
+
+            for baseName in baseNames:
+                # Not all patients will have all labs checked
+                if baseName in resultsByName:
+                    self._addResultFeatures_singleResultName(patientEpisodeByIndexTime, indexTimes, indexMicros, \
+                        preLimitMicros, postLimitMicros, resultsByName[baseName], valueCol, datetimeCol, \
+                        colBySuffixByBaseName[baseName])
 
         return
 
+    def _addResultFeatures_singleResultName(self, patientEpisodeByIndexTime, indexTimes, indexMicros, preLimitMicros, postLimitMicros, results, valueCol, datetimeCol, colBySuffix):
+        """
+        Add summary features for one result base name to all of a patient's index times at once.
+        Results are sorted by time once, so each index time's window is a
+        [lo, hi) slice found by binary search. Counts, means and standard deviations
+        come from prefix sums over the slices, order statistics from a padded
+        gather of the window values.
+
+        Ties are resolved as a scan of results in their given order would:
+        first / last / proximate pick the earliest listed of equally placed results.
+        """
+        results = [result for result in results if result[datetimeCol] is not None]
+        if len(results) < 1:
+            return
+
+        # Stable sort so equal times keep their listed order
+        resultMicros = self._datetimeMicros([result[datetimeCol] for result in results])
+        order = np.argsort(resultMicros, kind="mergesort")
+        resultMicros = resultMicros[order]
+        values = np.array([result[valueCol] for result in results], dtype=float)[order]
+        inRange = np.array([result.get("result_in_range_yn") == "Y" for result in results], dtype=np.int64)[order]
+        nResults = len(results)
+
+        # Window of results [lo, hi) for each index time
+        if preLimitMicros is not None:
+            lo = np.searchsorted(resultMicros, preLimitMicros, "left")
+        else:
+            lo = np.zeros(len(indexMicros), dtype=np.int64)
+        if postLimitMicros is not None:
+            hi = np.searchsorted(resultMicros, postLimitMicros, "left")
+        else:
+            hi = np.repeat(nResults, len(indexMicros))
+        hi = np.maximum(lo, hi)
+        counts = hi - lo
+
+        iEpisodes = np.flatnonzero(counts > 0)
+        if len(iEpisodes) < 1:
+            return
+        indexMicros = indexMicros[iEpisodes]
+        lo = lo[iEpisodes]
+        hi = hi[iEpisodes]
+        counts = counts[iEpisodes]
+
+        # Prefix sums, with values shifted by their mean for numerical stability of the variance
+        shift = values.mean()
+        shiftedValues = (values - shift).astype(np.longdouble)
+        cumInRange = np.concatenate(([0], np.cumsum(inRange)))
+        cumValues = np.concatenate(([0], np.cumsum(shiftedValues)))
+        cumSquares = np.concatenate(([0], np.cumsum(shiftedValues * shiftedValues)))
+        countsInRange = cumInRange[hi] - cumInRange[lo]
+        windowMeans = (cumValues[hi] - cumValues[lo]) / counts
+        windowVars = (cumSquares[hi] - cumSquares[lo]) / counts - windowMeans * windowMeans
+        means = (windowMeans + shift).astype(float)
+        stds = np.sqrt(np.maximum(windowVars, 0)).astype(float)
+
+        (mins, maxs, medians) = self._windowOrderStatistics(values, lo, counts)
+        # Constant windows summarize exactly, without prefix sum rounding
+        constant = (mins == maxs)
+        means[constant] = mins[constant]
+        stds[constant] = 0.0
+
+        # First result in the window, and the first listed of those at the last time
+        iFirst = lo
+        iLast = np.maximum(lo, np.searchsorted(resultMicros, resultMicros[hi - 1], "left"))
+
+        # Proximate result is the nearest one at or after the index time or the nearest one before it
+        iIndex = np.searchsorted(resultMicros, indexMicros, "left")
+        iAfter = np.maximum(iIndex, lo)
+        hasAfter = (iAfter < hi)
+        iAfter = np.minimum(iAfter, hi - 1)
+        iBefore = np.minimum(iIndex, hi) - 1
+        hasBefore = (iBefore >= lo)
+        iBefore = np.maximum(iBefore, lo)
+        iBefore = np.searchsorted(resultMicros, resultMicros[iBefore], "left")
+        afterDist = resultMicros[iAfter] - indexMicros
+        beforeDist = indexMicros - resultMicros[iBefore]
+        useAfter = hasAfter & (~hasBefore | (afterDist < beforeDist) | ((afterDist == beforeDist) & (order[iAfter] < order[iBefore])))
+        iProximate = np.where(useAfter, iAfter, iBefore)
+
+        firstValues = values[iFirst]
+        lastValues = values[iLast]
+        diffs = lastValues - firstValues
+        timeDiffDays = (resultMicros[iLast] - resultMicros[iFirst]) / 1e6 / SECONDS_PER_DAY
+        slopes = np.zeros(len(iEpisodes))
+        sloped = (timeDiffDays > 0.0)
+        slopes[sloped] = diffs[sloped] / timeDiffDays[sloped]
+        firstTimeDays = (resultMicros[iFirst] - indexMicros) / 1e6 / SECONDS_PER_DAY
+        lastTimeDays = (resultMicros[iLast] - indexMicros) / 1e6 / SECONDS_PER_DAY
+        proximateTimeDays = (resultMicros[iProximate] - indexMicros) / 1e6 / SECONDS_PER_DAY
+
+        # Order statistics stay numpy scalars as from np.min, np.mean, etc. Others are plain values.
+        countList = counts.tolist()
+        countInRangeList = countsInRange.tolist()
+        firstList = firstValues.tolist()
+        lastList = lastValues.tolist()
+        diffList = diffs.tolist()
+        slopeList = slopes.tolist()
+        proximateList = values[iProximate].tolist()
+        firstTimeDaysList = firstTimeDays.tolist()
+        lastTimeDaysList = lastTimeDays.tolist()
+        proximateTimeDaysList = proximateTimeDays.tolist()
+        for i, iEpisode in enumerate(iEpisodes.tolist()):
+            patient = patientEpisodeByIndexTime[indexTimes[iEpisode]]
+            patient[colBySuffix["count"]] = countList[i]
+            patient[colBySuffix["countInRange"]] = countInRangeList[i]
+            patient[colBySuffix["min"]] = mins[i]
+            patient[colBySuffix["max"]] = maxs[i]
+            patient[colBySuffix["median"]] = medians[i]
+            patient[colBySuffix["mean"]] = means[i]
+            patient[colBySuffix["std"]] = stds[i]
+            patient[colBySuffix["first"]] = firstList[i]
+            patient[colBySuffix["last"]] = lastList[i]
+            patient[colBySuffix["diff"]] = diffList[i]
+            patient[colBySuffix["slope"]] = slopeList[i]
+            patient[colBySuffix["proximate"]] = proximateList[i]
+            patient[colBySuffix["firstTimeDays"]] = firstTimeDaysList[i]
+            patient[colBySuffix["lastTimeDays"]] = lastTimeDaysList[i]
+            patient[colBySuffix["proximateTimeDays"]] = proximateTimeDaysList[i]
+
+    def _windowOrderStatistics(self, values, lo, counts):
+        """
+        Return (mins, maxs, medians) arrays of the values[lo:lo+count] windows.
+        Windows are gathered into rows padded with +inf and sorted,
+        in chunks of rows to bound memory use.
+        """
+        nWindows = len(lo)
+        mins = np.zeros(nWindows)
+        maxs = np.zeros(nWindows)
+        medians = np.zeros(nWindows)
+        maxCount = counts.max()
+        offsets = np.arange(maxCount)
+        chunkRows = max(1, RESULT_WINDOW_CHUNK_ELEMENTS // maxCount)
+        for start in xrange(0, nWindows, chunkRows):
+            stop = min(start + chunkRows, nWindows)
+            chunkCounts = counts[start:stop]
+            positions = lo[start:stop, np.newaxis] + offsets
+            padded = (offsets >= chunkCounts[:, np.newaxis])
+            windows = values[np.minimum(positions, len(values) - 1)]
+            windows[padded] = np.inf
+            windows.sort(axis=1)
+            rows = np.arange(stop - start)
+            mins[start:stop] = windows[:, 0]
+            maxs[start:stop] = windows[rows, chunkCounts - 1]
+            medians[start:stop] = (windows[rows, (chunkCounts - 1) // 2] + windows[rows, chunkCounts // 2]) / 2
+        return (mins, maxs, medians)
+
+    def _datetimeMicros(self, datetimes):
+        """Array of the given datetimes as integer microseconds since the epoch"""
+        return np.array(datetimes, dtype="datetime64[us]").astype(np.int64)
+
+    def _timedeltaMicros(self, timeDelta):
+        """Given timedelta as integer microseconds"""
+        return (timeDelta.days * SECONDS_PER_DAY + timeDelta.seconds) * 10**6 + timeDelta.microseconds
+
     # TODO(sbala): Fix isLabPanel arg declaration to be None by default.
     def _queryLabResultsByName(self, labNames, isLabPanel = True):
         """
@@ -1429,6 +1597,44 @@ class FeatureMatrixFactory:
             self.addClinicalItemFeatures([feature], dayBins=[], \
                 features="pre")
 
+    def addFeaturesInParallel(self, featurePlan, nWorkers=None):
+        """
+        Execute a plan of independent add*Features calls concurrently.
+        featurePlan: List of (methodName, args, kwargs) steps, for example
+            [   ("addClinicalItemFeatures", (["TestItem100"],), {}),
+                ("addLabResultFeatures", (["Foo"], False, preTimeDelta, postTimeDelta), {}),
+                ("addCharlsonComorbidityFeatures", (), {"features": "pre"}),
+            ]
+        nWorkers: Number of worker processes. Defaults to one per step, up to the CPU count.
+            1 runs the steps serially in this process.
+
+        Each step runs in its own forked worker process, which queries the database
+        with its own connection and aggregates into its own temp files, so both the
+        query waits and the (GIL bound) aggregation of the feature families overlap.
+        Temp files are added in plan order, so the feature matrix columns are
+        the same as calling the methods one after another.
+        """
+        # Verify patient list and/or patient episode has been processed.
+        if not self.patientsProcessed:
+            raise ValueError("Must process patients before features.")
+
+        featurePlan = [(methodName, tuple(args), dict(kwargs)) for (methodName, args, kwargs) in featurePlan]
+        if nWorkers is None:
+            nWorkers = min(len(featurePlan), multiprocessing.cpu_count())
+
+        if nWorkers > 1:
+            pool = multiprocessing.Pool(nWorkers, _initFeaturePlanWorker, (self,))
+            try:
+                tempFileNamesBySteps = pool.map(_executeFeaturePlanStep, featurePlan, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+            for tempFileNames in tempFileNamesBySteps:
+                self._featureTempFileNames.extend(tempFileNames)
+        else:
+            for (methodName, args, kwargs) in featurePlan:
+                getattr(self, methodName)(*args, **kwargs)
+
     def buildFeatureMatrix(self, header=None, matrixFileName=None):
         """
         Given a set of factory inputs, build a feature matrix which
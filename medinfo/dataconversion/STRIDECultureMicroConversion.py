@@ -9,6 +9,7 @@ from medinfo.db.Model import SQLQuery;
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList, RowItemFieldComparator;
 
 from Util import log;
+from ConversionCore import ClinicalItemKeyCache, PatientItemWriter;
 from Env import DATE_FORMAT;
 
 
@@ -26,6 +27,8 @@ class STRIDECultureMicroConversion:
 
         self.categoryBySourceDescr = dict();    # Local cache to track the clinical item category table contents
         self.clinicalItemByCompositeKey = dict(); # Local cache to track clinical item table contents
+        self.keyCache = ClinicalItemKeyCache();  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache); # Buffer to write patient items in bulk
 
     def convertSourceItems(self, convOptions):
         """Primary run function to process the contents of the raw source
@@ -43,6 +46,7 @@ class STRIDECultureMicroConversion:
             for sourceItem in self.querySourceItems(convOptions, progress=progress, conn=conn):
                 self.convertSourceItem(sourceItem, conn=conn);
                 progress.Update();
+            self.patientItemWriter.flush(conn);
 
         finally:
             conn.close();
@@ -131,6 +135,8 @@ class STRIDECultureMicroConversion:
             category = self.categoryFromSourceItem(sourceItem, conn=conn);
             clinicalItem = self.clinicalItemFromSourceItem(sourceItem, category, conn=conn);
             patientItem = self.patientItemFromSourceItem(sourceItem, clinicalItem, conn=conn);
+            if not extConn:
+                self.patientItemWriter.flush(conn);
 
         finally:
             if not extConn:
@@ -151,8 +157,7 @@ class STRIDECultureMicroConversion:
                         "description":  categoryDescription,
                     }
                 );
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn);
-            category["clinical_item_category_id"] = categoryId;
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn);
             self.categoryBySourceDescr[categoryKey] = category;
         return self.categoryBySourceDescr[categoryKey];
 
@@ -178,8 +183,7 @@ class STRIDECultureMicroConversion:
                         "description": description
                     }
                 );
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn);
-            clinicalItem["clinical_item_id"] = clinicalItemId;
+            self.keyCache.addClinicalItem(clinicalItem);   # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCompositeKey[clinicalItemKey] = clinicalItem;
         return self.clinicalItemByCompositeKey[clinicalItemKey];
 
@@ -194,21 +198,8 @@ class STRIDECultureMicroConversion:
                     "item_date":  sourceItem["shifted_result_time"],
                 }
             );
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys() );
-        insertParams= patientItem.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-            patientItem["patient_item_id"] = DBUtil.execute( DBUtil.identityQuery("patient_item"), conn=conn )[0][0];
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, pull out existing ID and continue to insert whatever else is possible
-            # log.info(err);   # Lookup just by the composite key components to avoid attempting duplicate insertion again
-            searchPatientItem = \
-                {   "patient_id":       patientItem["patient_id"],
-                    "clinical_item_id": patientItem["clinical_item_id"],
-                    "item_date":        patientItem["item_date"],
-                }
-            (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchPatientItem, conn=conn);
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn);
         return patientItem;
 
     def main(self, argv):
@@ -9,6 +9,7 @@ from medinfo.db.Model import SQLQuery;
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList;
 
 from Util import log;
+from ConversionCore import ClinicalItemKeyCache, PatientItemWriter;
 from Env import DATE_FORMAT;
 
 SOURCE_TABLE = "stride_patient";
@@ -79,6 +80,8 @@ class STRIDEDemographicsConversion:
 
         self.categoryBySourceDescr = dict();
         self.clinicalItemByCategoryIdExtId = dict();
+        self.keyCache = ClinicalItemKeyCache();  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache); # Buffer to write patient items in bulk
 
     def convertSourceItems(self, patientIds=None):
         """Primary run function to process the contents of the stride_patient
@@ -93,6 +96,7 @@ class STRIDEDemographicsConversion:
         try:
             for sourceItem in self.querySourceItems(patientIds, progress=progress, conn=conn):
                 self.convertSourceItem(sourceItem, conn=conn);
+            self.patientItemWriter.flush(conn);
         finally:
             conn.close();
         # progress.PrintStatus();
@@ -202,6 +206,8 @@ class STRIDEDemographicsConversion:
             categoryModel = self.categoryFromSourceItem(sourceItem, conn=conn);
             clinicalItemModel = self.clinicalItemFromSourceItem(sourceItem, categoryModel, conn=conn);
             patientItemModel = self.patientItemModelFromSourceItem(sourceItem, clinicalItemModel, conn=conn);
+            if not extConn:
+                self.patientItemWriter.flush(conn);
 
         finally:
             if not extConn:
@@ -218,8 +224,7 @@ class STRIDEDemographicsConversion:
                         "description":  "Demographics",
                     }
                 );
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn);
-            category["clinical_item_category_id"] = categoryId;
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn);
             self.categoryBySourceDescr[categoryKey] = category;
         return self.categoryBySourceDescr[categoryKey];
 
@@ -236,8 +241,7 @@ class STRIDEDemographicsConversion:
                         "description": sourceItem["description"],
                     }
                 );
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn);
-            clinicalItem["clinical_item_id"] = clinicalItemId;
+            self.keyCache.addClinicalItem(clinicalItem);   # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdExtId[clinicalItemKey] = clinicalItem;
         return self.clinicalItemByCategoryIdExtId[clinicalItemKey];
 
@@ -252,14 +256,8 @@ class STRIDEDemographicsConversion:
                     "item_date":  sourceItem["itemDate"],
                 }
             );
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys() );
-        insertParams= patientItem.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.info(err);
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn);
 
 
 
@@ -9,6 +9,7 @@ from medinfo.db.Model import SQLQuery;
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList;
 
 from Util import log;
+from ConversionCore import ClinicalItemKeyCache, PatientItemWriter;
 from Env import DATE_FORMAT;
 
 SOURCE_TABLE = "stride_dx_list";
@@ -38,6 +39,8 @@ class STRIDEDxListConversion:
 
         self.categoryBySourceDescr = dict();
         self.clinicalItemByCategoryIdExtId = dict();
+        self.keyCache = ClinicalItemKeyCache();  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache); # Buffer to write patient items in bulk
         self.icd9_str_by_code = None
         self.icd10_str_by_code = None
 
@@ -55,6 +58,7 @@ class STRIDEDxListConversion:
         try:
             for sourceItem in self.querySourceItems(startDate, endDate, progress=progress, conn=conn):
                 self.convertSourceItem(sourceItem, conn=conn);
+            self.patientItemWriter.flush(conn);
         finally:
             conn.close();
         progress.PrintStatus();
@@ -200,6 +204,8 @@ class STRIDEDxListConversion:
             categoryModel = self.categoryFromSourceItem(sourceItem, conn=conn);
             clinicalItem = self.clinicalItemFromSourceItem(sourceItem, categoryModel, conn=conn);
             patientItem = self.patientItemModelFromSourceItem(sourceItem, clinicalItem, conn=conn);
+            if not extConn:
+                self.patientItemWriter.flush(conn);
 
         finally:
             if not extConn:
@@ -217,8 +223,7 @@ class STRIDEDxListConversion:
                         "description":  "Diagnosis (%s)" % sourceItem["data_source"],
                     }
                 );
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn);
-            category["clinical_item_category_id"] = categoryId;
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn);
             self.categoryBySourceDescr[categoryKey] = category;
         return self.categoryBySourceDescr[categoryKey];
 
@@ -236,8 +241,7 @@ class STRIDEDxListConversion:
                         "description": "%(icd_str)s" % sourceItem,
                     }
                 );
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn);
-            clinicalItem["clinical_item_id"] = clinicalItemId;
+            self.keyCache.addClinicalItem(clinicalItem);   # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdExtId[clinicalItemKey] = clinicalItem;
         return self.clinicalItemByCategoryIdExtId[clinicalItemKey]
 
@@ -252,15 +256,8 @@ class STRIDEDxListConversion:
                     "item_date":  sourceItem["noted_date"],
                 }
             );
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys() );
-        insertParams= patientItem.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.info(err);
-            pass;
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn);
 
     def prepare_icd9_lookup(self, conn):
         """
@@ -10,6 +10,7 @@ from medinfo.db.Model import SQLQuery;
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList, RowItemFieldComparator;
 
 from Util import log;
+from ConversionCore import ClinicalItemKeyCache, PatientItemWriter;
 from Const import TEMPLATE_MEDICATION_ID, TEMPLATE_MEDICATION_PREFIX;
 from Const import COLLECTION_TYPE_ORDERSET;
 from Env import DATE_FORMAT;
@@ -37,6 +38,8 @@ class STRIDEOrderMedConversion:
 
         self.categoryBySourceDescr = dict();    # Local cache to track the clinical item category table contents
         self.clinicalItemByCategoryIdCode = dict(); # Local cache to track clinical item table contents
+        self.keyCache = ClinicalItemKeyCache();  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache); # Buffer to write patient items in bulk
         self.itemCollectionByKeyStr = dict();   # Local cache to track item collections
         self.itemCollectionItemByCollectionIdItemId = dict();   # Local cache to track item collection items
 
@@ -70,6 +73,7 @@ class STRIDEOrderMedConversion:
                 if sourceItem["order_med_id"] not in convertedOrderMedIds:  # Don't repeat conversion if mixture components already addressed
                     self.convertSourceItem(sourceItem, conn=conn);
                 progress.Update();
+            self.patientItemWriter.flush(conn);
 
         finally:
             conn.close();
@@ -374,6 +378,8 @@ class STRIDEOrderMedConversion:
                 itemCollection = self.itemCollectionFromSourceItem(sourceItem, conn=conn);
                 itemCollectionItem = self.itemCollectionItemFromSourceItem(sourceItem, itemCollection, clinicalItem, conn=conn);
                 patientItemCollectionLink = self.patientItemCollectionLinkFromSourceItem(sourceItem, itemCollectionItem, patientItem, conn=conn);
+            if not extConn:
+                self.patientItemWriter.flush(conn);
 
         finally:
             if not extConn:
@@ -394,8 +400,7 @@ class STRIDEOrderMedConversion:
                         "description":  categoryDescription,
                     }
                 );
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn);
-            category["clinical_item_category_id"] = categoryId;
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn);
             self.categoryBySourceDescr[categoryKey] = category;
         return self.categoryBySourceDescr[categoryKey];
 
@@ -412,8 +417,7 @@ class STRIDEOrderMedConversion:
                         "description": sourceItem["description"],
                     }
                 );
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn);
-            clinicalItem["clinical_item_id"] = clinicalItemId;
+            self.keyCache.addClinicalItem(clinicalItem);   # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdCode[clinicalItemKey] = clinicalItem;
         else:
             # Clinical Item does exist, but check for redundancies and opportunities to
@@ -424,7 +428,8 @@ class STRIDEOrderMedConversion:
                 # Prior medication recorded description either a generic template,
                 #   or a longer version than necessary, that can be replaced with the current one
                 priorClinicalItem["description"] = sourceItem["description"];
-                DBUtil.updateRow("clinical_item", priorClinicalItem, priorClinicalItem["clinical_item_id"], conn=conn);
+                if priorClinicalItem["clinical_item_id"] is not None:   # Otherwise a new item not inserted yet, which will be with this description
+                    DBUtil.updateRow("clinical_item", priorClinicalItem, priorClinicalItem["clinical_item_id"], conn=conn);
         return self.clinicalItemByCategoryIdCode[clinicalItemKey];
 
     def patientItemFromSourceItem(self, sourceItem, clinicalItem, conn):
@@ -438,21 +443,8 @@ class STRIDEOrderMedConversion:
                     "item_date":  sourceItem["ordering_date"],
                 }
             );
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys() );
-        insertParams= patientItem.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-            patientItem["patient_item_id"] = DBUtil.execute( DBUtil.identityQuery("patient_item"), conn=conn )[0][0];
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, pull out existint ID and continue to insert whatever else is possible
-            log.info(err);   # Lookup just by the composite key components to avoid attempting duplicate insertion again
-            searchPatientItem = \
-                {   "patient_id":       patientItem["patient_id"],
-                    "clinical_item_id": patientItem["clinical_item_id"],
-                    "item_date":        patientItem["item_date"],
-                }
-            (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchPatientItem, conn=conn);
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn);
         return patientItem;
 
 
@@ -482,13 +474,14 @@ class STRIDEOrderMedConversion:
 
     def itemCollectionItemFromSourceItem(self, sourceItem, itemCollection, clinicalItem, conn):
         # Load or produce an item_collection_item record model for the given sourceItem
-        itemKey = (itemCollection["item_collection_id"], clinicalItem["clinical_item_id"]);
+        clinicalItemId = self.keyCache.clinicalItemId(clinicalItem, conn);  # Insert now if a new clinical item
+        itemKey = (itemCollection["item_collection_id"], clinicalItemId);
         if itemKey not in self.itemCollectionItemByCollectionIdItemId:
             # Item Collection Item does not yet exist in the local cache.  Check if in database table (if not, persist a new record)
             collectionItem = \
                 RowItemModel \
                 (   {   "item_collection_id": itemCollection["item_collection_id"],
-                        "clinical_item_id": clinicalItem["clinical_item_id"],
+                        "clinical_item_id": clinicalItemId,
                         "collection_type_id": COLLECTION_TYPE_ORDERSET,
                     }
                 );
@@ -498,21 +491,8 @@ class STRIDEOrderMedConversion:
         return self.itemCollectionItemByCollectionIdItemId[itemKey];
 
     def patientItemCollectionLinkFromSourceItem(self, sourceItem, collectionItem, patientItem, conn):
-        # Produce a patient_item_collection_link record model for the given sourceItem
-        patientItemCollectionLink = \
-            RowItemModel \
-            (   {   "patient_item_id": patientItem["patient_item_id"],
-                    "item_collection_item_id":  collectionItem["item_collection_item_id"],
-                }
-            );
-        insertQuery = DBUtil.buildInsertQuery("patient_item_collection_link", patientItemCollectionLink.keys() );
-        insertParams= patientItemCollectionLink.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.info(err);
+        # Buffer a patient_item_collection_link for the given sourceItem, to write in bulk once the patient item ID is known
+        self.patientItemWriter.addCollectionLink(patientItem, collectionItem);
 
 
     def main(self, argv):
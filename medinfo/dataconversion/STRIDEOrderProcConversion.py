@@ -9,6 +9,7 @@ from medinfo.db.Model import SQLQuery;
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList;
 
 from Util import log;
+from ConversionCore import ClinicalItemKeyCache, PatientItemWriter;
 from Env import DATE_FORMAT;
 from Const import COLLECTION_TYPE_ORDERSET;
 
@@ -44,6 +45,8 @@ class STRIDEOrderProcConversion:
 
         self.categoryBySourceDescr = dict();    # Local cache to track the clinical item category table contents
         self.clinicalItemByCategoryIdExtId = dict(); # Local cache to track clinical item table contents
+        self.keyCache = ClinicalItemKeyCache();  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache); # Buffer to write patient items in bulk
         self.itemCollectionByKeyStr = dict();   # Local cache to track item collections
         self.itemCollectionItemByCollectionIdItemId = dict();   # Local cache to track item collection items
 
@@ -62,6 +65,7 @@ class STRIDEOrderProcConversion:
             for sourceItem in self.querySourceItems(startDate, endDate, progress=progress, conn=conn):
                 self.convertSourceItem(sourceItem, conn=conn);
                 progress.Update();
+            self.patientItemWriter.flush(conn);
         finally:
             conn.close();
         progress.PrintStatus();
@@ -135,6 +139,8 @@ class STRIDEOrderProcConversion:
                 itemCollection = self.itemCollectionFromSourceItem(sourceItem, conn=conn);
                 itemCollectionItem = self.itemCollectionItemFromSourceItem(sourceItem, itemCollection, clinicalItem, conn=conn);
                 patientItemCollectionLink = self.patientItemCollectionLinkFromSourceItem(sourceItem, itemCollectionItem, patientItem, conn=conn);
+            if not extConn:
+                self.patientItemWriter.flush(conn);
         finally:
             if not extConn:
                 conn.close();
@@ -151,8 +157,7 @@ class STRIDEOrderProcConversion:
                         "description":  sourceItem["order_type"],
                     }
                 );
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn);
-            category["clinical_item_category_id"] = categoryId;
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn);
             self.categoryBySourceDescr[categoryKey] = category;
         return self.categoryBySourceDescr[categoryKey];
 
@@ -177,8 +182,7 @@ class STRIDEOrderProcConversion:
                         "description": sourceItem["description"],
                     }
                 );
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn);
-            clinicalItem["clinical_item_id"] = clinicalItemId;
+            self.keyCache.addClinicalItem(clinicalItem);   # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdExtId[clinicalItemKey] = clinicalItem;
         return self.clinicalItemByCategoryIdExtId[clinicalItemKey];
 
@@ -193,21 +197,8 @@ class STRIDEOrderProcConversion:
                     "item_date":  sourceItem["order_time"],
                 }
             );
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys() );
-        insertParams= patientItem.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-            patientItem["patient_item_id"] = DBUtil.execute( DBUtil.identityQuery("patient_item"), conn=conn )[0][0];
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, pull out existint ID and continue to insert whatever else is possible
-            log.info(err);   # Lookup just by the composite key components to avoid attempting duplicate insertion again
-            searchPatientItem = \
-                {   "patient_id":       patientItem["patient_id"],
-                    "clinical_item_id": patientItem["clinical_item_id"],
-                    "item_date":        patientItem["item_date"],
-                }
-            (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchPatientItem, conn=conn);
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn);
         return patientItem;
 
 
@@ -237,13 +228,14 @@ class STRIDEOrderProcConversion:
 
     def itemCollectionItemFromSourceItem(self, sourceItem, itemCollection, clinicalItem, conn):
         # Load or produce an item_collection_item record model for the given sourceItem
-        itemKey = (itemCollection["item_collection_id"], clinicalItem["clinical_item_id"]);
+        clinicalItemId = self.keyCache.clinicalItemId(clinicalItem, conn);  # Insert now if a new clinical item
+        itemKey = (itemCollection["item_collection_id"], clinicalItemId);
         if itemKey not in self.itemCollectionItemByCollectionIdItemId:
             # Item Collection Item does not yet exist in the local cache.  Check if in database table (if not, persist a new record)
             collectionItem = \
                 RowItemModel \
                 (   {   "item_collection_id": itemCollection["item_collection_id"],
-                        "clinical_item_id": clinicalItem["clinical_item_id"],
+                        "clinical_item_id": clinicalItemId,
                         "collection_type_id": COLLECTION_TYPE_ORDERSET,
                     }
                 );
@@ -253,21 +245,8 @@ class STRIDEOrderProcConversion:
         return self.itemCollectionItemByCollectionIdItemId[itemKey];
 
     def patientItemCollectionLinkFromSourceItem(self, sourceItem, collectionItem, patientItem, conn):
-        # Produce a patient_item_collection_link record model for the given sourceItem
-        patientItemCollectionLink = \
-            RowItemModel \
-            (   {   "patient_item_id": patientItem["patient_item_id"],
-                    "item_collection_item_id":  collectionItem["item_collection_item_id"],
-                }
-            );
-        insertQuery = DBUtil.buildInsertQuery("patient_item_collection_link", patientItemCollectionLink.keys() );
-        insertParams= patientItemCollectionLink.values();
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute( insertQuery, insertParams, conn=conn );
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.info(err);
+        # Buffer a patient_item_collection_link for the given sourceItem, to write in bulk once the patient item ID is known
+        self.patientItemWriter.addCollectionLink(patientItem, collectionItem);
 
 
     def main(self, argv):
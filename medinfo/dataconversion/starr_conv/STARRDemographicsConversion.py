@@ -14,6 +14,7 @@ from medinfo.db.Model import RowItemModel
 from medinfo.dataconversion.starr_conv import STARRUtil
 
 from medinfo.dataconversion.Util import log
+from medinfo.dataconversion.ConversionCore import ClinicalItemKeyCache, PatientItemWriter
 from medinfo.db.bigquery import bigQueryUtil
 
 from google.cloud import bigquery
@@ -93,6 +94,8 @@ class STARRDemographicsConversion:
 
         self.categoryBySourceDescr = dict()
         self.clinicalItemByCategoryIdExtId = dict()
+        self.keyCache = ClinicalItemKeyCache()  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache)  # Buffer to write patient items in bulk
 
     def convertItemsByBatch(self, patientIdsFile, batchSize=250000, tempDir=tempfile.gettempdir(), removeCsvs=True,
                             targetDatasetId='clinical_item2018', skipFirstLine=True, startBatch=0):
@@ -162,6 +165,7 @@ class STARRDemographicsConversion:
             category_model = self.categoryFromSourceItem(conn)   # only 1 category - no need to have it in the loop
             for sourceItem in self.querySourceItems(patientIds, progress):
                 self.convertSourceItem(category_model, sourceItem, conn)
+            self.patientItemWriter.flush(conn)
 
     def convertSourceItem(self, categoryModel, sourceItem, conn=None):
         """Given an individual sourceItem record, produce / convert it into an equivalent
@@ -287,8 +291,7 @@ class STARRDemographicsConversion:
                 }
             )
 
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn)
-            category["clinical_item_category_id"] = categoryId
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn)
             self.categoryBySourceDescr[category_key] = category
         return self.categoryBySourceDescr[category_key]
 
@@ -305,8 +308,7 @@ class STARRDemographicsConversion:
                     "description": sourceItem["description"],
                 }
             )
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn)
-            clinicalItem["clinical_item_id"] = clinicalItemId
+            self.keyCache.addClinicalItem(clinicalItem)    # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdExtId[clinicalItemKey] = clinicalItem
         return self.clinicalItemByCategoryIdExtId[clinicalItemKey]
 
@@ -322,14 +324,8 @@ class STARRDemographicsConversion:
                 "item_date_utc": None,                          # it's a date - so, no need to have a duplicate here
             }
         )
-        insert_query = DBUtil.buildInsertQuery("patient_item", patient_item.keys())
-        insert_params = patient_item.values()
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute(insert_query, insert_params, conn=conn)
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.warn(err)
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patient_item, clinicalItem, conn)
 
     def main(self, argv):
         """Main method, callable from command line"""
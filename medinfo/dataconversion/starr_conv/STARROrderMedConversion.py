@@ -13,7 +13,8 @@ from medinfo.db.Model import SQLQuery
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList, RowItemFieldComparator
 
 from medinfo.dataconversion.Util import log
-from medinfo.dataconversion.Const import TEMPLATE_MEDICATION_ID, TEMPLATE_MEDICATION_PREFIX
+from medinfo.dataconversion.ConversionCore import ClinicalItemKeyCache, PatientItemWriter, CLINICAL_ITEM_IDENTITY_COLS
+from medinfo.dataconversion.Const import TEMPLATE_MEDICATION_ID
 from medinfo.dataconversion.Const import COLLECTION_TYPE_ORDERSET
 from medinfo.dataconversion.Env import DATE_FORMAT
 
@@ -50,6 +51,8 @@ class STARROrderMedConversion:
 
         self.categoryBySourceDescr = dict()     # Local cache to track the clinical item category table contents
         self.clinicalItemByCategoryIdCode = dict()  # Local cache to track clinical item table contents
+        self.keyCache = ClinicalItemKeyCache(keyCols=CLINICAL_ITEM_IDENTITY_COLS)  # Prewarmed clinical item keys, to resolve new items in batches (not by description, which is simplified as we go)
+        self.patientItemWriter = PatientItemWriter(self.keyCache)  # Buffer to write patient items in bulk
         self.itemCollectionByKeyStr = dict()    # Local cache to track item collections
         self.itemCollectionItemByCollectionIdItemId = dict()    # Local cache to track item collection items
 
@@ -108,11 +111,28 @@ class STARROrderMedConversion:
             for sourceItem in self.querySourceItems(rxcuiDataByMedId, convOptions, progress=progress, conn=conn):
                 self.convertSourceItem(sourceItem, conn=conn)
                 progress.Update()
+            self.patientItemWriter.flush(conn)
 
         finally:
             conn.close()
         progress.PrintStatus()
 
+    def collectNewClinicalItems(self, convOptions):
+        """Pre-pass for a parallel conversion (see STARRParallelConversion).
+        Derive the category and clinical item for each source item in the date range, without writing patient items,
+        and return the new ones not yet in the database, as ClinicalItemKeyCache.newItemRows.
+        """
+        self.keyCache = ClinicalItemKeyCache(collectOnly=True, keyCols=CLINICAL_ITEM_IDENTITY_COLS)
+        conn = self.connFactory.connection()
+        try:
+            rxcuiDataByMedId = self.loadRXCUIData()
+            for sourceItem in self.querySourceItems(rxcuiDataByMedId, convOptions, conn=conn):
+                category = self.categoryFromSourceItem(sourceItem, conn=conn)
+                self.clinicalItemFromSourceItem(sourceItem, category, conn=conn)
+        finally:
+            conn.close()
+        return self.keyCache.newItemRows()
+
     def loadRXCUIData(self):
         """Load up the full contents of the stride_mapped_meds table into
         memory (only a few thousand records) to facilitate rapid lookup resolution
@@ -293,6 +313,8 @@ class STARROrderMedConversion:
                 itemCollection = self.itemCollectionFromSourceItem(sourceItem, conn=conn)
                 itemCollectionItem = self.itemCollectionItemFromSourceItem(sourceItem, itemCollection, clinicalItem, conn=conn)
                 patientItemCollectionLink = self.patientItemCollectionLinkFromSourceItem(sourceItem, itemCollectionItem, patientItem, conn=conn)
+            if not extConn:
+                self.patientItemWriter.flush(conn)
 
         finally:
             if not extConn:
@@ -311,8 +333,7 @@ class STARROrderMedConversion:
                     "description":  categoryDescription,
                 }
             )
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn)
-            category["clinical_item_category_id"] = categoryId
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn)
             self.categoryBySourceDescr[categoryKey] = category
         return self.categoryBySourceDescr[categoryKey]
 
@@ -329,19 +350,12 @@ class STARROrderMedConversion:
                     "description": sourceItem["med_description"],
                 }
             )
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn)
-            clinicalItem["clinical_item_id"] = clinicalItemId
+            self.keyCache.addClinicalItem(clinicalItem)    # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdCode[clinicalItemKey] = clinicalItem
-        else:
-            # Clinical Item does exist, but check for redundancies and opportunities to
-            #   simplify different descriptions for the same medication
-            priorClinicalItem = self.clinicalItemByCategoryIdCode[clinicalItemKey]
-            priorDescription = priorClinicalItem["description"]
-            if len(sourceItem["med_description"]) < len(priorDescription) or priorDescription.startswith(TEMPLATE_MEDICATION_PREFIX):
-                # Prior medication recorded description either a generic template,
-                #   or a longer version than necessary, that can be replaced with the current one
-                priorClinicalItem["description"] = sourceItem["med_description"]
-                DBUtil.updateRow("clinical_item", priorClinicalItem, priorClinicalItem["clinical_item_id"], conn=conn)
+        # Check for redundancies and opportunities to simplify different descriptions for the same medication.
+        #   Replace a generic template or longer version than necessary with the current one.
+        #   Written now if an existing item, but left for insertNewItemRows to resolve across partitions if collecting new items.
+        self.keyCache.preferDescription(self.clinicalItemByCategoryIdCode[clinicalItemKey], sourceItem["med_description"], conn)
         return self.clinicalItemByCategoryIdCode[clinicalItemKey]
 
     def patientItemFromSourceItem(self, sourceItem, clinicalItem, conn):
@@ -356,21 +370,8 @@ class STARROrderMedConversion:
                 "item_date_utc": str(sourceItem["order_time_jittered_utc"]),    # without str(), the time is being converted in postgres
             }
         )
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys())
-        insertParams = patientItem.values()
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute(insertQuery, insertParams, conn=conn)
-            patientItem["patient_item_id"] = DBUtil.execute(DBUtil.identityQuery("patient_item"), conn=conn)[0][0]
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, pull out existint ID and continue to insert whatever else is possible
-            log.info(err)    # Lookup just by the composite key components to avoid attempting duplicate insertion again
-            searchPatientItem = {
-                "patient_id":       patientItem["patient_id"],
-                "clinical_item_id": patientItem["clinical_item_id"],
-                "item_date":        patientItem["item_date"],
-            }
-            (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchPatientItem, conn=conn)
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn)
         return patientItem
 
     def itemCollectionFromSourceItem(self, sourceItem, conn):
@@ -403,13 +404,14 @@ class STARROrderMedConversion:
 
     def itemCollectionItemFromSourceItem(self, sourceItem, itemCollection, clinicalItem, conn):
         # Load or produce an item_collection_item record model for the given sourceItem
-        itemKey = (itemCollection["item_collection_id"], clinicalItem["clinical_item_id"])
+        clinicalItemId = self.keyCache.clinicalItemId(clinicalItem, conn)   # Insert now if a new clinical item
+        itemKey = (itemCollection["item_collection_id"], clinicalItemId)
         if itemKey not in self.itemCollectionItemByCollectionIdItemId:
             # Item Collection Item does not yet exist in the local cache.  Check if in database table (if not, persist a new record)
             collectionItem = RowItemModel(
                 {
                     "item_collection_id": itemCollection["item_collection_id"],
-                    "clinical_item_id": clinicalItem["clinical_item_id"],
+                    "clinical_item_id": clinicalItemId,
                     "collection_type_id": COLLECTION_TYPE_ORDERSET,
                 }
             )
@@ -419,21 +421,8 @@ class STARROrderMedConversion:
         return self.itemCollectionItemByCollectionIdItemId[itemKey]
 
     def patientItemCollectionLinkFromSourceItem(self, sourceItem, collectionItem, patientItem, conn):
-        # Produce a patient_item_collection_link record model for the given sourceItem
-        patientItemCollectionLink = RowItemModel(
-            {
-                "patient_item_id": patientItem["patient_item_id"],
-                "item_collection_item_id": collectionItem["item_collection_item_id"],
-            }
-        )
-        insertQuery = DBUtil.buildInsertQuery("patient_item_collection_link", patientItemCollectionLink.keys())
-        insertParams = patientItemCollectionLink.values()
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute(insertQuery, insertParams, conn=conn)
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.info(err)
+        # Buffer a patient_item_collection_link for the given sourceItem, to write in bulk once the patient item ID is known
+        self.patientItemWriter.addCollectionLink(patientItem, collectionItem)
 
     def main(self, argv):
         """Main method, callable from command line"""
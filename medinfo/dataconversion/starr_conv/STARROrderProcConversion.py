@@ -15,6 +15,7 @@ from medinfo.db.Model import SQLQuery
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList
 
 from medinfo.dataconversion.Util import log
+from medinfo.dataconversion.ConversionCore import ClinicalItemKeyCache, PatientItemWriter
 from medinfo.dataconversion.Const import COLLECTION_TYPE_ORDERSET
 from medinfo.dataconversion.Env import DATE_FORMAT
 
@@ -60,13 +61,12 @@ class STARROrderProcConversion:
 
         self.categoryBySourceDescr = dict()                     # Local cache to track the clinical item category table contents
         self.clinicalItemByCategoryIdExtId = dict()             # Local cache to track clinical item table contents
+        self.keyCache = ClinicalItemKeyCache()  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache)  # Buffer to write patient items in bulk
 
         self.itemCollectionByKeyStr = dict()                    # Local cache to track item collections
         self.itemCollectionItemByCollectionIdItemId = dict()    # Local cache to track item collection items
 
-        self.patient_items = dict()                             # Local cache of processed patient items
-        self.patient_item_collection_links = set()              # Local cache of processed patient item collection links
-
     def convertAndUpload(self, startDate=None, endDate=None, tempDir=tempfile.gettempdir(), removeCsvs=True):
         """
         Wrapper around primary run function, does conversion locally and uploads to BQ
@@ -117,10 +117,27 @@ class STARROrderProcConversion:
             for sourceItem in self.querySourceItems(startDate, endDate, progress=progress, conn=conn):
                 self.convertSourceItem(sourceItem, conn=conn)
                 progress.Update()
+            self.patientItemWriter.flush(conn)
         finally:
             conn.close()
         progress.PrintStatus()
 
+    def collectNewClinicalItems(self, startDate=None, endDate=None):
+        """Pre-pass for a parallel conversion (see STARRParallelConversion).
+        Derive the category and clinical item for each source item in the date range, without writing anything,
+        and return the new ones not yet in the database, as ClinicalItemKeyCache.newItemRows.
+        """
+        self.keyCache = ClinicalItemKeyCache(collectOnly=True)
+        conn = self.connFactory.connection()
+        try:
+            for sourceItem in self.querySourceItems(startDate, endDate, conn=conn):
+                if sourceItem["proc_code"] is not None:
+                    category = self.categoryFromSourceItem(sourceItem, conn=conn)
+                    self.clinicalItemFromSourceItem(sourceItem, category, conn=conn)
+        finally:
+            conn.close()
+        return self.keyCache.newItemRows()
+
     def querySourceItems(self, startDate=None, endDate=None, progress=None, conn=None):
         """Query the database for list of all source clinical items (orders, etc.)
         and yield the results one at a time.  If startDate provided, only return items whose order_time is on or after that date.
@@ -222,6 +239,8 @@ class STARROrderProcConversion:
                 itemCollection = self.itemCollectionFromSourceItem(sourceItem, conn=conn)
                 itemCollectionItem = self.itemCollectionItemFromSourceItem(sourceItem, itemCollection, clinicalItem, conn=conn)
                 patientItemCollectionLink = self.patientItemCollectionLinkFromSourceItem(sourceItem, itemCollectionItem, patientItem, conn=conn)
+            if not extConn:
+                self.patientItemWriter.flush(conn)
         finally:
             if not extConn:
                 conn.close()
@@ -237,8 +256,7 @@ class STARROrderProcConversion:
                     "description": "{} ({})".format(sourceItem["order_type"], sourceItem["ordering_mode"])
                 }
             )
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn)
-            category["clinical_item_category_id"] = categoryId
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn)
             self.categoryBySourceDescr[categoryKey] = category
         return self.categoryBySourceDescr[categoryKey]
 
@@ -263,8 +281,7 @@ class STARROrderProcConversion:
                     "description":               sourceItem["description"],
                 }
             )
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn)
-            clinicalItem["clinical_item_id"] = clinicalItemId
+            self.keyCache.addClinicalItem(clinicalItem)    # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCategoryIdExtId[clinicalItemKey] = clinicalItem
         return self.clinicalItemByCategoryIdExtId[clinicalItemKey]
 
@@ -281,28 +298,8 @@ class STARROrderProcConversion:
             }
         )
 
-        key_hash = hash('{}{}{}'.format(patientItem["patient_id"], patientItem["clinical_item_id"],
-                                        patientItem["item_date"]))
-        if key_hash in self.patient_items:
-            return self.patient_items[key_hash]
-
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys())
-        insertParams = patientItem.values()
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute(insertQuery, insertParams, conn=conn)
-            patientItem["patient_item_id"] = DBUtil.execute(DBUtil.identityQuery("patient_item"), conn=conn)[0][0]
-            self.patient_items[key_hash] = patientItem
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, pull out existint ID and continue to insert whatever else is possible
-            log.warn(err)   # Lookup just by the composite key components to avoid attempting duplicate insertion again
-            searchPatientItem = {
-                "patient_id":       patientItem["patient_id"],
-                "clinical_item_id": patientItem["clinical_item_id"],
-                "item_date":        patientItem["item_date"],
-            }
-            (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchPatientItem, conn=conn)
-            self.patient_items[key_hash] = patientItem
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn)
 
         return patientItem
 
@@ -328,13 +325,14 @@ class STARROrderProcConversion:
 
     def itemCollectionItemFromSourceItem(self, sourceItem, itemCollection, clinicalItem, conn):
         # Load or produce an item_collection_item record model for the given sourceItem
-        itemKey = (itemCollection["item_collection_id"], clinicalItem["clinical_item_id"])
+        clinicalItemId = self.keyCache.clinicalItemId(clinicalItem, conn)   # Insert now if a new clinical item
+        itemKey = (itemCollection["item_collection_id"], clinicalItemId)
         if itemKey not in self.itemCollectionItemByCollectionIdItemId:
             # Item Collection Item does not yet exist in the local cache.  Check if in database table (if not, persist a new record)
             collectionItem = RowItemModel(
                 {
                     "item_collection_id": itemCollection["item_collection_id"],
-                    "clinical_item_id": clinicalItem["clinical_item_id"],
+                    "clinical_item_id": clinicalItemId,
                     "collection_type_id": COLLECTION_TYPE_ORDERSET,
                 }
             )
@@ -344,27 +342,8 @@ class STARROrderProcConversion:
         return self.itemCollectionItemByCollectionIdItemId[itemKey]
 
     def patientItemCollectionLinkFromSourceItem(self, sourceItem, collectionItem, patientItem, conn):
-        hash_key = hash('{}{}'.format(patientItem["patient_item_id"], collectionItem["item_collection_item_id"]))
-        if hash_key in self.patient_item_collection_links:
-            return
-
-        # Produce a patient_item_collection_link record model for the given sourceItem
-        patientItemCollectionLink = RowItemModel(
-            {
-                "patient_item_id": patientItem["patient_item_id"],
-                "item_collection_item_id":  collectionItem["item_collection_item_id"],
-            }
-        )
-        insertQuery = DBUtil.buildInsertQuery("patient_item_collection_link", patientItemCollectionLink.keys())
-        insertParams = patientItemCollectionLink.values()
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute(insertQuery, insertParams, conn=conn)
-            self.patient_item_collection_links.add(hash_key)
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, just note it and continue to insert whatever else is possible
-            log.warn(err)
-            self.patient_item_collection_links.add(hash_key)
+        # Buffer a patient_item_collection_link for the given sourceItem, to write in bulk once the patient item ID is known
+        self.patientItemWriter.addCollectionLink(patientItem, collectionItem)
 
     def main(self, argv):
         """Main method, callable from command line"""
@@ -410,9 +389,6 @@ class STARROrderProcConversion:
             self.convertAndUpload(date, endDateBracket)
             date += timedelta(days=7)
 
-            self.patient_items.clear()
-            self.patient_item_collection_links.clear()
-
         self.move_clinical_and_item_collection_to_bq()
 
         timer = time.time() - timer
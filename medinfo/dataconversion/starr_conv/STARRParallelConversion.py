@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""Run a STARR data conversion module over a date range in parallel.
+
+Splits the date range into partitions and converts each with the module's convertSourceItems
+in a pool of worker processes, each with its own converter instance
+(so its own database connection, BigQuery client and clinical item key cache).
+
+New clinical items are created up front by a pre-pass (collectNewClinicalItems over each partition),
+inserted in one batch in sorted key order, so the clinical_item IDs are the same regardless of the
+number of workers or the order partitions finish in, and the workers only have to look up existing items.
+Items found with different descriptions (STARROrderMedConversion) get the preferred one
+(ConversionCore.descriptionRank) in that same batch, rather than whichever partition updates it last.
+
+Each completed partition is recorded in a local (SQLite) state table,
+so an interrupted run can be restarted with the same arguments and only convert the remaining partitions.
+(Patient items already written by a partially converted partition are skipped when it is redone.)
+
+Only converts into the local database.  Upload results to BigQuery afterwards as usual.
+"""
+
+import sys, os
+import importlib
+import multiprocessing
+import sqlite3
+import tempfile
+import time
+
+from datetime import datetime
+from datetime import timedelta
+from itertools import imap
+from optparse import OptionParser
+
+from medinfo.db import DBUtil
+from medinfo.dataconversion.Util import log
+from medinfo.dataconversion.ConversionCore import ClinicalItemKeyCache
+from medinfo.dataconversion.Env import DATE_FORMAT
+
+PARTITION_DAYS = 7  # Same as the week at a time STARROrderProcConversion.main converts
+DEFAULT_STATE_FILENAME = os.path.join(tempfile.gettempdir(), "starr_conversion_state.sqlite")
+
+# Conversion modules that convert by date range, by their command line name
+CONVERTER_MODULES = {
+    "order_proc": "medinfo.dataconversion.starr_conv.STARROrderProcConversion",
+    "order_med": "medinfo.dataconversion.starr_conv.STARROrderMedConversion",
+    "treatment_team": "medinfo.dataconversion.starr_conv.STARRTreatmentTeamConversion",
+}
+
+# Stages recorded in the state table
+CLINICAL_ITEM_STAGE = "clinical_item"   # Pre-pass over the whole date range to insert new clinical items
+PATIENT_ITEM_STAGE = "patient_item"     # Conversion of a date partition
+
+
+def datePartitions(startDate, endDate, partitionDays=PARTITION_DAYS):
+    """Return list of (startDate, endDate) partitions of partitionDays covering [startDate, endDate)"""
+    partitions = list()
+    date = startDate
+    while date < endDate:
+        partitions.append((date, min(date + timedelta(days=partitionDays), endDate)))
+        date += timedelta(days=partitionDays)
+    return partitions
+
+
+class ConversionStateTable:
+    """Local SQLite table recording the completed (date partition) stages of each conversion"""
+
+    def __init__(self, filename=DEFAULT_STATE_FILENAME):
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute(
+            """create table if not exists conversion_partition
+            (   conversion text,
+                stage text,
+                start_date text,
+                end_date text,
+                completed_time text,
+                primary key (conversion, stage, start_date, end_date)
+            )
+            """)
+        self.conn.commit()
+
+    def isCompleted(self, conversion, stage, startDate, endDate):
+        cursor = self.conn.execute(
+            """select count(*) from conversion_partition
+            where conversion = ? and stage = ? and start_date = ? and end_date = ?
+            """, (conversion, stage, startDate.isoformat(), endDate.isoformat()))
+        return cursor.fetchone()[0] > 0
+
+    def markCompleted(self, conversion, stage, startDate, endDate):
+        self.conn.execute(
+            """insert or replace into conversion_partition (conversion, stage, start_date, end_date, completed_time)
+            values (?,?,?,?,?)
+            """, (conversion, stage, startDate.isoformat(), endDate.isoformat(), datetime.now().isoformat()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _converterAndArgs(task):
+    """Instantiate the converter for a (modulePath, className, optionValues, startDate, endDate) task,
+    with the arguments for its convertSourceItems / collectNewClinicalItems methods.
+    Modules with a ConversionOptions class take one of those, otherwise just the dates.
+    """
+    (modulePath, className, optionValues, startDate, endDate) = task
+    module = importlib.import_module(modulePath)
+    converter = getattr(module, className)()
+    if hasattr(module, "ConversionOptions"):
+        convOptions = module.ConversionOptions()
+        convOptions.__dict__.update(optionValues)
+        convOptions.startDate = startDate
+        convOptions.endDate = endDate
+        args = (convOptions,)
+    else:
+        args = (startDate, endDate)
+    return (converter, args)
+
+def _collectPartition(task):
+    """Return the clinical item key columns of the converter's key cache,
+    with the new (category rows, clinical item rows) for a partition task
+    """
+    (converter, args) = _converterAndArgs(task)
+    (categoryRows, clinicalItemRows) = converter.collectNewClinicalItems(*args)
+    return (converter.keyCache.keyCols, categoryRows, clinicalItemRows)
+
+def _convertPartition(task):
+    """Convert a partition task, returning its (startDate, endDate) once done"""
+    (converter, args) = _converterAndArgs(task)
+    converter.convertSourceItems(*args)
+    return task[-2:]
+
+
+class STARRParallelConversion:
+    def __init__(self, modulePath, className=None, optionValues=None, stateFilename=DEFAULT_STATE_FILENAME):
+        """Run the conversion class in the module (by default the class with the same name as the module),
+        with any optionValues to set on its ConversionOptions.
+        """
+        self.modulePath = modulePath
+        self.className = className if className is not None else modulePath.split(".")[-1]
+        self.optionValues = dict(optionValues) if optionValues is not None else dict()
+        self.stateFilename = stateFilename
+
+        self.conversionName = "%s.%s" % (self.modulePath, self.className)
+
+    def run(self, startDate, endDate, partitionDays=PARTITION_DAYS, nWorkers=None):
+        """Convert the source items dated in [startDate, endDate), split into partitions of partitionDays.
+        nWorkers: Number of worker processes. Defaults to one per partition, up to the CPU count.
+            1 runs the partitions serially in this process.
+        """
+        partitions = datePartitions(startDate, endDate, partitionDays)
+        if nWorkers is None:
+            nWorkers = min(len(partitions), multiprocessing.cpu_count())
+
+        stateTable = ConversionStateTable(self.stateFilename)
+        pool = None
+        try:
+            mapFunc = imap
+            if nWorkers > 1:
+                pool = multiprocessing.Pool(nWorkers)
+                mapFunc = lambda func, tasks: pool.imap_unordered(func, tasks, chunksize=1)
+
+            if not stateTable.isCompleted(self.conversionName, CLINICAL_ITEM_STAGE, startDate, endDate):
+                log.info("Collecting new clinical items from %d partitions" % len(partitions))
+                self.insertNewClinicalItems(mapFunc(_collectPartition, self.partitionTasks(partitions)))
+                stateTable.markCompleted(self.conversionName, CLINICAL_ITEM_STAGE, startDate, endDate)
+
+            remainingPartitions = \
+                [   (partitionStart, partitionEnd) for (partitionStart, partitionEnd) in partitions
+                    if not stateTable.isCompleted(self.conversionName, PATIENT_ITEM_STAGE, partitionStart, partitionEnd)
+                ]
+            log.info("Converting %d of %d partitions" % (len(remainingPartitions), len(partitions)))
+            for (partitionStart, partitionEnd) in mapFunc(_convertPartition, self.partitionTasks(remainingPartitions)):
+                stateTable.markCompleted(self.conversionName, PATIENT_ITEM_STAGE, partitionStart, partitionEnd)
+                log.info("Converted %s - %s" % (partitionStart, partitionEnd))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            stateTable.close()
+
+    def partitionTasks(self, partitions):
+        return [(self.modulePath, self.className, self.optionValues, partitionStart, partitionEnd) for (partitionStart, partitionEnd) in partitions]
+
+    def insertNewClinicalItems(self, newItemRowsList):
+        """Insert the union of the new (category rows, clinical item rows) collected from each partition,
+        merged by the clinical item key columns they were collected with (keyCols, category rows, clinical item rows)
+        """
+        keyCols = None
+        allCategoryRows = list()
+        allClinicalItemRows = list()
+        for (keyCols, categoryRows, clinicalItemRows) in newItemRowsList:
+            allCategoryRows.extend(categoryRows)
+            allClinicalItemRows.extend(clinicalItemRows)
+        if keyCols is None:
+            return  # No partitions
+
+        conn = DBUtil.connection()
+        try:
+            ClinicalItemKeyCache(keyCols=keyCols).insertNewItemRows(allCategoryRows, allClinicalItemRows, conn)
+        finally:
+            conn.close()
+
+
+def main(argv):
+    """Main method, callable from command line"""
+    usageStr = "usage: %prog [options] <converterName>\n" + \
+        "   <converterName> - One of: %s\n" % str.join(", ", sorted(CONVERTER_MODULES.keys())) + \
+        "Rerun with the same arguments to resume an interrupted run."
+    parser = OptionParser(usage=usageStr)
+    parser.add_option("-s", "--startDate", dest="startDate", metavar="<startDate>", help="Date string (e.g., 2011-12-15), convert items dated on or after this date.")
+    parser.add_option("-e", "--endDate", dest="endDate", metavar="<endDate>", help="Date string (e.g., 2011-12-15), convert items dated before this date.")
+    parser.add_option("-d", "--partitionDays", dest="partitionDays", default=str(PARTITION_DAYS), help="Days of source items per partition. Default %d." % PARTITION_DAYS)
+    parser.add_option("-p", "--processes", dest="processes", help="Number of worker processes. Defaults to the CPU count.")
+    parser.add_option("-f", "--stateFile", dest="stateFile", default=DEFAULT_STATE_FILENAME, help="SQLite file to record completed partitions in. Default %s." % DEFAULT_STATE_FILENAME)
+    parser.add_option("-n", "--normalizeMixtures", dest="normalizeMixtures", action="store_true", help="order_med: Unravel / normalize medication mixtures into separate entries, one for each ingredient")
+    parser.add_option("-c", "--doseCountLimit", dest="doseCountLimit", help="order_med: Dose count limit to distinguish finite dose orders by")
+    parser.add_option("-a", "--aggregate", dest="aggregate", action="store_true", help="treatment_team: Aggregate similar treatment team roles")
+    (options, args) = parser.parse_args(argv[1:])
+
+    if len(args) != 1 or args[0] not in CONVERTER_MODULES or options.startDate is None or options.endDate is None:
+        parser.print_help()
+        sys.exit(-1)
+
+    log.info("Starting: " + str.join(" ", argv))
+    timer = time.time()
+
+    optionValues = dict()
+    if options.normalizeMixtures:
+        optionValues["normalizeMixtures"] = True
+    if options.doseCountLimit is not None:
+        optionValues["doseCountLimit"] = int(options.doseCountLimit)
+    optionValues["aggregate"] = bool(options.aggregate)   # Off unless specified, as in STARRTreatmentTeamConversion.main
+
+    conversion = STARRParallelConversion(CONVERTER_MODULES[args[0]], optionValues=optionValues, stateFilename=options.stateFile)
+
+    startDate = datetime(*time.strptime(options.startDate, DATE_FORMAT)[0:3])
+    endDate = datetime(*time.strptime(options.endDate, DATE_FORMAT)[0:3])
+    nWorkers = int(options.processes) if options.processes is not None else None
+    conversion.run(startDate, endDate, int(options.partitionDays), nWorkers)
+
+    timer = time.time() - timer
+    log.info("%.3f seconds to complete", timer)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -12,6 +12,7 @@ from medinfo.db.Model import SQLQuery
 from medinfo.db.Model import RowItemModel, modelListFromTable, modelDictFromList, RowItemFieldComparator
 
 from medinfo.dataconversion.Util import log
+from medinfo.dataconversion.ConversionCore import ClinicalItemKeyCache, PatientItemWriter
 from medinfo.dataconversion.Env import DATE_FORMAT
 
 from medinfo.db.bigquery import bigQueryUtil
@@ -53,6 +54,8 @@ class STARRTreatmentTeamConversion:
 
         self.categoryBySourceDescr = dict()  # Local cache to track the clinical item category table contents
         self.clinicalItemByCompositeKey = dict()  # Local cache to track clinical item table contents
+        self.keyCache = ClinicalItemKeyCache()  # Prewarmed clinical item keys, to resolve new items in batches
+        self.patientItemWriter = PatientItemWriter(self.keyCache)  # Buffer to write patient items in bulk
 
     def convertAndUpload(self, convOptions, tempDir=tempfile.gettempdir(), removeCsvs=True, targetDatasetId='clinical_item2018'):
         """
@@ -100,12 +103,28 @@ class STARRTreatmentTeamConversion:
                 log.debug('sourceItem: {}'.format(sourceItem))
                 self.convertSourceItem(category, sourceItem, conn=conn)
                 progress.Update()
+            self.patientItemWriter.flush(conn)
 
         finally:
             conn.close()
 
         progress.PrintStatus()
 
+    def collectNewClinicalItems(self, convOptions):
+        """Pre-pass for a parallel conversion (see STARRParallelConversion).
+        Derive the clinical item for each source item in the date range, without writing anything,
+        and return the new ones not yet in the database, as ClinicalItemKeyCache.newItemRows.
+        """
+        self.keyCache = ClinicalItemKeyCache(collectOnly=True)
+        conn = self.connFactory.connection()
+        try:
+            category = self.categoryFromSourceItem(conn)
+            for sourceItem in self.querySourceItems(convOptions):
+                self.clinicalItemFromSourceItem(sourceItem, category, conn=conn)
+        finally:
+            conn.close()
+        return self.keyCache.newItemRows()
+
     def querySourceItems(self, convOptions):
         """Query the database for list of all source clinical items (medications, etc.)
         and yield the results one at a time.  If startDate provided, only return items whose
@@ -247,6 +266,8 @@ class STARRTreatmentTeamConversion:
             #   in a first pass, with subsequent calls just yielding back in memory cached copies
             clinicalItem = self.clinicalItemFromSourceItem(sourceItem, category, conn=conn)
             ignoredPatientItem = self.patientItemFromSourceItem(sourceItem, clinicalItem, conn=conn)
+            if not extConn:
+                self.patientItemWriter.flush(conn)
 
         finally:
             if not extConn:
@@ -265,8 +286,7 @@ class STARRTreatmentTeamConversion:
                     "description": categoryDescription,
                 }
             )
-            (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", category, conn=conn)
-            category["clinical_item_category_id"] = categoryId
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn)
             self.categoryBySourceDescr[categoryKey] = category
         return self.categoryBySourceDescr[categoryKey]
 
@@ -283,8 +303,7 @@ class STARRTreatmentTeamConversion:
                     "description": sourceItem["description"],
                 }
             )
-            (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", clinicalItem, conn=conn)
-            clinicalItem["clinical_item_id"] = clinicalItemId
+            self.keyCache.addClinicalItem(clinicalItem)    # ID set now if existing, otherwise once inserted with the next batch
             self.clinicalItemByCompositeKey[clinicalItemKey] = clinicalItem
         return self.clinicalItemByCompositeKey[clinicalItemKey]
 
@@ -308,24 +327,8 @@ class STARRTreatmentTeamConversion:
             }
         )
 
-        insertQuery = DBUtil.buildInsertQuery("patient_item", patientItem.keys())
-        insertParams = patientItem.values()
-        try:
-            # Optimistic insert of a new unique item
-            DBUtil.execute(insertQuery, insertParams, conn=conn)
-            # Retrieve id of just inserted row
-            patientItem["patient_item_id"] = DBUtil.execute(DBUtil.identityQuery("patient_item"), conn=conn)[0][0]
-        except conn.IntegrityError, err:
-            # If turns out to be a duplicate, okay, pull out existing ID and continue to insert whatever else is possible
-            log.info(err)  # Lookup just by the composite key components to avoid attempting duplicate insertion again
-
-            searchPatientItem = {
-                "patient_id": patientItem["patient_id"],
-                "clinical_item_id": patientItem["clinical_item_id"],
-                "item_date": patientItem["item_date"],
-            }
-            (patientItem["patient_item_id"], isNew) = DBUtil.findOrInsertItem("patient_item", searchPatientItem,
-                                                                              conn=conn)
+        # Buffer to write in bulk, skipping any duplicates of existing items
+        self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn)
         return patientItem
 
     def main(self, argv):
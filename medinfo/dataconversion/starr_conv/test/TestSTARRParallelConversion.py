@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Test case for respective module in application package"""
+
+import sys, os
+import tempfile
+
+from datetime import datetime
+
+import unittest
+
+from medinfo.dataconversion.test.Const import RUNNER_VERBOSITY
+from medinfo.dataconversion.Util import log
+
+from medinfo.db.test.Util import DBTestCase
+
+from stride.clinical_item.ClinicalItemDataLoader import ClinicalItemDataLoader
+
+from medinfo.db import DBUtil
+from medinfo.db.Model import RowItemModel
+from medinfo.dataconversion.ConversionCore import ClinicalItemKeyCache, PatientItemWriter, CLINICAL_ITEM_IDENTITY_COLS
+
+from medinfo.dataconversion.starr_conv import STARRParallelConversion
+
+TEST_SOURCE_TABLE = "test_parallel_source"
+
+# (patient_id, code, item_date, description) source items, in the 3 weekly partitions from 2020-01-01 to 2020-01-21.
+#   Same codes may be found with different descriptions in different partitions, to be simplified to the preferred one.
+TEST_SOURCE_ITEMS = \
+    [   (-1, "C", datetime(2020, 1, 2), "Test C Tablet"),
+        (-1, "A", datetime(2020, 1, 3), "Test A"),
+        (-1, "E", datetime(2020, 1, 4), "Test E Injection"),
+        (-2, "C", datetime(2020, 1, 9), "Test C"),
+        (-2, "B", datetime(2020, 1, 10), "Test B"),
+        (-3, "A", datetime(2020, 1, 16), "Test A"),
+        (-3, "D", datetime(2020, 1, 17), "Test D"),
+        (-3, "D", datetime(2020, 1, 17), "Test D"),  # Duplicate
+        (-3, "E", datetime(2020, 1, 18), "Test E"),
+    ]
+
+
+class TestDateConversion:
+    """Minimal date range conversion module, in the form of the STARR ones, converting TEST_SOURCE_ITEMS.
+    Simplifies item descriptions as it goes, like STARROrderMedConversion.
+    """
+
+    def __init__(self):
+        self.connFactory = DBUtil.ConnectionFactory()
+        self.categoryBySourceDescr = dict()
+        self.clinicalItemByCode = dict()
+        self.keyCache = ClinicalItemKeyCache(keyCols=CLINICAL_ITEM_IDENTITY_COLS)
+        self.patientItemWriter = PatientItemWriter(self.keyCache)
+
+    def querySourceItems(self, startDate, endDate):
+        for (patientId, code, itemDate, description) in TEST_SOURCE_ITEMS:
+            if startDate <= itemDate < endDate:
+                yield RowItemModel([patientId, code, itemDate, description], ["patient_id", "code", "item_date", "description"])
+
+    def collectNewClinicalItems(self, startDate, endDate):
+        self.keyCache = ClinicalItemKeyCache(collectOnly=True, keyCols=CLINICAL_ITEM_IDENTITY_COLS)
+        conn = self.connFactory.connection()
+        try:
+            for sourceItem in self.querySourceItems(startDate, endDate):
+                self.clinicalItemFromSourceItem(sourceItem, self.categoryFromSourceItem(conn), conn)
+        finally:
+            conn.close()
+        return self.keyCache.newItemRows()
+
+    def convertSourceItems(self, startDate, endDate):
+        conn = self.connFactory.connection()
+        try:
+            for sourceItem in self.querySourceItems(startDate, endDate):
+                clinicalItem = self.clinicalItemFromSourceItem(sourceItem, self.categoryFromSourceItem(conn), conn)
+                patientItem = RowItemModel({"patient_id": sourceItem["patient_id"], "clinical_item_id": clinicalItem["clinical_item_id"], "item_date": sourceItem["item_date"]})
+                self.patientItemWriter.addPatientItem(patientItem, clinicalItem, conn)
+            self.patientItemWriter.flush(conn)
+        finally:
+            conn.close()
+
+    def categoryFromSourceItem(self, conn):
+        if TEST_SOURCE_TABLE not in self.categoryBySourceDescr:
+            category = RowItemModel({"source_table": TEST_SOURCE_TABLE, "description": "Test Category"})
+            category["clinical_item_category_id"] = self.keyCache.categoryId(category, conn)
+            self.categoryBySourceDescr[TEST_SOURCE_TABLE] = category
+        return self.categoryBySourceDescr[TEST_SOURCE_TABLE]
+
+    def clinicalItemFromSourceItem(self, sourceItem, category, conn):
+        if sourceItem["code"] not in self.clinicalItemByCode:
+            clinicalItem = RowItemModel(
+                {
+                    "clinical_item_category_id": category["clinical_item_category_id"],
+                    "external_id": None,
+                    "name": sourceItem["code"],
+                    "description": sourceItem["description"],
+                }
+            )
+            self.keyCache.addClinicalItem(clinicalItem)
+            self.clinicalItemByCode[sourceItem["code"]] = clinicalItem
+        self.keyCache.preferDescription(self.clinicalItemByCode[sourceItem["code"]], sourceItem["description"], conn)
+        return self.clinicalItemByCode[sourceItem["code"]]
+
+
+class TestSTARRParallelConversion(DBTestCase):
+    def setUp(self):
+        """Prepare state for test cases"""
+        DBTestCase.setUp(self)
+        ClinicalItemDataLoader.build_clinical_item_psql_schemata()
+
+        (fd, self.stateFilename) = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+
+        self.conversion = STARRParallelConversion.STARRParallelConversion(__name__, "TestDateConversion", stateFilename=self.stateFilename)
+        self.startDate = datetime(2020, 1, 1)
+        self.endDate = datetime(2020, 1, 21)
+
+    def tearDown(self):
+        """Restore state from any setUp or test steps"""
+        os.remove(self.stateFilename)
+        DBTestCase.tearDown(self)
+
+    def test_datePartitions(self):
+        expectedPartitions = \
+            [   (datetime(2020, 1, 1), datetime(2020, 1, 8)),
+                (datetime(2020, 1, 8), datetime(2020, 1, 15)),
+                (datetime(2020, 1, 15), datetime(2020, 1, 21)),
+            ]
+        self.assertEqual(expectedPartitions, STARRParallelConversion.datePartitions(self.startDate, self.endDate, 7))
+        self.assertEqual([], STARRParallelConversion.datePartitions(self.endDate, self.startDate, 7))
+
+    def test_run(self):
+        self.conversion.run(self.startDate, self.endDate, partitionDays=7, nWorkers=3)
+
+        # New clinical items created in order of their keys, rather than the order found or partitions finished in,
+        #   once each, with the preferred (shortest) of the descriptions found in different partitions
+        results = DBUtil.execute("select name, description from clinical_item order by clinical_item_id")
+        self.assertEqual([["A", "Test A"], ["B", "Test B"], ["C", "Test C"], ["D", "Test D"], ["E", "Test E"]], results)
+
+        query = \
+            """select pi.patient_id, ci.name, pi.item_date
+            from patient_item as pi, clinical_item as ci
+            where pi.clinical_item_id = ci.clinical_item_id
+            order by pi.item_date
+            """
+        expectedData = [list(sourceItem[:3]) for sourceItem in TEST_SOURCE_ITEMS]
+        expectedData.remove([-3, "D", datetime(2020, 1, 17)])   # Duplicate only converted once
+        self.assertEqual(expectedData, DBUtil.execute(query))
+
+        # Rerun with everything completed does nothing more
+        self.conversion.run(self.startDate, self.endDate, partitionDays=7, nWorkers=3)
+        self.assertEqual(expectedData, DBUtil.execute(query))
+        self.assertEqual(5, DBUtil.execute("select count(*) from clinical_item")[0][0])
+
+    def test_run_existingDescriptions(self):
+        # Existing clinical item with a generic template description, to be replaced by the preferred one found
+        (categoryId, isNew) = DBUtil.findOrInsertItem("clinical_item_category", RowItemModel({"source_table": TEST_SOURCE_TABLE, "description": "Test Category"}))
+        (clinicalItemId, isNew) = DBUtil.findOrInsertItem("clinical_item", RowItemModel({"clinical_item_category_id": categoryId, "name": "E", "description": "ZZZ Template E"}))
+
+        # Collecting new items for a partition does not update anything yet,
+        #   just reports the existing item with the preferred description found
+        task = self.conversion.partitionTasks([(datetime(2020, 1, 1), datetime(2020, 1, 8))])[0]
+        (keyCols, categoryRows, clinicalItemRows) = STARRParallelConversion._collectPartition(task)
+        self.assertEqual(CLINICAL_ITEM_IDENTITY_COLS, keyCols)
+        self.assertEqual([], categoryRows)
+        results = sorted([(row["name"], row["description"]) for row in clinicalItemRows])
+        self.assertEqual([("A", "Test A"), ("C", "Test C Tablet"), ("E", "Test E Injection")], results)
+        self.assertEqual([["ZZZ Template E"]], DBUtil.execute("select description from clinical_item"))
+
+        # Same results regardless of the order partitions are processed in, rerunning from scratch (empty state file)
+        for nWorkers in (1, 3):
+            open(self.stateFilename, "w").close()
+            self.conversion.run(self.startDate, self.endDate, partitionDays=7, nWorkers=nWorkers)
+            results = DBUtil.execute("select clinical_item_id, name, description from clinical_item where name in ('C','E') order by name")
+            self.assertEqual([["C", "Test C"], [clinicalItemId, "E", "Test E"]], [results[0][1:], results[1]])
+            self.assertEqual(5, DBUtil.execute("select count(*) from clinical_item")[0][0])
+            self.assertEqual(8, DBUtil.execute("select count(*) from patient_item")[0][0])
+
+    def test_run_resume(self):
+        # Simulate an interrupted run that had completed the middle partition, which should then be skipped
+        stateTable = STARRParallelConversion.ConversionStateTable(self.stateFilename)
+        stateTable.markCompleted(self.conversion.conversionName, STARRParallelConversion.PATIENT_ITEM_STAGE, datetime(2020, 1, 8), datetime(2020, 1, 15))
+        stateTable.close()
+
+        self.conversion.run(self.startDate, self.endDate, partitionDays=7, nWorkers=1)
+
+        results = DBUtil.execute("select patient_id from patient_item order by item_date")
+        self.assertEqual([[-1], [-1], [-1], [-3], [-3], [-3]], results)
+
+        stateTable = STARRParallelConversion.ConversionStateTable(self.stateFilename)
+        try:
+            self.assertTrue(stateTable.isCompleted(self.conversion.conversionName, STARRParallelConversion.CLINICAL_ITEM_STAGE, self.startDate, self.endDate))
+            for (startDate, endDate) in STARRParallelConversion.datePartitions(self.startDate, self.endDate, 7):
+                self.assertTrue(stateTable.isCompleted(self.conversion.conversionName, STARRParallelConversion.PATIENT_ITEM_STAGE, startDate, endDate))
+        finally:
+            stateTable.close()
+
+
+def suite():
+    """Returns the suite of tests to run for this test class / module.
+    Use unittest.makeSuite methods which simply extracts all of the
+    methods for the given class whose name starts with "test"
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestSTARRParallelConversion))
+
+    return test_suite
+
+
+if __name__ == "__main__":
+    unittest.TextTestRunner(verbosity=RUNNER_VERBOSITY).run(suite())
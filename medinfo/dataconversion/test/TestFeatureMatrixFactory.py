@@ -236,6 +236,44 @@ class TestFeatureMatrixFactory(DBTestCase):
 
         self.assertEqualList(resultMatrix[2:], expectedMatrix)
 
+    def test_addFeaturesInParallel(self):
+        # Same features, added one after another or as a parallel feature plan
+        preTimeDelta = datetime.timedelta(-90)
+        postTimeDelta = datetime.timedelta(0)
+        featurePlan = \
+            [   ("addClinicalItemFeatures", (["TestItem100"],), {}),
+                ("addFlowsheetFeatures", (["Resp","FiO2"], preTimeDelta, postTimeDelta), {}),
+                ("addClinicalItemFeatures", (["TestItem200"],), {"features": "pre"}),
+                ("addTimeCycleFeatures", ("order_time", "month"), {}),
+            ]
+
+        resultMatrixByWorkers = dict()
+        for nWorkers in (1, 3):
+            patientEpisodeQuery = SQLQuery()
+            patientEpisodeQuery.addSelect("CAST(pat_id AS bigint)")
+            patientEpisodeQuery.addSelect("sop.order_proc_id AS order_proc_id")
+            patientEpisodeQuery.addSelect("order_time")
+            patientEpisodeQuery.addFrom("stride_order_proc AS sop")
+            patientEpisodeQuery.addWhereEqual("proc_code", "LABMETB")
+            patientEpisodeQuery.addOrderBy("pat_id, sop.order_proc_id, order_time")
+            cursor = self.connection.cursor()
+            cursor.execute(str(patientEpisodeQuery), patientEpisodeQuery.params)
+
+            factory = FeatureMatrixFactory()
+            factory.setPatientEpisodeInput(cursor, "pat_id", "order_time")
+            factory.processPatientEpisodeInput()
+            factory.addFeaturesInParallel(featurePlan, nWorkers=nWorkers)
+            factory.buildFeatureMatrix()
+            resultMatrixByWorkers[nWorkers] = factory.readFeatureMatrixFile()[2:]
+            os.remove(factory.getMatrixFileName())
+
+        self.assertTrue(len(resultMatrixByWorkers[1]) > 1)
+        # Feature families in plan order
+        header = resultMatrixByWorkers[1][0]
+        self.assertEqual(75, len(header))
+        self.assertEqual(["TestItem100.preTimeDays", "Resp.-90_0.count", "TestItem200.preTimeDays", "order_time.month"], [header[3], header[29], header[59], header[72]])
+        self.assertEqual(resultMatrixByWorkers[1], resultMatrixByWorkers[3])
+
     def test_buildFeatureMatrix_prePostFeatures(self):
         """
         Test features parameter in addClinicalItemFeatures which allows
@@ -447,6 +485,73 @@ class TestFeatureMatrixFactory(DBTestCase):
         except OSError:
             pass
 
+    def test_countItemEvents(self):
+        itemTimes = [datetime.datetime(2010,1,1), datetime.datetime(2010,1,3,12), datetime.datetime(2010,1,5), datetime.datetime(2010,1,5), datetime.datetime(2010,1,12)]
+        episodeTimes = [datetime.datetime(2009,12,1), datetime.datetime(2010,1,5), datetime.datetime(2010,1,13)]
+        itemMicros = self.factory._datetimeMicros(itemTimes)
+        episodeMicros = self.factory._datetimeMicros(episodeTimes)
+
+        (preTimeDays, preCounts, postTimeDays, postCounts) = self.factory._countItemEvents(itemMicros, episodeMicros, [1,4,7])
+
+        # Events at the index time count as post. Day bins include their boundary.
+        self.assertEqual([None, -1.5, -1.0], preTimeDays)
+        self.assertEqual([[0,0,0,0], [2,0,2,2], [5,1,1,1]], preCounts.tolist())
+        self.assertEqual([31.0, 0.0, None], postTimeDays)
+        self.assertEqual([[5,0,0,0], [3,2,2,3], [0,0,0,0]], postCounts.tolist())
+
+    def test_addResultFeatures_singlePatient(self):
+        # Summarize results for each index time within [indexTime-5 days, indexTime+3 days)
+        preTimeDelta = datetime.timedelta(-5)
+        postTimeDelta = datetime.timedelta(3)
+        resultsByName = \
+            {   "Foo":
+                [   {"value": 3.0, "time": datetime.datetime(2010,1,8), "result_in_range_yn": "Y"},
+                    {"value": 1.0, "time": datetime.datetime(2010,1,6), "result_in_range_yn": "N"},
+                    {"value": 5.0, "time": datetime.datetime(2010,1,8), "result_in_range_yn": "Y"},
+                    {"value": 4.0, "time": datetime.datetime(2010,1,12), "result_in_range_yn": "N"},
+                    {"value": 100.0, "time": None, "result_in_range_yn": "Y"},  # No time, so ignored
+                ],
+            }
+        patientEpisodeByIndexTime = \
+            {   datetime.datetime(2010,1,9): {},
+                datetime.datetime(2010,1,10): {},
+                datetime.datetime(2010,1,20): {},
+            }
+        self.factory._addResultFeatures_singlePatient(patientEpisodeByIndexTime, resultsByName, \
+            ["Foo","Bar"], "value", "time", preTimeDelta, postTimeDelta)
+
+        # Ties in time or proximity resolve to the first listed result
+        expectedFooFeatures = \
+            {   datetime.datetime(2010,1,9):
+                {   "count": 3, "countInRange": 2, "min": 1.0, "max": 5.0, "median": 3.0, "mean": 3.0, "std": 1.63299,
+                    "first": 1.0, "last": 3.0, "diff": 2.0, "slope": 1.0, "proximate": 3.0,
+                    "firstTimeDays": -3.0, "lastTimeDays": -1.0, "proximateTimeDays": -1.0,
+                },
+                datetime.datetime(2010,1,10):
+                {   "count": 4, "countInRange": 2, "min": 1.0, "max": 5.0, "median": 3.5, "mean": 3.25, "std": 1.47902,
+                    "first": 1.0, "last": 4.0, "diff": 3.0, "slope": 0.5, "proximate": 3.0,
+                    "firstTimeDays": -4.0, "lastTimeDays": 2.0, "proximateTimeDays": -2.0,
+                },
+            }
+        emptyFeatures = dict( (suffix, None) for suffix in FeatureMatrixFactory.RESULT_FEATURE_SUFFIXES )
+        emptyFeatures["count"] = 0
+        emptyFeatures["countInRange"] = 0
+        expectedFooFeatures[datetime.datetime(2010,1,20)] = emptyFeatures
+
+        for indexTime, patient in patientEpisodeByIndexTime.iteritems():
+            for suffix in FeatureMatrixFactory.RESULT_FEATURE_SUFFIXES:
+                expectedValue = expectedFooFeatures[indexTime][suffix]
+                if expectedValue is None:
+                    self.assertEqual(None, patient["Foo.-5_3.%s" % suffix])
+                else:
+                    self.assertAlmostEqual(expectedValue, patient["Foo.-5_3.%s" % suffix], 5)
+                self.assertEqual(emptyFeatures[suffix], patient["Bar.-5_3.%s" % suffix])
+
+        # No results pass only fills in columns not yet populated
+        self.factory._addResultFeatures_singlePatient(patientEpisodeByIndexTime, None, \
+            ["Foo"], "value", "time", preTimeDelta, postTimeDelta)
+        self.assertEqual(4, patientEpisodeByIndexTime[datetime.datetime(2010,1,10)]["Foo.-5_3.count"])
+
     def test_loadMapData(self):
         self.factory = FeatureMatrixFactory()
 
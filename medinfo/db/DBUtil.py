@@ -13,22 +13,24 @@ If using different DB-API modules, this module should
 be edited in the following places...
     - module import statements
     - Env.SQL_PLACEHOLDER (in Env.py file)
-    - connection method (including references to Env constants)
+    - openConnection method (including references to Env constants)
     - identityQuery method
 """
 
 import sys, os
 import subprocess
+import threading;
 import time;
 from datetime import datetime;
 import json;
 import csv;
+from cStringIO import StringIO;
 from getpass import getpass;
 from optparse import OptionParser
 from medinfo.common.Const import EST_INPUT, COMMENT_TAG, TOKEN_END, NULL_STRING;
 from medinfo.common.Util import stdOpen, isStdFile, fileLineCount, ProgressDots;
 from medinfo.common.Util import parseDateValue, asciiSafeStr;
-from Model import SQLQuery, RowItemModel;
+from Model import SQLQuery, RowItemModel, generatePlaceholders;
 from Model import modelListFromTable, modelDictFromList;
 from Const import DEFAULT_ID_COL_SUFFIX, SQL_DELIM;
 from Env import DB_PARAM;   # Default connection parameters
@@ -38,6 +40,16 @@ from medinfo.db import Util;
 
 DOUBLE_TOKEN_END = TOKEN_END+TOKEN_END;
 
+ROWS_PER_COPY = 100000;  # Rows to stream per COPY in bulkInsertRows
+ROWS_PER_INSERT = 1000;  # Rows per multi-row insert query in bulkInsertRows, for connectors without COPY
+ROWS_PER_FETCH = 10000;  # Rows to fetch at a time from a streamingCursor in iterateRows
+UPDATE_STAGE_TABLE = "update_from_file_stage";  # Temp table to stage rows to update in updateFromFile
+INSERT_STAGE_TABLE = "insert_new_rows_stage";   # Temp table to stage rows to insert in bulkInsertNewRows
+SQLITE_UPSERT_VERSION = (3,24,0);   # First SQLite version with insert ... on conflict do update
+
+MAX_POOLED_CONNECTIONS = 8;  # Idle connections per database to keep open for reuse by connection(). 0 to always open new ones
+POOLED_CONNECTION_CHECK_SECONDS = 60;   # Verify pooled connections idle longer than this still work before reusing them
+
 ###################################################
 ######### BEGIN Database Specific Stuff ###########
 ###################################################
@@ -47,8 +59,9 @@ SQL_PLACEHOLDER = Env.SQL_PLACEHOLDER;
 
 def connection( connParams=None ):
     """Return a connection to the application database.
-    Implementation of this method should change depending upon what
-    database is being interfaced to.
+    Connections come from the process-wide connectionPool, so calling close()
+    on the returned connection will roll back any uncommitted work and
+    return it to the pool for reuse, rather than disconnecting.
     """
     Util.numConnections += 1;
 
@@ -62,7 +75,14 @@ def connection( connParams=None ):
 
     if Util.numConnections <= 1:
         log.info("Preparing DB Connection to %(DSN)s@%(HOST)s as %(UID)s" % connParams );
-    
+
+    return connectionPool.connection(connParams);
+
+def openConnection( connParams ):
+    """Open a new (unpooled) connection to the application database.
+    Implementation of this method should change depending upon what
+    database is being interfaced to.
+    """
     # MySQLdb
     if Env.DATABASE_CONNECTOR_NAME == "mysql.connector":
         import mysql.connector; 
@@ -155,6 +175,8 @@ def dropDatabase( dbParams ):
     """Drop the database specified by the DSN name specified in the dbParams.
     Will likely require logging in first as the user-password specified.
     """
+    # Pooled idle connections would block the drop, or be left pointing to the dropped database
+    connectionPool.close();
     if Env.DATABASE_CONNECTOR_NAME == "psycopg2":
     # For PostgreSQL, cannot drop database while connected to it, so connect to default "postgres" database to start.
         defaultParams = dict(dbParams);
@@ -173,16 +195,409 @@ def dropDatabase( dbParams ):
         except:
             pass
 
+def streamingCursor( conn, name="stream_cursor" ):
+    """Return a cursor whose query results are streamed from the database server in batches
+    (see iterateRows), rather than the whole result set being loaded into client memory on execute.
+    For PostgreSQL, a named (server-side) cursor, held open across any commits on the connection.
+    For MySQL, an unbuffered cursor, in which case no other queries can run on the connection
+    until all of the results are read, so callers should generally use a dedicated connection.
+    """
+    if Env.DATABASE_CONNECTOR_NAME == "psycopg2":
+        cursor = conn.cursor(name, withhold=True);
+        cursor.itersize = ROWS_PER_FETCH;
+        return cursor;
+    elif Env.DATABASE_CONNECTOR_NAME == "mysql.connector":
+        return conn.cursor(buffered=False);
+    elif Env.DATABASE_CONNECTOR_NAME == "MySQLdb":
+        import MySQLdb.cursors;
+        return conn.cursor(MySQLdb.cursors.SSCursor);
+    else:
+        return conn.cursor();
+
+def iterateRows( cursor, rowsPerFetch=ROWS_PER_FETCH ):
+    """Generator over the result rows of an executed cursor, fetching rowsPerFetch rows at a time"""
+    rows = cursor.fetchmany(rowsPerFetch);
+    while rows:
+        for row in rows:
+            yield row;
+        rows = cursor.fetchmany(rowsPerFetch);
+
+def bulkInsertRows( tableName, columnNames, rows, conn, rowsPerInsert=None ):
+    """Insert many rows (tuples of values corresponding to columnNames) into the named table,
+    without a separate query per row.  For PostgreSQL, streams the rows via COPY
+    (in chunks of rowsPerInsert rows).  For other connectors, uses multi-row insert ... values queries,
+    each for up to rowsPerInsert rows.
+    Returns the number of rows inserted.
+    """
+    if rowsPerInsert is None:
+        rowsPerInsert = ROWS_PER_COPY if Env.DATABASE_CONNECTOR_NAME == "psycopg2" else ROWS_PER_INSERT;
+
+    nRows = 0;
+    cursor = conn.cursor();
+    try:
+        rowChunk = list();
+        for row in rows:
+            rowChunk.append(row);
+            if len(rowChunk) >= rowsPerInsert:
+                nRows += bulkInsertRowChunk( tableName, columnNames, rowChunk, cursor );
+                rowChunk = list();
+        if len(rowChunk) > 0:
+            nRows += bulkInsertRowChunk( tableName, columnNames, rowChunk, cursor );
+    finally:
+        cursor.close();
+    return nRows;
+
+def bulkInsertRowChunk( tableName, columnNames, rowChunk, cursor ):
+    if Env.DATABASE_CONNECTOR_NAME == "psycopg2":
+        copyFile = StringIO();
+        for row in rowChunk:
+            copyFile.write( str.join("\t", [copyValueStr(value) for value in row]) );
+            copyFile.write("\n");
+        copyFile.seek(0);
+        cursor.copy_from( copyFile, tableName, sep="\t", null="\\N", columns=columnNames );
+    elif Env.DATABASE_CONNECTOR_NAME == "sqlite3":
+        # sqlite limits the number of parameters per query, but executemany of a single row insert is just as fast
+        query = "insert into %s (%s) values (%s)" % (tableName, str.join(",", columnNames), generatePlaceholders(len(columnNames)) );
+        cursor.executemany( query, [tuple(row) for row in rowChunk] );
+    else:
+        rowPlaceholders = "(%s)" % generatePlaceholders(len(columnNames));
+        query = "insert into %s (%s) values %s" % (tableName, str.join(",", columnNames), str.join(",", [rowPlaceholders]*len(rowChunk)) );
+        params = list();
+        for row in rowChunk:
+            params.extend(row);
+        cursor.execute( query, tuple(params) );
+    return len(rowChunk);
+
+def insertRowsReturningIds( tableName, columnNames, rows, conn, rowsPerInsert=ROWS_PER_INSERT ):
+    """Insert rows (tuples of values corresponding to columnNames) into the named table
+    and return the list of the auto-generated primary key values of the new rows, in the same order.
+    For PostgreSQL, a multi-row insert ... returning query per rowsPerInsert rows
+    (which returns the new rows in the order of its values list).
+    For other connectors, one insert query and identity lookup per row.
+    Does not commit.
+    """
+    ids = list();
+    cursor = conn.cursor();
+    try:
+        if Env.DATABASE_CONNECTOR_NAME == "psycopg2":
+            rowPlaceholders = "(%s)" % generatePlaceholders(len(columnNames));
+            for iStart in xrange(0, len(rows), rowsPerInsert):
+                rowChunk = rows[iStart:iStart+rowsPerInsert];
+                query = "insert into %s (%s) values %s returning %s" % (tableName, str.join(",", columnNames), str.join(",", [rowPlaceholders]*len(rowChunk)), defaultIDColumn(tableName) );
+                params = list();
+                for row in rowChunk:
+                    params.extend(row);
+                cursor.execute( query, tuple(params) );
+                ids.extend( [result[0] for result in cursor.fetchall()] );
+        else:
+            query = buildInsertQuery( tableName, columnNames );
+            for row in rows:
+                cursor.execute( query, tuple(row) );
+                if Env.DATABASE_CONNECTOR_NAME == "sqlite3":
+                    ids.append( cursor.lastrowid );
+                else:
+                    cursor.execute( identityQuery(tableName) );
+                    ids.append( cursor.fetchone()[0] );
+    finally:
+        cursor.close();
+    return ids;
+
+def bulkInsertNewRows( tableName, columnNames, keyColNames, rows, conn, retrieveCol=None ):
+    """Insert a list of rows (tuples of values corresponding to columnNames) into the named table,
+    skipping any whose (not null) keyColNames values match an existing row or an earlier row in the list.
+    For PostgreSQL, duplicates are resolved set-wise: the rows are streamed via COPY
+    into a temp staging table, followed by a single insert ... select of the new rows.
+    For other connectors, one findOrInsertItem per row.
+
+    If retrieveCol is provided, returns a list with the retrieveCol value of the (new or existing)
+    table row matching the keys of each of the given rows.  Otherwise returns None.
+    Does not commit, so the caller can roll back the whole list on failure.
+    """
+    if Env.DATABASE_CONNECTOR_NAME != "psycopg2":
+        values = list();
+        for row in rows:
+            rowModel = RowItemModel( row, columnNames );
+            searchModel = RowItemModel( rowModel.valuesByName(keyColNames), keyColNames );
+            (value, isNew) = findOrInsertItem( tableName, searchModel, rowModel, retrieveCol=retrieveCol, autoCommit=False, conn=conn );
+            values.append(value);
+        if retrieveCol is None:
+            values = None;
+        return values;
+
+    values = None;
+    keyCols = str.join(",", keyColNames);
+    matchClause = str.join(" and ", ["%s.%s = stage.%s" % (tableName, col, col) for col in keyColNames]);
+    cursor = conn.cursor();
+    try:
+        cursor.execute("drop table if exists %s" % INSERT_STAGE_TABLE);
+        cursor.execute("create temp table %s as select 0 as stage_line, %s from %s where 1=0" % (INSERT_STAGE_TABLE, str.join(",", columnNames), tableName) );
+        stageRows = [[iRow] + list(row) for (iRow, row) in enumerate(rows)];
+        bulkInsertRowChunk( INSERT_STAGE_TABLE, ["stage_line"] + list(columnNames), stageRows, cursor );
+
+        # First of any rows with the same keys, unless already in the table.
+        #   On conflict clause in case of concurrent inserts of the same keys
+        query = \
+            """insert into %(table)s (%(cols)s)
+            select %(cols)s
+            from
+            (   select distinct on (%(keys)s) *
+                from %(stage)s as stage
+                where not exists (select 1 from %(table)s where %(match)s)
+                order by %(keys)s, stage_line
+            ) as stage
+            order by stage_line
+            on conflict do nothing
+            """ % {"table": tableName, "cols": str.join(",", columnNames), "keys": keyCols, "stage": INSERT_STAGE_TABLE, "match": matchClause};
+        cursor.execute(query);
+
+        if retrieveCol is not None:
+            cursor.execute("select stage.stage_line, %s.%s from %s as stage join %s on %s" % (tableName, retrieveCol, INSERT_STAGE_TABLE, tableName, matchClause) );
+            valueByLine = dict(cursor.fetchall());
+            values = [valueByLine.get(iRow) for iRow in xrange(len(rows))];
+
+        cursor.execute("drop table %s" % INSERT_STAGE_TABLE);
+    finally:
+        cursor.close();
+    return values;
+
+def copyValueStr( value ):
+    """String representation of a value for a PostgreSQL COPY text format row"""
+    if value is None:
+        return "\\N";
+    elif isinstance(value, float):
+        return repr(value);   # Full precision
+    elif isinstance(value, datetime):
+        return value.isoformat(" ");
+    else:
+        if isinstance(value, unicode):
+            value = value.encode("utf-8");
+        return str(value).replace("\\","\\\\").replace("\t","\\t").replace("\n","\\n").replace("\r","\\r");
+
+def buildUpsertQueries( tableName, keyColNames, incrementColNames, sourceQuery ):
+    """Build the queries (to execute in order) to insert all rows from the sourceQuery
+    (which should select the keyColNames followed by the incrementColNames) into the named table.
+    For any rows that conflict with existing ones on the (unique) keyColNames,
+    instead increment the existing incrementColNames values by the new ones.
+    If no incrementColNames, then conflicting rows are just skipped.
+
+    A single set-based upsert query where the database supports one (PostgreSQL, MySQL, SQLite since SQLITE_UPSERT_VERSION).
+    Otherwise, an update of the existing rows (with correlated subqueries), followed by an insert of the rest.
+    """
+    colNames = list(keyColNames) + list(incrementColNames);
+    intoClause = "into %s (%s)" % (tableName, str.join(",", colNames));
+    query = None;
+
+    if Env.DATABASE_CONNECTOR_NAME == "psycopg2":
+        query = ["insert", intoClause, sourceQuery];
+    elif Env.DATABASE_CONNECTOR_NAME == "sqlite3":
+        import sqlite3;
+        if sqlite3.sqlite_version_info >= SQLITE_UPSERT_VERSION:
+            # "where true" so the on conflict clause is not parsed as a join constraint of the source select
+            query = ["insert", intoClause, "select * from (%s) as source where true" % sourceQuery];
+    if query is not None:
+        query.append("on conflict (%s) do" % str.join(",", keyColNames) );
+        if len(incrementColNames) < 1:
+            query.append("nothing");
+        else:
+            query.append("update set");
+            query.append( str.join(",", ["%(col)s = %(table)s.%(col)s + excluded.%(col)s" % {"table": tableName, "col": col} for col in incrementColNames]) );
+        return [str.join(" ", query)];
+
+    if Env.DATABASE_CONNECTOR_NAME in ("mysql.connector", "MySQLdb"):
+        if len(incrementColNames) < 1:
+            return [str.join(" ", ["insert ignore", intoClause, sourceQuery])];
+        query = ["insert", intoClause, sourceQuery];
+        query.append("on duplicate key update");
+        query.append( str.join(",", ["%(col)s = %(col)s + values(%(col)s)" % {"col": col} for col in incrementColNames]) );
+        return [str.join(" ", query)];
+
+    # No upsert syntax available
+    matchClause = str.join(" and ", ["source.%(col)s = %(table)s.%(col)s" % {"table": tableName, "col": col} for col in keyColNames]);
+    queries = list();
+    if len(incrementColNames) > 0:
+        sourceMatch = "from (%s) source where %s" % (sourceQuery, matchClause);
+        setClause = str.join(",", ["%(col)s = %(col)s + (select source.%(col)s %(sourceMatch)s)" % {"col": col, "sourceMatch": sourceMatch} for col in incrementColNames]);
+        queries.append("update %s set %s where exists (select 1 %s)" % (tableName, setClause, sourceMatch) );
+    queries.append("insert %s select * from (%s) source where not exists (select 1 from %s where %s)" % (intoClause, sourceQuery, tableName, matchClause) );
+    return queries;
+
 ###################################################
 #########  END  Database Specific Stuff ###########
 ###################################################
 
+def connectionSettings( conn ):
+    """Transaction settings of a connection, to tell if a caller changed them"""
+    return (getattr(conn, "autocommit", None), getattr(conn, "isolation_level", None));
+
+class PooledConnection(object):
+    """Wrapper around a pooled DB-API connection, delegating everything to it,
+    except close, which returns the connection to its pool instead.
+    """
+    def __init__(self, pool, poolKey, conn, settings):
+        self.__dict__.update(_pool=pool, _poolKey=poolKey, _conn=conn, _settings=settings, _pid=os.getpid());
+
+    def close(self):
+        conn = self.__dict__["_conn"];
+        if conn is not None:
+            self.__dict__["_conn"] = None;
+            self._pool.checkin(self._poolKey, conn, self._settings, self._pid);
+
+    def rawConnection(self):
+        """Underlying DB-API connection"""
+        conn = self.__dict__["_conn"];
+        if conn is None:
+            raise ValueError("Connection already closed (returned to pool)");
+        return conn;
+
+    def __getattr__(self, name):
+        return getattr(self.rawConnection(), name);
+
+    def __setattr__(self, name, value):
+        setattr(self.rawConnection(), name, value);
+
+    def __enter__(self):
+        return self.rawConnection().__enter__();
+
+    def __exit__(self, *args):
+        return self.rawConnection().__exit__(*args);
+
+class ConnectionPool:
+    """Process-wide pool of open database connections, keyed by connection parameters,
+    so the many short connection(), query, close() sequences in an application
+    do not each pay for a new database connection and login.
+
+    Connections are checked out by connection() and checked back in by their close().
+    On check in, any open transaction is rolled back (as closing would have done),
+    and connections whose transaction settings (e.g., autocommit) were changed are closed
+    rather than reused.  Up to MAX_POOLED_CONNECTIONS idle connections are kept per
+    key, with any more opened as needed and closed when returned.
+    Idle connections are checked to still work before being reused.
+
+    After a fork (e.g., multiprocessing workers), the child process starts a new pool.
+    Connections inherited from the parent share its network sockets, so they are
+    set aside, never used or closed by the child.
+    """
+    def __init__(self):
+        self.lock = threading.Lock();
+        self.pid = os.getpid();
+        self.idleConnsByKey = dict();   # (conn, settings, idleSinceTime) tuples, by pool key
+        self.inheritedConns = list();   # Connections from a parent process, kept only to avoid closing them
+
+    def poolKey(self, connParams):
+        key = tuple(sorted(connParams.iteritems()));
+        if Env.DATABASE_CONNECTOR_NAME == "sqlite3":
+            # sqlite3 connections may only be used by the thread that opened them
+            key += (threading.current_thread().ident,);
+        return key;
+
+    def _checkFork(self):
+        """Start a new pool if this is now a forked child process. Call with lock held."""
+        if self.pid != os.getpid():
+            for idleConns in self.idleConnsByKey.itervalues():
+                self.inheritedConns.extend([conn for (conn, settings, idleSince) in idleConns]);
+            self.idleConnsByKey = dict();
+            self.pid = os.getpid();
+
+    def connection(self, connParams):
+        """Check out a pooled connection for the connParams, opening a new one if none available"""
+        key = self.poolKey(connParams);
+        while True:
+            self.lock.acquire();
+            try:
+                self._checkFork();
+                idleConns = self.idleConnsByKey.get(key);
+                if not idleConns:
+                    break;
+                (conn, settings, idleSince) = idleConns.pop();
+            finally:
+                self.lock.release();
+            if self.isUsable(conn, idleSince):
+                return PooledConnection(self, key, conn, settings);
+            self.discard(conn);
+
+        conn = openConnection(connParams);
+        return PooledConnection(self, key, conn, connectionSettings(conn));
+
+    def checkin(self, key, conn, settings, pid):
+        """Return a checked out connection to the pool, or close it if cannot be reused"""
+        if pid != os.getpid():
+            # Checked out before a fork. Belongs to the parent process.
+            self.inheritedConns.append(conn);
+            return;
+        try:
+            conn.rollback();
+        except Exception, err:
+            log.debug(err);
+            self.discard(conn);
+            return;
+        if connectionSettings(conn) != settings:
+            self.discard(conn);
+            return;
+
+        self.lock.acquire();
+        try:
+            self._checkFork();
+            idleConns = self.idleConnsByKey.setdefault(key, list());
+            if len(idleConns) < MAX_POOLED_CONNECTIONS:
+                idleConns.append((conn, settings, time.time()));
+                return;
+        finally:
+            self.lock.release();
+        self.discard(conn);
+
+    def isUsable(self, conn, idleSince):
+        """Health check on a connection before reusing it"""
+        if getattr(conn, "closed", False):  # psycopg2 reports connections closed by the server
+            return False;
+        if time.time() - idleSince > POOLED_CONNECTION_CHECK_SECONDS:
+            try:
+                cursor = conn.cursor();
+                cursor.execute("SELECT 1");
+                cursor.fetchall();
+                cursor.close();
+                conn.rollback();
+            except Exception, err:
+                log.debug(err);
+                return False;
+        return True;
+
+    def discard(self, conn):
+        try:
+            conn.close();
+        except Exception, err:
+            log.debug(err);
+
+    def idleCount(self):
+        self.lock.acquire();
+        try:
+            self._checkFork();
+            return sum([len(idleConns) for idleConns in self.idleConnsByKey.itervalues()]);
+        finally:
+            self.lock.release();
+
+    def close(self):
+        """Close all idle connections, such as before dropping a database they may be connected to"""
+        self.lock.acquire();
+        try:
+            self._checkFork();
+            idleConnsByKey = self.idleConnsByKey;
+            self.idleConnsByKey = dict();
+        finally:
+            self.lock.release();
+        for idleConns in idleConnsByKey.itervalues():
+            for (conn, settings, idleSince) in idleConns:
+                self.discard(conn);
+
+"""Default pool of connections for connection()"""
+connectionPool = ConnectionPool();
+
 class ConnectionFactory:
     """Simple factory object to encapsulate the primary DBUtil.connection function.
     This way, we can pass around the *means* to produce a connection object,
     without having to pass around an actual connection object (which spares
     the caller the responsibility of having to take care of connection
     committing and closing, etc.
+    Connections are checked out of the connectionPool, so are cheap to get and close repeatedly.
     """
     
     def __init__(self, connParam=None):
@@ -383,8 +798,8 @@ def normalizeColName( col ):
 def insertFile( sourceFile, tableName, columnNames=None, delim=None, idFile=None, skipErrors=False, dateColFormats=None, escapeStrings=False, estInput=None, connFactory=None ):
     """Insert the contents of a whitespace-delimited text file into the database.
     
-    For PostgreSQL specifically, consider alternative direct COPY command that can run 10x:
-    E.g., gzip -d -c TTeam_2014.tsv.gz | psql -U jonc101 -c "COPY tteamx (  pat_deid,  enc_deid,  relation,  prov_id,  prov_name,  start_date,  end_date ) FROM STDIN WITH (FORMAT csv, DELIMITER E'\t', HEADER, NULL 'None');" resident-access-log-2017
+    Rows are parsed and then inserted in bulk chunks with bulkInsertRowChunk (COPY for PostgreSQL).
+    If a chunk fails, its rows are retried one insert at a time, to report (or skip) the lines with errors.
 
     Inserts the contents of the <sourceFile> into the database
     under the <tableName>.  One line is expected in the <sourceFile>
@@ -456,49 +871,24 @@ def insertFile( sourceFile, tableName, columnNames=None, delim=None, idFile=None
         log.debug(sql)
         
 
-        # Loop through file and execute insert statement everytime find enough delimited parameters.  
+        # Loop through file and insert chunks of rows everytime find enough delimited parameters.
+        rowsPerChunk = ROWS_PER_COPY if Env.DATABASE_CONNECTOR_NAME == "psycopg2" else ROWS_PER_INSERT;
         nInserts = 0
-        nCols = len(columnNames)
-        params = list();
+        rowChunk = list();
         progress = ProgressDots(total=estInput);
         for iLine, rowModel in enumerate(reader):
             # Parse out data values from strings
+            params = list();
             for iCol, colName in enumerate(columnNames):
                 value = parseValue(rowModel[colName], colName, dateColFormats, escapeStrings);
                 params.append(value);
+            rowChunk.append(params);
 
-            log.debug(params)
-            try:
-                cur.execute(sql,tuple(params))
-                nInserts += cur.rowcount
-
-                if idFile != None:
-                    rowId = None;
-                    if iIdCol is not None:  # Look for manually assigned ID value first
-                        rowId = params[iIdCol];
-                    else:
-                        cur.execute(identityQuery(tableName));
-                        rowId = cur.fetchone()[0];
-                    print >> idFile, rowId;
-
-                # Need to "auto-commit" after each command, 
-                #   otherwise a skipped error will rollback 
-                #   any previous commands as well
-                if skipErrors: 
-                    conn.commit()    
-
-                progress.Update()
-
-            except Exception, err:
-                log.info(sql);
-                log.info(tuple(params))
-                conn.rollback();    # Reset any changes since the last commit
-                if skipErrors:
-                    log.warning("Error Executing in Script: "+ sql )
-                    log.warning(err)
-                else:
-                    raise;
-            params = list();
+            if len(rowChunk) >= rowsPerChunk:
+                nInserts += insertFileRowChunk( tableName, columnNames, rowChunk, sql, iIdCol, idFile, skipErrors, conn, cur, progress );
+                rowChunk = list();
+        if len(rowChunk) > 0:
+            nInserts += insertFileRowChunk( tableName, columnNames, rowChunk, sql, iIdCol, idFile, skipErrors, conn, cur, progress );
 
         conn.commit()
 
@@ -510,6 +900,86 @@ def insertFile( sourceFile, tableName, columnNames=None, delim=None, idFile=None
     return 0    
 
 
+def insertFileRowChunk( tableName, columnNames, rowChunk, sql, iIdCol, idFile, skipErrors, conn, cur, progress ):
+    """Insert a chunk of parsed rows for insertFile in bulk.
+    If the bulk insert fails (or the connector has no way to know the new rows' IDs
+    for the idFile up front), insert the rows one at a time with the sql insert query instead,
+    to report (and if skipErrors, skip) the rows with errors.
+    Returns the number of rows inserted.
+    """
+    bulkErr = None;
+    if idFile is None or iIdCol is not None or Env.DATABASE_CONNECTOR_NAME == "psycopg2":
+        try:
+            bulkColumnNames = columnNames;
+            bulkRows = rowChunk;
+            rowIds = None;
+            if idFile is not None:
+                if iIdCol is not None:  # Look for manually assigned ID values first
+                    rowIds = [params[iIdCol] for params in rowChunk];
+                else:
+                    # Draw the new rows' IDs from the table's sequence up front, rather than an identityQuery after each insert
+                    cur.execute("select nextval('%s') from generate_series(1,%d)" % (sequenceName(tableName), len(rowChunk)) );
+                    rowIds = [row[0] for row in cur.fetchall()];
+                    bulkColumnNames = [defaultIDColumn(tableName)] + list(columnNames);
+                    bulkRows = [[rowId]+params for (rowId, params) in zip(rowIds, rowChunk)];
+
+            nInserts = bulkInsertRowChunk( tableName, bulkColumnNames, bulkRows, cur );
+
+            if rowIds is not None:
+                for rowId in rowIds:
+                    print >> idFile, rowId;
+
+            # Commit each chunk, otherwise a skipped error will rollback any previous chunks as well
+            if skipErrors:
+                conn.commit();
+
+            progress.Update(nInserts);
+            return nInserts;
+        except Exception, err:
+            log.debug(err);
+            bulkErr = err;
+            conn.rollback();    # Reset any changes since the last commit
+
+    # Retry one row at a time to find and report the rows with errors
+    nInserts = 0;
+    for params in rowChunk:
+        log.debug(params)
+        try:
+            cur.execute(sql,tuple(params))
+            nInserts += cur.rowcount
+
+            if idFile != None:
+                rowId = None;
+                if iIdCol is not None:  # Look for manually assigned ID value first
+                    rowId = params[iIdCol];
+                else:
+                    cur.execute(identityQuery(tableName));
+                    rowId = cur.fetchone()[0];
+                print >> idFile, rowId;
+
+            # Need to "auto-commit" after each command, 
+            #   otherwise a skipped error will rollback 
+            #   any previous commands as well
+            if skipErrors: 
+                conn.commit()    
+
+            progress.Update()
+
+        except Exception, err:
+            log.info(sql);
+            log.info(tuple(params))
+            conn.rollback();    # Reset any changes since the last commit
+            if skipErrors:
+                log.warning("Error Executing in Script: "+ sql )
+                log.warning(err)
+            else:
+                raise;
+
+    if bulkErr is not None and not skipErrors:
+        # The rows went in one at a time, but the failed bulk insert rolled back any previous chunks
+        raise bulkErr;
+    return nInserts;
+
 def updateFromFile( sourceFile, tableName, columnNames=None, nIdCols=1, delim=None, skipErrors=False, connFactory=None  ):
     """Update the database with the contents of a whitespace-delimited text file.
     
@@ -529,6 +999,11 @@ def updateFromFile( sourceFile, tableName, columnNames=None, nIdCols=1, delim=No
     values must not be None / null.  The query looks for rows where columnname = value,
     and the = operator always returns false when the value is null.
 
+    For PostgreSQL, chunks of lines are COPY loaded into a temp staging table
+    and applied with a single update ... from join (bulkUpdateRowChunk).
+    Otherwise, or if a chunk fails, run one update query per line,
+    to report (or skip) the lines with errors.
+
     Returns the total number of rows successfully updated.
     """
     if columnNames is None or len(columnNames) < 1:
@@ -572,55 +1047,128 @@ def updateFromFile( sourceFile, tableName, columnNames=None, nIdCols=1, delim=No
 
         log.debug(sql)
 
-        # Loop through file and execute update statement for every line
+        bulkUpdate = (Env.DATABASE_CONNECTOR_NAME == "psycopg2");
+        if bulkUpdate:
+            createUpdateStageTable( tableName, columnNames, nIdCols, cur );
+            conn.commit();  # Keep the temp table through any rollbacks
+
+        # Loop through file and update chunks of lines
         progress = ProgressDots()
+        rowChunk = list();
         for iLine, line in enumerate(sourceFile):
             if not line.startswith(COMMENT_TAG):
-                try:
-                    line = line[:-1];    # Strip the newline character
-                    params = line.split(delim);
-                    
-                    # Special handling for null / None string
-                    for iParam in xrange(len(params)):
-                        if params[iParam] == "" or params[iParam] == NULL_STRING:   # Treat blank strings as NULL
-                            params[iParam] = None;
-
-                    # Reposition ID columns to end of parameter list
-                    idParams = params[:nIdCols];
-                    dataParams = params[nIdCols:];
-                    paramTuple = dataParams;
-                    paramTuple.extend( idParams );
-                    paramTuple = tuple(paramTuple);
-                    
-                    cur.execute(sql, paramTuple);
-
-                    # Need to "auto-commit" after each command, 
-                    #   otherwise a skipped error will rollback 
-                    #   any previous commands as well
-                    if skipErrors:
-                        conn.commit()    
-
-                    progress.Update()
-
-                except Exception, err:
-                    conn.rollback();    # Reset changes and connection state
-                    log.critical(sql);
-                    log.critical(paramTuple);
-                    log.warning("Error Executing in Script: %s", parameterizeQueryString(sql,paramTuple) );
-                    if skipErrors:
-                        log.warning(err)
-                    else:
-                        raise err
+                line = line[:-1];    # Strip the newline character
+                params = line.split(delim);
+
+                # Special handling for null / None string
+                for iParam in xrange(len(params)):
+                    if params[iParam] == "" or params[iParam] == NULL_STRING:   # Treat blank strings as NULL
+                        params[iParam] = None;
+                rowChunk.append(params);
+
+                if len(rowChunk) >= ROWS_PER_COPY:
+                    updateFileRowChunk( tableName, columnNames, nIdCols, rowChunk, sql, bulkUpdate, skipErrors, conn, cur, progress );
+                    rowChunk = list();
+        if len(rowChunk) > 0:
+            updateFileRowChunk( tableName, columnNames, nIdCols, rowChunk, sql, bulkUpdate, skipErrors, conn, cur, progress );
 
         conn.commit()
 
         return progress.GetCounts();
 
     finally:
+        if Env.DATABASE_CONNECTOR_NAME == "psycopg2":
+            # Pooled connections live on, so clean up the staging table (after any incomplete transaction)
+            try:
+                conn.rollback();
+                cur.execute("drop table if exists %s" % UPDATE_STAGE_TABLE);
+                conn.commit();
+            except Exception, err:
+                log.warning(err);
         conn.close()
 
     return 0    
 
+def createUpdateStageTable( tableName, columnNames, nIdCols, cursor ):
+    """Create the temp table to stage updateFromFile lines in for bulkUpdateRowChunk.
+    Columns for the line number, then each of the ID and data columns, with the same types as in the tableName table.
+    Columns are renamed, as the same column can be both an ID and data column.
+    """
+    selectCols = ["0 as stage_line"];
+    for iCol, colName in enumerate(columnNames):
+        selectCols.append("%s as stage_col_%d" % (colName, iCol));
+    cursor.execute("drop table if exists %s" % UPDATE_STAGE_TABLE);
+    cursor.execute("create temp table %s as select %s from %s where 1=0" % (UPDATE_STAGE_TABLE, str.join(",", selectCols), tableName) );
+
+def bulkUpdateRowChunk( tableName, columnNames, nIdCols, rowChunk, cursor ):
+    """Update the tableName rows for a chunk of updateFromFile lines,
+    by COPY into the staging table and a single update ... from join against it.
+    If the same ID values occur on multiple lines, the last line's values are used.
+    """
+    cursor.execute("truncate %s" % UPDATE_STAGE_TABLE);
+    stageColumnNames = ["stage_line"] + ["stage_col_%d" % iCol for iCol in xrange(len(columnNames))];
+    stageRows = [[iLine] + params for (iLine, params) in enumerate(rowChunk)];
+    bulkInsertRowChunk( UPDATE_STAGE_TABLE, stageColumnNames, stageRows, cursor );
+
+    idStageCols = ["stage_col_%d" % iCol for iCol in xrange(nIdCols)];
+    setClauses = ["%s = stage.stage_col_%d" % (columnNames[iCol], iCol) for iCol in xrange(nIdCols, len(columnNames))];
+    whereClauses = ["%s.%s = stage.stage_col_%d" % (tableName, columnNames[iCol], iCol) for iCol in xrange(nIdCols)];
+    query = "update %s set %s from (select distinct on (%s) * from %s order by %s, stage_line desc) as stage where %s" % \
+        (tableName, str.join(", ", setClauses), str.join(",", idStageCols), UPDATE_STAGE_TABLE, str.join(",", idStageCols), str.join(" and ", whereClauses) );
+    cursor.execute(query);
+
+def updateFileRowChunk( tableName, columnNames, nIdCols, rowChunk, sql, bulkUpdate, skipErrors, conn, cur, progress ):
+    """Apply a chunk of parsed updateFromFile lines with bulkUpdateRowChunk.
+    If not bulkUpdate or that fails, run the sql update query one line at a time instead,
+    to report (and if skipErrors, skip) the lines with errors.
+    """
+    bulkErr = None;
+    if bulkUpdate:
+        try:
+            bulkUpdateRowChunk( tableName, columnNames, nIdCols, rowChunk, cur );
+            # Commit each chunk, otherwise a skipped error will rollback any previous chunks as well
+            if skipErrors:
+                conn.commit();
+            progress.Update(len(rowChunk));
+            return;
+        except Exception, err:
+            log.debug(err);
+            bulkErr = err;
+            conn.rollback();    # Reset changes and connection state
+
+    for params in rowChunk:
+        try:
+            # Reposition ID columns to end of parameter list
+            idParams = params[:nIdCols];
+            dataParams = params[nIdCols:];
+            paramTuple = dataParams;
+            paramTuple.extend( idParams );
+            paramTuple = tuple(paramTuple);
+            
+            cur.execute(sql, paramTuple);
+
+            # Need to "auto-commit" after each command, 
+            #   otherwise a skipped error will rollback 
+            #   any previous commands as well
+            if skipErrors:
+                conn.commit()    
+
+            progress.Update()
+
+        except Exception, err:
+            conn.rollback();    # Reset changes and connection state
+            log.critical(sql);
+            log.critical(paramTuple);
+            log.warning("Error Executing in Script: %s", parameterizeQueryString(sql,paramTuple) );
+            if skipErrors:
+                log.warning(err)
+            else:
+                raise err
+
+    if bulkErr is not None and not skipErrors:
+        # The lines went in one at a time, but the failed bulk update rolled back any previous chunks
+        raise bulkErr;
+
 
 def dumpTableToCsv(table_name, file_name, conn_params=None):
     if conn_params is None:
@@ -488,6 +488,88 @@ class TestDBUtil(DBTestCase):
         self.assertEqual("newText",data)
         self.assertEqual(False,isNew)
 
+    def test_bulkInsertNewRows(self):
+        DBUtil.runDBScript( self.SCRIPT_FILE, False )
+
+        conn = DBUtil.connection()
+        try:
+            log.debug("Insert new rows, retrieving their generated IDs in order")
+            newIds = DBUtil.insertRowsReturningIds("TestTypes", ["MyText","MyInteger"], [("New A",500),("New B",600)], conn, rowsPerInsert=1)
+            conn.commit()
+            results = DBUtil.execute("select TestTypes_id from TestTypes where MyInteger >= 500 order by MyInteger", conn=conn)
+            self.assertEqual( [row[0] for row in results], newIds )
+
+            log.debug("Insert only rows with keys not matching existing rows or earlier rows in the list")
+            rows = \
+                [   ("Sample Text", 123, 1.0),  # Existing
+                    ("New C", 700, 2.0),
+                    ("New C", 700, 3.0),    # Duplicate of earlier row, first one wins
+                    ("New D", 800, 4.0),
+                    ("New A", 500, 5.0),    # Existing
+                ]
+            retrieved = DBUtil.bulkInsertNewRows("TestTypes", ["MyText","MyInteger","MyReal"], ["MyText","MyInteger"], rows, conn, retrieveCol="MyReal")
+            conn.commit()
+            self.assertEqual( [123.45, 2.0, 2.0, 4.0, None], retrieved )
+
+            results = DBUtil.execute("select MyText, MyInteger, MyReal from TestTypes where MyInteger >= 500 order by MyInteger", conn=conn)
+            expected = [["New A",500,None],["New B",600,None],["New C",700,2.0],["New D",800,4.0]]
+            self.assertEqual( expected, results )
+
+            log.debug("Nothing returned without a retrieve column")
+            self.assertEqual( None, DBUtil.bulkInsertNewRows("TestTypes", ["MyText","MyInteger"], ["MyText","MyInteger"], [("New E",900)], conn) )
+            conn.commit()
+            results = DBUtil.execute("select count(*) from TestTypes", conn=conn)
+            self.assertEqual( 8, results[0][0] )
+        finally:
+            conn.close()
+
+    def test_buildUpsertQueries(self):
+        createQuery = "create table TestUpsert (MyKey integer primary key, MyCount integer, MySum real)";
+        sourceQuery = "select MyKey, MyCount, MySum from TestUpsertSource";
+        expected = [[1, 11, 1.5], [2, 2, 2.0], [3, 3, 3.5]];
+
+        def checkUpsert(conn):
+            cursor = conn.cursor();
+            cursor.execute(createQuery);
+            cursor.execute("create table TestUpsertSource (MyKey integer, MyCount integer, MySum real)");
+            cursor.execute("insert into TestUpsert values (1, 10, 1.0)");
+            cursor.execute("insert into TestUpsert values (2, 2, 2.0)");
+            cursor.execute("insert into TestUpsertSource values (1, 1, 0.5)");
+            cursor.execute("insert into TestUpsertSource values (3, 3, 3.5)");
+            # Existing rows incremented, new ones inserted
+            for query in DBUtil.buildUpsertQueries("TestUpsert", ["MyKey"], ["MyCount","MySum"], sourceQuery):
+                cursor.execute(query);
+            # Without increments, existing rows just skipped
+            for query in DBUtil.buildUpsertQueries("TestUpsert", ["MyKey"], [], "select MyKey from TestUpsertSource"):
+                cursor.execute(query);
+            cursor.execute("select MyKey, MyCount, MySum from TestUpsert order by MyKey");
+            self.assertEqual( expected, [list(row) for row in cursor.fetchall()] );
+            cursor.close();
+
+        conn = DBUtil.connection();
+        try:
+            checkUpsert(conn);
+        finally:
+            conn.close();
+
+        # SQLite, with and without upsert syntax
+        import sqlite3;
+        origConnectorName = DBUtil.Env.DATABASE_CONNECTOR_NAME;
+        origUpsertVersion = DBUtil.SQLITE_UPSERT_VERSION;
+        DBUtil.Env.DATABASE_CONNECTOR_NAME = "sqlite3";
+        try:
+            for upsertVersion in [(3,24,0), (999,)]:
+                DBUtil.SQLITE_UPSERT_VERSION = upsertVersion;
+                nQueries = len(DBUtil.buildUpsertQueries("TestUpsert", ["MyKey"], ["MyCount","MySum"], sourceQuery));
+                self.assertEqual( 1 if sqlite3.sqlite_version_info >= upsertVersion else 2, nQueries );
+                conn = sqlite3.connect(":memory:");
+                try:
+                    checkUpsert(conn);
+                finally:
+                    conn.close();
+        finally:
+            DBUtil.Env.DATABASE_CONNECTOR_NAME = origConnectorName;
+            DBUtil.SQLITE_UPSERT_VERSION = origUpsertVersion;
 
     def test_updateFromFile(self):
         # Create a test data file to insert, and verify no errors
@@ -508,6 +590,23 @@ class TestDBUtil(DBTestCase):
         self.assertEqual( self.DATA_ROWS, results );
 
 
+    def test_updateFromFile_skipErrors(self):
+        DBUtil.runDBScript( self.SCRIPT_FILE, False ) # Assume this works based on test_runDBScript method
+        for idValue in self.ID_DATA:
+            DBUtil.execute("insert into TestTypes ("+self.ID_COL+") values (%s)",(idValue,));
+
+        # Bogus value on one line. Later lines override earlier ones for the same ID.
+        dataText = "100\t1.5\n200\tABCD\n100\t2.5\n300\t3.5\n";
+        query = "select MyInteger, MyReal from TestTypes where MyInteger in (100,200,300) order by MyInteger";
+
+        # Without skipping errors, expect no rows updated
+        self.assertRaises( Exception, DBUtil.updateFromFile, StringIO(dataText), self.DATA_TABLE, ["MyInteger","MyReal"], delim="\t" );
+        self.assertEqual( [[100,None],[200,None],[300,None]], DBUtil.execute(query) );
+
+        nUpdates = DBUtil.updateFromFile( StringIO(dataText), self.DATA_TABLE, ["MyInteger","MyReal"], delim="\t", skipErrors=True );
+        self.assertEqual( 3, nUpdates );
+        self.assertEqual( [[100,2.5],[200,None],[300,3.5]], DBUtil.execute(query) );
+
     def test_updateFromFile_commandline(self):
         # Similar to test_updateFromFile, but from higher-level command-line interface
         DBUtil.runDBScript( self.SCRIPT_FILE, False ) # Assume this works based on test_runDBScript method
@@ -593,6 +692,58 @@ class TestDBUtil(DBTestCase):
         DBUtil.deleteRows("TestTypes", nonDefaultIds, "MyInteger");
         afterCount = DBUtil.execute( query )[0][0];
 
+    def test_connectionPool(self):
+        DBUtil.runDBScript( self.SCRIPT_FILE, False );
+        DBUtil.connectionPool.close();
+        query = "select count(*) from TestTypes;";
+
+        # Closed connections return to the pool to be reused
+        conn = DBUtil.connection();
+        rawConn = conn.rawConnection();
+        conn.close();
+        self.assertEqual( 1, DBUtil.connectionPool.idleCount() );
+        self.assertRaises( ValueError, conn.rawConnection );
+        conn = DBUtil.connection();
+        self.assertTrue( rawConn is conn.rawConnection() );
+        self.assertEqual( 0, DBUtil.connectionPool.idleCount() );
+
+        # Uncommitted work is rolled back on return, as if actually closed
+        initialCount = DBUtil.execute( query )[0][0];
+        DBUtil.execute( "insert into TestTypes (MyText,MyInteger) values ('Uncommitted', 999)", conn=conn, autoCommit=False );
+        conn.close();
+        self.assertEqual( initialCount, DBUtil.execute( query )[0][0] );
+
+        # Connections are not reused if their transaction settings were changed
+        DBUtil.connectionPool.close();
+        conn = DBUtil.connection();
+        rawConn = conn.rawConnection();
+        if hasattr(rawConn, "autocommit"):
+            conn.autocommit = True;
+        else:
+            conn.isolation_level = None;
+        conn.close();
+        self.assertEqual( 0, DBUtil.connectionPool.idleCount() );
+
+        # Nested connections beyond the pool size are closed when returned
+        origMaxPooled = DBUtil.MAX_POOLED_CONNECTIONS;
+        DBUtil.MAX_POOLED_CONNECTIONS = 2;
+        try:
+            conns = [DBUtil.connection() for i in xrange(3)];
+            for conn in conns:
+                conn.close();
+            self.assertEqual( 2, DBUtil.connectionPool.idleCount() );
+        finally:
+            DBUtil.MAX_POOLED_CONNECTIONS = origMaxPooled;
+
+        # A forked child process starts a new pool, leaving inherited connections for the parent
+        conn = DBUtil.connection();
+        DBUtil.connectionPool.pid = -1;
+        self.assertEqual( 0, DBUtil.connectionPool.idleCount() );
+        self.assertEqual( 1, len(DBUtil.connectionPool.inheritedConns) );
+        del DBUtil.connectionPool.inheritedConns[:];
+        self.assertEqual( initialCount, DBUtil.execute( query, conn=conn )[0][0] );
+        conn.close();
+
 
 def suite():
     """Returns the suite of tests to run for this test class / module.
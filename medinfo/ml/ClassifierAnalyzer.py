@@ -10,15 +10,140 @@ import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from pandas import DataFrame
 import sys
+import multiprocessing
 import numpy as np
 
-from sklearn.metrics import recall_score, precision_score, f1_score
+from sklearn.metrics import accuracy_score, recall_score, precision_score, f1_score
 from sklearn.metrics import average_precision_score, roc_auc_score
 from sklearn.metrics import precision_recall_curve, roc_curve
 
 from medinfo.ml.PredictorAnalyzer import PredictorAnalyzer
 from medinfo.common.Util import log
 
+# Max number of resample indices to score at a time (in each worker process).
+BOOTSTRAP_CHUNK_ELEMENTS = 2**22
+
+class BootstrapScorer:
+    """
+    Scores many bootstrap resamples of a binary classifier's test results at
+    once, for all of the metrics needed, rather than resampling and re-scoring
+    with sklearn one sample and one metric at a time.
+
+    Test items are ranked by descending predicted probability once up front
+    (stable, so tied items keep their test order). Each resample (a row of
+    an index matrix) then only needs an integer sort of its items' ranks, after
+    which every metric is a cumulative sum or count across the rows.
+    """
+    def __init__(self, y_true, y_pred, y_pred_prob):
+        y_true = np.asarray(y_true).ravel()
+        y_pred = np.asarray(y_pred).ravel()
+        y_pred_prob = np.asarray(y_pred_prob, dtype=float).ravel()
+
+        order = np.argsort(-y_pred_prob, kind='mergesort')
+        self._rank_by_index = np.empty(len(order), dtype=np.int64)
+        self._rank_by_index[order] = np.arange(len(order))
+        self._true_by_rank = (y_true[order] == 1)
+        self._pred_by_rank = (y_pred[order] == 1)
+        # Items with tied probabilities share a group, numbered in descending
+        # probability order.
+        prob_by_rank = y_pred_prob[order]
+        self._group_by_rank = np.concatenate(([0], np.cumsum(prob_by_rank[1:] != prob_by_rank[:-1])))
+        self._num_groups = self._group_by_rank[-1] + 1 if len(order) > 0 else 0
+
+    def score_samples(self, indices, metrics, k=None, desired_precision=None):
+        """
+        Score each resample (row) of the index matrix.
+        Returns dict of metric => array of scores, only for the resamples with
+        both positive and negative samples (others are rejected, as the ROC
+        AUC would not be defined).
+        """
+        num_iter, num_samples = indices.shape
+        ranks = np.sort(self._rank_by_index[indices], axis=1)
+        y_true = self._true_by_rank[ranks]
+        y_pred = self._pred_by_rank[ranks]
+
+        num_true = y_true.sum(axis=1)
+        accepted = (num_true > 0) & (num_true < num_samples)
+        y_true = y_true[accepted]
+        y_pred = y_pred[accepted]
+        ranks = ranks[accepted]
+        num_true = num_true[accepted].astype(float)
+
+        true_positive = y_true & y_pred
+        num_true_positive = true_positive.sum(axis=1).astype(float)
+        num_pred = y_pred.sum(axis=1).astype(float)
+
+        scores_by_metric = dict()
+        for metric in metrics:
+            if metric == ClassifierAnalyzer.ACCURACY_SCORE:
+                scores = (y_true == y_pred).sum(axis=1) / float(num_samples)
+            elif metric == ClassifierAnalyzer.RECALL_SCORE:
+                scores = num_true_positive / num_true
+            elif metric == ClassifierAnalyzer.PRECISION_SCORE:
+                scores = self._divide(num_true_positive, num_pred)
+            elif metric == ClassifierAnalyzer.F1_SCORE:
+                precision = self._divide(num_true_positive, num_pred)
+                recall = num_true_positive / num_true
+                scores = self._divide(2 * precision * recall, precision + recall)
+            elif metric in (ClassifierAnalyzer.ROC_AUC_SCORE, ClassifierAnalyzer.AVERAGE_PRECISION_SCORE):
+                (positives, negatives) = self._group_counts(ranks, y_true)
+                if metric == ClassifierAnalyzer.ROC_AUC_SCORE:
+                    # Pairs of positive and negative samples ranked correctly,
+                    # counting ties as half.
+                    negatives_below = negatives.sum(axis=1)[:,np.newaxis] - np.cumsum(negatives, axis=1)
+                    pairs_correct = (positives * (negatives_below + 0.5 * negatives)).sum(axis=1)
+                    scores = pairs_correct / (num_true * (num_samples - num_true))
+                else:
+                    # Precision at each threshold, weighted by the increase in
+                    # recall from the previous threshold.
+                    true_positives = np.cumsum(positives, axis=1)
+                    precision = self._divide(true_positives, true_positives + np.cumsum(negatives, axis=1))
+                    recall = true_positives / num_true[:,np.newaxis]
+                    recall_increase = np.diff(np.concatenate((np.zeros((len(recall), 1)), recall), axis=1), axis=1)
+                    scores = (recall_increase * precision).sum(axis=1)
+            elif metric == ClassifierAnalyzer.PRECISION_AT_K_SCORE:
+                scores = self._divide(true_positive[:,:k].sum(axis=1).astype(float), y_pred[:,:k].sum(axis=1).astype(float))
+            elif metric == ClassifierAnalyzer.PERCENT_PREDICTABLY_POSITIVE:
+                # Number of true samples within the largest top k (< num_samples)
+                # predictions that meet the desired precision, as a fraction of
+                # all samples.
+                precision_at_k = self._divide(np.cumsum(true_positive, axis=1).astype(float), np.cumsum(y_pred, axis=1).astype(float))[:,:-1]
+                meets_precision = (precision_at_k >= desired_precision)
+                last_k_index = meets_precision.shape[1] - 1 - np.argmax(meets_precision[:,::-1], axis=1)
+                true_at_k = np.cumsum(y_true, axis=1)[np.arange(len(y_true)), last_k_index]
+                scores = np.where(meets_precision.any(axis=1), true_at_k, 0) / float(num_samples)
+            else:
+                raise ValueError('Bootstrap of score metric %s not supported.' % metric)
+            scores_by_metric[metric] = scores
+        return scores_by_metric
+
+    def _group_counts(self, ranks, y_true):
+        """
+        Count of positive and negative samples in each resample (row), by
+        predicted probability group (column, in descending probability order).
+        """
+        num_iter = len(ranks)
+        groups = self._group_by_rank[ranks] + (np.arange(num_iter) * self._num_groups)[:,np.newaxis]
+        num_cells = num_iter * self._num_groups
+        positives = np.bincount(groups[y_true], minlength=num_cells).reshape(num_iter, self._num_groups).astype(float)
+        negatives = np.bincount(groups[~y_true], minlength=num_cells).reshape(num_iter, self._num_groups).astype(float)
+        return (positives, negatives)
+
+    def _divide(self, numerator, denominator):
+        """Element-wise division, with 0 where the denominator is 0 (as sklearn does for ill-defined scores)"""
+        return numerator / np.where(denominator > 0, denominator, 1) * (denominator > 0)
+
+# Scorer for the process pool workers, set on worker start up.
+_worker_bootstrap_scorer = None
+
+def _init_bootstrap_worker(bootstrap_scorer):
+    global _worker_bootstrap_scorer
+    _worker_bootstrap_scorer = bootstrap_scorer
+
+def _score_bootstrap_samples(args):
+    (indices, metrics, k, desired_precision) = args
+    return _worker_bootstrap_scorer.score_samples(indices, metrics, k, desired_precision)
+
 class ClassifierAnalyzer(PredictorAnalyzer):
     ACCURACY_SCORE = 'accuracy'
     RECALL_SCORE = 'recall'
@@ -38,7 +163,7 @@ class ClassifierAnalyzer(PredictorAnalyzer):
                         K_95_PRECISION_SCORE, K_90_PRECISION_SCORE,
                         ROC_AUC_SCORE]
 
-    def __init__(self, classifier, X_test, y_test, random_state=None):
+    def __init__(self, classifier, X_test, y_test, random_state=None, n_jobs=None):
         # TODO(sbala): Make this API more flexible, so that it can work
         # with multi-label classifiers or binary classifiers whose
         # positive label != 1.
@@ -60,9 +185,14 @@ class ClassifierAnalyzer(PredictorAnalyzer):
         elif isinstance(random_state, np.random.RandomState):
             self._random_state = random_state
 
+        # Number of processes to score bootstrap resamples across.
+        self._n_jobs = n_jobs
 
     def _score_accuracy(self, ci=None, n_bootstrap_iter=None):
-        return PredictorAnalyzer._score_accuracy(self, ci, n_bootstrap_iter)
+        if ci:
+            return self._bootstrap_score_ci(accuracy_score, ci, self._y_test, y_pred=self._y_predicted, n_bootstrap_iter=n_bootstrap_iter)
+        else:
+            return PredictorAnalyzer._score_accuracy(self)
 
     def _score_recall(self, ci=None, n_bootstrap_iter=None):
         if ci:
@@ -100,54 +230,78 @@ class ClassifierAnalyzer(PredictorAnalyzer):
         # right choice based on score_fn's expected input.
         if score_fn == self._score_precision_at_k:
             sample_score = score_fn(y_test, y_pred, y_pred_prob, k)
+            metric = ClassifierAnalyzer.PRECISION_AT_K_SCORE
         elif score_fn == self._score_percent_predictably_positive:
             sample_score = score_fn(y_test, y_pred, y_pred_prob, desired_precision)
+            metric = ClassifierAnalyzer.PERCENT_PREDICTABLY_POSITIVE
         elif score_fn in [average_precision_score, roc_auc_score]:
             sample_score = score_fn(y_test, y_pred_prob)
+            metric = ClassifierAnalyzer.AVERAGE_PRECISION_SCORE if score_fn == average_precision_score else ClassifierAnalyzer.ROC_AUC_SCORE
         else:
             sample_score = score_fn(y_test, y_pred)
+            metric = {
+                accuracy_score: ClassifierAnalyzer.ACCURACY_SCORE,
+                recall_score: ClassifierAnalyzer.RECALL_SCORE,
+                precision_score: ClassifierAnalyzer.PRECISION_SCORE,
+                f1_score: ClassifierAnalyzer.F1_SCORE
+            }[score_fn]
+
+        bootstrap_scores = self._bootstrap_scores([metric], y_test, y_pred, y_pred_prob, n_bootstrap_iter, k, desired_precision)
+        ci_lower_bound, ci_upper_bound = self._bootstrap_ci_bounds(bootstrap_scores[metric], ci)
+
+        return sample_score, ci_lower_bound, ci_upper_bound
 
+    def _bootstrap_scores(self, metrics, y_test, y_pred=None, y_pred_prob=None, n_bootstrap_iter=None, k=None, desired_precision=None):
+        # Score all metrics on the same bootstrap resamples, drawn as one
+        # n_bootstrap_iter x len(y_test) matrix of indices (in row blocks to
+        # bound memory) and scored with vectorized rank operations, optionally
+        # across a process pool. Returns dict of metric => sorted scores.
         if n_bootstrap_iter is None:
             n_bootstrap_iter = 100
+        num_samples = len(y_test)
+        if y_pred is None:
+            y_pred = np.zeros(num_samples)
+        if y_pred_prob is None:
+            y_pred_prob = np.zeros(num_samples)
+        bootstrap_scorer = BootstrapScorer(y_test, y_pred, y_pred_prob)
+
         # For consistency of results, seed random number generator with
-        # fixed number.
+        # fixed number. Rows are drawn in order in this process, so the
+        # resamples do not depend on the number of processes.
         rng = self._random_state
-        # Use bootstrap to compute CIs.
-        bootstrap_scores = list()
-        for i in range(0, n_bootstrap_iter):
-            # Sample y_test and y_pred with replacement.
-            indices = rng.randint(0, len(y_test) - 1, len(y_test))
-            sample_y_test = np.array(y_test)[indices]
-            if y_pred is not None: sample_y_pred = np.array(y_pred)[indices]
-            if y_pred_prob is not None: sample_y_pred_prob = np.array(y_pred_prob)[indices]
-            if len(np.unique(sample_y_test)) < 2:
-                # We need at least one positive and one negative sample for ROC AUC
-                # to be defined: reject the sample
-                continue
-            if score_fn == self._score_precision_at_k:
-                score = score_fn(DataFrame(sample_y_test), DataFrame(sample_y_pred), DataFrame(sample_y_pred_prob), k)
-            elif score_fn == self._score_percent_predictably_positive:
-                score = score_fn(DataFrame(sample_y_test), DataFrame(sample_y_pred), DataFrame(sample_y_pred_prob), desired_precision)
-            elif score_fn in [average_precision_score, roc_auc_score]:
-                score = score_fn(sample_y_test, sample_y_pred_prob)
-            else:
-                score = score_fn(sample_y_test, sample_y_pred)
-            bootstrap_scores.append(score)
+        iter_per_block = max(1, BOOTSTRAP_CHUNK_ELEMENTS // max(1, num_samples))
+        def sample_blocks():
+            for i in range(0, n_bootstrap_iter, iter_per_block):
+                # Sample y_test and y_pred with replacement.
+                indices = rng.randint(0, num_samples - 1, (min(iter_per_block, n_bootstrap_iter - i), num_samples))
+                yield (indices, metrics, k, desired_precision)
+
+        if self._n_jobs is not None and self._n_jobs > 1:
+            pool = multiprocessing.Pool(self._n_jobs, _init_bootstrap_worker, (bootstrap_scorer,))
+            try:
+                block_scores = list(pool.imap(_score_bootstrap_samples, sample_blocks()))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            block_scores = [bootstrap_scorer.score_samples(*args) for args in sample_blocks()]
+
+        bootstrap_scores = dict()
+        for metric in metrics:
+            bootstrap_scores[metric] = np.sort(np.concatenate([scores_by_metric[metric] for scores_by_metric in block_scores]))
+            log.debug('%s bootstrap_scores: %s' % (metric, bootstrap_scores[metric]))
+        return bootstrap_scores
 
-        # Sort bootstrap scores to get CIs.
-        bootstrap_scores.sort()
-        log.debug('bootstrap_scores: %s' % bootstrap_scores)
-        sorted_scores = np.array(bootstrap_scores)
+    def _bootstrap_ci_bounds(self, sorted_scores, ci):
         # May not be equal to n_bootstrap_iter if some samples were rejected
         num_bootstraps = len(sorted_scores)
-        log.debug('sorted_scores: %s' % sorted_scores)
 
         ci_lower_bound_float = (1.0 - ci) / 2
         ci_lower_bound = sorted_scores[int(ci_lower_bound_float * num_bootstraps)]
         ci_upper_bound_float = ci + ci_lower_bound_float
         ci_upper_bound = sorted_scores[int(ci_upper_bound_float * num_bootstraps)]
 
-        return sample_score, ci_lower_bound, ci_upper_bound
+        return ci_lower_bound, ci_upper_bound
 
     def _score_precision_at_k(self, y_true, y_pred, y_pred_prob, k, ci=None, n_bootstrap_iter=None, desired_precision=None):
         if ci:
@@ -368,6 +522,15 @@ class ClassifierAnalyzer(PredictorAnalyzer):
         report_dict.update({'y_test.value_counts()': [str(y_test_counts.to_dict())]})
         column_names.append('y_test.value_counts()')
 
+        # Bootstrap CIs for all scores from the same resamples.
+        if ci:
+            bootstrap_metrics = [ClassifierAnalyzer.ACCURACY_SCORE, ClassifierAnalyzer.RECALL_SCORE,
+                                 ClassifierAnalyzer.PRECISION_SCORE, ClassifierAnalyzer.F1_SCORE,
+                                 ClassifierAnalyzer.AVERAGE_PRECISION_SCORE,
+                                 ClassifierAnalyzer.PERCENT_PREDICTABLY_POSITIVE,
+                                 ClassifierAnalyzer.ROC_AUC_SCORE]
+            bootstrap_scores = self._bootstrap_scores(bootstrap_metrics, self._y_test, self._y_predicted, self._y_pred_prob, desired_precision=0.99)
+
         # Add scores.
         for score_metric in ClassifierAnalyzer.SUPPORTED_SCORES:
             # Hack to avoid breaking tests.
@@ -388,10 +551,9 @@ class ClassifierAnalyzer(PredictorAnalyzer):
                     score_value = self.score(score_metric, k=k_10_percent)
             else:
                 score_label = score_metric
+                score_value = self.score(metric=score_metric)
                 if ci:
-                    score_value, lower_ci, upper_ci = self.score(metric=score_metric, ci=ci)
-                else:
-                    score_value = self.score(metric=score_metric)
+                    lower_ci, upper_ci = self._bootstrap_ci_bounds(bootstrap_scores[score_metric], ci)
             column_names.append(score_label)
             report_dict.update({score_label: score_value})
             if ci:
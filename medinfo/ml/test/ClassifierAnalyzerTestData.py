@@ -156,7 +156,7 @@ RANDOM_100_TEST_CASE = {
             'upper': 1.0
         },
         'roc_auc': {
-            'lower': 0.6799999999999999,
+            'lower': 0.68,
             'upper': 1.0
         },
         'precision_at_k': {
@@ -181,21 +181,21 @@ RANDOM_100_TEST_CASE = {
             'f1_0.95_upper_ci': 1.0,
             'precision': 0.9444444444444444,
             'y_test.value_counts()': ['{0: 8, 1: 17}'],
-            'f1_0.95_lower_ci': 0.8750000000000001,
+            'f1_0.95_lower_ci': 0.9032258064516129,
             'average_precision': 0.9287191326551189,
             'recall_0.95_lower_ci': 1.0,
             'precision_0.95_upper_ci': 1.0,
-            'percent_predictably_positive_0.95_lower_ci': 0.0,
+            'percent_predictably_positive_0.95_lower_ci': 0.04,
             'accuracy_0.95_lower_ci': 0.88,
             'recall': 1.0,
-            'average_precision_0.95_lower_ci': 0.7548275442506212,
+            'average_precision_0.95_lower_ci': 0.7550889488800674,
             'roc_auc': 0.9044117647058824,
-            'average_precision_0.95_upper_ci': 1.0000000000000002,
+            'average_precision_0.95_upper_ci': 1.0,
             'test_size': [25],
             'model': ['L1_REGRESS_AND_ROUND(1.0*x3)'],
-            'precision_0.95_lower_ci': 0.8333333333333334,
-            'roc_auc_0.95_lower_ci': 0.5952380952380952,
-            'percent_predictably_positive_0.95_upper_ci': 0.84,
+            'precision_0.95_lower_ci': 0.8235294117647058,
+            'roc_auc_0.95_lower_ci': 0.68,
+            'percent_predictably_positive_0.95_upper_ci': 0.8,
             'accuracy': 0.96},
             columns=[u'model', u'test_size', u'y_test.value_counts()', u'accuracy',
                    u'accuracy_0.95_lower_ci', u'accuracy_0.95_upper_ci', u'recall',
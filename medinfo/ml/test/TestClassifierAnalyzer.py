@@ -18,6 +18,7 @@ from LocalEnv import TEST_RUNNER_VERBOSITY
 from medinfo.common.test.Util import make_test_suite, MedInfoTestCase
 from medinfo.common.Util import log
 from medinfo.ml.ListPredictor import ListPredictor
+from medinfo.ml import ClassifierAnalyzer as ClassifierAnalyzerModule
 from medinfo.ml.ClassifierAnalyzer import ClassifierAnalyzer
 from medinfo.ml.SupervisedClassifier import SupervisedClassifier
 
@@ -219,6 +220,24 @@ class TestClassifierAnalyzer(MedInfoTestCase):
         expected_upper_ci = RANDOM_100_TEST_CASE['ci']['percent_predictably_positive']['upper']
         self.assertEqual(expected_upper_ci, actual_upper_ci)
 
+    def test_bootstrap_parallel(self):
+        # Scoring resamples across a process pool, in many small blocks,
+        # should give the same CIs as scoring them all in this process.
+        X_test = self._ml_analyzer._X_test
+        y_test = self._ml_analyzer._y_test
+        metrics = [ClassifierAnalyzer.ACCURACY_SCORE, ClassifierAnalyzer.F1_SCORE,
+                   ClassifierAnalyzer.AVERAGE_PRECISION_SCORE, ClassifierAnalyzer.ROC_AUC_SCORE]
+        expected_cis = [self._ml_analyzer.score(metric=metric, ci=0.95, n_bootstrap_iter=200) for metric in metrics]
+
+        parallel_analyzer = ClassifierAnalyzer(self._ml_classifier, X_test, y_test, n_jobs=2)
+        original_chunk_elements = ClassifierAnalyzerModule.BOOTSTRAP_CHUNK_ELEMENTS
+        ClassifierAnalyzerModule.BOOTSTRAP_CHUNK_ELEMENTS = 10 * y_test.shape[0]
+        try:
+            actual_cis = [parallel_analyzer.score(metric=metric, ci=0.95, n_bootstrap_iter=200) for metric in metrics]
+        finally:
+            ClassifierAnalyzerModule.BOOTSTRAP_CHUNK_ELEMENTS = original_chunk_elements
+        self.assertEqual(expected_cis, actual_cis)
+
     def test_plot_precision_recall_curve(self):
         # Compute precision-recall curve.
         precision_recall_curve = self._ml_analyzer.compute_precision_recall_curve()
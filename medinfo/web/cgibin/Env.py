@@ -42,6 +42,9 @@ TRACKING_SCRIPT_TEMPLATE = "";
 # Otherwise turn this off to not waste I/O to stdout if using WSGI or mod_python
 CGI_TEXT_RESPONSE = False;
 
-# Whether to use a local memory data cache to reduce DB hits for web queries.  If left unchecked, this will result
-#   in excessive memory use / leak by the webserver
+# Whether to use a local memory data cache to reduce DB hits for web queries.
+#   Bounded to the estimated bytes of results below (least recently used evicted first),
+#   with results expiring after the TTL seconds to pick up changes made by other processes.
 USE_DATA_CACHE = True;
+DATA_CACHE_MAX_SIZE = 512*1024*1024;
+DATA_CACHE_TTL = 60*60;
@@ -5,6 +5,7 @@ import Env;
 import Const
 import sys, os
 import logging
+from medinfo.common.DataCache import DataCache;
 
 log = logging.getLogger("CDSS")
 log.setLevel(Const.LOGGER_LEVEL)
@@ -18,4 +19,4 @@ log.addHandler(handler)
 """Persistent cache object to store query results in local memory for reuse later"""
 webDataCache = None;
 if Env.USE_DATA_CACHE:
-    webDataCache = dict();
+    webDataCache = DataCache(maxSize=Env.DATA_CACHE_MAX_SIZE, ttl=Env.DATA_CACHE_TTL);
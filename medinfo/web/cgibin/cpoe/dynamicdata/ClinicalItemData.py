@@ -11,6 +11,7 @@ from medinfo.cpoe.DataManager import DataManager;
 
 from medinfo.web.cgibin.cpoe.dynamicdata.BaseDynamicData import BaseDynamicData;
 from medinfo.web.cgibin import Options;
+from medinfo.web.cgibin.Util import webDataCache;
 
 class ClinicalItemData(BaseDynamicData):
     """Simple script to (dynamically) retrieve basic data from clinical_item table,
@@ -33,6 +34,7 @@ class ClinicalItemData(BaseDynamicData):
     def action_updateCounts(self):
         # Update the summary counts to facilitate future rapid queries
         dataManager = DataManager();
+        dataManager.dataCache = webDataCache;  # So the shared cache is invalidated for the updated counts
         dataManager.updateClinicalItemCounts();
 
     def action_default(self):